@@ -0,0 +1,225 @@
+import collections
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def make_etag(body):
+    """Strong ETag for a response body"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an ETag
+
+    Uses the weak comparison RFC 7232 prescribes for If-None-Match.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(','))
+    return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in candidates)
+
+
+class CachedResponse:
+    """A rendered response body with the metadata needed to replay it"""
+
+    __slots__ = ('body', 'etag', 'content_type', 'headers', 'generation', 'expires')
+
+    def __init__(self, body, content_type, headers=None, generation=0, expires=0.0):
+        self.body = body
+        self.etag = make_etag(body)
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.generation = generation
+        self.expires = expires
+
+
+class LRUResponseCache:
+    """
+    Bounded in-process LRU cache of rendered camera responses
+
+    Entries are tagged with a generation: one shared by all list responses
+    and one per camera for detail responses. Invalidating a camera bumps
+    its generation and the list generation, so stale entries are dropped on
+    their next lookup without scanning the cache. Entries also expire after
+    a TTL as a safety net.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._list_generation = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, camera_id=None):
+        if camera_id is None:
+            return self._list_generation
+        return self._generations.get(camera_id, 0)
+
+    def get(self, key, camera_id=None):
+        """
+        Look up a response
+
+        Args:
+            key: Cache key (request path and query)
+            camera_id: Camera id for detail responses, None for lists
+
+        Returns:
+            CachedResponse: The cached response, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.generation == self.generation(camera_id) and entry.expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, entry, camera_id=None, generation=None):
+        """
+        Store a response
+
+        Args:
+            key: Cache key
+            entry: CachedResponse to store
+            camera_id: Camera id for detail responses, None for lists
+            generation: Generation read before the response was computed;
+                        if it changed meanwhile the entry is not stored
+        """
+        with self._lock:
+            current = self.generation(camera_id)
+            if generation is not None and generation != current:
+                return
+            entry.generation = current
+            entry.expires = time.monotonic() + self.ttl
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, camera_ids):
+        """Invalidate the given cameras and every list response"""
+        with self._lock:
+            self._list_generation += 1
+            for camera_id in camera_ids:
+                self._generations[camera_id] = self._generations.get(camera_id, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._list_generation += 1
+            self._generations.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self).__name__,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+class DjangoResponseCache(LRUResponseCache):
+    """
+    Response cache stored in Django's cache framework
+
+    Lets several worker processes share entries through a shared cache
+    (e.g. Memcached or Redis). Generations live in the cache as well, so an
+    invalidation in one worker is seen by all of them. Hit and miss
+    counters are per process.
+    """
+
+    LIST_GENERATION_KEY = 'camera-response:list-generation'
+
+    def __init__(self, max_entries=1024, ttl=30.0, alias='default'):
+        super().__init__(max_entries=max_entries, ttl=ttl)
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def _generation_key(self, camera_id):
+        if camera_id is None:
+            return self.LIST_GENERATION_KEY
+        return f'camera-response:generation:{camera_id}'
+
+    def generation(self, camera_id=None):
+        return self.cache.get(self._generation_key(camera_id), 0)
+
+    def get(self, key, camera_id=None):
+        entry = self.cache.get(f'camera-response:{key}')
+        if entry is not None and entry.generation == self.generation(camera_id):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def set(self, key, entry, camera_id=None, generation=None):
+        current = self.generation(camera_id)
+        if generation is not None and generation != current:
+            return
+        entry.generation = current
+        self.cache.set(f'camera-response:{key}', entry, self.ttl)
+
+    def invalidate(self, camera_ids):
+        for key in [self.LIST_GENERATION_KEY] + [self._generation_key(i) for i in camera_ids]:
+            self.cache.add(key, 0, None)
+            self.cache.incr(key)
+        self.invalidations += 1
+
+    def clear(self):
+        self.invalidate([])
+
+    def stats(self):
+        stats = super().stats()
+        stats['entries'] = None
+        return stats
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide camera response cache, created from settings
+
+    Returns:
+        LRUResponseCache: The configured cache implementation
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                cache_class = import_string(settings.CAMERA_RESPONSE_CACHE)
+                _response_cache = cache_class(
+                    max_entries=settings.CAMERA_RESPONSE_CACHE_MAX_ENTRIES,
+                    ttl=settings.CAMERA_RESPONSE_CACHE_TTL,
+                )
+    return _response_cache
+
+
+def invalidate_cameras(camera_ids):
+    """Drop cached responses that may include any of the given cameras"""
+    get_response_cache().invalidate(list(camera_ids))
@@ -0,0 +1,283 @@
+import atexit
+import logging
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .cache import invalidate_cameras
+from .events import camera_delta, get_event_log
+from .hls import split_stream_name
+from .metrics import CALLBACK_DENIED, CALLBACK_ERRORS, CALLBACK_EVENTS, observe_request
+from .llhls import LLHLS_CLIENT, get_low_latency
+from .models import Camera
+from .motion import MOTION_CLIENT, get_motion_detector
+from .ondemand import get_on_demand
+from .streamkeys import authorize
+from .transcode import LADDER_CLIENT, get_ladder_manager
+from .viewers import get_viewer_tracker
+
+logger = logging.getLogger(__name__)
+
+# on_hls is not nginx-rtmp's: nginx mirrors HLS playlist requests to it, see nginx.conf
+CALLBACK_ACTIONS = ('on_connect', 'on_publish', 'on_publish_done', 'on_play', 'on_done', 'on_hls')
+
+# Bound once so counting a callback is a single increment
+_callback_counters = {action: CALLBACK_EVENTS.labels(action) for action in CALLBACK_ACTIONS}
+_denied_counters = {action: CALLBACK_DENIED.labels(action) for action in ('on_publish', 'on_play')}
+
+# Longest wait before retrying state changes that failed to apply; the wait doubles per failure
+RETRY_MAX_SECONDS = 30.0
+
+
+class ActiveStateWriter:
+    """
+    Coalesce Camera.active changes from RTMP callbacks into batched updates
+
+    Callbacks only record the desired state in memory and return. A
+    background thread waits for the coalescing window to pass and then
+    applies all pending changes with at most one UPDATE per state and
+    batch, touching only the active and updated_at columns. Repeated
+    events for the same camera inside the window collapse to the last one,
+    and rows already in the desired state are not written at all. A batch
+    is applied in one transaction; if it fails, it is retried after a
+    backoff even when no further callbacks arrive.
+    """
+
+    def __init__(self, window=0.25, batch_size=500):
+        self.window = window
+        self.batch_size = batch_size
+        self._pending = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # Seconds to wait before retrying a failed batch, 0 after a success
+        self._retry_delay = 0.0
+        self._stopping = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def submit(self, camera_id, active):
+        """Record the desired active state for a camera; never blocks on the database"""
+        with self._lock:
+            self._pending[camera_id] = active
+            self._events += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='callback-state-writer', daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+    def flush(self):
+        """
+        Write all pending changes to the database
+
+        Returns:
+            dict: Mapping of camera id to the new active state for rows that changed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            events, self._events = self._events, 0
+        if not pending:
+            return {}
+
+        changed = {}
+        deltas = []
+        now = timezone.now()
+        try:
+            # All or nothing: rows committed here must be invalidated and published below, and
+            # a retry would skip them as already in their state
+            with transaction.atomic():
+                for active in (True, False):
+                    ids = [camera_id for camera_id, state in pending.items() if state is active]
+                    for start in range(0, len(ids), self.batch_size):
+                        chunk = ids[start:start + self.batch_size]
+                        queryset = Camera.objects.filter(id__in=chunk).exclude(active=active)
+                        updated = dict(queryset.values_list('id', 'hls_url'))
+                        if updated:
+                            Camera.objects.filter(id__in=list(updated)).update(active=active, updated_at=now)
+                            deltas.extend(camera_delta(camera_id, active, hls_url, now)
+                                          for camera_id, hls_url in updated.items())
+                            changed.update((camera_id, active) for camera_id in updated)
+        except Exception as e:
+            self._retry_delay = min(max(self._retry_delay * 2, self.window, 1.0), RETRY_MAX_SECONDS)
+            logger.error(f"Failed to apply {len(pending)} stream state changes, "
+                         f"retrying in {self._retry_delay:.0f}s: {e}")
+            with self._lock:
+                # Newer events received meanwhile take precedence
+                for camera_id, active in pending.items():
+                    self._pending.setdefault(camera_id, active)
+            return {}
+        finally:
+            close_old_connections()
+        self._retry_delay = 0.0
+
+        if changed:
+            logger.info(
+                f"Applied {len(changed)} stream state changes "
+                f"from {events} callback events"
+            )
+            invalidate_cameras(changed)
+            get_event_log().publish(deltas)
+        return changed
+
+    def stop(self):
+        """Flush whatever is pending and stop the writer thread"""
+        self._stopped = True
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            if self._stopped:
+                break
+            # Let duplicate events for the same streams accumulate
+            time.sleep(self.window)
+            self._wakeup.clear()
+            self.flush()
+            if self._retry_delay:
+                # The failed changes were put back; retry them without waiting for a callback
+                self._stopping.wait(self._retry_delay)
+                self._wakeup.set()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_state_writer():
+    """
+    Return the process-wide ActiveStateWriter, creating it from settings
+
+    Returns:
+        ActiveStateWriter: The shared writer
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ActiveStateWriter(window=settings.CALLBACK_COALESCE_WINDOW)
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def handle_callback(action, params):
+    """
+    Handle an nginx-rtmp notification without touching the database
+
+    Publishers (and with STREAM_AUTH=all, players) are checked against the
+    in-memory stream key index, see api.streamkeys. Publishes, plays and
+    HLS playlist fetches are passed on to the bitrate ladder manager, see
+    api.transcode, publishes to the LL-HLS packagers, see api.llhls, and
+    the motion detector, see api.motion, and plays and HLS playlist fetches
+    to the on-demand relays, see api.ondemand.
+    Plays and their ends are counted as viewing sessions, see api.viewers.
+    The active state of on-demand cameras is theirs to keep: their relays
+    publish and stop as viewers come and go.
+
+    Args:
+        action: One of CALLBACK_ACTIONS
+        params: Mapping of the parameters sent by nginx-rtmp
+
+    Returns:
+        int: HTTP status code for nginx-rtmp (2xx allows the action, 403 rejects it)
+    """
+    app = params.get('app', '')
+    name = params.get('name', '')
+    addr = params.get('addr', '')
+    # Repeated events of one stream are sampled by the logging pipeline, see api.logs
+    logger.info(f"RTMP {action} - app: {app}, name: {name}, addr: {addr}",
+                extra={'event': action, 'stream': name, 'addr': addr})
+    _callback_counters[action].inc()
+
+    if action in _denied_counters and not authorize(action, params):
+        logger.warning(f"Rejected RTMP {action} of stream {name} from {addr}: bad stream key or token",
+                       extra={'event': f'{action}_denied', 'stream': name, 'addr': addr})
+        _denied_counters[action].inc()
+        return 403
+
+    if action in ('on_publish', 'on_publish_done'):
+        camera_id, suffix = split_stream_name(name)
+        if camera_id is None:
+            logger.warning(f"Non-numeric stream name: {name}", extra={'event': 'bad_stream_name', 'stream': name})
+        elif not suffix:
+            # Renditions published by a bitrate ladder (12_low) leave the camera's state alone
+            if not get_on_demand().manages(camera_id):
+                get_state_writer().submit(camera_id, action == 'on_publish')
+            get_ladder_manager().set_publishing(camera_id, action == 'on_publish')
+            get_low_latency().set_publishing(camera_id, action == 'on_publish')
+            get_motion_detector().set_publishing(camera_id, action == 'on_publish')
+    elif action in ('on_play', 'on_done') and params.get('client') not in (LADDER_CLIENT, LLHLS_CLIENT,
+                                                                         MOTION_CLIENT):
+        camera_id, _ = split_stream_name(name)
+        if camera_id is not None:
+            if action == 'on_play':
+                get_ladder_manager().viewer_joined(camera_id)
+                get_on_demand().viewer_joined(camera_id)
+                get_viewer_tracker().play(name, addr, camera_id)
+            else:
+                get_ladder_manager().viewer_left(camera_id)
+                get_on_demand().viewer_left(camera_id)
+                get_viewer_tracker().done(name, addr)
+    elif action == 'on_hls':
+        camera_id, _ = split_stream_name(name)
+        if camera_id is not None:
+            get_ladder_manager().hls_request(camera_id, addr)
+            get_on_demand().hls_request(camera_id, addr)
+
+    # Otherwise always return 200 so nginx-rtmp never blocks a stream on the backend
+    return 200
+
+
+async def callback_application(scope, receive, send):
+    """
+    Minimal ASGI application for /api/stream/<action> callbacks
+
+    Bypasses Django's middleware and request machinery; the response is
+    sent as soon as the event has been queued.
+    """
+    started = time.perf_counter()
+    action = scope['path'].rstrip('/').rsplit('/', 1)[-1]
+    params = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+
+    if scope['method'] == 'POST':
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        params.update(parse_qsl(body.decode('latin-1')))
+
+    if action not in CALLBACK_ACTIONS:
+        status, payload = 404, b'{"status": "Not found"}'
+        route = '<unmatched>'
+    else:
+        try:
+            status = handle_callback(action, params)
+            payload = b'{"status": "OK"}' if status < 400 else b'{"status": "Forbidden"}'
+        except Exception as e:
+            logger.exception(f"Error in {action} callback: {e}", extra={'event': action, 'stream': params.get('name')})
+            CALLBACK_ERRORS.labels(action).inc()
+            status, payload = 200, b'{"status": "Error"}'
+        # Same route names as the Django URL patterns in api.urls
+        route = f"stream-{action.replace('_', '-')}"
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+    observe_request(scope['method'], route, status, time.perf_counter() - started)
@@ -0,0 +1,540 @@
+import atexit
+import collections
+import contextlib
+import datetime
+import logging
+import mmap
+import os
+import queue
+import shutil
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+from .hls import get_hls_watcher
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.bin'
+DAY_FORMAT = '%Y-%m-%d'
+
+# start_ms, duration_ms, hour (data file), byte offset, byte length, flags
+RECORD = struct.Struct('<qIIQII')
+FLAG_DISCONTINUITY = 0x1
+
+# Seconds between retention sweeps
+PRUNE_INTERVAL = 3600
+# Index snapshots kept open for seeking
+INDEX_CACHE_SIZE = 256
+
+Segment = collections.namedtuple(
+    'Segment', ['start_ms', 'duration_ms', 'hour', 'offset', 'length', 'flags'])
+
+
+def data_name(hour):
+    """Name of the file holding one hour of archived segments"""
+    return f'{hour:02d}.ts'
+
+
+def day_of(ms):
+    """UTC day directory name for a timestamp in milliseconds"""
+    return time.strftime(DAY_FORMAT, time.gmtime(ms / 1000))
+
+
+def to_ms(when):
+    """Convert an aware datetime to milliseconds since the epoch"""
+    return int(when.timestamp() * 1000)
+
+
+def from_ms(ms):
+    """Convert milliseconds since the epoch to an aware UTC datetime"""
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+
+def copy_file(source, target):
+    """
+    Append one file to another, in the kernel where possible
+
+    Args:
+        source: File object to read from its start
+        target: File object opened for appending
+
+    Returns:
+        int: Bytes copied
+    """
+    length = os.fstat(source.fileno()).st_size
+    copied = 0
+    try:
+        while copied < length:
+            sent = os.sendfile(target.fileno(), source.fileno(), copied, length - copied)
+            if sent == 0:
+                break
+            copied += sent
+    except (AttributeError, OSError):
+        if copied:
+            raise
+        source.seek(0)
+        shutil.copyfileobj(source, target)
+        copied = length
+    return copied
+
+
+class SegmentIndex:
+    """
+    Read-only, memory-mapped view of one day's seek index
+
+    The index is a sequence of fixed-size RECORDs sorted by start time, so
+    a timestamp resolves by binary search without reading the rest of the
+    file. Records appended after opening are not visible; open the index
+    again to see them. A partially written trailing record is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.stat(path).st_size
+        self.count = self.size // RECORD.size
+        # Readers using the mapping, and whether it is closed once they are done
+        self.users = 0
+        self.retired = False
+        self._map = None
+        if self.count:
+            with open(path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), self.count * RECORD.size, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def record(self, position):
+        """Return the Segment at a position of the index"""
+        return Segment(*RECORD.unpack_from(self._map, position * RECORD.size))
+
+    def start_at(self, position):
+        return RECORD.unpack_from(self._map, position * RECORD.size)[0]
+
+    def bisect(self, when_ms):
+        """Return the position of the last segment starting at or before when_ms, or -1"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.start_at(middle) <= when_ms:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def find(self, when_ms):
+        """
+        Find the segment covering a timestamp
+
+        Args:
+            when_ms: Milliseconds since the epoch
+
+        Returns:
+            int: Position of the segment covering when_ms or, if when_ms
+                 falls in a gap, of the next segment; None past the end
+        """
+        position = self.bisect(when_ms)
+        if position >= 0:
+            segment = self.record(position)
+            if segment.start_ms + segment.duration_ms > when_ms:
+                return position
+        position += 1
+        return position if position < self.count else None
+
+    def range(self, start_ms, end_ms):
+        """Yield the segments overlapping [start_ms, end_ms)"""
+        position = self.find(start_ms)
+        if position is None:
+            return
+        while position < self.count:
+            segment = self.record(position)
+            if segment.start_ms >= end_ms:
+                break
+            yield segment
+            position += 1
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class DayWriter:
+    """
+    Appends segments to one camera's day directory
+
+    Segment bytes go to hourly data files first and the index record is
+    written afterwards, so a crash leaves at worst unindexed bytes at the
+    end of a data file and never an index entry without its data.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, INDEX_NAME)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size % RECORD.size:
+            os.truncate(path, size - size % RECORD.size)
+            size -= size % RECORD.size
+        self.last_end_ms = 0
+        if size:
+            with open(path, 'rb') as f:
+                f.seek(size - RECORD.size)
+                last = Segment(*RECORD.unpack(f.read(RECORD.size)))
+            self.last_end_ms = last.start_ms + last.duration_ms
+        self._index = open(path, 'ab', buffering=0)
+        self._data = {}
+
+    def _data_file(self, hour):
+        f = self._data.get(hour)
+        if f is None:
+            f = open(os.path.join(self.directory, data_name(hour)), 'ab', buffering=0)
+            self._data[hour] = f
+        return f
+
+    def append(self, source_path, start_ms, duration_ms, discontinuity=False):
+        """
+        Archive one segment file
+
+        Args:
+            source_path: Segment written by nginx-rtmp
+            start_ms: Start of the segment, milliseconds since the epoch
+            duration_ms: Segment duration in milliseconds
+            discontinuity: Whether the segment follows a stream restart
+
+        Returns:
+            Segment: The index record written
+        """
+        hour = time.gmtime(start_ms / 1000).tm_hour
+        target = self._data_file(hour)
+        offset = os.fstat(target.fileno()).st_size
+        with open(source_path, 'rb') as source:
+            length = copy_file(source, target)
+        segment = Segment(start_ms, duration_ms, hour, offset, length,
+                          FLAG_DISCONTINUITY if discontinuity else 0)
+        self._index.write(RECORD.pack(*segment))
+        self.last_end_ms = start_ms + duration_ms
+        return segment
+
+    def close(self):
+        self._index.close()
+        for f in self._data.values():
+            f.close()
+        self._data.clear()
+
+
+class DVRRecorder:
+    """
+    Archives the HLS segments nginx-rtmp writes for recording cameras
+
+    Segments are copied as they are, without re-encoding, into
+    <root>/<camera id>/<YYYY-MM-DD>/ (UTC days) as hourly HH.ts files plus
+    an index.bin of fixed-size records. The HLS watcher reports new
+    segments; a single worker thread copies them while they are still
+    inside nginx's playlist window.
+    """
+
+    def __init__(self, root, retention_days=0):
+        self.root = root
+        self.retention_days = retention_days
+        self._recording = set()
+        self._loaded = False
+        self._queue = queue.Queue()
+        self._writers = {}
+        self._indexes = collections.OrderedDict()
+        self._index_lock = threading.Lock()
+        self._thread = None
+        self.archived = 0
+        self.skipped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='dvr-recorder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.close_indexes()
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def start_recording(self, camera_id):
+        self._recording.add(camera_id)
+
+    def stop_recording(self, camera_id):
+        self._recording.discard(camera_id)
+        self._queue.put(('close', camera_id, None))
+
+    def is_recording(self, camera_id):
+        return camera_id in self._recording
+
+    def on_segment(self, camera_id, suffix, segments):
+        """HLSWatcher listener; only the camera's main rendition is archived"""
+        if suffix or (self._loaded and camera_id not in self._recording):
+            return
+        self._queue.put(('archive', camera_id, segments))
+
+    def camera_directory(self, camera_id):
+        return os.path.join(self.root, str(camera_id))
+
+    def _load(self):
+        from .models import Camera
+        try:
+            self._recording.update(Camera.objects.filter(recording=True).values_list('id', flat=True))
+        except Exception as e:
+            logger.error(f"Could not load recording cameras: {e}")
+        self._loaded = True
+
+    def _run(self):
+        self._load()
+        next_prune = time.monotonic()
+        while True:
+            if self.retention_days and time.monotonic() >= next_prune:
+                self.prune()
+                next_prune = time.monotonic() + PRUNE_INTERVAL
+            try:
+                item = self._queue.get(timeout=PRUNE_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            action, camera_id, segments = item
+            if action == 'close':
+                self._close_writer(camera_id)
+            elif camera_id in self._recording:
+                self._archive(camera_id, segments)
+        for camera_id in [*self._writers]:
+            self._close_writer(camera_id)
+
+    def _close_writer(self, camera_id):
+        entry = self._writers.pop(camera_id, None)
+        if entry is not None:
+            entry[1].close()
+
+    def _writer(self, camera_id, day):
+        entry = self._writers.get(camera_id)
+        if entry is None or entry[0] != day:
+            self._close_writer(camera_id)
+            entry = (day, DayWriter(os.path.join(self.camera_directory(camera_id), day)))
+            self._writers[camera_id] = entry
+        return entry[1]
+
+    def _archive(self, camera_id, segments):
+        for sequence, duration, path, discontinuity, written_at in segments:
+            duration_ms = int(round(duration * 1000))
+            # nginx closes a segment when it ends, so its mtime marks the end
+            start_ms = int(written_at * 1000) - duration_ms
+            writer = self._writer(camera_id, day_of(start_ms))
+            if start_ms + duration_ms <= writer.last_end_ms:
+                # Already archived, e.g. playlist re-read after a restart
+                self.skipped += 1
+                continue
+            start_ms = max(start_ms, writer.last_end_ms)
+            try:
+                writer.append(path, start_ms, duration_ms, discontinuity)
+                self.archived += 1
+            except FileNotFoundError:
+                logger.warning(f"Segment {sequence} of camera {camera_id} expired before archiving")
+            except OSError as e:
+                logger.error(f"Failed to archive segment {sequence} of camera {camera_id}: {e}")
+
+    def prune(self, now=None):
+        """Delete day directories older than the retention period"""
+        if not self.retention_days:
+            return 0
+        now = now or time.time()
+        cutoff = day_of((now - self.retention_days * 86400) * 1000)
+        removed = 0
+        try:
+            cameras = [entry.path for entry in os.scandir(self.root) if entry.is_dir()]
+        except FileNotFoundError:
+            return 0
+        for directory in cameras:
+            with os.scandir(directory) as entries:
+                expired = [entry.path for entry in entries if entry.is_dir() and entry.name < cutoff]
+            for path in expired:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} expired recording days")
+        return removed
+
+    def days(self, camera_id):
+        """Sorted day directory names recorded for a camera"""
+        try:
+            with os.scandir(self.camera_directory(camera_id)) as entries:
+                return sorted(entry.name for entry in entries if entry.is_dir())
+        except FileNotFoundError:
+            return []
+
+    @contextlib.contextmanager
+    def index(self, camera_id, day):
+        """
+        Use a SegmentIndex of a camera's day, reusing the open mapping while
+        the index has not grown
+
+        Indexes dropped from the cache, evicted or replaced by a newer
+        snapshot, are closed as soon as no reader uses them any more, so
+        their mappings do not hold file descriptors until garbage collection.
+
+        Yields:
+            SegmentIndex: The index, None if the day has none
+        """
+        path = os.path.join(self.camera_directory(camera_id), day, INDEX_NAME)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            yield None
+            return
+        with self._index_lock:
+            index = self._indexes.get(path)
+            if index is not None and index.size == size:
+                self._indexes.move_to_end(path)
+            else:
+                if index is not None:
+                    self._retire(index)
+                index = SegmentIndex(path)
+                self._indexes[path] = index
+                if len(self._indexes) > INDEX_CACHE_SIZE:
+                    self._retire(self._indexes.popitem(last=False)[1])
+            index.users += 1
+        try:
+            yield index
+        finally:
+            with self._index_lock:
+                index.users -= 1
+                if index.retired and not index.users:
+                    index.close()
+
+    def _retire(self, index):
+        """Close an index dropped from the cache once unused; called with the index lock held"""
+        index.retired = True
+        if not index.users:
+            index.close()
+
+    def close_indexes(self):
+        """Close the cached index mappings"""
+        with self._index_lock:
+            while self._indexes:
+                self._retire(self._indexes.popitem()[1])
+
+    def summary(self, camera_id):
+        """
+        Describe what has been recorded for a camera
+
+        Returns:
+            dict: recording flag and per-day start, end, segment count and bytes
+        """
+        days = []
+        for day in self.days(camera_id):
+            with self.index(camera_id, day) as index:
+                if not index:
+                    continue
+                first, last, count = index.record(0), index.record(len(index) - 1), len(index)
+            directory = os.path.join(self.camera_directory(camera_id), day)
+            size = 0
+            for hour in range(first.hour, last.hour + 1):
+                try:
+                    size += os.path.getsize(os.path.join(directory, data_name(hour)))
+                except FileNotFoundError:
+                    pass
+            days.append({
+                'date': day,
+                'start': from_ms(first.start_ms),
+                'end': from_ms(last.start_ms + last.duration_ms),
+                'segments': count,
+                'bytes': size,
+            })
+        return {'id': camera_id, 'recording': self.is_recording(camera_id), 'days': days}
+
+    def seek(self, camera_id, when):
+        """
+        Resolve a point in time to an archived segment
+
+        Args:
+            camera_id: Camera id
+            when: Aware datetime
+
+        Returns:
+            dict: The segment covering when (or the first one after it if
+                  when falls in a gap), or None if nothing was recorded later
+        """
+        when_ms = to_ms(when)
+        requested_day = day_of(when_ms)
+        for day in self.days(camera_id):
+            if day < requested_day:
+                continue
+            with self.index(camera_id, day) as index:
+                if not index:
+                    continue
+                position = index.find(when_ms) if day == requested_day else 0
+                if position is None:
+                    continue
+                segment = index.record(position)
+            return {
+                'requested': from_ms(when_ms),
+                'start': from_ms(segment.start_ms),
+                'duration': segment.duration_ms / 1000,
+                'offset': max(0, when_ms - segment.start_ms) / 1000,
+                'gap': segment.start_ms > when_ms,
+                'discontinuity': bool(segment.flags & FLAG_DISCONTINUITY),
+                'file': os.path.join(str(camera_id), day, data_name(segment.hour)),
+                'byte_offset': segment.offset,
+                'byte_length': segment.length,
+            }
+        return None
+
+    def segments(self, camera_id, start, end):
+        """
+        Yield (data file path, Segment) for the archive overlapping [start, end)
+
+        Args:
+            camera_id: Camera id
+            start: Aware datetime
+            end: Aware datetime
+        """
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        first_day, last_day = day_of(start_ms), day_of(end_ms)
+        for day in self.days(camera_id):
+            if day < first_day or day > last_day:
+                continue
+            directory = os.path.join(self.camera_directory(camera_id), day)
+            # Held while the caller consumes the segments
+            with self.index(camera_id, day) as index:
+                if not index:
+                    continue
+                for segment in index.range(start_ms, end_ms):
+                    yield os.path.join(directory, data_name(segment.hour)), segment
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def forget_camera(camera_id):
+    """Stop recording a deleted camera, if the recorder is running in this process"""
+    if _recorder is not None:
+        _recorder.stop_recording(camera_id)
+
+
+def get_recorder():
+    """
+    Return the process-wide DVRRecorder, starting it and subscribing it to
+    the HLS watcher on first use
+
+    Returns:
+        DVRRecorder: The running recorder
+    """
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                recorder = DVRRecorder(settings.RECORDINGS_ROOT, settings.RECORDING_RETENTION_DAYS)
+                recorder.start()
+                get_hls_watcher().add_listener(recorder.on_segment)
+                atexit.register(recorder.stop)
+                _recorder = recorder
+    return _recorder
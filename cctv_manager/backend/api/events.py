@@ -0,0 +1,222 @@
+import asyncio
+import collections
+import json
+import logging
+import threading
+import uuid
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def camera_delta(camera_id, active=None, hls_url=None, updated_at=None, deleted=False):
+    """
+    Build the compact delta event describing a camera state change
+
+    Returns:
+        dict: Event payload as sent to clients
+    """
+    if deleted:
+        return {'id': camera_id, 'deleted': True}
+    return {
+        'id': camera_id,
+        'active': active,
+        'hls_url': hls_url,
+        'updated_at': updated_at.isoformat().replace('+00:00', 'Z') if updated_at else None,
+    }
+
+
+def delta_from_camera(camera):
+    return camera_delta(camera.id, camera.active, camera.hls_url, camera.updated_at)
+
+
+class CameraEventLog:
+    """
+    Bounded in-memory log of camera delta events with resumable cursors
+
+    Every event gets a sequence number; a cursor is '<epoch>:<sequence>'
+    where the epoch identifies this process, so cursors from before a
+    restart are recognised as stale. Publishers may be any thread; async
+    subscribers are woken through their own event loop.
+    """
+
+    def __init__(self, size=10000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = collections.deque(maxlen=size)
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    @property
+    def cursor(self):
+        return f'{self.epoch}:{self._sequence}'
+
+    def publish(self, deltas):
+        """
+        Append delta events and wake up subscribers
+
+        Args:
+            deltas: Iterable of payloads built with camera_delta()
+        """
+        with self._lock:
+            for delta in deltas:
+                self._sequence += 1
+                self._events.append((self._sequence, delta))
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def parse_cursor(self, cursor):
+        """
+        Return the sequence number of a cursor, or None if it cannot be resumed
+        """
+        if not cursor:
+            return None
+        epoch, _, sequence = cursor.partition(':')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def since(self, cursor):
+        """
+        Return the events a client holding the cursor has not seen
+
+        Events are compacted to the latest one per camera, so a client that
+        was away for a while only receives the final state of each camera.
+
+        Args:
+            cursor: Cursor previously handed to the client, or None
+
+        Returns:
+            tuple: (events, new cursor, reset) where reset is True if the
+                   cursor is unknown or too old and the client must reload
+                   the full camera list
+        """
+        sequence = self.parse_cursor(cursor)
+        with self._lock:
+            latest = self._sequence
+            oldest = self._events[0][0] if self._events else latest + 1
+            if sequence is None or sequence > latest or sequence + 1 < oldest:
+                return [], f'{self.epoch}:{latest}', True
+            pending = [(seq, delta) for seq, delta in self._events if seq > sequence]
+
+        compacted = {}
+        for seq, delta in pending:
+            compacted.pop(delta['id'], None)
+            compacted[delta['id']] = delta
+        return list(compacted.values()), f'{self.epoch}:{latest}', False
+
+    async def wait(self, cursor, timeout):
+        """Wait until events newer than the cursor exist or the timeout expires"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            if self.parse_cursor(cursor) != self._sequence:
+                return
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+_event_log = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log():
+    """
+    Return the process-wide CameraEventLog, creating it from settings
+
+    Returns:
+        CameraEventLog: The shared event log
+    """
+    global _event_log
+    if _event_log is None:
+        with _event_log_lock:
+            if _event_log is None:
+                _event_log = CameraEventLog(size=settings.CAMERA_EVENT_LOG_SIZE)
+    return _event_log
+
+
+def publish_cameras(cameras):
+    """Publish the current state of the given cameras"""
+    get_event_log().publish(delta_from_camera(camera) for camera in cameras)
+
+
+def publish_deleted(camera_ids):
+    """Publish deletion events for the given camera ids"""
+    get_event_log().publish(camera_delta(camera_id, deleted=True) for camera_id in camera_ids)
+
+
+def format_sse(cursor, event, data):
+    return f'id: {cursor}\nevent: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
+
+
+async def camera_events_application(scope, receive, send):
+    """
+    ASGI application streaming camera deltas as Server-Sent Events
+
+    Clients resume with the standard Last-Event-ID header (sent
+    automatically by EventSource) or a ?cursor= query parameter, typically
+    the X-Events-Cursor header of the camera list they just loaded. A
+    'reset' event tells the client its cursor could not be resumed and it
+    must reload the camera list; 'cameras' events carry a list of deltas.
+    """
+    headers = dict(scope.get('headers', []))
+    query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    cursor = headers.get(b'last-event-id', b'').decode('latin-1') or query.get('cursor')
+    resuming = bool(cursor)
+    event_log = get_event_log()
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def send_event(name, data):
+        await send({'type': 'http.response.body', 'body': format_sse(cursor, name, data),
+                    'more_body': True})
+
+    disconnect = asyncio.ensure_future(watch_disconnect())
+    try:
+        events, cursor, reset = event_log.since(cursor)
+        if reset and resuming:
+            await send_event('reset', {})
+        while True:
+            if events:
+                await send_event('cameras', events)
+            else:
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n',
+                            'more_body': True})
+            waiter = asyncio.ensure_future(
+                event_log.wait(cursor, settings.CAMERA_EVENT_KEEPALIVE)
+            )
+            await asyncio.wait({waiter, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                waiter.cancel()
+                return
+            events, cursor, reset = event_log.since(cursor)
+            if reset:
+                # Fell too far behind the bounded log
+                await send_event('reset', {})
+    except OSError as e:
+        logger.debug(f"Camera event stream closed: {e}")
+    finally:
+        disconnect.cancel()
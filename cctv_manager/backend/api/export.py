@@ -0,0 +1,394 @@
+import asyncio
+import collections
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .cache import make_etag
+from .dvr import to_ms
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_TS = 'ts'
+CONTAINER_MP4 = 'mp4'
+EXPORT_CONTAINERS = (CONTAINER_TS, CONTAINER_MP4)
+CONTENT_TYPES = {CONTAINER_TS: 'video/mp2t', CONTAINER_MP4: 'video/mp4'}
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PTS_CLOCK = 90  # MPEG-TS timestamps tick at 90 kHz
+PTS_WRAP = 1 << 33
+
+# Bytes read from disk (and sent) at a time
+CHUNK_SIZE = 1024 * 1024
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# A byte range of an archive data file, or in-memory bytes when data is set
+Piece = collections.namedtuple('Piece', ['path', 'offset', 'length', 'data'])
+
+
+def read_pts(data, position):
+    """Decode a 33-bit PES timestamp"""
+    return (((data[position] >> 1) & 0x07) << 30 | data[position + 1] << 22 |
+            (data[position + 2] >> 1) << 15 | data[position + 3] << 7 | data[position + 4] >> 1)
+
+
+def scan_segment(data):
+    """
+    Find the PES starts of an MPEG-TS segment
+
+    Args:
+        data: Segment bytes
+
+    Returns:
+        tuple: (header_end, starts) where header_end is the offset of the
+               first PES packet (everything before it is PAT/PMT) and starts
+               lists (offset, pts, random_access) for each PES start with a PTS
+    """
+    header_end = None
+    starts = []
+    for offset in range(0, len(data) - PACKET_SIZE + 1, PACKET_SIZE):
+        if data[offset] != SYNC_BYTE or not data[offset + 1] & 0x40:
+            continue
+        control = (data[offset + 3] >> 4) & 0x03
+        payload = offset + 4
+        random_access = False
+        if control & 0x02:
+            adaptation = data[offset + 4]
+            random_access = adaptation > 0 and bool(data[offset + 5] & 0x40)
+            payload += 1 + adaptation
+        if not control & 0x01 or payload + 14 > offset + PACKET_SIZE:
+            continue
+        if data[payload:payload + 3] != b'\x00\x00\x01':
+            continue
+        if header_end is None:
+            header_end = offset
+        if data[payload + 7] & 0x80:
+            starts.append((offset, read_pts(data, payload + 9), random_access))
+    return (header_end or 0), starts
+
+
+def trim_segment(data, segment, start_ms, end_ms):
+    """
+    Cut a boundary segment down to [start_ms, end_ms) at packet boundaries
+
+    The start is moved back to the last keyframe at or before start_ms so
+    the clip decodes from its first byte; the PAT/PMT of the segment are
+    kept in front of it. The end is cut at the first PES packet starting
+    after end_ms.
+
+    Args:
+        data: Segment bytes
+        segment: dvr.Segment it was read from
+        start_ms: Clip start, milliseconds since the epoch
+        end_ms: Clip end, milliseconds since the epoch
+
+    Returns:
+        tuple: (header, cut_start, cut_end) with header the bytes to send
+               before data[cut_start:cut_end]
+    """
+    header_end, starts = scan_segment(data)
+    if not starts:
+        return b'', 0, len(data)
+    first_pts = starts[0][1]
+    cut_start, cut_end = 0, len(data)
+
+    if start_ms > segment.start_ms:
+        target = (start_ms - segment.start_ms) * PTS_CLOCK
+        for offset, pts, random_access in starts:
+            if (pts - first_pts) % PTS_WRAP > target:
+                break
+            if random_access:
+                cut_start = offset
+    if end_ms < segment.start_ms + segment.duration_ms:
+        target = (end_ms - segment.start_ms) * PTS_CLOCK
+        for offset, pts, random_access in starts:
+            if offset > cut_start and (pts - first_pts) % PTS_WRAP > target:
+                cut_end = offset
+                break
+
+    header = data[:header_end] if cut_start > header_end else b''
+    return header, cut_start, cut_end
+
+
+class Clip:
+    """
+    The bytes of an export as a list of pieces
+
+    Whole segments are referenced by their position in the archive and
+    contiguous segments are merged, so an hour of footage is one piece no
+    matter how many segments it holds; only the two boundary segments are
+    read into memory to be trimmed.
+    """
+
+    def __init__(self, camera_id, start, end):
+        self.camera_id = camera_id
+        self.start = start
+        self.end = end
+        self.pieces = []
+        self.size = 0
+        self.segments = 0
+
+    def add(self, path, offset, length, data=None):
+        if not length:
+            return
+        if data is None and self.pieces:
+            last = self.pieces[-1]
+            if last.data is None and last.path == path and last.offset + last.length == offset:
+                self.pieces[-1] = last._replace(length=last.length + length)
+                self.size += length
+                return
+        self.pieces.append(Piece(path, offset, length, data))
+        self.size += length
+
+    def add_trimmed(self, path, segment, start_ms, end_ms):
+        with open(path, 'rb') as f:
+            data = os.pread(f.fileno(), segment.length, segment.offset)
+        header, cut_start, cut_end = trim_segment(data, segment, start_ms, end_ms)
+        self.add(None, 0, len(header), header)
+        self.add(path, segment.offset + cut_start, cut_end - cut_start)
+
+    def _reads(self, first, last):
+        """Yield (piece, offset, length) reads covering bytes [first, last] of the clip"""
+        position = 0
+        for piece in self.pieces:
+            piece_end = position + piece.length
+            if piece_end > first and position <= last:
+                begin = max(first, position) - position
+                end = min(last + 1, piece_end) - position
+                while begin < end:
+                    length = min(CHUNK_SIZE, end - begin)
+                    yield piece, begin, length
+                    begin += length
+            position = piece_end
+            if position > last:
+                break
+
+    @staticmethod
+    def _read(piece, begin, length, files):
+        if piece.data is not None:
+            return piece.data[begin:begin + length]
+        fd = files.get(piece.path)
+        if fd is None:
+            fd = os.open(piece.path, os.O_RDONLY)
+            files[piece.path] = fd
+        return os.pread(fd, length, piece.offset + begin)
+
+    def iter_bytes(self, first=0, last=None):
+        """Yield the bytes [first, last] of the clip in chunks of at most CHUNK_SIZE"""
+        last = self.size - 1 if last is None else last
+        files = {}
+        try:
+            for piece, begin, length in self._reads(first, last):
+                yield self._read(piece, begin, length, files)
+        finally:
+            for fd in files.values():
+                os.close(fd)
+
+    async def aiter_bytes(self, first=0, last=None):
+        """Asynchronous iter_bytes(); disk reads run in a worker thread"""
+        last = self.size - 1 if last is None else last
+        files = {}
+        try:
+            for piece, begin, length in self._reads(first, last):
+                if piece.data is not None:
+                    yield self._read(piece, begin, length, files)
+                else:
+                    yield await asyncio.to_thread(self._read, piece, begin, length, files)
+        finally:
+            for fd in files.values():
+                os.close(fd)
+
+
+def build_clip(recorder, camera_id, start, end):
+    """
+    Select the archived segments covering [start, end)
+
+    Args:
+        recorder: dvr.DVRRecorder
+        camera_id: Camera id
+        start: Aware datetime
+        end: Aware datetime
+
+    Returns:
+        Clip: The clip, empty if nothing was recorded in the range
+    """
+    start_ms, end_ms = to_ms(start), to_ms(end)
+    clip = Clip(camera_id, start, end)
+    previous = None
+    for path, segment in recorder.segments(camera_id, start, end):
+        if previous is not None:
+            if clip.segments == 1:
+                # Only the first and the last segment are trimmed
+                clip.add_trimmed(*previous, start_ms, end_ms)
+            else:
+                clip.add(previous[0], previous[1].offset, previous[1].length)
+        previous = (path, segment)
+        clip.segments += 1
+    if previous is not None:
+        clip.add_trimmed(*previous, start_ms if clip.segments == 1 else 0, end_ms)
+    return clip
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header
+
+    Args:
+        header: Range header value, or None
+        size: Size of the representation
+
+    Returns:
+        tuple: (first, last) byte positions, None to send everything (no or
+               unsupported header) or False when the range is unsatisfiable
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if not length:
+            return False
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or last < first:
+        return False
+    return first, last
+
+
+def remux_available():
+    """Whether ffmpeg can be found for MP4 exports"""
+    return shutil.which(settings.FFMPEG_BIN) is not None
+
+
+def remux_args():
+    """ffmpeg arguments remuxing MPEG-TS on stdin to fragmented MP4 on stdout"""
+    return [
+        settings.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin',
+        '-f', 'mpegts', '-i', 'pipe:0',
+        '-map', '0', '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+        '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', 'pipe:1',
+    ]
+
+
+def iter_mp4(clip):
+    """Yield the clip remuxed to MP4 by ffmpeg, without re-encoding"""
+    process = subprocess.Popen(remux_args(), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            for chunk in clip.iter_bytes():
+                process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, name='clip-remux', daemon=True)
+    feeder.start()
+    try:
+        while True:
+            chunk = process.stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        feeder.join()
+        if process.returncode not in (0, -9):
+            logger.error(f"ffmpeg remux of camera {clip.camera_id} exited with {process.returncode}")
+
+
+async def aiter_mp4(clip):
+    """Asynchronous iter_mp4()"""
+    process = await asyncio.create_subprocess_exec(
+        *remux_args(), stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+
+    async def feed():
+        try:
+            async for chunk in clip.aiter_bytes():
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.ensure_future(feed())
+    try:
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        feeder.cancel()
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+
+def clip_response(request, clip, container):
+    """
+    Build the streaming response for an export
+
+    TS exports have a known size, so they carry Content-Length, an ETag and
+    honour single Range requests (guarded by If-Range) for resumable
+    downloads. MP4 exports are remuxed on the fly and cannot be resumed.
+    Under ASGI the body is an asynchronous iterator, so Django does not
+    buffer it.
+
+    Args:
+        request: The request (Django or DRF)
+        clip: Clip to send, not empty
+        container: One of EXPORT_CONTAINERS
+
+    Returns:
+        HttpResponse: 200, 206 or 416 response
+    """
+    is_async = isinstance(getattr(request, '_request', request), ASGIRequest)
+    filename = f'camera-{clip.camera_id}-{clip.start:%Y%m%dT%H%M%SZ}.{container}'
+
+    if container == CONTAINER_MP4:
+        response = StreamingHttpResponse(aiter_mp4(clip) if is_async else iter_mp4(clip),
+                                         content_type=CONTENT_TYPES[container])
+        response['Accept-Ranges'] = 'none'
+    else:
+        etag = make_etag(f'{clip.camera_id}:{clip.start.isoformat()}:{clip.end.isoformat()}:'
+                         f'{clip.size}'.encode())
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range == etag:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), clip.size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{clip.size}'
+            return response
+        first, last = byte_range or (0, clip.size - 1)
+        body = clip.aiter_bytes(first, last) if is_async else clip.iter_bytes(first, last)
+        response = StreamingHttpResponse(body, status=206 if byte_range else 200,
+                                         content_type=CONTENT_TYPES[container])
+        response['Content-Length'] = str(last - first + 1)
+        if byte_range:
+            response['Content-Range'] = f'bytes {first}-{last}/{clip.size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,485 @@
+import atexit
+import collections
+import ctypes
+import ctypes.util
+import logging
+import math
+import os
+import select
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_NAME = 'index.m3u8'
+
+STATUS_LIVE = 'live'
+STATUS_STALE = 'stale'
+STATUS_ENDED = 'ended'
+STATUS_MISSING = 'missing'
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def parse_playlist(text):
+    """
+    Parse an HLS media or master playlist
+
+    Args:
+        text: Playlist contents
+
+    Returns:
+        dict: target_duration, media_sequence, ended, variants (URIs of a
+              master playlist) and segments as (sequence, duration, uri,
+              discontinuity) tuples
+    """
+    target_duration = None
+    media_sequence = 0
+    ended = False
+    variants = []
+    segments = []
+    duration = None
+    discontinuity = False
+    expect_variant = False
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            tag, _, value = line.partition(':')
+            if tag == '#EXT-X-TARGETDURATION':
+                target_duration = float(value)
+            elif tag == '#EXT-X-MEDIA-SEQUENCE':
+                media_sequence = int(value)
+            elif tag == '#EXTINF':
+                duration = float(value.split(',', 1)[0])
+            elif tag == '#EXT-X-DISCONTINUITY':
+                discontinuity = True
+            elif tag == '#EXT-X-ENDLIST':
+                ended = True
+            elif tag == '#EXT-X-STREAM-INF':
+                expect_variant = True
+            continue
+        if expect_variant:
+            variants.append(line)
+            expect_variant = False
+        elif duration is not None:
+            segments.append((media_sequence + len(segments), duration, line, discontinuity))
+            duration = None
+            discontinuity = False
+
+    return {
+        'target_duration': target_duration,
+        'media_sequence': media_sequence,
+        'ended': ended,
+        'variants': variants,
+        'segments': segments,
+    }
+
+
+class PlaylistHealth:
+    """
+    Health of one HLS playlist, updated incrementally
+
+    Each update only looks at segments newer than the last one seen, so
+    the cost per playlist rewrite is one small file read plus one stat()
+    of each new segment.
+    """
+
+    def __init__(self, path, window=20):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.target_duration = None
+        self.media_sequence = None
+        self.last_sequence = -1
+        self.segments = collections.deque(maxlen=window)
+        self.discontinuities = 0
+        self.restarts = 0
+        self.last_segment_at = None
+        self.last_segment_path = None
+        self.updated_at = None
+        self.variants = []
+        self.ended = False
+
+    def update(self, text, now):
+        """
+        Apply a new version of the playlist
+
+        Returns:
+            list: Newly seen segments as (sequence, duration, path,
+                  discontinuity, written_at) tuples
+        """
+        parsed = parse_playlist(text)
+        self.updated_at = now
+        self.variants = parsed['variants']
+        if self.variants:
+            return []
+        self.target_duration = parsed['target_duration']
+        self.ended = parsed['ended']
+
+        segments = parsed['segments']
+        if segments and segments[-1][0] < self.last_sequence:
+            # Sequence went backwards: the publisher restarted
+            self.last_sequence = -1
+            self.restarts += 1
+            self.discontinuities += 1
+        self.media_sequence = parsed['media_sequence']
+
+        new_segments = []
+        for sequence, duration, uri, discontinuity in segments:
+            if sequence <= self.last_sequence:
+                continue
+            path = os.path.join(self.directory, uri)
+            try:
+                stat = os.stat(path)
+                size, written_at = stat.st_size, stat.st_mtime
+            except OSError:
+                size, written_at = None, now
+            if discontinuity and self.last_sequence >= 0:
+                self.discontinuities += 1
+            self.segments.append((sequence, duration, size))
+            self.last_sequence = sequence
+            self.last_segment_at = max(written_at, self.last_segment_at or 0)
+            self.last_segment_path = path
+            new_segments.append((sequence, duration, path, discontinuity, written_at))
+        return new_segments
+
+    def as_dict(self, now, stale_factor=3.0):
+        if self.variants:
+            return {'variants': self.variants, 'updated_at': self.updated_at}
+
+        durations = [duration for _, duration, _ in self.segments]
+        mean = sum(durations) / len(durations) if durations else None
+        jitter = math.sqrt(sum((d - mean) ** 2 for d in durations) / len(durations)) if durations else 0.0
+        sized = [(duration, size) for _, duration, size in self.segments if size is not None]
+        age = now - self.last_segment_at if self.last_segment_at else None
+        target = self.target_duration or (max(durations) if durations else None)
+
+        if age is None:
+            state = STATUS_MISSING
+        elif self.ended:
+            state = STATUS_ENDED
+        elif target and age > stale_factor * target:
+            state = STATUS_STALE
+        else:
+            state = STATUS_LIVE
+
+        total_duration = sum(duration for duration, _ in sized)
+        return {
+            'status': state,
+            'last_segment_age': round(age, 3) if age is not None else None,
+            'target_duration': self.target_duration,
+            'media_sequence': self.media_sequence,
+            'last_sequence': self.last_sequence if self.last_sequence >= 0 else None,
+            'segment_duration': round(mean, 3) if mean is not None else None,
+            'duration_jitter': round(jitter, 3),
+            'bitrate': int(sum(size for _, size in sized) * 8 / total_duration) if total_duration else None,
+            'discontinuities': self.discontinuities,
+            'restarts': self.restarts,
+            'updated_at': self.updated_at,
+        }
+
+
+class Inotify:
+    """Minimal ctypes binding of Linux inotify"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self, timeout):
+        """Return (wd, mask, name) tuples, waiting at most timeout seconds"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def split_stream_name(name):
+    """
+    Split an HLS directory name into camera id and variant suffix
+
+    Returns:
+        tuple: (camera id, suffix) e.g. ('12_low') -> (12, '_low'); camera
+               id is None for directories not named after a camera
+    """
+    base, separator, suffix = name.partition('_')
+    try:
+        return int(base), separator + suffix
+    except ValueError:
+        return None, ''
+
+
+class HLSWatcher:
+    """
+    Watch the nginx-rtmp HLS output and keep per-camera stream health
+
+    Uses inotify on HLS_ROOT and each stream directory, reacting only to
+    playlist rewrites. Where inotify is not available it polls, stat()ing
+    each stream's playlist once per interval. Health requests are served
+    from memory.
+    """
+
+    def __init__(self, root, mode='auto', poll_interval=1.0, window=20, stale_factor=3.0):
+        self.root = root
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.window = window
+        self.stale_factor = stale_factor
+        self.active_mode = None
+        self._playlists = {}
+        self._cameras = collections.defaultdict(dict)
+        self._signatures = {}
+        self._watches = {}
+        self._listeners = []
+        self._playlist_listeners = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='hls-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def add_listener(self, listener):
+        """
+        Call listener(camera_id, suffix, segments) for every batch of new
+        segments, with segments as returned by PlaylistHealth.update()
+        """
+        self._listeners.append(listener)
+
+    def add_playlist_listener(self, listener):
+        """Call listener(path) whenever a stream's playlist was rewritten, before it is read"""
+        self._playlist_listeners.append(listener)
+
+    def latest_segment(self, camera_id, suffix=''):
+        """
+        Return the newest segment of one of a camera's playlists
+
+        Returns:
+            tuple: (sequence, path, written_at), or None if no segment was seen
+        """
+        with self._lock:
+            playlist = self._cameras.get(camera_id, {}).get(suffix)
+            if playlist is None or playlist.last_segment_path is None:
+                return None
+            return playlist.last_sequence, playlist.last_segment_path, playlist.last_segment_at
+
+    def health(self, camera_id, now=None):
+        """
+        Return the health of a camera's HLS output
+
+        Args:
+            camera_id: Camera id
+            now: Reference wall-clock time, defaults to time.time()
+
+        Returns:
+            dict: Overall status plus per-playlist details keyed by variant
+                  suffix ('' for the camera's own playlist)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            playlists = {
+                suffix: playlist.as_dict(now, self.stale_factor)
+                for suffix, playlist in self._cameras.get(camera_id, {}).items()
+            }
+        states = [playlist['status'] for playlist in playlists.values() if 'status' in playlist]
+        for state in (STATUS_LIVE, STATUS_STALE, STATUS_ENDED):
+            if state in states:
+                overall = state
+                break
+        else:
+            overall = STATUS_MISSING
+        return {'id': camera_id, 'status': overall, 'playlists': playlists}
+
+    def health_many(self, camera_ids):
+        now = time.time()
+        return {camera_id: self.health(camera_id, now) for camera_id in camera_ids}
+
+    def handle_playlist(self, path):
+        """Re-read one playlist after nginx rewrote it"""
+        name = os.path.basename(os.path.dirname(path))
+        camera_id, suffix = split_stream_name(name)
+        if camera_id is None:
+            return
+        for listener in self._playlist_listeners:
+            try:
+                listener(path)
+            except Exception as e:
+                logger.error(f"HLS playlist listener failed for {path}: {e}")
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                text = f.read()
+        except OSError:
+            return
+        with self._lock:
+            playlist = self._playlists.get(path)
+            if playlist is None:
+                playlist = PlaylistHealth(path, self.window)
+                self._playlists[path] = playlist
+                self._cameras[camera_id][suffix] = playlist
+            segments = playlist.update(text, time.time())
+        if not segments:
+            return
+        for listener in self._listeners:
+            try:
+                listener(camera_id, suffix, segments)
+            except Exception as e:
+                logger.error(f"HLS segment listener failed for camera {camera_id}: {e}")
+
+    def _stream_directories(self):
+        try:
+            with os.scandir(self.root) as entries:
+                return [entry.path for entry in entries if entry.is_dir()]
+        except FileNotFoundError:
+            return []
+
+    def _poll_once(self):
+        for directory in self._stream_directories():
+            path = os.path.join(directory, PLAYLIST_NAME)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if self._signatures.get(path) != signature:
+                self._signatures[path] = signature
+                self.handle_playlist(path)
+
+    def _watch_directory(self, inotify, directory):
+        try:
+            wd = inotify.add_watch(directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF)
+        except OSError as e:
+            logger.warning(f"Cannot watch HLS directory {directory}: {e}")
+            return
+        self._watches[wd] = directory
+        path = os.path.join(directory, PLAYLIST_NAME)
+        if os.path.exists(path):
+            self.handle_playlist(path)
+
+    def _run_inotify(self, inotify):
+        os.makedirs(self.root, exist_ok=True)
+        root_wd = inotify.add_watch(self.root, IN_CREATE | IN_MOVED_TO)
+        for directory in self._stream_directories():
+            self._watch_directory(inotify, directory)
+
+        while not self._stopped.is_set():
+            for wd, mask, name in inotify.read(timeout=1.0):
+                if mask & IN_Q_OVERFLOW:
+                    logger.warning("HLS watcher event queue overflowed, rescanning")
+                    self._poll_once()
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                if wd == root_wd:
+                    if mask & IN_ISDIR:
+                        self._watch_directory(inotify, os.path.join(self.root, name))
+                    continue
+                directory = self._watches.get(wd)
+                if directory is not None and name == PLAYLIST_NAME:
+                    self.handle_playlist(os.path.join(directory, name))
+
+    def _run(self):
+        inotify = None
+        if self.mode in ('auto', 'inotify'):
+            try:
+                inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                if self.mode == 'inotify':
+                    logger.error(f"inotify unavailable, HLS health disabled: {e}")
+                    return
+                logger.info(f"inotify unavailable, polling {self.root}: {e}")
+
+        if inotify is not None:
+            self.active_mode = 'inotify'
+            try:
+                self._run_inotify(inotify)
+            except OSError as e:
+                logger.warning(f"HLS inotify watch failed, falling back to polling: {e}")
+            finally:
+                inotify.close()
+            if self._stopped.is_set():
+                return
+
+        self.active_mode = 'poll'
+        while not self._stopped.is_set():
+            try:
+                self._poll_once()
+            except OSError as e:
+                logger.warning(f"Error polling HLS directory {self.root}: {e}")
+            self._stopped.wait(self.poll_interval)
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_hls_watcher():
+    """
+    Return the process-wide HLSWatcher, creating and starting it from settings
+
+    Returns:
+        HLSWatcher: The running watcher
+    """
+    global _watcher
+    if _watcher is None:
+        with _watcher_lock:
+            if _watcher is None:
+                watcher = HLSWatcher(
+                    settings.HLS_WATCH_ROOT,
+                    mode=settings.HLS_WATCH_MODE,
+                    poll_interval=settings.HLS_POLL_INTERVAL,
+                    window=settings.HLS_HEALTH_WINDOW,
+                    stale_factor=settings.HLS_STALE_FACTOR,
+                )
+                watcher.start()
+                atexit.register(watcher.stop)
+                _watcher = watcher
+    return _watcher
@@ -0,0 +1,567 @@
+import asyncio
+import atexit
+import collections
+import logging
+import os
+import threading
+import time
+
+from .metrics import INGEST_RESTARTS, SUPERVISED_PROCESSES
+
+logger = logging.getLogger(__name__)
+
+# Process states reported by the supervisor
+STATE_STARTING = 'starting'
+STATE_RUNNING = 'running'
+STATE_BACKOFF = 'backoff'
+STATE_STOPPING = 'stopping'
+STATE_STOPPED = 'stopped'
+PROCESS_STATES = (STATE_STARTING, STATE_RUNNING, STATE_BACKOFF, STATE_STOPPING, STATE_STOPPED)
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# ffmpeg writes a -progress report about twice a second; rates cover the last few seconds
+PROGRESS_SAMPLES = 10
+
+# Microseconds (and bytes) of the source an on-demand relay probes before relaying
+FAST_START_PROBE = 1000000
+
+
+class IngestCapacityError(Exception):
+    """Raised when the supervisor is already running its maximum number of processes"""
+
+
+def build_ffmpeg_args(source_url, target_url, on_demand=False):
+    """
+    Build the ffmpeg arguments used to relay a camera feed into nginx-rtmp
+
+    Video is copied as-is; audio is normalised to mono AAC so every camera
+    looks the same to nginx. On-demand relays start while a viewer waits:
+    they probe the source for at most FAST_START_PROBE microseconds instead
+    of ffmpeg's 5 s, which a camera without audio would otherwise use up,
+    and report -progress so their traffic can be accounted.
+
+    Args:
+        source_url: RTSP or RTMP URL to pull from
+        target_url: RTMP URL to publish to
+        on_demand: Build the arguments of an on-demand relay
+
+    Returns:
+        list: ffmpeg arguments (without the binary)
+    """
+    args = ['-hide_banner', '-loglevel', 'error', '-nostdin']
+    if on_demand:
+        args += ['-nostats', '-progress', 'pipe:1',
+                 '-analyzeduration', str(FAST_START_PROBE), '-probesize', str(FAST_START_PROBE)]
+    if source_url.startswith('rtsp://'):
+        args += ['-rtsp_transport', 'tcp']
+    args += [
+        '-i', source_url,
+        '-c:v', 'copy', '-c:a', 'aac', '-ar', '44100', '-ac', '1',
+        '-f', 'flv', target_url,
+    ]
+    return args
+
+
+def reports_progress(args):
+    """Whether ffmpeg arguments ask for -progress reports on stdout"""
+    try:
+        return args[args.index('-progress') + 1] == 'pipe:1'
+    except (ValueError, IndexError):
+        return False
+
+
+def read_proc_usage(pid):
+    """
+    Read cumulative CPU seconds and resident memory for a process from /proc
+
+    Args:
+        pid: Process id
+
+    Returns:
+        tuple: (cpu_seconds, rss_bytes), or (None, None) if unavailable
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            statm = f.read()
+    except OSError:
+        return None, None
+    # The command name may contain spaces, so split after the closing paren
+    fields = stat[stat.rindex(b')') + 2:].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    rss_bytes = int(statm.split()[1]) * _PAGE_SIZE
+    return cpu_seconds, rss_bytes
+
+
+class IngestProcess:
+    """
+    Book-keeping for one supervised ffmpeg process
+    """
+
+    def __init__(self, key, args, stderr_lines, output=None):
+        self.key = key
+        self.args = args
+        # Coroutine function handed the stdout of every run of the process
+        self.output = output
+        self.state = STATE_STARTING
+        self.process = None
+        self.task = None
+        self.stop_event = asyncio.Event()
+        self.wake_event = asyncio.Event()
+        self.restarts = 0
+        self.restart_requested = False
+        self.started_at = None
+        self.last_exit_code = None
+        self.stderr_tail = collections.deque(maxlen=stderr_lines)
+        self.cpu_seconds = 0.0
+        self.cpu_percent = 0.0
+        self.rss_bytes = 0
+        self._last_sample = None
+        # Latest -progress report and (time, frame, out_time_us) of the recent ones
+        self.progress = None
+        self._progress_samples = collections.deque(maxlen=PROGRESS_SAMPLES)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def sample(self, now):
+        """Update CPU and RSS accounting from /proc"""
+        if self.process is None or self.process.returncode is not None:
+            self.cpu_percent = 0.0
+            self.rss_bytes = 0
+            return
+        cpu_seconds, rss_bytes = read_proc_usage(self.process.pid)
+        if cpu_seconds is None:
+            return
+        if self._last_sample is not None:
+            last_time, last_cpu = self._last_sample
+            elapsed = now - last_time
+            if elapsed > 0:
+                self.cpu_percent = round(100.0 * (cpu_seconds - last_cpu) / elapsed, 2)
+        self._last_sample = (now, cpu_seconds)
+        self.cpu_seconds = cpu_seconds
+        self.rss_bytes = rss_bytes
+
+    def add_progress(self, report, now):
+        """Record one ffmpeg -progress report (its key=value pairs)"""
+        self.progress = report
+        try:
+            frame = int(report.get('frame', 0))
+            # out_time_ms is in microseconds as well; older ffmpeg only has that one
+            out_time_us = int(report.get('out_time_us', report.get('out_time_ms')))
+        except (TypeError, ValueError):
+            return
+        self._progress_samples.append((now, frame, out_time_us))
+
+    def progress_rates(self):
+        """
+        Output rates over the recent -progress reports
+
+        ffmpeg's own fps and speed figures average over the whole run, which
+        includes waiting for a live source to connect, so they are not used.
+
+        Returns:
+            dict: fps of the first video output and speed (media seconds per
+                  second, 1.0 is real time); None until two reports arrived
+        """
+        if len(self._progress_samples) < 2:
+            return None
+        first_time, first_frame, first_out = self._progress_samples[0]
+        last_time, last_frame, last_out = self._progress_samples[-1]
+        elapsed = last_time - first_time
+        if elapsed <= 0:
+            return None
+        return {
+            'fps': round((last_frame - first_frame) / elapsed, 2),
+            'speed': round((last_out - first_out) / 1e6 / elapsed, 3),
+        }
+
+    def as_dict(self):
+        return {
+            'key': self.key,
+            'state': self.state,
+            'pid': self.pid,
+            'restarts': self.restarts,
+            'uptime': round(time.monotonic() - self.started_at, 1) if self.started_at else None,
+            'last_exit_code': self.last_exit_code,
+            'cpu_seconds': round(self.cpu_seconds, 2),
+            'cpu_percent': self.cpu_percent,
+            'rss_bytes': self.rss_bytes,
+            'progress': self.progress_rates(),
+            'stderr_tail': list(self.stderr_tail),
+        }
+
+
+class IngestSupervisor:
+    """
+    Supervise many long-running ffmpeg processes from a single asyncio loop
+
+    The loop runs in a daemon thread so synchronous Django views can drive it
+    through the thread-safe public methods. Each process gets a runner task
+    that drains stderr without blocking, restarts the process with
+    exponential backoff when it exits, and a shared sampler task keeps CPU
+    and RSS figures up to date.
+    """
+
+    def __init__(self, ffmpeg_bin='ffmpeg', max_processes=256, backoff_initial=1.0,
+                 backoff_max=60.0, stable_after=30.0, stop_timeout=5.0,
+                 sample_interval=5.0, stderr_lines=20):
+        self.ffmpeg_bin = ffmpeg_bin
+        self.max_processes = max_processes
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.stop_timeout = stop_timeout
+        self.sample_interval = sample_interval
+        self.stderr_lines = stderr_lines
+        self.processes = {}
+        self._loop = None
+        self._thread = None
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    # Thread-safe public API
+
+    def start(self):
+        """Start the event loop thread if it is not already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(ready,), name='ingest-supervisor', daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+
+    def spawn(self, key, args, timeout=10, output=None):
+        """
+        Start supervising a process, replacing any existing one for the same key
+
+        Args:
+            key: Identifier of the process (usually the camera id)
+            args: ffmpeg arguments (without the binary)
+            timeout: Seconds to wait for the loop to accept the request
+            output: Coroutine function reading the process's stdout, called
+                    with the StreamReader of every run; it runs on the
+                    supervisor's loop and must read until EOF
+
+        Returns:
+            dict: Status of the supervised process
+
+        Raises:
+            IngestCapacityError: If max_processes are already supervised
+        """
+        return self._call(self._spawn(key, args, output), timeout)
+
+    def spawn_many(self, items, timeout=30):
+        """
+        Start supervising several processes in one round trip to the loop
+
+        Args:
+            items: Iterable of (key, args) pairs, or (key, args, output)
+            timeout: Seconds to wait for the loop to accept the request
+
+        Returns:
+            dict: Mapping of key to its status dict, or to the exception
+                  (e.g. IngestCapacityError) that prevented it from starting
+        """
+        return self._call(self._spawn_many(list(items)), timeout)
+
+    def stop_process(self, key, timeout=None):
+        """
+        Stop a supervised process and forget about it
+
+        Returns:
+            bool: True if a process was being supervised for the key
+        """
+        timeout = timeout or self.stop_timeout + 5
+        return self._call(self._stop(key), timeout)
+
+    def stop_many(self, keys, timeout=None):
+        """
+        Stop several supervised processes concurrently
+
+        Returns:
+            dict: Mapping of key to True if a process was being supervised
+        """
+        timeout = timeout or self.stop_timeout + 10
+        return self._call(self._stop_many(list(keys)), timeout)
+
+    def restart_process(self, key, timeout=10):
+        """
+        Restart a supervised process immediately, resetting its backoff
+
+        Returns:
+            bool: True if a process was being supervised for the key
+        """
+        return self._call(self._restart(key), timeout)
+
+    def status(self, key=None):
+        """
+        Return the status of one process or of all processes
+
+        Args:
+            key: Identifier of the process, or None for all of them
+
+        Returns:
+            dict or list: Status dictionaries, None if the key is unknown
+        """
+        if key is not None:
+            entry = self.processes.get(key)
+            return entry.as_dict() if entry else None
+        return [entry.as_dict() for entry in list(self.processes.values())]
+
+    def is_running(self, key):
+        entry = self.processes.get(key)
+        return entry is not None and entry.state != STATE_STOPPED
+
+    def shutdown(self):
+        """Stop every supervised process and the event loop"""
+        if self._loop is None:
+            return
+        try:
+            self._call(self._stop_all(), self.stop_timeout + 10)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop = None
+            self._thread = None
+
+    # Event loop internals
+
+    def _run_loop(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._sampler = self._loop.create_task(self._sample_forever())
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._sampler.cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+    def _call(self, coro, timeout):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return future.result(timeout)
+
+    async def _spawn(self, key, args, output=None):
+        if key in self.processes:
+            await self._stop(key)
+        if len(self.processes) >= self.max_processes:
+            raise IngestCapacityError(
+                f"Supervisor is at its limit of {self.max_processes} processes"
+            )
+        entry = IngestProcess(key, args, self.stderr_lines, output)
+        self.processes[key] = entry
+        entry.task = asyncio.create_task(self._supervise(entry))
+        return entry.as_dict()
+
+    async def _spawn_many(self, items):
+        results = {}
+        for key, args, *output in items:
+            try:
+                results[key] = await self._spawn(key, args, *output)
+            except IngestCapacityError as e:
+                results[key] = e
+        return results
+
+    async def _stop_many(self, keys):
+        stopped = await asyncio.gather(*(self._stop(key) for key in keys))
+        return dict(zip(keys, stopped))
+
+    async def _stop(self, key):
+        entry = self.processes.pop(key, None)
+        if entry is None:
+            return False
+        entry.state = STATE_STOPPING
+        entry.stop_event.set()
+        entry.wake_event.set()
+        await self._terminate(entry)
+        if entry.task is not None:
+            await entry.task
+        entry.state = STATE_STOPPED
+        return True
+
+    async def _restart(self, key):
+        entry = self.processes.get(key)
+        if entry is None:
+            return False
+        entry.restarts = 0
+        entry.restart_requested = True
+        entry.wake_event.set()
+        await self._terminate(entry)
+        return True
+
+    async def _stop_all(self):
+        await self._stop_many(list(self.processes))
+
+    async def _terminate(self, entry):
+        process = entry.process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Process {entry.key} did not exit after SIGTERM, killing it")
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+    async def _supervise(self, entry):
+        backoff = self.backoff_initial
+        progress = reports_progress(entry.args)
+        piped = progress or entry.output is not None
+        while not entry.stop_event.is_set():
+            entry.state = STATE_STARTING
+            try:
+                entry.process = await asyncio.create_subprocess_exec(
+                    self.ffmpeg_bin, *entry.args,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE if piped else asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                )
+            except OSError as e:
+                logger.error(f"Failed to launch process {entry.key}: {e}")
+                entry.process = None
+                entry.last_exit_code = None
+                entry.stderr_tail.append(str(e))
+            else:
+                if entry.stop_event.is_set():
+                    # Stopped while launching, when _stop() had no process to terminate yet
+                    try:
+                        entry.process.terminate()
+                    except ProcessLookupError:
+                        pass
+                entry.state = STATE_RUNNING
+                entry.started_at = time.monotonic()
+                entry._last_sample = None
+                entry.progress = None
+                entry._progress_samples.clear()
+                logger.info(f"Started process {entry.key} with PID {entry.process.pid}")
+                if entry.output is not None:
+                    await asyncio.gather(self._drain(entry), self._read_output(entry))
+                elif progress:
+                    await asyncio.gather(self._drain(entry), self._read_progress(entry))
+                else:
+                    await self._drain(entry)
+                entry.last_exit_code = await entry.process.wait()
+                runtime = time.monotonic() - entry.started_at
+                if runtime >= self.stable_after:
+                    backoff = self.backoff_initial
+
+            if entry.stop_event.is_set():
+                break
+            if entry.restart_requested:
+                entry.restart_requested = False
+                entry.wake_event.clear()
+                backoff = self.backoff_initial
+                continue
+
+            entry.restarts += 1
+            INGEST_RESTARTS.inc()
+            entry.state = STATE_BACKOFF
+            logger.warning(
+                f"Process {entry.key} exited with code {entry.last_exit_code}, "
+                f"restarting in {backoff:.1f}s"
+            )
+            try:
+                await asyncio.wait_for(entry.wake_event.wait(), backoff)
+            except asyncio.TimeoutError:
+                backoff = min(backoff * 2, self.backoff_max)
+            else:
+                # Woken by restart_process() or stop_process()
+                entry.wake_event.clear()
+                entry.restart_requested = False
+                backoff = self.backoff_initial
+        entry.state = STATE_STOPPED
+
+    async def _drain(self, entry):
+        """Read stderr until EOF, keeping only the last few lines"""
+        stream = entry.process.stderr
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # Line longer than the stream buffer limit; skip it
+                continue
+            if not line:
+                return
+            entry.stderr_tail.append(line.decode(errors='replace').rstrip())
+
+    async def _read_progress(self, entry):
+        """Collect the -progress reports ffmpeg writes to stdout until EOF"""
+        stream = entry.process.stdout
+        report = {}
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                continue
+            if not line:
+                return
+            key, _, value = line.decode(errors='replace').strip().partition('=')
+            report[key] = value
+            # Every report ends with progress=continue (or progress=end)
+            if key == 'progress':
+                entry.add_progress(report, time.monotonic())
+                report = {}
+
+    async def _read_output(self, entry):
+        """Hand stdout to the process's output reader, then discard what it left unread"""
+        stream = entry.process.stdout
+        try:
+            await entry.output(stream)
+        except Exception as e:
+            logger.error(f"Failed to read the output of process {entry.key}: {e}")
+        # A reader that gave up must not leave the process blocked on a full pipe
+        while await stream.read(65536):
+            pass
+
+    async def _sample_forever(self):
+        while True:
+            now = time.monotonic()
+            states = dict.fromkeys(PROCESS_STATES, 0)
+            for entry in list(self.processes.values()):
+                entry.sample(now)
+                states[entry.state] += 1
+            for state, count in states.items():
+                SUPERVISED_PROCESSES.labels(state).set(count)
+            await asyncio.sleep(self.sample_interval)
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    """
+    Return the process-wide ingest supervisor, creating it from settings
+
+    Returns:
+        IngestSupervisor: The shared supervisor
+    """
+    global _supervisor
+    if _supervisor is None:
+        with _supervisor_lock:
+            if _supervisor is None:
+                from django.conf import settings
+                _supervisor = IngestSupervisor(
+                    ffmpeg_bin=settings.FFMPEG_BIN,
+                    max_processes=settings.INGEST_MAX_PROCESSES,
+                    backoff_initial=settings.INGEST_BACKOFF_INITIAL,
+                    backoff_max=settings.INGEST_BACKOFF_MAX,
+                    stop_timeout=settings.INGEST_STOP_TIMEOUT,
+                )
+                _supervisor.start()
+                atexit.register(_supervisor.shutdown)
+    return _supervisor
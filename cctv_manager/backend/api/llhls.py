@@ -0,0 +1,868 @@
+import asyncio
+import atexit
+import collections
+import datetime
+import functools
+import logging
+import math
+import re
+import struct
+import threading
+import time
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+
+from .ingest import FAST_START_PROBE, get_supervisor
+from .metrics import LLHLS_BLOCKED, LLHLS_STREAMS, observe_request
+from .models import LATENCY_LOW
+from .nodes import get_node_registry
+from .ondemand import get_on_demand
+from .scheduling import CameraScheduler
+
+logger = logging.getLogger(__name__)
+
+# Packager states reported per camera
+PACKAGER_OFF = 'off'
+PACKAGER_IDLE = 'idle'
+PACKAGER_STARTING = 'starting'
+PACKAGER_RUNNING = 'running'
+PACKAGER_STATES = (PACKAGER_IDLE, PACKAGER_STARTING, PACKAGER_RUNNING)
+
+# Marks the packager's own play of a camera stream, which is not a viewer
+LLHLS_CLIENT = 'llhls'
+
+# ffmpeg closes a fragment on the first frame past -frag_duration; asking for
+# this much less than the part target keeps parts within it down to 10 fps
+FRAME_ALLOWANCE = 0.1
+
+# Slack when comparing summed part durations with the segment target, so
+# rounding in the timescale does not push a cut to the following keyframe
+DURATION_EPSILON = 0.001
+
+# Target durations a blocking request is held before it fails (RFC 8216bis: three)
+BLOCK_TIMEOUT_FACTOR = 3
+
+# Partial segments are listed for the segments within this many target
+# durations of the live edge (RFC 8216bis: "greater than three")
+PART_LISTED_TARGETS = 3
+
+# sample_is_non_sync_sample in ISO BMFF sample flags
+NON_SYNC_SAMPLE = 0x10000
+
+Track = collections.namedtuple('Track', ['timescale', 'handler', 'default_duration', 'default_flags'])
+Part = collections.namedtuple('Part', ['data', 'duration', 'independent'])
+
+
+def build_packager_args(source_url, part_target):
+    """
+    Build the ffmpeg arguments repackaging a camera's stream as fragmented MP4 on stdout
+
+    Video and audio are copied. Each fragment (moof + mdat) becomes one
+    partial segment; ffmpeg starts a fragment at every keyframe and once the
+    current one holds -frag_duration of media.
+
+    Args:
+        source_url: RTMP URL of the camera's stream
+        part_target: Seconds of media per partial segment
+
+    Returns:
+        list: ffmpeg arguments (without the binary)
+    """
+    fragment = max(part_target - FRAME_ALLOWANCE, FRAME_ALLOWANCE)
+    return [
+        '-hide_banner', '-loglevel', 'error', '-nostdin', '-fflags', 'nobuffer',
+        '-analyzeduration', str(FAST_START_PROBE), '-probesize', str(FAST_START_PROBE),
+        '-i', source_url,
+        '-map', '0:v', '-map', '0:a?', '-c', 'copy',
+        '-f', 'mp4', '-movflags', 'empty_moov+default_base_moof+frag_keyframe',
+        '-frag_duration', str(int(fragment * 1e6)), '-flush_packets', '1', 'pipe:1',
+    ]
+
+
+# ISO BMFF parsing, only as far as partial segments need it
+
+def iter_boxes(data, start=0, end=None):
+    """Yield (type, payload start, payload end) of the boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            return
+        yield kind, start + header, start + size
+        start += size
+
+
+def find_box(data, path, start=0, end=None):
+    """Return (payload start, payload end) of the box at a path of types, or None"""
+    for kind, payload, box_end in iter_boxes(data, start, end):
+        if kind == path[0]:
+            return (payload, box_end) if len(path) == 1 else find_box(data, path[1:], payload, box_end)
+    return None
+
+
+def parse_init(data):
+    """
+    Read the tracks of an fMP4 init segment (ftyp + moov)
+
+    Returns:
+        dict: Track id -> Track
+
+    Raises:
+        ValueError: If there is no moov box
+    """
+    moov = find_box(data, (b'moov',))
+    if moov is None:
+        raise ValueError('init segment without a moov box')
+    defaults = {}
+    mvex = find_box(data, (b'mvex',), *moov)
+    if mvex is not None:
+        for kind, payload, _ in iter_boxes(data, *mvex):
+            if kind == b'trex':
+                track_id, _, duration, _, flags = struct.unpack_from('>5I', data, payload + 4)
+                defaults[track_id] = (duration, flags)
+    tracks = {}
+    for kind, payload, end in iter_boxes(data, *moov):
+        if kind != b'trak':
+            continue
+        tkhd = find_box(data, (b'tkhd',), payload, end)
+        mdhd = find_box(data, (b'mdia', b'mdhd'), payload, end)
+        hdlr = find_box(data, (b'mdia', b'hdlr'), payload, end)
+        if tkhd is None or mdhd is None or hdlr is None:
+            continue
+        # Version 1 boxes (first payload byte) have 64-bit creation and modification times
+        track_id = struct.unpack_from('>I', data, tkhd[0] + (20 if data[tkhd[0]] else 12))[0]
+        timescale = struct.unpack_from('>I', data, mdhd[0] + (20 if data[mdhd[0]] else 12))[0]
+        duration, flags = defaults.get(track_id, (0, 0))
+        tracks[track_id] = Track(timescale, bytes(data[hdlr[0] + 8:hdlr[0] + 12]), duration, flags)
+    return tracks
+
+
+def _traf_timing(data, start, end, tracks):
+    """(track, ticks, flags of the first sample) of one traf box"""
+    tfhd = find_box(data, (b'tfhd',), start, end)
+    if tfhd is None:
+        return None
+    flags = int.from_bytes(data[tfhd[0] + 1:tfhd[0] + 4], 'big')
+    track = tracks.get(struct.unpack_from('>I', data, tfhd[0] + 4)[0])
+    if track is None:
+        return None
+    default_duration, default_flags = track.default_duration, track.default_flags
+    offset = tfhd[0] + 8
+    # base-data-offset, sample-description-index
+    offset += 8 if flags & 0x1 else 0
+    offset += 4 if flags & 0x2 else 0
+    if flags & 0x8:
+        default_duration = struct.unpack_from('>I', data, offset)[0]
+        offset += 4
+    offset += 4 if flags & 0x10 else 0
+    if flags & 0x20:
+        default_flags = struct.unpack_from('>I', data, offset)[0]
+
+    ticks = 0
+    first = None
+    for kind, payload, _ in iter_boxes(data, start, end):
+        if kind != b'trun':
+            continue
+        run_flags = int.from_bytes(data[payload + 1:payload + 4], 'big')
+        count = struct.unpack_from('>I', data, payload + 4)[0]
+        offset = payload + 8 + (4 if run_flags & 0x1 else 0)
+        first_flags = None
+        if run_flags & 0x4:
+            first_flags = struct.unpack_from('>I', data, offset)[0]
+            offset += 4
+        # Per sample: duration, size, flags, composition time offset, each if present
+        fields = [bit for bit in (0x100, 0x200, 0x400, 0x800) if run_flags & bit]
+        values = struct.unpack_from(f'>{count * len(fields)}I', data, offset)
+        stride = len(fields)
+        if 0x100 in fields:
+            ticks += sum(values[fields.index(0x100)::stride])
+        else:
+            ticks += count * default_duration
+        if first is None and count:
+            if first_flags is not None:
+                first = first_flags
+            elif 0x400 in fields:
+                first = values[fields.index(0x400)]
+            else:
+                first = default_flags
+    return track, ticks, first
+
+
+def parse_fragment(data, tracks):
+    """
+    Read the duration of a fragment and whether it starts on a sync sample
+
+    The video track decides; a fragment without one uses its first track.
+
+    Args:
+        data: The moof box
+        tracks: Tracks of the init segment, see parse_init()
+
+    Returns:
+        tuple: (seconds, independent)
+
+    Raises:
+        ValueError: If no track of the fragment is known
+    """
+    moof = find_box(data, (b'moof',))
+    result = None
+    for kind, payload, end in iter_boxes(data, *moof) if moof else ():
+        if kind != b'traf':
+            continue
+        timing = _traf_timing(data, payload, end, tracks)
+        if timing is None:
+            continue
+        track, ticks, first = timing
+        entry = (ticks / track.timescale, first is not None and not first & NON_SYNC_SAMPLE)
+        if track.handler == b'vide':
+            return entry
+        if result is None:
+            result = entry
+    if result is None:
+        raise ValueError('fragment without a known track')
+    return result
+
+
+class Segment:
+    """A segment of a low-latency stream; complete once the next one started"""
+
+    __slots__ = ('msn', 'started', 'init', 'discontinuity', 'parts', 'duration', 'complete')
+
+    def __init__(self, msn, started, init, discontinuity):
+        self.msn = msn
+        # Wall-clock time of its first frame, for EXT-X-PROGRAM-DATE-TIME
+        self.started = started
+        self.init = init
+        self.discontinuity = discontinuity
+        self.parts = []
+        self.duration = 0.0
+        self.complete = False
+
+
+class LowLatencyStream:
+    """
+    The partial segments of one camera, and the requests waiting for them
+
+    Parts are appended by the packager's output reader on the supervisor's
+    loop. A segment ends at the first independent part once it lasts
+    segment_target seconds, and the last window complete segments are kept.
+    Media sequence numbers start at the Unix time the stream was created,
+    so they keep growing across restarts of the backend. Waiters may be on
+    any event loop; they are woken through their own.
+    """
+
+    def __init__(self, camera_id, part_target=0.5, segment_target=2.0, window=6):
+        self.camera_id = camera_id
+        self.part_target = part_target
+        self.segment_target = segment_target
+        self.window = window
+        self.segments = collections.deque()
+        # Init segment id -> ftyp + moov of one run of the packager
+        self.inits = {}
+        self.ended = True
+        self.last_part_at = None
+        self._init = None
+        self._next_msn = int(time.time())
+        self._discontinuity = False
+        # EXT-X-DISCONTINUITY-SEQUENCE: discontinuities gone from the playlist
+        self._discontinuities = 0
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    # Writing; called by the packager's output reader
+
+    def start(self, init):
+        """Begin a run of the packager with its init segment"""
+        with self._lock:
+            self._close_segment()
+            self._init = max((self._init or 0) + 1, int(time.time() * 1000))
+            self.inits[self._init] = init
+            self._discontinuity = bool(self.segments)
+            self.ended = False
+        self._notify()
+
+    def add_part(self, data, duration, independent):
+        """
+        Append a partial segment
+
+        Returns:
+            bool: False if the part was dropped because no segment could start with it
+        """
+        with self._lock:
+            segment = self.segments[-1] if self.segments and not self.segments[-1].complete else None
+            if segment is not None and independent and segment.duration + DURATION_EPSILON >= self.segment_target:
+                segment.complete = True
+                segment = None
+            if segment is None:
+                if not independent or self._init is None:
+                    return False
+                segment = Segment(self._next_msn, time.time() - duration, self._init, self._discontinuity)
+                self._next_msn += 1
+                self._discontinuity = False
+                self.segments.append(segment)
+                self._trim()
+            segment.parts.append(Part(data, duration, independent))
+            segment.duration += duration
+            self.last_part_at = time.monotonic()
+        self._notify()
+        return True
+
+    def end(self):
+        """End a run of the packager; its last segment is complete"""
+        with self._lock:
+            self._close_segment()
+            self.ended = True
+        self._notify()
+
+    def _close_segment(self):
+        if self.segments and not self.segments[-1].complete:
+            self.segments[-1].complete = True
+
+    def _trim(self):
+        while len(self.segments) > self.window + 1:
+            if self.segments.popleft().discontinuity:
+                self._discontinuities += 1
+        oldest = self.segments[0].init
+        for init in [*self.inits]:
+            if init < oldest:
+                del self.inits[init]
+
+    def _notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's loop is closed
+                pass
+
+    # Reading; called from request handlers
+
+    @property
+    def live(self):
+        """Whether the packager is delivering parts"""
+        return not self.ended and bool(self.segments) and not self.segments[-1].complete
+
+    def target_duration(self):
+        """EXT-X-TARGETDURATION: no segment duration, rounded, may exceed it"""
+        longest = max((segment.duration for segment in list(self.segments) if segment.complete), default=0.0)
+        return max(math.ceil(self.segment_target), math.floor(longest + 0.5))
+
+    def last_msn(self):
+        with self._lock:
+            return self.segments[-1].msn if self.segments else self._next_msn - 1
+
+    def has(self, msn, part=None):
+        """Whether a playlist would hold segment msn, or its part if given"""
+        with self._lock:
+            if self.ended and self.segments:
+                return True
+            if not self.segments:
+                return False
+            last = self.segments[-1]
+            if msn != last.msn:
+                return msn < last.msn
+            return last.complete or (part is not None and len(last.parts) > part)
+
+    def has_parts(self):
+        return bool(self.segments)
+
+    def upcoming(self, msn, index=None):
+        """Whether a part (or a whole segment, without index) is still to come from the running packager"""
+        with self._lock:
+            if self.ended:
+                return False
+            if not self.segments:
+                return msn == self._next_msn
+            last = self.segments[-1]
+            if msn == last.msn + 1:
+                return True
+            if msn != last.msn or last.complete:
+                return False
+            return index is None or index >= len(last.parts)
+
+    def part(self, msn, index):
+        with self._lock:
+            for segment in reversed(self.segments):
+                if segment.msn == msn:
+                    return segment.parts[index].data if index < len(segment.parts) else None
+                if segment.msn < msn:
+                    break
+        return None
+
+    def segment(self, msn):
+        with self._lock:
+            for segment in reversed(self.segments):
+                if segment.msn == msn:
+                    return b''.join(part.data for part in segment.parts) if segment.complete else None
+                if segment.msn < msn:
+                    break
+        return None
+
+    def init(self, init):
+        return self.inits.get(init)
+
+    def playlist(self):
+        """
+        Render the media playlist
+
+        Returns:
+            str: The playlist, None before the first part
+        """
+        target = self.target_duration()
+        with self._lock:
+            segments = list(self.segments)
+            parts = [list(segment.parts) for segment in segments]
+            complete = [segment.complete for segment in segments]
+            ended = self.ended
+            discontinuities = self._discontinuities
+        if not segments:
+            return None
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:6',
+            f'#EXT-X-TARGETDURATION:{target}',
+            f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * self.part_target:.3f},'
+            f'HOLD-BACK={3 * target:.3f}',
+            f'#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}',
+            f'#EXT-X-MEDIA-SEQUENCE:{segments[0].msn}',
+        ]
+        if discontinuities:
+            lines.append(f'#EXT-X-DISCONTINUITY-SEQUENCE:{discontinuities}')
+
+        listed = 0
+        edge = 0.0
+        for segment in reversed(segments):
+            if edge >= PART_LISTED_TARGETS * target:
+                break
+            listed += 1
+            edge += segment.duration
+
+        init = None
+        for index, segment in enumerate(segments):
+            if segment.discontinuity:
+                lines.append('#EXT-X-DISCONTINUITY')
+            if segment.init != init:
+                init = segment.init
+                lines.append(f'#EXT-X-MAP:URI="init-{init}.mp4"')
+            started = datetime.datetime.fromtimestamp(segment.started, tz=datetime.timezone.utc)
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{started.isoformat(timespec='milliseconds')}"
+                         .replace('+00:00', 'Z'))
+            if index >= len(segments) - listed:
+                for number, part in enumerate(parts[index]):
+                    lines.append(f'#EXT-X-PART:DURATION={part.duration:.3f},URI="part-{segment.msn}.{number}.m4s"'
+                                 + (',INDEPENDENT=YES' if part.independent else ''))
+            if complete[index]:
+                lines.append(f'#EXTINF:{sum(part.duration for part in parts[index]):.3f},')
+                lines.append(f'seg-{segment.msn}.m4s')
+        if ended:
+            lines.append('#EXT-X-ENDLIST')
+        else:
+            last = segments[-1]
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part-{last.msn}.{len(parts[-1])}.m4s"')
+        return '\n'.join(lines) + '\n'
+
+    async def wait(self, ready, timeout):
+        """
+        Wait until ready() holds, for at most timeout seconds
+
+        Returns:
+            bool: What ready() returned last
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                event.clear()
+                if ready():
+                    return True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def as_dict(self):
+        with self._lock:
+            segments = list(self.segments)
+        return {
+            'segments': sum(1 for segment in segments if segment.complete),
+            'last_msn': segments[-1].msn if segments else None,
+            'parts': sum(len(segment.parts) for segment in segments),
+            'bytes': sum(len(part.data) for segment in segments for part in segment.parts),
+            'target_duration': self.target_duration(),
+            'part_target': self.part_target,
+            'last_part_age': round(time.monotonic() - self.last_part_at, 3) if self.last_part_at else None,
+        }
+
+
+async def package(stream, output):
+    """
+    Feed the fragmented MP4 of one packager run into its stream, until EOF
+
+    Args:
+        stream: LowLatencyStream of the camera
+        output: StreamReader on ffmpeg's stdout
+    """
+    init = b''
+    tracks = None
+    moof = None
+    try:
+        while True:
+            header = await output.readexactly(8)
+            size, kind = struct.unpack('>I4s', header)
+            if size == 1:
+                header += await output.readexactly(8)
+                size = struct.unpack_from('>Q', header, 8)[0]
+            if size < len(header):
+                raise ValueError(f"box {kind!r} of {size} bytes")
+            box = header + await output.readexactly(size - len(header))
+            if kind == b'ftyp':
+                init = box
+            elif kind == b'moov':
+                init += box
+                tracks = parse_init(init)
+                stream.start(init)
+            elif kind == b'moof':
+                moof = box
+            elif kind == b'mdat' and moof is not None and tracks is not None:
+                duration, independent = parse_fragment(moof, tracks)
+                stream.add_part(moof + box, duration, independent)
+                moof = None
+    except asyncio.IncompleteReadError:
+        pass
+    finally:
+        stream.end()
+
+
+class LowLatencyPackager(CameraScheduler):
+    """
+    Package the streams of low-latency cameras as LL-HLS
+
+    Every camera with latency='low' gets one ffmpeg process while it
+    publishes, keyed 'llhls-<camera id>' in the shared ingest supervisor.
+    It plays the stream from the camera's RTMP node, resolved by
+    node_urls(node_id) like the bitrate ladders, and writes fragmented MP4
+    to stdout. Each fragment is a partial segment of the camera's
+    LowLatencyStream, which llhls_application serves from memory. A restart
+    of the process is a discontinuity in the playlist.
+    """
+
+    thread_name = 'llhls-packager'
+    key_prefix = 'llhls'
+    loads = 'low-latency cameras'
+    schedules = 'LL-HLS packagers'
+
+    def __init__(self, supervisor, rtmp_url, part_target=0.5, segment_target=2.0, window=6,
+                 interval=5.0, node_urls=None):
+        super().__init__(supervisor, interval)
+        self.rtmp_url = rtmp_url
+        self.part_target = part_target
+        self.segment_target = segment_target
+        self.window = window
+        self.node_urls = node_urls
+        self._streams = {}
+
+    # Camera settings and publish state; called from request threads and callbacks
+
+    def read_cameras(self):
+        from .models import Camera
+
+        return {camera_id: entry for camera_id, *entry in Camera.objects.filter(
+            latency=LATENCY_LOW).values_list('id', 'stream_key', 'node_id')}
+
+    def camera_entry(self, camera):
+        """The stream key and node of a saved camera"""
+        if camera.latency != LATENCY_LOW:
+            return None
+        return [camera.stream_key, camera.node_id]
+
+    def stream(self, camera_id):
+        """
+        Return the LowLatencyStream of a low-latency camera
+
+        Returns:
+            LowLatencyStream: The stream, None for other cameras
+        """
+        if camera_id not in self._cameras:
+            return None
+        stream = self._streams.get(camera_id)
+        if stream is None:
+            with self._lock:
+                stream = self._streams.setdefault(camera_id, LowLatencyStream(
+                    camera_id, self.part_target, self.segment_target, self.window))
+        return stream
+
+    # Scheduling
+
+    def _urls(self, node_id):
+        if self.node_urls is None:
+            return self.rtmp_url, ''
+        return self.node_urls(node_id)
+
+    def packager_args(self, camera_id, stream_key, node_id=None):
+        """ffmpeg arguments of a camera's packager"""
+        rtmp_url, _ = self._urls(node_id)
+        return build_packager_args(f'{rtmp_url}/{camera_id}?key={stream_key}&client={LLHLS_CLIENT}',
+                                   self.part_target)
+
+    def reconcile(self):
+        """
+        Start the packagers of publishing low-latency cameras and stop the rest
+
+        Returns:
+            dict: Packager state of every low-latency camera
+        """
+        with self._lock:
+            cameras = dict(self._cameras)
+            wanted = {camera_id: entry for camera_id, entry in cameras.items() if camera_id in self._publishing}
+
+        unwanted = [camera_id for camera_id in self._running if camera_id not in wanted]
+        if unwanted:
+            self.supervisor.stop_many(self._key(camera_id) for camera_id in unwanted)
+            for camera_id in unwanted:
+                logger.info(f"Stopped LL-HLS packager of camera {camera_id}")
+                del self._running[camera_id]
+        for camera_id in [*self._running]:
+            # Gone from the supervisor, e.g. after stop_all_streams()
+            if not self.supervisor.is_running(self._key(camera_id)):
+                del self._running[camera_id]
+        for camera_id in [*self._streams]:
+            if camera_id not in cameras:
+                # Wake whoever still waits on it
+                self._streams.pop(camera_id).end()
+
+        spawn = []
+        for camera_id, (stream_key, node_id) in wanted.items():
+            args = self.packager_args(camera_id, stream_key, node_id)
+            if self._running.get(camera_id) != args:
+                # New, or the stream key was rotated or the camera moved; spawn() replaces the process
+                spawn.append((camera_id, args))
+        if spawn:
+            results = self.supervisor.spawn_many(
+                (self._key(camera_id), args, functools.partial(package, self.stream(camera_id)))
+                for camera_id, args in spawn)
+            for camera_id, args in spawn:
+                result = results.get(self._key(camera_id))
+                if isinstance(result, Exception):
+                    logger.warning(f"Cannot start LL-HLS packager of camera {camera_id}: {result}")
+                    self._running.pop(camera_id, None)
+                else:
+                    logger.info(f"Started LL-HLS packager of camera {camera_id}")
+                    self._running[camera_id] = args
+
+        states = {camera_id: self._state(camera_id) for camera_id in cameras}
+        counts = collections.Counter(states.values())
+        for state in PACKAGER_STATES:
+            LLHLS_STREAMS.labels(state).set(counts[state])
+        return states
+
+    def _state(self, camera_id):
+        if camera_id not in self._cameras:
+            return PACKAGER_OFF
+        if camera_id not in self._running:
+            return PACKAGER_IDLE
+        stream = self._streams.get(camera_id)
+        return PACKAGER_RUNNING if stream is not None and stream.live else PACKAGER_STARTING
+
+    # Reporting
+
+    def camera(self, camera_id):
+        """
+        Return the packager state and the buffered segments of a camera
+
+        Returns:
+            dict: State, playlist URL, supervisor state and restarts, and the
+                  segments, parts and bytes held in memory (None when off)
+        """
+        state = self._state(camera_id)
+        stream = self.stream(camera_id)
+        process = self.supervisor.status(self._key(camera_id)) if camera_id in self._running else None
+        return {
+            'id': camera_id,
+            'state': state,
+            'playlist_url': f'{settings.LLHLS_BASE_URL}/{camera_id}/index.m3u8' if stream is not None else None,
+            'process': process['state'] if process else None,
+            'restarts': process['restarts'] if process else 0,
+            'stream': stream.as_dict() if stream is not None else None,
+        }
+
+    def status(self):
+        """
+        Return the packagers of all low-latency cameras
+
+        Returns:
+            dict: Part and segment targets, counts by state, memory held and
+                  per-camera states
+        """
+        cameras = [self.camera(camera_id) for camera_id in sorted(self._cameras)]
+        counts = collections.Counter(camera['state'] for camera in cameras)
+        return {
+            'part_target': self.part_target,
+            'segment_target': self.segment_target,
+            'window': self.window,
+            'packagers': {state: counts[state] for state in PACKAGER_STATES},
+            'bytes': sum(camera['stream']['bytes'] for camera in cameras if camera['stream']),
+            'cameras': cameras,
+        }
+
+
+_packager = None
+_packager_lock = threading.Lock()
+
+
+def get_low_latency():
+    """
+    Return the process-wide LowLatencyPackager, starting it from settings
+
+    Returns:
+        LowLatencyPackager: The shared packager
+    """
+    global _packager
+    if _packager is None:
+        with _packager_lock:
+            if _packager is None:
+                packager = LowLatencyPackager(
+                    get_supervisor(),
+                    settings.RTMP_INGEST_URL,
+                    part_target=settings.LLHLS_PART_TARGET,
+                    segment_target=settings.LLHLS_SEGMENT_TARGET,
+                    window=settings.LLHLS_SEGMENTS,
+                    interval=settings.LLHLS_INTERVAL,
+                    node_urls=get_node_registry().urls,
+                )
+                packager.start()
+                atexit.register(packager.stop)
+                _packager = packager
+    return _packager
+
+
+# Serving
+
+PATH_PATTERN = re.compile(
+    r'^/llhls/(?P<camera>[0-9]+)/(?:(?P<playlist>index\.m3u8)|init-(?P<init>[0-9]+)\.mp4'
+    r'|part-(?P<part_msn>[0-9]+)\.(?P<part>[0-9]+)\.m4s|seg-(?P<msn>[0-9]+)\.m4s)$')
+
+PLAYLIST_TYPE = b'application/vnd.apple.mpegurl'
+MEDIA_TYPE = b'video/mp4'
+
+# Media and blocking playlist responses never change for their URL
+IMMUTABLE = b'public, max-age=60'
+
+
+async def _held(stream, ready, kind):
+    """Hold a request until ready(), timing it; returns whether it became ready"""
+    if ready():
+        return True
+    started = time.perf_counter()
+    result = await stream.wait(ready, BLOCK_TIMEOUT_FACTOR * stream.target_duration())
+    LLHLS_BLOCKED.labels(kind, 'ready' if result else 'timeout').observe(time.perf_counter() - started)
+    return result
+
+
+async def _serve_playlist(stream, query):
+    try:
+        msn = int(query['_HLS_msn']) if '_HLS_msn' in query else None
+        part = int(query['_HLS_part']) if '_HLS_part' in query else None
+    except ValueError:
+        return 400, b'_HLS_msn and _HLS_part must be numbers', None
+    if part is not None and msn is None:
+        return 400, b'_HLS_part needs _HLS_msn', None
+    if msn is None:
+        # A first request may come while the packager starts, e.g. behind an on-demand relay
+        if not await _held(stream, stream.has_parts, 'playlist'):
+            return 404, b'Stream not live', None
+        return 200, stream.playlist().encode(), b'no-cache'
+    if msn > stream.last_msn() + 2:
+        return 400, b'_HLS_msn is more than two segments ahead', None
+    if not await _held(stream, functools.partial(stream.has, msn, part), 'playlist'):
+        return 503, b'Timed out waiting for the requested part', None
+    return 200, stream.playlist().encode(), IMMUTABLE
+
+
+async def _serve_part(stream, msn, index):
+    data = stream.part(msn, index)
+    if data is None and stream.upcoming(msn, index):
+        # The preload hint: answered as soon as the part is complete
+        await _held(stream, lambda: stream.part(msn, index) is not None or not stream.upcoming(msn, index), 'part')
+        data = stream.part(msn, index)
+    return (200, data, IMMUTABLE) if data is not None else (404, b'No such part', None)
+
+
+async def _serve_segment(stream, msn):
+    data = stream.segment(msn)
+    if data is None and stream.upcoming(msn):
+        await _held(stream, lambda: stream.segment(msn) is not None or not stream.upcoming(msn), 'segment')
+        data = stream.segment(msn)
+    return (200, data, IMMUTABLE) if data is not None else (404, b'No such segment', None)
+
+
+async def llhls_application(scope, receive, send):
+    """
+    ASGI application serving low-latency HLS under /llhls/<camera id>/
+
+    index.m3u8 is the media playlist; with _HLS_msn (and _HLS_part) it is a
+    blocking reload, held until the playlist holds that segment (or part).
+    A request for the part named by the preload hint, or for the segment
+    being written, is held until it is complete. Held requests fail after
+    BLOCK_TIMEOUT_FACTOR target durations. Playlist requests count as HLS
+    viewers of on-demand cameras, by the address nginx forwards.
+    """
+    started = time.perf_counter()
+    match = PATH_PATTERN.match(scope['path'])
+    stream = get_low_latency().stream(int(match['camera'])) if match else None
+    if match is None:
+        route = '<unmatched>'
+    else:
+        route = 'llhls-' + ('playlist' if match['playlist'] else 'init' if match['init'] else
+                            'part' if match['part'] else 'segment')
+    content_type = MEDIA_TYPE
+    cache = None
+    if scope['method'] not in ('GET', 'HEAD'):
+        status, body = 405, b'Method not allowed'
+    elif stream is None:
+        status, body = 404, b'Not a low-latency camera'
+    elif match['playlist']:
+        headers = dict(scope.get('headers', []))
+        client = headers.get(b'x-real-ip', b'').decode('latin-1') or (scope.get('client') or ('',))[0]
+        get_on_demand().hls_request(stream.camera_id, client)
+        query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        status, body, cache = await _serve_playlist(stream, query)
+        content_type = PLAYLIST_TYPE
+    elif match['init']:
+        body = stream.init(int(match['init']))
+        status, body, cache = (200, body, IMMUTABLE) if body is not None else (404, b'No such init segment', None)
+    elif match['part']:
+        status, body, cache = await _serve_part(stream, int(match['part_msn']), int(match['part']))
+    else:
+        status, body, cache = await _serve_segment(stream, int(match['msn']))
+
+    if status != 200:
+        content_type = b'text/plain'
+    headers = [
+        (b'content-type', content_type),
+        (b'content-length', str(len(body)).encode()),
+        (b'access-control-allow-origin', b'*'),
+    ]
+    if cache is not None:
+        headers.append((b'cache-control', cache))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body if scope['method'] != 'HEAD' else b''})
+    observe_request(scope['method'], route, status, time.perf_counter() - started)
@@ -0,0 +1,317 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Configured from settings.LOGGING before the apps are loaded, so nothing
+# here may import models
+
+# Attributes callers pass with extra= that JSONFormatter writes as fields
+STRUCTURED_FIELDS = ('event', 'stream', 'addr', 'camera_id', 'suppressed')
+
+# Marks the end of the queue for the writer thread
+_STOP = object()
+
+# Seconds between the writer's reports of dropped records
+DROP_REPORT_SECONDS = 1.0
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with the structured fields callers passed"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str)
+
+
+class EventRateFilter(logging.Filter):
+    """
+    Let at most burst records of one event per stream through per window seconds
+
+    Records carrying an event (and usually a stream) in extra= are counted
+    per (event, stream): on_play of a popular stream, say, or rejected
+    publishes from one misconfigured encoder. Past the burst, records are
+    suppressed until the window ends; the first record of the next window
+    reports how many were. Errors and records without an event always pass.
+    """
+
+    def __init__(self, burst=10, window=10.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.suppressed = 0
+        # (event, stream) -> [window start, records let through, records suppressed]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event is None or record.levelno >= logging.ERROR:
+            return True
+        key = (event, getattr(record, 'stream', None))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window:
+                if len(self._windows) >= 10000:
+                    self._prune(now)
+                self._windows[key] = [now, 1, 0]
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                    record.msg = f"{record.getMessage()} ({window[2]} similar suppressed)"
+                    record.args = None
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            self.suppressed += 1
+            return False
+
+    def _prune(self, now):
+        """Forget windows that ended; called with the lock held"""
+        for key in [key for key, window in self._windows.items() if now - window[0] >= self.window]:
+            del self._windows[key]
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """StreamHandler that writes a batch of records with one write and one flush"""
+
+    def write_batch(self, records):
+        text = ''.join(self.format(record) + self.terminator for record in records if record.levelno >= self.level)
+        if not text:
+            return
+        self.acquire()
+        try:
+            self.stream.write(text)
+            self.flush()
+        except Exception:
+            self.handleError(records[0])
+        finally:
+            self.release()
+
+
+class LogFileHandler(logging.Handler):
+    """
+    Append to a log file, rotating it by size and by time
+
+    The file is rotated before a write that would take it past max_bytes,
+    and at every multiple of rotate_seconds of Unix time (86400: midnight
+    UTC), also when a file left by a previous process is from an earlier
+    period. Rotated files are kept as <name>.1 (newest) to
+    <name>.<backup_count>. Either limit is off at 0.
+    """
+
+    def __init__(self, filename, max_bytes=0, rotate_seconds=0, backup_count=5, encoding='utf-8'):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.encoding = encoding
+        self._file = None
+        self._size = 0
+        self._rotate_at = None
+
+    def _period_end(self, now):
+        return (now // self.rotate_seconds + 1) * self.rotate_seconds if self.rotate_seconds else None
+
+    def _open(self):
+        self._file = open(self.filename, 'ab')
+        stat = os.fstat(self._file.fileno())
+        self._size = stat.st_size
+        self._rotate_at = self._period_end(stat.st_mtime if stat.st_size else time.time())
+
+    def rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.backup_count:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f'{self.filename}.{index}'
+                if os.path.exists(source):
+                    os.replace(source, f'{self.filename}.{index + 1}')
+            if os.path.exists(self.filename):
+                os.replace(self.filename, f'{self.filename}.1')
+        elif os.path.exists(self.filename):
+            os.remove(self.filename)
+        self._open()
+
+    def write_batch(self, records):
+        data = ''.join(self.format(record) + '\n' for record in records
+                       if record.levelno >= self.level).encode(self.encoding, 'backslashreplace')
+        if not data:
+            return
+        self.acquire()
+        try:
+            if self._file is None:
+                self._open()
+            if self._size and ((self.max_bytes and self._size + len(data) > self.max_bytes)
+                               or (self._rotate_at and time.time() >= self._rotate_at)):
+                self.rotate()
+            self._write(data)
+            self._size += len(data)
+        except Exception:
+            self.handleError(records[0])
+        finally:
+            self.release()
+
+    def _write(self, data):
+        self._file.write(data)
+        self._file.flush()
+
+    def emit(self, record):
+        self.write_batch([record])
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        finally:
+            self.release()
+        super().close()
+
+
+class PipelineHandler(logging.handlers.QueueHandler):
+    """
+    Queue log records for a writer thread, which writes them in batches
+
+    Callers only fix the record's message and put it on a bounded queue;
+    formatting, console and file writes and rotation happen in the writer
+    thread, which writes everything queued (up to batch_size records) with
+    one write and flush per target. When the queue is full, records below
+    ERROR are dropped and counted, and the writer reports how many at most
+    every DROP_REPORT_SECONDS; errors wait for room, and keep their
+    traceback, which the writer formats.
+
+    Args:
+        filename: Log file, rotated by max_bytes and rotate_seconds (see
+                  LogFileHandler); None writes to the console only
+        console: Whether to also write to stderr
+        capacity: Records the queue holds
+        batch_size: Most records written at once
+    """
+
+    def __init__(self, filename=None, max_bytes=0, rotate_seconds=0, backup_count=5, console=True,
+                 capacity=10000, batch_size=500):
+        super().__init__(queue.Queue(capacity))
+        self.batch_size = batch_size
+        self.targets = []
+        if console:
+            self.targets.append(BatchStreamHandler())
+        if filename:
+            self.targets.append(LogFileHandler(filename, max_bytes, rotate_seconds, backup_count))
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self._reported_drops = 0
+        self._reported_at = 0.0
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # Set by dictConfig; formatting is the targets' job
+        super().setFormatter(fmt)
+        for target in self.targets:
+            target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The message is fixed now as its arguments may change; the traceback
+        # stays for the writer to format in full
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.ERROR:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+    def start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        """Write everything queued so far and stop the writer thread"""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(_STOP)
+            thread.join(timeout=10)
+
+    def flush(self):
+        """Wait until the records queued so far are written"""
+        if self._thread is not None:
+            self.queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is _STOP
+            records = batch[:-1] if stopping else list(batch)
+            dropped = self.dropped - self._reported_drops
+            if dropped and (stopping or time.monotonic() - self._reported_at >= DROP_REPORT_SECONDS):
+                self._reported_drops += dropped
+                self._reported_at = time.monotonic()
+                records.append(logging.LogRecord(
+                    __name__, logging.WARNING, __file__, 0,
+                    f"Dropped {dropped} log records, the log queue was full", None, None))
+            if records:
+                self._write(records)
+            for _ in batch:
+                self.queue.task_done()
+            if stopping:
+                return
+
+    def _write(self, records):
+        for target in self.targets:
+            target.write_batch(records)
+        self.written += len(records)
+        self.batches += 1
+
+    def close(self):
+        self.stop()
+        for target in self.targets:
+            target.close()
+        super().close()
+
+    def status(self):
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+        }
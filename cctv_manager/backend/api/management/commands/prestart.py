@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from api.warmup import pending_migrations
+
+# Copy of the static files manifest collectstatic wrote when the image was built
+BUILD_MANIFEST = os.path.join(settings.BASE_DIR, 'staticfiles.build.json')
+
+
+def read_bytes(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Prepare a container for the server in one process: apply pending migrations and collect "
+            "static files only if STATIC_ROOT does not hold the ones of this image")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--build-manifest', default=BUILD_MANIFEST,
+                            help='manifest collectstatic wrote at build time (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        pending = pending_migrations()
+        if pending:
+            self.stdout.write(f"Applying {len(pending)} migrations")
+            call_command('migrate', interactive=False, verbosity=options['verbosity'])
+        else:
+            self.stdout.write("No migrations to apply")
+
+        # STATIC_ROOT is a volume, filled from the image only when it was created
+        build = read_bytes(options['build_manifest'])
+        if build is not None and build == read_bytes(os.path.join(settings.STATIC_ROOT, 'staticfiles.json')):
+            self.stdout.write("Static files are current")
+        else:
+            call_command('collectstatic', interactive=False, verbosity=options['verbosity'])
+        self.stdout.write(self.style.SUCCESS("Ready to start"))
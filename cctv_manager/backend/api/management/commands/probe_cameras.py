@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Camera
+from api.probe import MODE_HANDSHAKE, PROBE_MODES, STATUS_OK, get_prober
+
+
+class Command(BaseCommand):
+    help = "Check that cameras' RTMP endpoints answer the RTMP handshake (and optionally connect)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='camera ids (default: all cameras)')
+        parser.add_argument('--active', action='store_true', help='only probe active cameras')
+        parser.add_argument('--site', help='only probe cameras of this site')
+        parser.add_argument('--mode', choices=PROBE_MODES, default=MODE_HANDSHAKE)
+        parser.add_argument('--refresh', action='store_true', help='ignore cached results')
+        parser.add_argument('--concurrency', type=int, help='override RTMP_PROBE_CONCURRENCY')
+        parser.add_argument('--timeout', type=float, help='override RTMP_PROBE_TIMEOUT')
+        parser.add_argument('--json', action='store_true', help='print results as JSON')
+        parser.add_argument('--failures', action='store_true', help='only list failed probes')
+
+    def handle(self, *args, **options):
+        cameras = Camera.objects.order_by('id')
+        if options['ids']:
+            cameras = cameras.filter(id__in=options['ids'])
+        if options['active']:
+            cameras = cameras.filter(active=True)
+        if options['site']:
+            cameras = cameras.filter(site=options['site'])
+        cameras = list(cameras.only('id', 'name', 'ip_address', 'rtmp_port', 'app_name', 'stream_id'))
+        if not cameras:
+            raise CommandError('No cameras to probe')
+
+        prober = get_prober()
+        if options['concurrency']:
+            prober.concurrency = options['concurrency']
+        if options['timeout']:
+            prober.timeout = options['timeout']
+        results = prober.probe_cameras(cameras, options['mode'], options['refresh'])
+
+        failed = [camera for camera in cameras if results[camera.id]['status'] != STATUS_OK]
+        listed = failed if options['failures'] else cameras
+        if options['json']:
+            self.stdout.write(json.dumps({camera.id: results[camera.id] for camera in listed}, indent=2))
+            return
+
+        for camera in listed:
+            result = results[camera.id]
+            timing = f"{result['total_ms']:.1f} ms" if result['total_ms'] is not None else '-'
+            line = f"{camera.id:>6}  {result['status']:<16} {timing:>10}  {result['url']}"
+            if result['error']:
+                line += f"  ({result['error']})"
+            style = self.style.SUCCESS if result['status'] == STATUS_OK else self.style.ERROR
+            self.stdout.write(style(line))
+        self.stdout.write(f"{len(cameras) - len(failed)} of {len(cameras)} cameras answered "
+                          f"({options['mode']})")
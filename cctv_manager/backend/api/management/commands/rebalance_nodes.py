@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.models import Camera
+from api.utils import rebalance_cameras
+
+
+class Command(BaseCommand):
+    help = "Move cameras to the RTMP nodes the consistent hash ring places them on"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report which cameras would move')
+        parser.add_argument('--batch-size', type=int, default=500, help='cameras moved per database round trip')
+        parser.add_argument('--json', action='store_true', help='print the report as JSON')
+
+    def handle(self, *args, **options):
+        report = rebalance_cameras(dry_run=options['dry_run'], batch_size=options['batch_size'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for name, node in report['nodes'].items():
+            state = '' if node['enabled'] else '  (disabled)'
+            self.stdout.write(f"{name:<24} {node['before']:>7} -> {node['after']:<7} of {node['capacity']}{state}")
+        default = report['default']
+        if default['before'] or default['after']:
+            self.stdout.write(f"{'(settings)':<24} {default['before']:>7} -> {default['after']:<7}")
+
+        verb = 'would move' if report['dry_run'] else 'moved'
+        self.stdout.write(self.style.SUCCESS(f"{len(report['moved'])} of {report['cameras']} cameras {verb}"))
+        if report['republish']:
+            self.stdout.write(self.style.WARNING(
+                f"{len(report['republish'])} cameras push their stream and must publish to their new node: "
+                f"{', '.join(str(camera_id) for camera_id in report['republish'])}"))
+        # The relays of pull-mode cameras are supervised by the API server, not this process
+        relays = Camera.objects.filter(id__in=[move['id'] for move in report['moved']],
+                                       active=True).exclude(source_url='').count()
+        if relays and not report['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f"{relays} running relays still publish to their old node; restart those cameras, "
+                f"or rebalance with POST /api/nodes/rebalance/ so the server moves them"))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.utils import refresh_hls_urls
+
+
+class Command(BaseCommand):
+    help = "Point the hls_url of cameras at HLS_ORIGIN_BASE_URL, or back at their RTMP node when it is unset"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='cameras updated per database round trip')
+
+    def handle(self, *args, **options):
+        changed = refresh_hls_urls(batch_size=options['batch_size'])
+        target = settings.HLS_ORIGIN_BASE_URL or 'their RTMP nodes'
+        self.stdout.write(self.style.SUCCESS(f"{len(changed)} cameras now point at {target}"))
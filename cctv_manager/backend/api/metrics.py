@@ -0,0 +1,167 @@
+import functools
+import os
+import time
+
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# prometheus_client keeps values in per-process files when PROMETHEUS_MULTIPROC_DIR
+# is set before it is imported; scrapes then add up the files of all workers
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# API calls take milliseconds, stream operations up to the supervisor timeouts
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+OPERATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    'cctv_http_request_duration_seconds', 'API request latency by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+CALLBACK_EVENTS = Counter(
+    'cctv_rtmp_callbacks_total', 'nginx-rtmp notifications received', ['action'])
+CALLBACK_ERRORS = Counter(
+    'cctv_rtmp_callback_errors_total', 'nginx-rtmp notifications that failed', ['action'])
+CALLBACK_DENIED = Counter(
+    'cctv_rtmp_callback_denied_total', 'Publishers and players rejected for a bad stream key or token',
+    ['action'])
+STREAM_OPERATIONS = Histogram(
+    'cctv_stream_operation_duration_seconds', 'Duration of stream start, stop and restart',
+    ['operation', 'result'], buckets=OPERATION_BUCKETS)
+SUPERVISED_PROCESSES = Gauge(
+    'cctv_supervised_processes', 'ffmpeg processes supervised by the ingest supervisor',
+    ['state'], multiprocess_mode='livesum')
+INGEST_RESTARTS = Counter(
+    'cctv_ingest_restarts_total', 'Supervised ffmpeg processes restarted after exiting')
+TRANSCODE_LADDERS = Gauge(
+    'cctv_transcode_ladders', 'Adaptive bitrate ladders by state', ['state'], multiprocess_mode='livesum')
+TRANSCODE_CORES = Gauge(
+    'cctv_transcode_cores', 'Cores available to (capacity) and taken by (used) bitrate ladders',
+    ['kind'], multiprocess_mode='livemax')
+TRANSCODE_RUNG_FPS = Gauge(
+    'cctv_transcode_rung_fps', 'Frames per second encoded for each ladder rung, all cameras together',
+    ['rung'], multiprocess_mode='livesum')
+TRANSCODE_SPEED = Gauge(
+    'cctv_transcode_speed_min', 'Speed of the slowest running ladder; below 1 the node is saturated',
+    multiprocess_mode='livemin')
+ONDEMAND_RELAYS = Gauge(
+    'cctv_ondemand_relays', 'On-demand cameras by relay state', ['state'], multiprocess_mode='livesum')
+ONDEMAND_VIEWERS = Gauge(
+    'cctv_ondemand_viewers', 'Viewers of on-demand cameras by protocol', ['protocol'],
+    multiprocess_mode='livesum')
+ONDEMAND_STARTS = Counter(
+    'cctv_ondemand_starts_total', 'On-demand relays started, by what started them', ['reason'])
+ONDEMAND_WAIT = Histogram(
+    'cctv_ondemand_first_frame_seconds', 'Time from a first viewer to the first frame of an on-demand relay',
+    buckets=OPERATION_BUCKETS)
+LLHLS_STREAMS = Gauge(
+    'cctv_llhls_streams', 'Low-latency HLS cameras by packager state', ['state'], multiprocess_mode='livesum')
+LLHLS_BLOCKED = Histogram(
+    'cctv_llhls_blocked_seconds', 'Time blocking playlist reloads and preload hint requests were held',
+    ['kind', 'result'], buckets=OPERATION_BUCKETS)
+MOTION_FRAMES = Counter(
+    'cctv_motion_frames_total', 'Frames analysed for motion')
+MOTION_BATCH = Histogram(
+    'cctv_motion_batch_seconds', 'Time to analyse one batch of frames across cameras',
+    buckets=LATENCY_BUCKETS)
+MOTION_EVENTS = Counter(
+    'cctv_motion_events_total', 'Motion events started')
+HLS_ORIGIN_REQUESTS = Counter(
+    'cctv_hls_origin_requests_total', 'HLS origin requests by kind, and whether memory or disk answered them',
+    ['kind', 'result'])
+
+# Label children by key; labels() validates and locks on every call
+_request_children = {}
+
+
+def observe_request(method, route, status, seconds):
+    """Record one request in the latency histogram"""
+    key = (method, route, status)
+    child = _request_children.get(key)
+    if child is None:
+        child = _request_children.setdefault(key, REQUEST_LATENCY.labels(method, route, str(status)))
+    child.observe(seconds)
+
+
+def timed_operation(operation):
+    """
+    Decorator recording the duration of a stream operation
+
+    The result label is 'ok' when the function returns something truthy,
+    'failed' when it returns something falsy and 'error' when it raises.
+    """
+    ok = STREAM_OPERATIONS.labels(operation, 'ok')
+    failed = STREAM_OPERATIONS.labels(operation, 'failed')
+    error = STREAM_OPERATIONS.labels(operation, 'error')
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                error.observe(time.perf_counter() - started)
+                raise
+            (ok if result else failed).observe(time.perf_counter() - started)
+            return result
+        return wrapper
+    return decorator
+
+
+class CameraCollector:
+    """Camera counts read from the database when Prometheus scrapes"""
+
+    def describe(self):
+        # Lets the collector be registered before the database is usable
+        yield GaugeMetricFamily('cctv_cameras', 'Cameras by state', labels=['state'])
+
+    def collect(self):
+        from django.db.models import Count
+        from .models import Camera
+
+        cameras = GaugeMetricFamily('cctv_cameras', 'Cameras by state', labels=['state'])
+        counts = dict(Camera.objects.values_list('active').annotate(count=Count('id')).order_by())
+        cameras.add_metric(['active'], counts.get(True, 0))
+        cameras.add_metric(['inactive'], counts.get(False, 0))
+        cameras.add_metric(['recording'], Camera.objects.filter(recording=True).count())
+        yield cameras
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Record the latency of every request by method, route and status
+
+    The route is the URL pattern name (e.g. 'camera-start-stream'), so
+    requests for different cameras share one series. Place it first so
+    the time spent in the other middleware is included.
+    """
+
+    def process_request(self, request):
+        request._metrics_started = time.perf_counter()
+
+    def process_response(self, request, response):
+        started = getattr(request, '_metrics_started', None)
+        if started is not None:
+            match = request.resolver_match
+            route = (match.view_name or match.route) if match is not None else '<unmatched>'
+            observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text exposition of all metrics"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(CameraCollector())
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+if not MULTIPROCESS:
+    REGISTRY.register(CameraCollector())
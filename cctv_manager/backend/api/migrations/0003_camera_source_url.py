@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_remove_camera_rtsp_port_remove_camera_stream_path_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='source_url',
+            field=models.CharField(blank=True, default='', max_length=1024),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.20 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_camera_source_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='site',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='camera',
+            index=models.Index(fields=['updated_at', 'id'], name='camera_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='camera',
+            index=models.Index(fields=['active', 'updated_at', 'id'], name='camera_active_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='camera',
+            index=models.Index(fields=['site', 'updated_at', 'id'], name='camera_site_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='camera',
+            index=models.Index(fields=['ip_address', 'rtmp_port', 'app_name', 'stream_id'], name='camera_rtmp_endpoint_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_camera_site_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='recording',
+            field=models.BooleanField(default=False),
+        ),
+    ]
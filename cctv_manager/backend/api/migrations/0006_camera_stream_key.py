@@ -0,0 +1,45 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:40
+
+import api.models
+from django.db import migrations, models
+
+
+def fill_stream_keys(apps, schema_editor):
+    # A callable default is evaluated once for existing rows; give each its own key
+    Camera = apps.get_model('api', 'Camera')
+    cameras = [*Camera.objects.only('id')]
+    for camera in cameras:
+        camera.stream_key = api.models.generate_stream_key()
+    Camera.objects.bulk_update(cameras, ['stream_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_camera_recording'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='stream_key',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_stream_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='camera',
+            name='stream_key',
+            field=models.CharField(default=api.models.generate_stream_key, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='previous_stream_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='stream_key_rotated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
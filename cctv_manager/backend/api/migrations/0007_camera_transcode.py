@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_camera_stream_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='transcode',
+            field=models.CharField(choices=[('off', 'Off'), ('always', 'Always'), ('viewers', 'While viewed')], default='off', max_length=16),
+        ),
+    ]
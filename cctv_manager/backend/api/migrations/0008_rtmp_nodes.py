@@ -0,0 +1,32 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_camera_transcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RTMPNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.SlugField(max_length=64, unique=True)),
+                ('ingest_url', models.CharField(max_length=1024)),
+                ('hls_base_url', models.CharField(max_length=1024)),
+                ('capacity', models.PositiveIntegerField(default=100)),
+                ('enabled', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='node',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cameras', to='api.rtmpnode'),
+        ),
+    ]
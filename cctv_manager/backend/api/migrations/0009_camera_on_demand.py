@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_rtmp_nodes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='on_demand',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_camera_on_demand'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='latency',
+            field=models.CharField(choices=[('standard', 'Standard HLS'), ('low', 'Low-latency HLS')], default='standard', max_length=16),
+        ),
+    ]
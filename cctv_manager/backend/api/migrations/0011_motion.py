@@ -0,0 +1,49 @@
+# Generated by Django 4.2.20 on 2026-10-18 21:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_camera_latency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='motion',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='motion_mask',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='motion_min_area',
+            field=models.FloatField(default=0.005),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='motion_threshold',
+            field=models.PositiveSmallIntegerField(default=25),
+        ),
+        migrations.CreateModel(
+            name='MotionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('peak_area', models.FloatField(default=0.0)),
+                ('box', models.JSONField(blank=True, null=True)),
+                ('frames', models.PositiveIntegerField(default=0)),
+                ('camera', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='motion_events', to='api.camera')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['camera', 'started_at', 'id'], name='motion_camera_started_idx'), models.Index(fields=['started_at', 'id'], name='motion_started_idx')],
+            },
+        ),
+    ]
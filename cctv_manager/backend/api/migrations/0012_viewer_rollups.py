@@ -0,0 +1,59 @@
+# Generated by Django 4.2.20 on 2026-10-18 21:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_motion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewerHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('peak_viewers', models.PositiveIntegerField(default=0)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('watch_seconds', models.FloatField(default=0.0)),
+                ('camera', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.camera')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ViewerMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('peak_viewers', models.PositiveIntegerField(default=0)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('watch_seconds', models.FloatField(default=0.0)),
+                ('camera', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.camera')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start'], name='viewer_minute_start_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='viewerminute',
+            constraint=models.UniqueConstraint(fields=('camera', 'start'), name='viewer_minute_camera_start_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='viewerminute',
+            constraint=models.UniqueConstraint(condition=models.Q(('camera__isnull', True)), fields=('start',), name='viewer_minute_fleet_start_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='viewerhour',
+            index=models.Index(fields=['start'], name='viewer_hour_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='viewerhour',
+            constraint=models.UniqueConstraint(fields=('camera', 'start'), name='viewer_hour_camera_start_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='viewerhour',
+            constraint=models.UniqueConstraint(condition=models.Q(('camera__isnull', True)), fields=('start',), name='viewer_hour_fleet_start_uniq'),
+        ),
+    ]
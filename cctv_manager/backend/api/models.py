@@ -1,19 +1,168 @@
+import secrets
+
 from django.db import models
 
+
+def generate_stream_key():
+    """Random stream key for a new camera"""
+    return secrets.token_urlsafe(24)
+
+
+# When the adaptive bitrate ladder of a camera runs, see api.transcode
+TRANSCODE_OFF = 'off'
+TRANSCODE_ALWAYS = 'always'
+TRANSCODE_VIEWERS = 'viewers'
+TRANSCODE_CHOICES = [
+    (TRANSCODE_OFF, 'Off'),
+    (TRANSCODE_ALWAYS, 'Always'),
+    (TRANSCODE_VIEWERS, 'While viewed'),
+]
+
+# How a camera's HLS is packaged: nginx-rtmp's segments, or low-latency HLS
+# with partial segments served by the backend, see api.llhls
+LATENCY_STANDARD = 'standard'
+LATENCY_LOW = 'low'
+LATENCY_CHOICES = [
+    (LATENCY_STANDARD, 'Standard HLS'),
+    (LATENCY_LOW, 'Low-latency HLS'),
+]
+
+
+class RTMPNode(models.Model):
+    """An nginx-rtmp server cameras are placed on, see api.nodes"""
+    name = models.SlugField(max_length=64, unique=True)
+    # RTMP application cameras publish into, e.g. rtmp://rtmp-2:1935/live
+    ingest_url = models.CharField(max_length=1024)
+    # Where the node serves its HLS output, e.g. http://rtmp-2:8080/hls
+    hls_base_url = models.CharField(max_length=1024)
+    # Cameras the node can carry; also its share of the hash ring
+    capacity = models.PositiveIntegerField(default=100)
+    # Disabled nodes get no cameras; a rebalance moves theirs away
+    enabled = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Camera(models.Model):
     name = models.CharField(max_length=255)
+    site = models.CharField(max_length=255, blank=True, default='')
     ip_address = models.GenericIPAddressField()
     rtmp_port = models.IntegerField(default=1935)
     app_name = models.CharField(max_length=255, default='live')
     stream_id = models.CharField(max_length=255, default='stream1')
+    source_url = models.CharField(max_length=1024, blank=True, default='')
+    # Pull the source only while the stream is watched, see api.ondemand
+    on_demand = models.BooleanField(default=False)
     hls_url = models.URLField(blank=True, null=True)
     active = models.BooleanField(default=False)
+    recording = models.BooleanField(default=False)
+    # Publishers authenticate with ?key=<stream_key>; after a rotation the
+    # previous key stays valid for STREAM_KEY_GRACE seconds
+    stream_key = models.CharField(max_length=64, default=generate_stream_key)
+    previous_stream_key = models.CharField(max_length=64, blank=True, default='')
+    stream_key_rotated_at = models.DateTimeField(blank=True, null=True)
+    transcode = models.CharField(max_length=16, choices=TRANSCODE_CHOICES, default=TRANSCODE_OFF)
+    latency = models.CharField(max_length=16, choices=LATENCY_CHOICES, default=LATENCY_STANDARD)
+    # Detect motion in the stream, see api.motion
+    motion = models.BooleanField(default=False)
+    # Gray levels a pixel must change by to count as moving
+    motion_threshold = models.PositiveSmallIntegerField(default=25)
+    # Share of the unmasked frame that must move for motion
+    motion_min_area = models.FloatField(default=0.005)
+    # Rectangles [x, y, width, height], in fractions of the frame, where motion is ignored
+    motion_mask = models.JSONField(default=list, blank=True)
+    # RTMP node the camera streams through; None is the server configured in settings
+    node = models.ForeignKey(RTMPNode, null=True, blank=True, on_delete=models.SET_NULL,
+                             related_name='cameras')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination and updated_since filtering
+            models.Index(fields=['updated_at', 'id'], name='camera_updated_idx'),
+            models.Index(fields=['active', 'updated_at', 'id'], name='camera_active_updated_idx'),
+            models.Index(fields=['site', 'updated_at', 'id'], name='camera_site_updated_idx'),
+            # Lookups of a camera by its RTMP endpoint
+            models.Index(fields=['ip_address', 'rtmp_port', 'app_name', 'stream_id'],
+                         name='camera_rtmp_endpoint_idx'),
+        ]
+
     @property
     def rtmp_url(self):
         return f"rtmp://{self.ip_address}:{self.rtmp_port}/{self.app_name}/{self.stream_id}"
     
     def __str__(self):
-        return self.name 
\ No newline at end of file
+        return self.name
+
+
+class MotionEvent(models.Model):
+    """Motion detected in a camera's stream, see api.motion"""
+    camera = models.ForeignKey(Camera, on_delete=models.CASCADE, related_name='motion_events')
+    started_at = models.DateTimeField()
+    # None while the motion lasts
+    ended_at = models.DateTimeField(blank=True, null=True)
+    # Largest share of the unmasked frame that moved, and where: [x, y, width, height]
+    # in fractions of the frame
+    peak_area = models.FloatField(default=0.0)
+    box = models.JSONField(blank=True, null=True)
+    # Frames with motion
+    frames = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Time range queries, per camera and across the fleet
+            models.Index(fields=['camera', 'started_at', 'id'], name='motion_camera_started_idx'),
+            models.Index(fields=['started_at', 'id'], name='motion_started_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.camera_id} @ {self.started_at}"
+
+
+class ViewerRollup(models.Model):
+    """Viewers of a camera, or of all cameras, over one period, see api.viewers"""
+    # None for the whole fleet
+    camera = models.ForeignKey(Camera, null=True, blank=True, on_delete=models.CASCADE)
+    start = models.DateTimeField()
+    # Most viewers watching at once
+    peak_viewers = models.PositiveIntegerField(default=0)
+    # Viewing sessions that started in the period
+    sessions = models.PositiveIntegerField(default=0)
+    # Seconds watched by all viewers together; over the period's length, the average viewers
+    watch_seconds = models.FloatField(default=0.0)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.camera_id or 'fleet'} @ {self.start}"
+
+
+class ViewerMinute(ViewerRollup):
+    class Meta:
+        constraints = [
+            # Also serves the time range queries of a camera
+            models.UniqueConstraint(fields=['camera', 'start'], name='viewer_minute_camera_start_uniq'),
+            models.UniqueConstraint(fields=['start'], condition=models.Q(camera__isnull=True),
+                                    name='viewer_minute_fleet_start_uniq'),
+        ]
+        indexes = [
+            # Deleting rows past the retention
+            models.Index(fields=['start'], name='viewer_minute_start_idx'),
+        ]
+
+
+class ViewerHour(ViewerRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['camera', 'start'], name='viewer_hour_camera_start_uniq'),
+            models.UniqueConstraint(fields=['start'], condition=models.Q(camera__isnull=True),
+                                    name='viewer_hour_fleet_start_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['start'], name='viewer_hour_start_idx'),
+        ]
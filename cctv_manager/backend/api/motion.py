@@ -0,0 +1,685 @@
+import asyncio
+import atexit
+import collections
+import functools
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from .ingest import FAST_START_PROBE, get_supervisor
+from .metrics import MOTION_BATCH, MOTION_EVENTS, MOTION_FRAMES
+from .nodes import get_node_registry
+from .scheduling import CameraScheduler
+
+logger = logging.getLogger(__name__)
+
+# NumPy, imported by import_numpy() with the first motion camera: workers
+# without any do not pay for its import at startup
+np = None
+
+# Detector states reported per camera
+DETECTOR_OFF = 'off'
+DETECTOR_IDLE = 'idle'
+DETECTOR_STARTING = 'starting'
+DETECTOR_RUNNING = 'running'
+DETECTOR_STATES = (DETECTOR_IDLE, DETECTOR_STARTING, DETECTOR_RUNNING)
+
+# Marks the detector's own play of a camera stream, which is not a viewer
+MOTION_CLIENT = 'motion'
+
+# Seconds of frames the background is learned from before motion is reported
+WARMUP_SECONDS = 2
+
+# Seconds between writes of started and ended events to the database
+FLUSH_INTERVAL = 1.0
+
+
+def build_detector_args(source_url, width, height, fps):
+    """
+    Build the ffmpeg arguments of one camera's motion decoder
+
+    Frames are dropped to fps and scaled down before they are converted to
+    8-bit grayscale, then written to stdout back to back as rawvideo, so
+    every width * height bytes are one frame. Audio is not decoded.
+
+    Args:
+        source_url: RTMP URL of the camera's stream
+        width: Width of the frames
+        height: Height of the frames
+        fps: Frames per second written
+
+    Returns:
+        list: ffmpeg arguments (without the binary)
+    """
+    return [
+        '-hide_banner', '-loglevel', 'error', '-nostdin',
+        '-analyzeduration', str(FAST_START_PROBE), '-probesize', str(FAST_START_PROBE),
+        '-threads', '1', '-i', source_url, '-an',
+        '-vf', f'fps={fps:g},scale={width}:{height},format=gray',
+        '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1',
+    ]
+
+
+def import_numpy():
+    """Import NumPy into this module as np, once"""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def mask_pixels(rectangles, width, height):
+    """
+    Rasterize a motion mask
+
+    Args:
+        rectangles: [x, y, width, height] areas to ignore, in fractions of the frame
+        width: Width of the frames
+        height: Height of the frames
+
+    Returns:
+        numpy.ndarray: height x width booleans, True where motion counts
+    """
+    import_numpy()
+    mask = np.ones((height, width), dtype=bool)
+    for x, y, w, h in rectangles:
+        mask[int(y * height):math.ceil((y + h) * height), int(x * width):math.ceil((x + w) * width)] = False
+    return mask
+
+
+class MotionBatch:
+    """
+    Motion detection state of many cameras, stacked into shared arrays
+
+    Each camera owns one slot (the same index) of every array: the newest
+    frame from its decoder, the previous frame it was compared with, its
+    background model, mask and thresholds. process() takes the slots with a
+    new frame and runs every step as one NumPy operation over a chunk of
+    them, so the per-camera Python overhead does not grow with the frame
+    size. Chunks are sized to stay in the CPU cache between steps, and
+    neighbouring slots are updated in place.
+
+    A pixel moves when it differs by more than the camera's threshold from
+    both the previous frame (frame differencing) and the background
+    (background subtraction): the first alone misses the inside of slow
+    objects, the second alone reports where something stood before the
+    background caught up. The background is a sigma-delta estimate kept in
+    8 bits: pixels that do not move step one gray level towards each frame,
+    so it follows changing light at fps gray levels a second.
+
+    write() is called from the decoders' output readers; a frame that
+    process() has not taken yet is replaced by the next one and counted as
+    dropped.
+    """
+
+    # Bytes of frames analysed per NumPy pass
+    CHUNK_BYTES = 256 * 1024
+
+    # Arrays with one entry per slot: attribute, whether the entry is a frame, dtype
+    ARRAYS = (
+        ('_latest', True, 'uint8'),
+        ('_previous', True, 'uint8'),
+        ('_background', True, 'uint8'),
+        ('_mask', True, 'bool'),
+        ('_mask_area', False, 'float32'),
+        ('_threshold', False, 'uint8'),
+        ('_min_area', False, 'float32'),
+        ('_seen', False, 'int64'),
+        ('_fresh', False, 'bool'),
+    )
+
+    def __init__(self, width, height, warmup=10):
+        self.width = width
+        self.height = height
+        self.frame_size = width * height
+        self.warmup = warmup
+        self.chunk = max(self.CHUNK_BYTES // self.frame_size, 1)
+        self.dropped = 0
+        # Camera id -> slot, and slot -> camera id (None when free)
+        self._slots = {}
+        self._ids = []
+        # Allocated with the first slot
+        for name, _, _ in self.ARRAYS:
+            setattr(self, name, None)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def nbytes(self):
+        """Memory held by the arrays"""
+        arrays = (getattr(self, name) for name, _, _ in self.ARRAYS)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def _grow(self):
+        """Double the slots of every array"""
+        import_numpy()
+        size = max(2 * len(self._ids), 8)
+        for name, frame, dtype in self.ARRAYS:
+            old = getattr(self, name)
+            array = np.zeros((size, self.height, self.width) if frame else size, dtype=dtype)
+            if old is not None:
+                array[:len(old)] = old
+            setattr(self, name, array)
+        self._ids.extend([None] * (size - len(self._ids)))
+
+    def configure(self, camera_id, threshold, min_area, mask=()):
+        """
+        Set the thresholds and mask of a camera, giving it a slot if it has none
+
+        Args:
+            camera_id: Camera id
+            threshold: Gray levels a pixel must change by to count as moving
+            min_area: Share of the unmasked frame that must move for motion
+            mask: [x, y, width, height] areas to ignore, in fractions of the frame
+        """
+        pixels = mask_pixels(mask, self.width, self.height)
+        with self._lock:
+            slot = self._slots.get(camera_id)
+            if slot is None:
+                if None not in self._ids:
+                    self._grow()
+                slot = self._ids.index(None)
+                self._ids[slot] = camera_id
+                self._slots[camera_id] = slot
+                self._reset(slot)
+            self._mask[slot] = pixels
+            # An all-masked frame never moves instead of dividing by zero
+            self._mask_area[slot] = max(int(pixels.sum()), 1)
+            self._threshold[slot] = threshold
+            self._min_area[slot] = min_area
+
+    def remove(self, camera_id):
+        with self._lock:
+            slot = self._slots.pop(camera_id, None)
+            if slot is not None:
+                self._ids[slot] = None
+                self._reset(slot)
+
+    def reset(self, camera_id):
+        """Forget a camera's frames and background, e.g. when its decoder restarts"""
+        with self._lock:
+            slot = self._slots.get(camera_id)
+            if slot is not None:
+                self._reset(slot)
+
+    def _reset(self, slot):
+        self._seen[slot] = 0
+        self._fresh[slot] = False
+
+    def write(self, camera_id, frame):
+        """Store the newest frame (width * height bytes) of a camera"""
+        with self._lock:
+            slot = self._slots.get(camera_id)
+            if slot is None:
+                return
+            if self._fresh[slot]:
+                self.dropped += 1
+            self._latest[slot] = np.frombuffer(frame, dtype=np.uint8).reshape(self.height, self.width)
+            self._fresh[slot] = True
+
+    def seen(self, camera_id):
+        """Frames of a camera analysed since its decoder started"""
+        slot = self._slots.get(camera_id)
+        return int(self._seen[slot]) if slot is not None else 0
+
+    def process(self):
+        """
+        Analyse the new frame of every camera that has one
+
+        Returns:
+            list: (camera id, share of the unmasked frame that moved, box)
+                  per analysed camera; box is [x, y, width, height] around
+                  the moving pixels in fractions of the frame when the share
+                  reaches the camera's min_area, else None
+        """
+        with self._lock:
+            if self._fresh is None:
+                return []
+            slots = np.flatnonzero(self._fresh)
+        results = []
+        for start in range(0, slots.size, self.chunk):
+            # The lock is held per chunk, so decoders only wait for one
+            with self._lock:
+                chunk = slots[start:start + self.chunk]
+                # Slots removed or reset meanwhile have no new frame
+                chunk = chunk[self._fresh[chunk]]
+                if chunk.size:
+                    results.extend(self._process(chunk))
+        return results
+
+    def _process(self, slots):
+        """Analyse the new frames of the given slots, called with the lock held"""
+        self._fresh[slots] = False
+        contiguous = slots[-1] - slots[0] + 1 == slots.size
+        # Neighbouring slots are views updated in place, others copies written back
+        index = slice(slots[0], slots[-1] + 1) if contiguous else slots
+        current = self._latest[index]
+        previous = self._previous[index]
+        background = self._background[index]
+        threshold = self._threshold[slots][:, None, None]
+        seen = self._seen[slots]
+        ids = [self._ids[slot] for slot in slots]
+
+        # |a - b| of unsigned bytes without widening them
+        difference = np.maximum(current, previous)
+        difference -= np.minimum(current, previous)
+        moving = difference > threshold
+        np.maximum(current, background, out=difference)
+        difference -= np.minimum(current, background)
+        moving &= difference > threshold
+        moving &= self._mask[index]
+        # count_nonzero() of a whole frame is far faster than along axes
+        area = np.array([np.count_nonzero(frame) for frame in moving]) / self._mask_area[slots]
+        warming = seen < self.warmup
+        area[warming] = 0.0
+
+        # Pixels that do not move step one gray level towards the frame
+        still = ~moving
+        background += (np.greater(current, background) & still).view(np.uint8)
+        background -= (np.less(current, background) & still).view(np.uint8)
+        # While warming up the background is the newest frame
+        if warming.any():
+            background[warming] = current[warming]
+        if contiguous:
+            previous[...] = current
+        else:
+            self._previous[slots] = current
+            self._background[slots] = background
+        self._seen[slots] += 1
+
+        detected = np.flatnonzero((area >= self._min_area[slots]) & ~warming)
+        boxes = [None] * len(ids)
+        if detected.size:
+            rows = moving[detected].any(axis=2)
+            columns = moving[detected].any(axis=1)
+            top = rows.argmax(axis=1)
+            bottom = self.height - rows[:, ::-1].argmax(axis=1)
+            left = columns.argmax(axis=1)
+            right = self.width - columns[:, ::-1].argmax(axis=1)
+            for position, row in enumerate(detected):
+                boxes[row] = [
+                    round(left[position] / self.width, 3), round(top[position] / self.height, 3),
+                    round((right[position] - left[position]) / self.width, 3),
+                    round((bottom[position] - top[position]) / self.height, 3),
+                ]
+        return [(camera_id, float(area[position]), boxes[position]) for position, camera_id in enumerate(ids)]
+
+
+class OpenEvent:
+    """Motion of one camera that has not ended yet"""
+
+    __slots__ = ('camera_id', 'started_at', 'last_motion', 'ended_at', 'peak_area', 'box', 'frames', 'pk')
+
+    def __init__(self, camera_id, started_at):
+        self.camera_id = camera_id
+        self.started_at = started_at
+        self.last_motion = started_at
+        self.ended_at = None
+        self.peak_area = 0.0
+        self.box = None
+        self.frames = 0
+        # Primary key of its MotionEvent row once written
+        self.pk = None
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'started_at': self.started_at,
+            'peak_area': round(self.peak_area, 4),
+            'box': self.box,
+            'frames': self.frames,
+        }
+
+
+class MotionDetector(CameraScheduler):
+    """
+    Detect motion in the streams of cameras with motion detection enabled
+
+    Every such camera gets one ffmpeg process while it publishes, keyed
+    'motion-<camera id>' in the shared ingest supervisor. It plays the
+    stream from the camera's RTMP node, resolved by node_urls(node_id) like
+    the bitrate ladders, and writes small grayscale frames to stdout. Their
+    output readers put the frames into one MotionBatch, which a detection
+    thread analyses fps times a second for all cameras at once.
+
+    Motion opens a MotionEvent; it ends once a camera has not moved for
+    cooldown seconds. Started and ended events are written in batches every
+    FLUSH_INTERVAL seconds; peak area, box and frame count are written when
+    the event ends.
+    """
+
+    thread_name = 'motion-scheduler'
+    key_prefix = 'motion'
+    loads = 'motion cameras'
+    schedules = 'motion decoders'
+
+    def __init__(self, supervisor, rtmp_url, width=320, height=180, fps=5.0, cooldown=3.0, interval=5.0,
+                 node_urls=None):
+        super().__init__(supervisor, interval)
+        self.rtmp_url = rtmp_url
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.cooldown = cooldown
+        self.node_urls = node_urls
+        self.batch = MotionBatch(width, height, warmup=max(int(WARMUP_SECONDS * fps), 1))
+        # Camera id -> settings of the batch slot of its decoder
+        self._configured = {}
+        # Camera id -> OpenEvent, and events not written yet
+        self._open = {}
+        self._started = []
+        self._ended = []
+        self._areas = {}
+        self._frames = 0
+        self._cpu_seconds = 0.0
+        self._batches = 0
+        self._detect_thread = None
+
+    def start(self):
+        if self._thread is None:
+            super().start()
+            self._detect_thread = threading.Thread(target=self._detect, name='motion-detector', daemon=True)
+            self._detect_thread.start()
+
+    def stop(self):
+        """Stop scheduling, detection and the running decoders; open events are ended"""
+        super().stop()
+        if self._detect_thread is not None:
+            self._detect_thread.join(timeout=5)
+            self._detect_thread = None
+        self._end_events(list(self._open))
+        try:
+            self.flush()
+        except DatabaseError as e:
+            logger.error(f"Failed to write motion events: {e}")
+        finally:
+            close_old_connections()
+
+    def _detect(self):
+        period = 1.0 / self.fps
+        due = time.monotonic()
+        flushed = due
+        while not self._stopped:
+            due += period
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Behind: skip the ticks that were missed rather than run them back to back
+                due = time.monotonic()
+            try:
+                self.detect()
+                if time.monotonic() - flushed >= FLUSH_INTERVAL:
+                    flushed = time.monotonic()
+                    self.flush()
+            except DatabaseError as e:
+                logger.error(f"Failed to write motion events: {e}")
+            except Exception as e:
+                logger.error(f"Failed to detect motion: {e}")
+            finally:
+                close_old_connections()
+
+    # Camera settings and publish state; called from request threads and callbacks
+
+    def read_cameras(self):
+        from .models import Camera
+
+        return {camera_id: entry for camera_id, *entry in Camera.objects.filter(motion=True).values_list(
+            'id', 'stream_key', 'node_id', 'motion_threshold', 'motion_min_area', 'motion_mask')}
+
+    def camera_entry(self, camera):
+        """The stream key, node and motion settings of a saved camera"""
+        if not camera.motion:
+            return None
+        return [camera.stream_key, camera.node_id, camera.motion_threshold, camera.motion_min_area,
+                camera.motion_mask]
+
+    # Scheduling
+
+    def _urls(self, node_id):
+        if self.node_urls is None:
+            return self.rtmp_url, ''
+        return self.node_urls(node_id)
+
+    def detector_args(self, camera_id, stream_key, node_id=None):
+        """ffmpeg arguments of a camera's motion decoder"""
+        rtmp_url, _ = self._urls(node_id)
+        return build_detector_args(f'{rtmp_url}/{camera_id}?key={stream_key}&client={MOTION_CLIENT}',
+                                   self.width, self.height, self.fps)
+
+    async def _read_frames(self, camera_id, output):
+        """Feed a decoder's frames into the batch until EOF"""
+        # A new run starts a new background
+        self.batch.reset(camera_id)
+        try:
+            while True:
+                self.batch.write(camera_id, await output.readexactly(self.batch.frame_size))
+        except asyncio.IncompleteReadError:
+            pass
+
+    def reconcile(self):
+        """
+        Start the decoders of publishing motion cameras and stop the rest
+
+        Returns:
+            dict: Detector state of every motion camera
+        """
+        with self._lock:
+            cameras = dict(self._cameras)
+            wanted = {camera_id: entry for camera_id, entry in cameras.items() if camera_id in self._publishing}
+
+        unwanted = [camera_id for camera_id in self._running if camera_id not in wanted]
+        if unwanted:
+            self.supervisor.stop_many(self._key(camera_id) for camera_id in unwanted)
+            for camera_id in unwanted:
+                logger.info(f"Stopped motion decoder of camera {camera_id}")
+                del self._running[camera_id]
+        for camera_id in [*self._running]:
+            # Gone from the supervisor, e.g. after stop_all_streams()
+            if not self.supervisor.is_running(self._key(camera_id)):
+                del self._running[camera_id]
+        for camera_id in [*self._configured]:
+            if camera_id not in self._running and camera_id not in wanted:
+                self.batch.remove(camera_id)
+                del self._configured[camera_id]
+                self._areas.pop(camera_id, None)
+
+        spawn = []
+        for camera_id, (stream_key, node_id, threshold, min_area, mask) in wanted.items():
+            config = (threshold, min_area, mask)
+            if self._configured.get(camera_id) != config:
+                self.batch.configure(camera_id, threshold, min_area, mask)
+                self._configured[camera_id] = config
+            args = self.detector_args(camera_id, stream_key, node_id)
+            if self._running.get(camera_id) != args:
+                # New, or the stream key was rotated or the camera moved; spawn() replaces the process
+                spawn.append((camera_id, args))
+        if spawn:
+            results = self.supervisor.spawn_many(
+                (self._key(camera_id), args, functools.partial(self._read_frames, camera_id))
+                for camera_id, args in spawn)
+            for camera_id, args in spawn:
+                result = results.get(self._key(camera_id))
+                if isinstance(result, Exception):
+                    logger.warning(f"Cannot start motion decoder of camera {camera_id}: {result}")
+                    self._running.pop(camera_id, None)
+                else:
+                    logger.info(f"Started motion decoder of camera {camera_id}")
+                    self._running[camera_id] = args
+        return {camera_id: self._state(camera_id) for camera_id in cameras}
+
+    # Detection; called from the detection thread
+
+    def detect(self):
+        """
+        Analyse the newest frames of all cameras, opening and ending events
+
+        Returns:
+            int: Number of frames analysed
+        """
+        started = time.perf_counter()
+        cpu = time.thread_time()
+        results = self.batch.process()
+        now = timezone.now()
+        with self._lock:
+            for camera_id, area, box in results:
+                self._areas[camera_id] = area
+                if box is None:
+                    continue
+                event = self._open.get(camera_id)
+                if event is None:
+                    event = self._open[camera_id] = OpenEvent(camera_id, now)
+                    self._started.append(event)
+                    MOTION_EVENTS.inc()
+                event.last_motion = now
+                event.frames += 1
+                if area > event.peak_area:
+                    event.peak_area = area
+                    event.box = box
+        quiet = [camera_id for camera_id, event in self._open.items()
+                 if (now - event.last_motion).total_seconds() >= self.cooldown
+                 or camera_id not in self._running]
+        self._end_events(quiet)
+        if results:
+            self._frames += len(results)
+            self._batches += 1
+            self._cpu_seconds += time.thread_time() - cpu
+            MOTION_FRAMES.inc(len(results))
+            MOTION_BATCH.observe(time.perf_counter() - started)
+        return len(results)
+
+    def _end_events(self, camera_ids):
+        with self._lock:
+            for camera_id in camera_ids:
+                event = self._open.pop(camera_id, None)
+                if event is not None:
+                    # Ends with its last moving frame
+                    event.ended_at = event.last_motion
+                    self._ended.append(event)
+
+    def flush(self):
+        """Write the events started and ended since the last flush"""
+        from .models import MotionEvent
+
+        with self._lock:
+            started, self._started = self._started, []
+            ended, self._ended = self._ended, []
+            cameras = set(self._cameras)
+        # Events of cameras deleted meanwhile have nothing to refer to
+        started = [event for event in started if event.camera_id in cameras]
+        ended = [event for event in ended if event.camera_id in cameras]
+        # Events that end before their row is written are written complete
+        updated = [event for event in ended if event.pk is not None]
+        try:
+            if started:
+                rows = [MotionEvent(camera_id=event.camera_id, started_at=event.started_at,
+                                    ended_at=event.ended_at, peak_area=event.peak_area, box=event.box,
+                                    frames=event.frames) for event in started]
+                MotionEvent.objects.bulk_create(rows)
+                for event, row in zip(started, rows):
+                    event.pk = row.pk
+                started = []
+            rows = [MotionEvent(pk=event.pk, ended_at=event.ended_at, peak_area=event.peak_area, box=event.box,
+                                frames=event.frames) for event in updated]
+            if rows:
+                MotionEvent.objects.bulk_update(rows, ['ended_at', 'peak_area', 'box', 'frames'])
+        except DatabaseError:
+            with self._lock:
+                # Written again with the next flush
+                self._started[:0] = started
+                self._ended[:0] = ended
+            raise
+
+    def _state(self, camera_id):
+        if camera_id not in self._cameras:
+            return DETECTOR_OFF
+        if camera_id not in self._running:
+            return DETECTOR_IDLE
+        return DETECTOR_RUNNING if self.batch.seen(camera_id) else DETECTOR_STARTING
+
+    # Reporting
+
+    def camera(self, camera_id):
+        """
+        Return the detector state and the current motion of a camera
+
+        Returns:
+            dict: State, supervisor state and restarts, the share of the
+                  frame that moved in the last analysed frame and the open
+                  event, if any
+        """
+        process = self.supervisor.status(self._key(camera_id)) if camera_id in self._running else None
+        event = self._open.get(camera_id)
+        area = self._areas.get(camera_id)
+        return {
+            'id': camera_id,
+            'state': self._state(camera_id),
+            'process': process['state'] if process else None,
+            'restarts': process['restarts'] if process else 0,
+            'frames': self.batch.seen(camera_id),
+            'area': round(area, 4) if area is not None else None,
+            'event': event.as_dict() if event is not None else None,
+        }
+
+    def status(self):
+        """
+        Return the detectors of all motion cameras and the detection throughput
+
+        Returns:
+            dict: Frame size and rate, counts by state, frames analysed and
+                  dropped, frames per CPU second of the detection thread,
+                  memory held and per-camera states
+        """
+        cameras = [self.camera(camera_id) for camera_id in sorted(self._cameras)]
+        counts = collections.Counter(camera['state'] for camera in cameras)
+        return {
+            'width': self.width,
+            'height': self.height,
+            'fps': self.fps,
+            'detectors': {state: counts[state] for state in DETECTOR_STATES},
+            'frames': self._frames,
+            'dropped': self.batch.dropped,
+            'batch_size': round(self._frames / self._batches, 1) if self._batches else 0.0,
+            'frames_per_cpu_second': round(self._frames / self._cpu_seconds) if self._cpu_seconds else None,
+            'open_events': len(self._open),
+            'bytes': self.batch.nbytes,
+            'cameras': cameras,
+        }
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_motion_detector():
+    """
+    Return the process-wide MotionDetector, starting it from settings
+
+    Returns:
+        MotionDetector: The shared detector
+    """
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                detector = MotionDetector(
+                    get_supervisor(),
+                    settings.RTMP_INGEST_URL,
+                    width=settings.MOTION_WIDTH,
+                    height=settings.MOTION_HEIGHT,
+                    fps=settings.MOTION_FPS,
+                    cooldown=settings.MOTION_COOLDOWN,
+                    interval=settings.MOTION_INTERVAL,
+                    node_urls=get_node_registry().urls,
+                )
+                detector.start()
+                atexit.register(detector.stop)
+                _detector = detector
+    return _detector
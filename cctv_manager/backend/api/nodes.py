@@ -0,0 +1,217 @@
+import bisect
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count
+
+# Seconds the node registry is cached; changes made in this process clear it at once
+REGISTRY_TTL = 30
+
+
+def hash64(value):
+    """Stable 64-bit hash of a string, the same in every process and Python version"""
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring of RTMP nodes
+
+    Every node puts one point on the ring per camera of capacity, so cameras
+    spread in proportion to capacity. A camera's nodes, in order of
+    preference, are the owners of the points following the camera's hash.
+    Adding or removing a node only changes the preference of the cameras
+    whose first point it takes or gives up, about its share of the capacity.
+    """
+
+    def __init__(self, nodes):
+        """
+        Args:
+            nodes: Iterable of (name, capacity)
+        """
+        points = sorted((hash64(f'{name}#{index}'), name)
+                        for name, capacity in nodes for index in range(max(capacity, 1)))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+        self.nodes = len(set(self._names))
+
+    def candidates(self, key):
+        """Yield node names in ring order from the position of a key, each once"""
+        if not self._hashes:
+            return
+        start = bisect.bisect(self._hashes, hash64(str(key)))
+        seen = set()
+        for offset in range(len(self._hashes)):
+            name = self._names[(start + offset) % len(self._names)]
+            if name not in seen:
+                seen.add(name)
+                yield name
+                if len(seen) == self.nodes:
+                    return
+
+    def owner(self, key):
+        """First node of a key, None on an empty ring"""
+        return next(self.candidates(key), None)
+
+
+def place(camera_ids, ring, capacities, counts=None):
+    """
+    Assign cameras to nodes, each to its first node on the ring with room left
+
+    Cameras are placed in the given order; when every node is full a camera
+    goes to its first node anyway (consistent hashing with bounded loads).
+
+    Args:
+        camera_ids: Camera ids, in a stable order
+        ring: HashRing of the enabled nodes
+        capacities: Mapping of node name to capacity
+        counts: Mapping of node name to cameras already placed on it; updated
+
+    Returns:
+        dict: Camera id -> node name; empty for an empty ring
+    """
+    counts = {} if counts is None else counts
+    placement = {}
+    for camera_id in camera_ids:
+        chosen = owner = None
+        for name in ring.candidates(camera_id):
+            owner = owner or name
+            if counts.get(name, 0) < capacities[name]:
+                chosen = name
+                break
+        chosen = chosen or owner
+        if chosen is None:
+            break
+        counts[chosen] = counts.get(chosen, 0) + 1
+        placement[camera_id] = chosen
+    return placement
+
+
+class NodeRegistry:
+    """
+    The registered RTMP nodes and the hash ring of the enabled ones
+
+    Stream URLs are needed on every start and camera listing, so nodes are
+    read from the database at most every ttl seconds.
+    """
+
+    def __init__(self, ttl=REGISTRY_TTL):
+        self.ttl = ttl
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def snapshot(self, refresh=False):
+        """
+        Return the nodes and the ring, loading them if the cache is stale
+
+        Returns:
+            tuple: (mapping of node id to RTMPNode, HashRing of the enabled
+                    nodes, mapping of enabled node name to capacity)
+        """
+        snapshot = self._snapshot
+        if refresh or snapshot is None or time.monotonic() - self._loaded_at >= self.ttl:
+            from .models import RTMPNode
+
+            with self._lock:
+                nodes = {node.id: node for node in RTMPNode.objects.order_by('id')}
+                enabled = [node for node in nodes.values() if node.enabled]
+                ring = HashRing((node.name, node.capacity) for node in enabled)
+                snapshot = (nodes, ring, {node.name: node.capacity for node in enabled})
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+        return snapshot
+
+    def node(self, node_id):
+        """The RTMPNode with an id, None for None or an unknown id"""
+        if node_id is None:
+            return None
+        return self.snapshot()[0].get(node_id)
+
+    def urls(self, node_id):
+        """
+        Return where cameras of a node publish and where its HLS is served
+
+        Returns:
+            tuple: (RTMP ingest URL, HLS base URL) without trailing slashes;
+                   RTMP_INGEST_URL and HLS_BASE_URL for cameras without a node.
+                   HLS_ORIGIN_BASE_URL, when set, is the HLS base URL of
+                   every node, as the origin serves the shared HLS volume.
+        """
+        node = self.node(node_id)
+        if node is None:
+            return settings.RTMP_INGEST_URL, settings.HLS_ORIGIN_BASE_URL or settings.HLS_BASE_URL
+        return node.ingest_url.rstrip('/'), settings.HLS_ORIGIN_BASE_URL or node.hls_base_url.rstrip('/')
+
+    def name(self, node_id):
+        node = self.node(node_id)
+        return node.name if node is not None else None
+
+
+def node_counts():
+    """Number of cameras on each node, keyed by node name"""
+    from .models import Camera
+
+    return dict(Camera.objects.filter(node__isnull=False)
+                .values_list('node__name').annotate(count=Count('id')).order_by())
+
+
+def assign_nodes(cameras):
+    """
+    Place cameras without a node on the ring and save their node
+
+    Nothing is placed while no node is enabled; the cameras then use the
+    server configured in settings.
+
+    Args:
+        cameras: Camera model instances
+
+    Returns:
+        list: The cameras that were placed
+    """
+    from .models import Camera
+
+    nodes, ring, capacities = get_node_registry().snapshot()
+    unplaced = [camera for camera in cameras if camera.node_id is None]
+    if not unplaced or not ring.nodes:
+        return []
+    ids = {node.name: node.id for node in nodes.values()}
+    placement = place([camera.id for camera in unplaced], ring, capacities, node_counts())
+    for camera in unplaced:
+        camera.node_id = ids[placement[camera.id]]
+    Camera.objects.bulk_update(unplaced, ['node'], batch_size=500)
+    return unplaced
+
+
+def stream_hls_url(camera):
+    """HLS playlist URL of a camera on its node"""
+    return f"{get_node_registry().urls(camera.node_id)[1]}/{camera.id}/index.m3u8"
+
+
+def stream_ingest_url(camera):
+    """RTMP URL a camera's stream is published to on its node, without the stream key"""
+    return f"{get_node_registry().urls(camera.node_id)[0]}/{camera.id}"
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_node_registry():
+    """
+    Return the process-wide NodeRegistry
+
+    Returns:
+        NodeRegistry: The shared registry
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = NodeRegistry()
+    return _registry
@@ -0,0 +1,513 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .ingest import get_supervisor, reports_progress
+from .metrics import ONDEMAND_RELAYS, ONDEMAND_STARTS, ONDEMAND_VIEWERS, ONDEMAND_WAIT
+from .scheduling import CameraScheduler
+
+logger = logging.getLogger(__name__)
+
+# Relay states reported per camera
+RELAY_OFF = 'off'
+RELAY_IDLE = 'idle'
+RELAY_STARTING = 'starting'
+RELAY_RUNNING = 'running'
+RELAY_STATES = (RELAY_IDLE, RELAY_STARTING, RELAY_RUNNING)
+
+# What a relay was started for
+START_VIEWER = 'viewer'
+START_WARM = 'warm'
+# A relay that was already running when its camera became on-demand
+START_ADOPTED = 'adopted'
+
+# Seconds between checks for the first frame while a viewer waits for one
+FIRST_FRAME_POLL = 0.05
+
+# Waits for a first frame kept for the report
+WAIT_SAMPLES = 1000
+
+# Running seconds after which a camera's own CPU and traffic rates are used
+# for its always-on estimate instead of the average of all cameras
+MIN_MEASURED_SECONDS = 10
+
+USAGE_FIELDS = ('enabled_seconds', 'running_seconds', 'cpu_seconds', 'bytes')
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))], 3)
+
+
+class OnDemandIngest(CameraScheduler):
+    """
+    Run the relays of on-demand pull cameras only while they are watched
+
+    A camera is watched while nginx-rtmp reports players of one of its
+    streams (on_play/on_done), or while one of its HLS playlists was
+    fetched in the last hls_timeout seconds (on_hls, which nginx mirrors
+    from playlist requests). The first viewer wakes the manager, which
+    starts the relay at once; it stops idle_timeout seconds after the last
+    viewer left. warm() starts a relay ahead of its viewer and keeps it for
+    preroll seconds, so a player that called warm/ before opening the
+    stream finds the first segments already written.
+
+    Relays run under the shared ingest supervisor keyed by camera id, like
+    always-on relays, so stop_stream() and the ingest endpoint apply to
+    them. Every pass adds the time each camera was enabled and running and
+    its relay's CPU time and traffic to the savings report, which compares
+    them with running every relay all the time.
+    """
+
+    thread_name = 'ondemand-ingest'
+    loads = 'on-demand cameras'
+    schedules = 'on-demand relays'
+    tracks_publishing = False
+
+    def __init__(self, supervisor, relay_args, idle_timeout=60.0, hls_timeout=15.0, preroll=30.0,
+                 interval=2.0):
+        super().__init__(supervisor, interval)
+        self.relay_args = relay_args
+        self.idle_timeout = idle_timeout
+        self.hls_timeout = hls_timeout
+        self.preroll = preroll
+        self._rtmp_viewers = collections.Counter()
+        # Camera id -> {client address: when it last fetched a playlist}
+        self._hls_viewers = collections.defaultdict(dict)
+        # Camera id -> when its last viewer left
+        self._last_viewer = {}
+        # Camera id -> until when a warmed relay runs without viewers
+        self._warm_until = {}
+        # Running relays that have delivered a frame
+        self._framed = set()
+        # Camera id -> since when a viewer waits for its first frame
+        self._waiting = {}
+        self._waits = collections.deque(maxlen=WAIT_SAMPLES)
+        self._usage = collections.defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        # Camera id -> (pid, cpu seconds, bytes) at the last read of its relay
+        self._meters = {}
+        self._since = time.monotonic()
+        self._last_pass = None
+
+    def stop_running(self):
+        """Relays are left to the supervisor's own shutdown, which stops them with the always-on ones"""
+
+    def wait(self):
+        deadline = time.monotonic() + self.interval
+        while not self._stopped and self._waiting and time.monotonic() < deadline:
+            # Someone waits; time their first frame closely
+            if self._wakeup.wait(FIRST_FRAME_POLL):
+                break
+            self.check_frames()
+        self._wakeup.wait(max(deadline - time.monotonic(), 0))
+        self._wakeup.clear()
+
+    # Camera settings and viewers; called from request threads and callbacks
+
+    def read_cameras(self):
+        from .models import Camera
+
+        return dict.fromkeys(Camera.objects.filter(on_demand=True, active=True).exclude(source_url='')
+                             .values_list('id', flat=True), True)
+
+    def camera_entry(self, camera):
+        """True for an active on-demand pull camera"""
+        if camera.on_demand and camera.active and camera.source_url:
+            return True
+        return None
+
+    def manages(self, camera_id):
+        """Whether a camera's relay is started and stopped here"""
+        return camera_id in self._cameras
+
+    def update(self, camera):
+        """Record whether a saved camera is an active on-demand pull camera"""
+        managed = camera.id in self._cameras
+        super().update(camera)
+        if managed and not camera.on_demand and camera.active and camera.source_url:
+            # Switched to always-on while idle
+            if not self.supervisor.is_running(camera.id):
+                self.supervisor.spawn(camera.id, self.relay_args(camera))
+
+    def _watched(self, camera_id, now):
+        if self._rtmp_viewers[camera_id]:
+            return True
+        return any(now - seen < self.hls_timeout for seen in self._hls_viewers.get(camera_id, {}).values())
+
+    def _arrived(self, camera_id, now):
+        """A camera went from no viewer to one; called with the lock held"""
+        if camera_id not in self._cameras:
+            return
+        self._last_viewer.pop(camera_id, None)
+        if camera_id in self._framed:
+            self._waits.append(0.0)
+            ONDEMAND_WAIT.observe(0.0)
+        else:
+            self._waiting.setdefault(camera_id, now)
+            self._wakeup.set()
+
+    def _left(self, camera_id, now):
+        if not self._watched(camera_id, now):
+            self._last_viewer[camera_id] = now
+
+    def viewer_joined(self, camera_id):
+        """Record that someone started playing one of a camera's RTMP streams"""
+        now = time.monotonic()
+        with self._lock:
+            watched = self._watched(camera_id, now)
+            self._rtmp_viewers[camera_id] += 1
+            if not watched:
+                self._arrived(camera_id, now)
+
+    def viewer_left(self, camera_id):
+        """Record that a player of one of a camera's RTMP streams left"""
+        now = time.monotonic()
+        with self._lock:
+            if self._rtmp_viewers[camera_id] <= 1:
+                # A missed on_play must not leave the count negative
+                self._rtmp_viewers.pop(camera_id, None)
+                self._left(camera_id, now)
+            else:
+                self._rtmp_viewers[camera_id] -= 1
+
+    def hls_request(self, camera_id, client):
+        """Record a fetch of one of a camera's HLS playlists by a client address"""
+        now = time.monotonic()
+        with self._lock:
+            watched = self._watched(camera_id, now)
+            self._hls_viewers[camera_id][client] = now
+            if not watched:
+                self._arrived(camera_id, now)
+
+    def warm(self, camera_id):
+        """
+        Start a camera's relay ahead of its viewer
+
+        Returns:
+            bool: True for an on-demand camera
+        """
+        if camera_id not in self._cameras:
+            return False
+        with self._lock:
+            self._warm_until[camera_id] = time.monotonic() + self.preroll
+        self._wakeup.set()
+        return True
+
+    # Scheduling
+
+    def check_frames(self, now=None):
+        """Note the relays that delivered their first frame and time the viewers waiting for them"""
+        now = time.monotonic() if now is None else now
+        for camera_id in [*self._running]:
+            if camera_id in self._framed:
+                continue
+            process = self.supervisor.processes.get(camera_id)
+            progress = process.progress if process is not None else None
+            if not progress or progress.get('frame', '0') in ('', '0'):
+                continue
+            with self._lock:
+                self._framed.add(camera_id)
+                waiting = self._waiting.pop(camera_id, None)
+                if waiting is not None:
+                    self._waits.append(now - waiting)
+                    ONDEMAND_WAIT.observe(now - waiting)
+
+    def _meter(self, now, cameras):
+        """Add the time since the last pass, and the relays' CPU time and traffic, to the usage"""
+        elapsed = now - self._last_pass if self._last_pass is not None else 0.0
+        self._last_pass = now
+        for camera_id in cameras:
+            usage = self._usage[camera_id]
+            usage['enabled_seconds'] += elapsed
+            if camera_id in self._running:
+                usage['running_seconds'] += elapsed
+        for camera_id in [*self._running]:
+            process = self.supervisor.processes.get(camera_id)
+            if process is None or process.pid is None:
+                continue
+            # The supervisor samples every few seconds; what a relay used since is lost when it stops
+            process.sample(now)
+            try:
+                total = int((process.progress or {}).get('total_size', 0))
+            except ValueError:
+                total = 0
+            pid, cpu_seconds, size = self._meters.get(camera_id, (None, 0.0, 0))
+            if pid != process.pid:
+                # A new process; all it used so far is new
+                cpu_seconds, size = 0.0, 0
+            usage = self._usage[camera_id]
+            usage['cpu_seconds'] += max(process.cpu_seconds - cpu_seconds, 0.0)
+            usage['bytes'] += max(total - size, 0)
+            self._meters[camera_id] = (process.pid, process.cpu_seconds, total)
+
+    def reconcile(self, now=None):
+        """
+        Start the relays of watched and warmed cameras and stop idle ones
+
+        Returns:
+            dict: Relay state of every on-demand camera
+        """
+        from .models import Camera
+
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            cameras = set(self._cameras)
+            for camera_id, sessions in [*self._hls_viewers.items()]:
+                for client, seen in [*sessions.items()]:
+                    if now - seen >= self.hls_timeout:
+                        del sessions[client]
+                        if not sessions and not self._rtmp_viewers[camera_id]:
+                            self._last_viewer[camera_id] = seen + self.hls_timeout
+                if not sessions:
+                    del self._hls_viewers[camera_id]
+            wanted = {}
+            for camera_id in cameras:
+                if self._watched(camera_id, now):
+                    wanted[camera_id] = START_VIEWER
+                elif now < self._warm_until.get(camera_id, 0):
+                    wanted[camera_id] = START_WARM
+                elif camera_id in self._running and now - self._last_viewer.get(camera_id, -1e9) < self.idle_timeout:
+                    # Keep it for a viewer that comes back
+                    wanted[camera_id] = START_VIEWER
+            for camera_id in [*self._warm_until]:
+                if now >= self._warm_until[camera_id]:
+                    del self._warm_until[camera_id]
+            for camera_id in [*self._last_viewer]:
+                if now - self._last_viewer[camera_id] >= self.idle_timeout:
+                    del self._last_viewer[camera_id]
+            for camera_id in [*self._waiting]:
+                if camera_id not in cameras:
+                    del self._waiting[camera_id]
+
+        self._meter(now, cameras)
+        for camera_id in [*self._running]:
+            # No longer on demand, or stopped by stop_stream() or stop_all_streams()
+            if camera_id not in cameras or not self.supervisor.is_running(camera_id):
+                self._forget(camera_id)
+        for camera_id in cameras:
+            if camera_id not in self._running and self.supervisor.is_running(camera_id):
+                self._running[camera_id] = (now, START_ADOPTED)
+                process = self.supervisor.processes.get(camera_id)
+                if process is not None and not reports_progress(process.args):
+                    # Relayed all along; its first frame cannot be seen
+                    self._framed.add(camera_id)
+                with self._lock:
+                    if not self._watched(camera_id, now):
+                        self._last_viewer.setdefault(camera_id, now)
+
+        idle = [camera_id for camera_id in self._running if camera_id not in wanted]
+        if idle:
+            self.supervisor.stop_many(idle)
+            for camera_id in idle:
+                logger.info(f"Stopped on-demand relay of camera {camera_id}")
+                self._forget(camera_id)
+
+        start = {camera_id: reason for camera_id, reason in wanted.items() if camera_id not in self._running}
+        if start:
+            found = Camera.objects.in_bulk(list(start))
+            results = self.supervisor.spawn_many(
+                (camera.id, self.relay_args(camera)) for camera in found.values())
+            for camera_id, result in results.items():
+                if isinstance(result, Exception):
+                    logger.warning(f"Cannot start on-demand relay of camera {camera_id}: {result}")
+                    continue
+                logger.info(f"Started on-demand relay of camera {camera_id} for a {start[camera_id]}")
+                ONDEMAND_STARTS.labels(start[camera_id]).inc()
+                self._running[camera_id] = (now, start[camera_id])
+
+        self.check_frames(now)
+        states = {camera_id: self._state(camera_id) for camera_id in cameras}
+        self._export_metrics(states, now)
+        return states
+
+    def _forget(self, camera_id):
+        self._running.pop(camera_id, None)
+        self._framed.discard(camera_id)
+        self._meters.pop(camera_id, None)
+
+    def _state(self, camera_id):
+        if camera_id not in self._cameras:
+            return RELAY_OFF
+        if camera_id not in self._running:
+            return RELAY_IDLE
+        return RELAY_RUNNING if camera_id in self._framed else RELAY_STARTING
+
+    # Reporting
+
+    def _viewers(self, camera_id, now):
+        sessions = self._hls_viewers.get(camera_id, {})
+        return {
+            'rtmp': self._rtmp_viewers[camera_id],
+            'hls': sum(1 for seen in sessions.values() if now - seen < self.hls_timeout),
+        }
+
+    def _export_metrics(self, states, now):
+        counts = collections.Counter(states.values())
+        for state in RELAY_STATES:
+            ONDEMAND_RELAYS.labels(state).set(counts[state])
+        with self._lock:
+            viewers = [self._viewers(camera_id, now) for camera_id in states]
+        for protocol in ('rtmp', 'hls'):
+            ONDEMAND_VIEWERS.labels(protocol).set(sum(entry[protocol] for entry in viewers))
+
+    def _fleet_rates(self):
+        """CPU seconds and bytes per running second, over the cameras measured long enough"""
+        measured = [usage for usage in self._usage.values() if usage['running_seconds'] >= MIN_MEASURED_SECONDS]
+        running = sum(usage['running_seconds'] for usage in measured)
+        if not running:
+            return None
+        return (sum(usage['cpu_seconds'] for usage in measured) / running,
+                sum(usage['bytes'] for usage in measured) / running)
+
+    def _savings(self, usage, rates):
+        """Usage of a camera against running its relay all the time it was enabled"""
+        enabled = usage['enabled_seconds']
+        result = {
+            'enabled_seconds': round(enabled, 1),
+            'running_seconds': round(usage['running_seconds'], 1),
+            'duty_cycle': round(usage['running_seconds'] / enabled, 3) if enabled else None,
+            'cpu_seconds': round(usage['cpu_seconds'], 2),
+            'bytes': int(usage['bytes']),
+        }
+        if rates is None:
+            result.update(always_on_cpu_seconds=None, cpu_seconds_saved=None,
+                          always_on_bytes=None, bytes_saved=None)
+            return result
+        cpu_rate, byte_rate = rates
+        always_cpu = max(cpu_rate * enabled, usage['cpu_seconds'])
+        always_bytes = max(byte_rate * enabled, usage['bytes'])
+        result.update(
+            always_on_cpu_seconds=round(always_cpu, 2),
+            cpu_seconds_saved=round(always_cpu - usage['cpu_seconds'], 2),
+            always_on_bytes=int(always_bytes),
+            bytes_saved=int(always_bytes - usage['bytes']),
+        )
+        return result
+
+    def _camera_rates(self, usage, fleet):
+        if usage['running_seconds'] >= MIN_MEASURED_SECONDS:
+            return (usage['cpu_seconds'] / usage['running_seconds'],
+                    usage['bytes'] / usage['running_seconds'])
+        return fleet
+
+    def camera(self, camera_id, now=None):
+        """
+        Return the relay state, viewers and savings of a camera
+
+        Returns:
+            dict: State, what started the relay, viewers by protocol, seconds
+                  since the last viewer left and of pre-roll left, and usage
+                  against always-on ingest
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            viewers = self._viewers(camera_id, now)
+            left = self._last_viewer.get(camera_id)
+            warm_until = self._warm_until.get(camera_id)
+        running = self._running.get(camera_id)
+        usage = self._usage.get(camera_id)
+        return {
+            'id': camera_id,
+            'on_demand': camera_id in self._cameras,
+            'state': self._state(camera_id),
+            'started_by': running[1] if running else None,
+            'viewers': viewers,
+            'idle_seconds': round(now - left, 1) if left is not None and running else None,
+            'preroll_seconds': round(warm_until - now, 1) if warm_until and warm_until > now else None,
+            'savings': self._savings(usage, self._camera_rates(usage, self._fleet_rates())) if usage else None,
+        }
+
+    def status(self):
+        """
+        Return the relays and viewers of all on-demand cameras and what they saved
+
+        CPU time and traffic saved are estimated from what each relay used
+        while running, or from the average of all relays for cameras that
+        ran for less than MIN_MEASURED_SECONDS.
+
+        Returns:
+            dict: Counts by state, viewers, settings, waits for a first frame,
+                  fleet savings and per-camera states
+        """
+        now = time.monotonic()
+        cameras = [self.camera(camera_id, now) for camera_id in sorted(self._cameras)]
+        fleet = self._fleet_rates()
+        totals = dict.fromkeys(USAGE_FIELDS, 0)
+        always_cpu = always_bytes = 0.0
+        for camera_id, usage in list(self._usage.items()):
+            for field in USAGE_FIELDS:
+                totals[field] += usage[field]
+            rates = self._camera_rates(usage, fleet)
+            if rates is not None:
+                always_cpu += max(rates[0] * usage['enabled_seconds'], usage['cpu_seconds'])
+                always_bytes += max(rates[1] * usage['enabled_seconds'], usage['bytes'])
+        savings = self._savings(totals, None)
+        savings.update(cores_saved=None, mbps_saved=None)
+        window = now - self._since
+        if fleet is not None:
+            cpu_saved = always_cpu - totals['cpu_seconds']
+            bytes_saved = always_bytes - totals['bytes']
+            savings.update(
+                always_on_cpu_seconds=round(always_cpu, 2),
+                cpu_seconds_saved=round(cpu_saved, 2),
+                always_on_bytes=int(always_bytes),
+                bytes_saved=int(bytes_saved),
+                # Averaged over the time the manager has been running
+                cores_saved=round(cpu_saved / window, 3) if window else None,
+                mbps_saved=round(bytes_saved * 8 / window / 1e6, 3) if window else None,
+            )
+        waits = list(self._waits)
+        counts = collections.Counter(camera['state'] for camera in cameras)
+        return {
+            'relays': {state: counts[state] for state in RELAY_STATES},
+            'viewers': {protocol: sum(camera['viewers'][protocol] for camera in cameras)
+                        for protocol in ('rtmp', 'hls')},
+            'idle_timeout': self.idle_timeout,
+            'preroll': self.preroll,
+            'first_frame': {
+                'samples': len(waits),
+                'p50': _percentile(waits, 0.5),
+                'p95': _percentile(waits, 0.95),
+                'max': round(max(waits), 3) if waits else None,
+            },
+            'window_seconds': round(window, 1),
+            'savings': savings,
+            'cameras': cameras,
+        }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_on_demand():
+    """
+    Return the process-wide OnDemandIngest, starting it from settings
+
+    Returns:
+        OnDemandIngest: The shared manager
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                from .utils import ingest_args
+
+                manager = OnDemandIngest(
+                    get_supervisor(),
+                    ingest_args,
+                    idle_timeout=settings.ONDEMAND_IDLE_TIMEOUT,
+                    hls_timeout=settings.ONDEMAND_HLS_VIEWER_TIMEOUT,
+                    preroll=settings.ONDEMAND_PREROLL,
+                    interval=settings.ONDEMAND_INTERVAL,
+                )
+                manager.start()
+                atexit.register(manager.stop)
+                _manager = manager
+    return _manager
@@ -0,0 +1,327 @@
+import asyncio
+import collections
+import logging
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from .hls import PLAYLIST_NAME, get_hls_watcher, parse_playlist, split_stream_name
+from .metrics import HLS_ORIGIN_REQUESTS, observe_request
+from .ondemand import get_on_demand
+
+logger = logging.getLogger(__name__)
+
+# Segments from the end of a playlist kept in memory: players start
+# HOLD-BACK (three target durations) behind the newest, plus one of slack
+EDGE_SEGMENTS = 4
+
+# Seconds after which a cached playlist the watcher did not report is
+# checked with one stat(), in case a file event was missed
+REVALIDATE_SECONDS = 1.0
+
+# Ways a request is answered, counted per kind of object
+RESULT_HIT = 'hit'
+RESULT_MISS = 'miss'
+RESULT_COALESCED = 'coalesced'
+RESULT_UNCACHED = 'uncached'
+RESULT_MISSING = 'missing'
+RESULTS = (RESULT_HIT, RESULT_MISS, RESULT_COALESCED, RESULT_UNCACHED, RESULT_MISSING)
+
+KIND_PLAYLIST = 'playlist'
+KIND_SEGMENT = 'segment'
+
+Entry = collections.namedtuple('Entry', ['body', 'etag', 'signature', 'checked_at'])
+
+
+def file_signature(stat):
+    """What identifies one version of a file: inode, modification time and size"""
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def read_file(path):
+    """
+    Read a whole file
+
+    Returns:
+        tuple: (contents, signature), or None if it cannot be read
+    """
+    try:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            return f.read(), file_signature(stat)
+    except OSError:
+        return None
+
+
+class OriginCache:
+    """
+    Bounded in-memory cache of nginx-rtmp's HLS output, shared by all viewers
+
+    Playlists are cached until the HLS watcher reports that nginx rewrote
+    them. Segments never change once listed, so they are cached while they
+    are among the last EDGE_SEGMENTS of their cached playlist and dropped
+    when they fall out of it; older segments, and segments no cached
+    playlist lists yet (possibly still being written), are read from disk
+    for every request. The least recently used entries are evicted once
+    the cache holds more than capacity bytes.
+
+    Concurrent misses for the same file wait for one read instead of
+    starting their own, so a playlist rewrite costs one disk read however
+    many viewers poll it. Reads run in the default executor, in tasks of
+    their own that outlive the request that started them.
+    """
+
+    def __init__(self, root, capacity=256 * 1024 * 1024):
+        self.root = root
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        # Directory -> segment paths at its live edge, from its newest playlist
+        self._edges = {}
+        # Playlist path -> invalidations so far; a read started before one is not cached
+        self._versions = collections.Counter()
+        # Path -> future of the read in progress
+        self._loading = {}
+        self._counts = collections.Counter()
+        self.disk_reads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self, path):
+        """Forget a playlist nginx rewrote; called from the HLS watcher thread"""
+        with self._lock:
+            self._versions[path] += 1
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= len(entry.body)
+
+    def _store(self, path, entry):
+        """Add an entry, evicting the least recently used; called with the lock held"""
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self._bytes -= len(old.body)
+        if len(entry.body) > self.capacity:
+            return
+        self._entries[path] = entry
+        self._bytes += len(entry.body)
+        while self._bytes > self.capacity:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.body)
+            self.evictions += 1
+
+    def _set_edge(self, path, body):
+        """Record the live edge of a media playlist and drop segments that left it"""
+        directory = os.path.dirname(path)
+        segments = parse_playlist(body.decode('utf-8', 'replace'))['segments']
+        edge = {os.path.join(directory, uri) for _, _, uri, _ in segments[-EDGE_SEGMENTS:]
+                if '/' not in uri}
+        with self._lock:
+            for segment in self._edges.get(directory, ()):
+                if segment not in edge:
+                    entry = self._entries.pop(segment, None)
+                    if entry is not None:
+                        self._bytes -= len(entry.body)
+            self._edges[directory] = edge
+
+    def _cached(self, path, kind):
+        """Return a cached entry that is still valid, or None"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(path)
+        if kind == KIND_PLAYLIST and time.monotonic() - entry.checked_at >= REVALIDATE_SECONDS:
+            try:
+                signature = file_signature(os.stat(path))
+            except OSError:
+                signature = None
+            with self._lock:
+                if signature != entry.signature:
+                    if self._entries.get(path) is entry:
+                        del self._entries[path]
+                        self._bytes -= len(entry.body)
+                    return None
+                entry = entry._replace(checked_at=time.monotonic())
+                if path in self._entries:
+                    self._entries[path] = entry
+        return entry
+
+    async def get(self, path, kind):
+        """
+        Return a file of the HLS root from memory, or read it once for all waiting requests
+
+        Args:
+            path: Absolute path of the playlist or segment
+            kind: KIND_PLAYLIST or KIND_SEGMENT
+
+        Returns:
+            tuple: (Entry or None if the file does not exist, result)
+        """
+        entry = self._cached(path, kind)
+        if entry is not None:
+            return entry, RESULT_HIT
+        loading = self._loading.get(path)
+        if loading is not None:
+            entry, _ = await asyncio.shield(loading)
+            return entry, RESULT_COALESCED
+
+        # The read belongs to no request: one whose client goes away stops
+        # waiting for it, but the others still get its result
+        loading = asyncio.ensure_future(self._load(path, kind))
+        self._loading[path] = loading
+        loading.add_done_callback(lambda _: self._loading.pop(path, None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, path, kind):
+        """Read a file into an entry and cache it if it may be; returns (entry or None, result)"""
+        version = self._versions[path]
+        self.disk_reads += 1
+        result = await asyncio.to_thread(read_file, path)
+        if result is None:
+            return None, RESULT_MISSING
+        body, signature = result
+        entry = Entry(body, f'"{signature[0]:x}-{signature[1]:x}-{signature[2]:x}"'.encode(),
+                      signature, time.monotonic())
+        if kind == KIND_PLAYLIST:
+            if os.path.basename(path) == PLAYLIST_NAME:
+                self._set_edge(path, entry.body)
+            with self._lock:
+                # Rewritten while it was read: the next request reads it again
+                if self._versions[path] == version:
+                    self._store(path, entry)
+            return entry, RESULT_MISS
+        with self._lock:
+            if path not in self._edges.get(os.path.dirname(path), ()):
+                return entry, RESULT_UNCACHED
+            self._store(path, entry)
+        return entry, RESULT_MISS
+
+    def count(self, kind, result):
+        self._counts[kind, result] += 1
+
+    def status(self):
+        """
+        Return what the cache holds and how requests were answered
+
+        Returns:
+            dict: Entries, bytes and capacity, disk reads and evictions,
+                  and requests per kind by result with the share served
+                  from memory
+        """
+        with self._lock:
+            playlists = sum(1 for path in self._entries if path.endswith('.m3u8'))
+            entries = len(self._entries)
+        requests = {}
+        for kind in (KIND_PLAYLIST, KIND_SEGMENT):
+            counts = {result: self._counts[kind, result] for result in RESULTS}
+            total = sum(counts.values())
+            served = counts[RESULT_HIT] + counts[RESULT_COALESCED]
+            requests[kind] = dict(counts, hit_ratio=round(served / total, 4) if total else None)
+        return {
+            'root': self.root,
+            'playlists': playlists,
+            'segments': entries - playlists,
+            'bytes': self._bytes,
+            'capacity': self.capacity,
+            'disk_reads': self.disk_reads,
+            'evictions': self.evictions,
+            'requests': requests,
+        }
+
+
+_origin = None
+_origin_lock = threading.Lock()
+
+
+def get_origin_cache():
+    """
+    Return the process-wide OriginCache, invalidated by the HLS watcher
+
+    Returns:
+        OriginCache: The shared cache
+    """
+    global _origin
+    if _origin is None:
+        with _origin_lock:
+            if _origin is None:
+                origin = OriginCache(settings.HLS_WATCH_ROOT, capacity=settings.HLS_ORIGIN_CACHE_BYTES)
+                get_hls_watcher().add_playlist_listener(origin.invalidate)
+                _origin = origin
+    return _origin
+
+
+# Serving
+
+PATH_PATTERN = re.compile(
+    r'^/hls/(?:(?P<master>[0-9]+)\.m3u8'
+    r'|(?P<stream>[0-9]+(?:_[A-Za-z0-9]+)?)/(?:(?P<playlist>index\.m3u8)|(?P<segment>[A-Za-z0-9_-]+\.ts)))$')
+
+PLAYLIST_TYPE = b'application/vnd.apple.mpegurl'
+SEGMENT_TYPE = b'video/mp2t'
+
+# Bound once so counting a request is a single increment
+_request_counters = {(kind, result): HLS_ORIGIN_REQUESTS.labels(kind, result)
+                     for kind in (KIND_PLAYLIST, KIND_SEGMENT) for result in RESULTS}
+
+
+async def origin_application(scope, receive, send):
+    """
+    ASGI application serving nginx-rtmp's HLS output under /hls/ from memory
+
+    Accepts the paths nginx serves: /hls/<name>.m3u8 (the master playlist
+    of a bitrate ladder), /hls/<name>/index.m3u8 and the .ts segments next
+    to it. Playlists may be reused for HLS_ORIGIN_PLAYLIST_MAX_AGE seconds
+    and segments for HLS_ORIGIN_SEGMENT_MAX_AGE; both carry an ETag, and a
+    matching If-None-Match is answered with 304. Playlist requests count as
+    HLS viewers of on-demand cameras, by the address nginx forwards.
+    """
+    started = time.perf_counter()
+    match = PATH_PATTERN.match(scope['path'])
+    kind = KIND_SEGMENT if match and match['segment'] else KIND_PLAYLIST
+    route = f'hls-origin-{kind}' if match else '<unmatched>'
+    headers = dict(scope.get('headers', []))
+    response_headers = [(b'access-control-allow-origin', b'*')]
+    body = b''
+    if scope['method'] not in ('GET', 'HEAD'):
+        status, body = 405, b'Method not allowed'
+    elif match is None:
+        status, body = 404, b'Not an HLS playlist or segment'
+    else:
+        origin = get_origin_cache()
+        if match['master']:
+            camera_id = int(match['master'])
+            path = os.path.join(origin.root, match['master'] + '.m3u8')
+        else:
+            camera_id, _ = split_stream_name(match['stream'])
+            path = os.path.join(origin.root, match['stream'], match['playlist'] or match['segment'])
+        if kind == KIND_PLAYLIST:
+            client = headers.get(b'x-real-ip', b'').decode('latin-1') or (scope.get('client') or ('',))[0]
+            get_on_demand().hls_request(camera_id, client)
+        entry, result = await origin.get(path, kind)
+        origin.count(kind, result)
+        _request_counters[kind, result].inc()
+        if entry is None:
+            status, body = 404, b'No such file'
+        else:
+            if kind == KIND_PLAYLIST:
+                content_type, max_age = PLAYLIST_TYPE, settings.HLS_ORIGIN_PLAYLIST_MAX_AGE
+            else:
+                content_type, max_age = SEGMENT_TYPE, settings.HLS_ORIGIN_SEGMENT_MAX_AGE
+            response_headers += [
+                (b'content-type', content_type),
+                (b'cache-control', f'public, max-age={max_age}'.encode()),
+                (b'etag', entry.etag),
+            ]
+            if headers.get(b'if-none-match') == entry.etag:
+                status = 304
+            else:
+                status, body = 200, entry.body
+    if status >= 400:
+        response_headers.append((b'content-type', b'text/plain'))
+    response_headers.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body if scope['method'] != 'HEAD' else b''})
+    observe_request(scope['method'], route, status, time.perf_counter() - started)
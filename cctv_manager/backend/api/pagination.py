@@ -0,0 +1,145 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over (updated_at, id)
+
+    Pages are located with a WHERE clause on the last row seen instead of
+    OFFSET, and no COUNT(*) is issued, so every page costs the same no matter
+    how deep it is. With the (updated_at, id) index the database reads only
+    page_size + 1 rows per request.
+
+    The cursor is an opaque base64 string of the boundary row and the
+    direction; 'next' and 'previous' links are returned with each page.
+    """
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('updated_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        time_field, id_field = self.ordering
+        if reverse:
+            queryset = queryset.order_by(f'-{time_field}', f'-{id_field}')
+        else:
+            queryset = queryset.order_by(time_field, id_field)
+
+        if position is not None:
+            # Written as a range on the leading column plus a tie-breaker so
+            # the database can seek the (updated_at, id) index directly
+            updated_at, pk = position
+            if reverse:
+                queryset = queryset.filter(**{f'{time_field}__lte': updated_at}).filter(
+                    Q(**{f'{time_field}__lt': updated_at}) | Q(**{f'{id_field}__lt': pk})
+                )
+            else:
+                queryset = queryset.filter(**{f'{time_field}__gte': updated_at}).filter(
+                    Q(**{f'{time_field}__gt': updated_at}) | Q(**{f'{id_field}__gt': pk})
+                )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        self.first = rows[0] if rows else None
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position = (datetime.fromisoformat(data['t']), int(data['i']))
+            return position, bool(data.get('r'))
+        except (binascii.Error, ValueError, KeyError, TypeError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        data = {'t': getattr(row, self.ordering[0]).isoformat(), 'i': row.pk}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode())
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode('ascii'))
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.first, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Opaque pagination cursor from a next/previous link',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Number of results per page (max {self.max_page_size})',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class MotionEventPagination(KeysetPagination):
+    """Keyset pagination of motion events over (started_at, id), oldest first"""
+    ordering = ('started_at', 'id')
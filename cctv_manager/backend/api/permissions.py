@@ -0,0 +1,17 @@
+from rest_framework import permissions
+
+
+class CanSignStreamTokens(permissions.BasePermission):
+    """
+    Allow signing stream tokens: play tokens to authenticated users, publish tokens to staff
+
+    A publish token lets its holder replace the camera's video, so it needs
+    as much trust as the stream key itself.
+    """
+    message = 'Signing stream tokens requires authentication; publish tokens require staff.'
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not (user and user.is_authenticated):
+            return False
+        return request.data.get('action', 'play') != 'publish' or user.is_staff
@@ -0,0 +1,405 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+MODE_HANDSHAKE = 'handshake'
+MODE_CONNECT = 'connect'
+MODE_STREAM = 'stream'
+PROBE_MODES = (MODE_HANDSHAKE, MODE_CONNECT, MODE_STREAM)
+
+STATUS_OK = 'ok'
+STATUS_TIMEOUT = 'timeout'
+STATUS_REFUSED = 'refused'
+STATUS_UNREACHABLE = 'unreachable'
+STATUS_HANDSHAKE_FAILED = 'handshake_failed'
+STATUS_REJECTED = 'rejected'
+STATUS_PROTOCOL_ERROR = 'protocol_error'
+
+RTMP_VERSION = 3
+HANDSHAKE_SIZE = 1536
+DEFAULT_CHUNK_SIZE = 128
+
+MSG_SET_CHUNK_SIZE = 1
+MSG_COMMAND_AMF0 = 20
+
+AMF_NUMBER = 0x00
+AMF_BOOLEAN = 0x01
+AMF_STRING = 0x02
+AMF_OBJECT = 0x03
+AMF_NULL = 0x05
+AMF_UNDEFINED = 0x06
+AMF_ECMA_ARRAY = 0x08
+AMF_OBJECT_END = 0x09
+AMF_STRICT_ARRAY = 0x0A
+
+
+class ProtocolError(Exception):
+    """The peer does not speak RTMP as expected"""
+
+
+class Rejected(Exception):
+    """The server answered a command with _error"""
+
+
+def amf_encode(value):
+    """Encode a Python value as AMF0"""
+    if value is None:
+        return bytes([AMF_NULL])
+    if isinstance(value, bool):
+        return bytes([AMF_BOOLEAN, value])
+    if isinstance(value, (int, float)):
+        return bytes([AMF_NUMBER]) + struct.pack('>d', value)
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        return bytes([AMF_STRING]) + struct.pack('>H', len(data)) + data
+    if isinstance(value, dict):
+        body = b''.join(
+            struct.pack('>H', len(key.encode())) + key.encode() + amf_encode(item)
+            for key, item in value.items()
+        )
+        return bytes([AMF_OBJECT]) + body + b'\x00\x00' + bytes([AMF_OBJECT_END])
+    raise TypeError(f'Cannot encode {type(value).__name__} as AMF0')
+
+
+def amf_decode(data, offset=0):
+    """
+    Decode one AMF0 value
+
+    Returns:
+        tuple: (value, offset after the value)
+    """
+    marker = data[offset]
+    offset += 1
+    if marker == AMF_NUMBER:
+        return struct.unpack_from('>d', data, offset)[0], offset + 8
+    if marker == AMF_BOOLEAN:
+        return bool(data[offset]), offset + 1
+    if marker == AMF_STRING:
+        length = struct.unpack_from('>H', data, offset)[0]
+        offset += 2
+        return data[offset:offset + length].decode('utf-8', 'replace'), offset + length
+    if marker in (AMF_NULL, AMF_UNDEFINED):
+        return None, offset
+    if marker in (AMF_OBJECT, AMF_ECMA_ARRAY):
+        if marker == AMF_ECMA_ARRAY:
+            offset += 4
+        result = {}
+        while True:
+            length = struct.unpack_from('>H', data, offset)[0]
+            offset += 2
+            if length == 0 and data[offset] == AMF_OBJECT_END:
+                return result, offset + 1
+            key = data[offset:offset + length].decode('utf-8', 'replace')
+            result[key], offset = amf_decode(data, offset + length)
+    if marker == AMF_STRICT_ARRAY:
+        count = struct.unpack_from('>I', data, offset)[0]
+        offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = amf_decode(data, offset)
+            items.append(item)
+        return items, offset
+    raise ProtocolError(f'Unsupported AMF0 marker {marker:#x}')
+
+
+def amf_decode_all(data):
+    values = []
+    offset = 0
+    while offset < len(data):
+        value, offset = amf_decode(data, offset)
+        values.append(value)
+    return values
+
+
+def encode_message(chunk_stream_id, message_type, payload, stream_id=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Frame a message as RTMP chunks: one type 0 chunk followed by type 3 chunks"""
+    header = bytes([chunk_stream_id]) + b'\x00\x00\x00' + len(payload).to_bytes(3, 'big') \
+        + bytes([message_type]) + struct.pack('<I', stream_id)
+    chunks = [header + payload[:chunk_size]]
+    for start in range(chunk_size, len(payload), chunk_size):
+        chunks.append(bytes([0xC0 | chunk_stream_id]) + payload[start:start + chunk_size])
+    return b''.join(chunks)
+
+
+class ChunkReader:
+    """Reassemble RTMP messages from the server's chunk stream"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.streams = {}
+
+    async def read_message(self):
+        """
+        Returns:
+            tuple: (message type, payload) of the next complete message
+        """
+        while True:
+            first = (await self.reader.readexactly(1))[0]
+            fmt, csid = first >> 6, first & 0x3F
+            if csid == 0:
+                csid = 64 + (await self.reader.readexactly(1))[0]
+            elif csid == 1:
+                low, high = await self.reader.readexactly(2)
+                csid = 64 + low + high * 256
+
+            state = self.streams.setdefault(csid, {'length': 0, 'type': 0, 'extended': False,
+                                                   'payload': b''})
+            if fmt < 3:
+                header = await self.reader.readexactly((11, 7, 3)[fmt])
+                timestamp = int.from_bytes(header[0:3], 'big')
+                if fmt < 2:
+                    state['length'] = int.from_bytes(header[3:6], 'big')
+                    state['type'] = header[6]
+                state['extended'] = timestamp == 0xFFFFFF
+            if state['extended']:
+                await self.reader.readexactly(4)
+
+            remaining = state['length'] - len(state['payload'])
+            state['payload'] += await self.reader.readexactly(min(self.chunk_size, remaining))
+            if len(state['payload']) < state['length']:
+                continue
+
+            message_type, payload = state['type'], state['payload']
+            state['payload'] = b''
+            if message_type == MSG_SET_CHUNK_SIZE:
+                self.chunk_size = struct.unpack('>I', payload[:4])[0] & 0x7FFFFFFF
+                continue
+            return message_type, payload
+
+
+async def rtmp_handshake(reader, writer):
+    """Perform the simple (unencrypted) RTMP handshake"""
+    c1 = struct.pack('>II', int(time.monotonic() * 1000) & 0xFFFFFFFF, 0) + os.urandom(HANDSHAKE_SIZE - 8)
+    writer.write(bytes([RTMP_VERSION]) + c1)
+    await writer.drain()
+    s0 = await reader.readexactly(1)
+    if s0[0] != RTMP_VERSION:
+        raise ProtocolError(f'Unexpected RTMP version {s0[0]}')
+    s1 = await reader.readexactly(HANDSHAKE_SIZE)
+    await reader.readexactly(HANDSHAKE_SIZE)
+    writer.write(s1)
+    await writer.drain()
+
+
+async def rtmp_command(chunks, writer, name, transaction_id, *args):
+    """
+    Send an AMF0 command and wait for its _result
+
+    Returns:
+        list: The AMF0 values following the transaction id of _result
+    """
+    payload = amf_encode(name) + amf_encode(transaction_id) + b''.join(amf_encode(arg) for arg in args)
+    writer.write(encode_message(3, MSG_COMMAND_AMF0, payload))
+    await writer.drain()
+    while True:
+        message_type, payload = await chunks.read_message()
+        if message_type != MSG_COMMAND_AMF0:
+            continue
+        values = amf_decode_all(payload)
+        if len(values) < 2 or values[1] != transaction_id:
+            continue
+        if values[0] == '_result':
+            return values[2:]
+        if values[0] == '_error':
+            info = next((value for value in values[2:] if isinstance(value, dict)), {})
+            raise Rejected(info.get('description') or info.get('code') or 'connect rejected')
+
+
+async def probe_rtmp(host, port, app, mode=MODE_HANDSHAKE, timeout=3.0):
+    """
+    Probe one RTMP endpoint
+
+    Args:
+        host: IP address or host name
+        port: RTMP port
+        app: RTMP application name, used by connect
+        mode: 'handshake', 'connect' (handshake + connect) or 'stream'
+              (connect + createStream)
+        timeout: Seconds allowed for the whole probe
+
+    Returns:
+        dict: status, error and timings in milliseconds
+    """
+    result = {'status': STATUS_OK, 'mode': mode, 'error': None,
+              'handshake_ms': None, 'connect_ms': None, 'total_ms': None}
+    started = time.perf_counter()
+    writer = None
+
+    async def run():
+        nonlocal writer
+        reader, writer = await asyncio.open_connection(host, port)
+        mark = time.perf_counter()
+        await rtmp_handshake(reader, writer)
+        result['handshake_ms'] = round((time.perf_counter() - mark) * 1000, 3)
+        if mode == MODE_HANDSHAKE:
+            return
+        chunks = ChunkReader(reader)
+        mark = time.perf_counter()
+        await rtmp_command(chunks, writer, 'connect', 1, {
+            'app': app,
+            'flashVer': 'LNX 9,0,124,2',
+            'tcUrl': f'rtmp://{host}:{port}/{app}',
+            'fpad': False,
+            'capabilities': 15,
+            'audioCodecs': 0,
+            'videoCodecs': 0,
+            'videoFunction': 1,
+        })
+        if mode == MODE_STREAM:
+            await rtmp_command(chunks, writer, 'createStream', 2, None)
+        result['connect_ms'] = round((time.perf_counter() - mark) * 1000, 3)
+
+    try:
+        await asyncio.wait_for(run(), timeout)
+    except asyncio.TimeoutError:
+        result.update(status=STATUS_TIMEOUT, error=f'No answer within {timeout}s')
+    except ConnectionRefusedError as e:
+        result.update(status=STATUS_REFUSED, error=str(e))
+    except asyncio.IncompleteReadError:
+        result.update(status=STATUS_HANDSHAKE_FAILED if result['handshake_ms'] is None
+                      else STATUS_PROTOCOL_ERROR, error='Connection closed by server')
+    except ProtocolError as e:
+        result.update(status=STATUS_HANDSHAKE_FAILED if result['handshake_ms'] is None
+                      else STATUS_PROTOCOL_ERROR, error=str(e))
+    except Rejected as e:
+        result.update(status=STATUS_REJECTED, error=str(e))
+    except (OSError, ValueError, IndexError, struct.error) as e:
+        result.update(status=STATUS_UNREACHABLE if result['handshake_ms'] is None
+                      else STATUS_PROTOCOL_ERROR, error=str(e) or type(e).__name__)
+    finally:
+        if writer is not None:
+            writer.close()
+    result['total_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+class RTMPProber:
+    """
+    Probe many RTMP endpoints concurrently, with per-host rate limits and a TTL cache
+
+    At most `concurrency` probes are in flight, and probes to the same host
+    are spaced to at most `host_rate` per second so an NVR serving many
+    cameras is not flooded. Results are cached per endpoint and mode for
+    `ttl` seconds.
+    """
+
+    def __init__(self, concurrency=200, host_rate=5.0, timeout=3.0, ttl=60.0):
+        self.concurrency = concurrency
+        self.host_rate = host_rate
+        self.timeout = timeout
+        self.ttl = ttl
+        self._cache = {}
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def cached(self, target, mode):
+        key = (*target, mode)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def _store(self, target, mode, result):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._cache) > 100000:
+                self._cache = {key: entry for key, entry in self._cache.items() if entry[0] >= now}
+            self._cache[(*target, mode)] = (now + self.ttl, result)
+
+    async def _wait_for_host(self, host):
+        if not self.host_rate:
+            return
+        now = time.monotonic()
+        with self._lock:
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + 1.0 / self.host_rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def probe_many(self, targets, mode=MODE_HANDSHAKE, refresh=False):
+        """
+        Probe endpoints, serving fresh results from the cache
+
+        Args:
+            targets: Iterable of (host, port, app) tuples
+            mode: One of PROBE_MODES
+            refresh: Ignore cached results
+
+        Returns:
+            dict: Mapping of target to its result; results carry 'cached'
+                  and 'probed_at' (Unix time)
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+
+        async def probe_one(target):
+            host, port, app = target
+            await self._wait_for_host(host)
+            async with semaphore:
+                result = await probe_rtmp(host, port, app, mode, self.timeout)
+            result['probed_at'] = time.time()
+            self._store(target, mode, result)
+            results[target] = dict(result, cached=False)
+
+        pending = []
+        for target in dict.fromkeys(targets):
+            result = None if refresh else self.cached(target, mode)
+            if result is not None:
+                results[target] = dict(result, cached=True)
+            else:
+                pending.append(probe_one(target))
+        if pending:
+            await asyncio.gather(*pending)
+        return results
+
+    def probe_cameras(self, cameras, mode=MODE_HANDSHAKE, refresh=False):
+        """
+        Probe the RTMP endpoints of cameras from synchronous code
+
+        Args:
+            cameras: Iterable of Camera model instances
+            mode: One of PROBE_MODES
+            refresh: Ignore cached results
+
+        Returns:
+            dict: Mapping of camera id to its probe result
+        """
+        cameras = list(cameras)
+        results = asyncio.run(self.probe_many([camera_target(camera) for camera in cameras],
+                                              mode, refresh))
+        return {camera.id: dict(results[camera_target(camera)], url=camera.rtmp_url)
+                for camera in cameras}
+
+
+def camera_target(camera):
+    return (camera.ip_address, camera.rtmp_port, camera.app_name)
+
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+def get_prober():
+    """
+    Return the process-wide RTMPProber, creating it from settings
+
+    Returns:
+        RTMPProber: The shared prober
+    """
+    global _prober
+    if _prober is None:
+        with _prober_lock:
+            if _prober is None:
+                _prober = RTMPProber(
+                    concurrency=settings.RTMP_PROBE_CONCURRENCY,
+                    host_rate=settings.RTMP_PROBE_HOST_RATE,
+                    timeout=settings.RTMP_PROBE_TIMEOUT,
+                    ttl=settings.RTMP_PROBE_TTL,
+                )
+    return _prober
@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+
+from django.db import DatabaseError, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reloads of the managed cameras from the database
+RELOAD_INTERVAL = 300
+
+
+class CameraScheduler:
+    """
+    Run one supervised process per camera for the cameras a feature is enabled on
+
+    The cameras and their settings are read from the database on start and
+    every RELOAD_INTERVAL seconds; in between, saved and deleted cameras
+    are reported with update() and remove(), and the RTMP callbacks report
+    which cameras publish with set_publishing(). Changes reported while a
+    load reads the database are re-applied after it, so the load cannot undo
+    them. A scheduling thread calls reconcile() every interval seconds, and
+    at once when something changed.
+
+    Subclasses read their cameras in read_cameras(), describe a saved
+    camera in camera_entry() and start and stop their processes in
+    reconcile(); the processes are keyed '<key_prefix>-<camera id>' in the
+    shared ingest supervisor.
+    """
+
+    # Name of the scheduling thread
+    thread_name = 'camera-scheduler'
+    key_prefix = 'camera'
+    # What read_cameras() reads and reconcile() does, for the log
+    loads = 'cameras'
+    schedules = 'camera processes'
+    # Whether the first load reads which cameras publish
+    tracks_publishing = True
+
+    def __init__(self, supervisor, interval=5.0):
+        self.supervisor = supervisor
+        self.interval = interval
+        # Camera id -> entry of the cameras the feature is enabled on
+        self._cameras = {}
+        self._publishing = set()
+        # Camera id -> its running process, as reconcile() records it
+        self._running = {}
+        # Changes made while a load is reading the database, re-applied after it
+        self._changes = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._loaded_at = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop scheduling and the running processes"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.stop_running()
+
+    def stop_running(self):
+        running, self._running = self._running, {}
+        if running:
+            self.supervisor.stop_many(self._key(camera_id) for camera_id in running)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at >= RELOAD_INTERVAL:
+                    self.load()
+                self.reconcile()
+            except DatabaseError as e:
+                logger.error(f"Failed to load {self.loads}: {e}")
+            except Exception as e:
+                logger.error(f"Failed to schedule {self.schedules}: {e}")
+            finally:
+                close_old_connections()
+            self.wait()
+
+    def wait(self):
+        """Sleep until the next pass is due or something changed"""
+        self._wakeup.wait(self.interval)
+        self._wakeup.clear()
+
+    def _key(self, camera_id):
+        return f'{self.key_prefix}-{camera_id}'
+
+    # Camera settings and publish state; called from request threads and callbacks
+
+    def read_cameras(self):
+        """
+        Read the cameras the feature is enabled on
+
+        Returns:
+            dict: Camera id -> entry, as camera_entry() builds it
+        """
+        raise NotImplementedError
+
+    def camera_entry(self, camera):
+        """The entry of a saved camera, None if the feature is not enabled on it"""
+        raise NotImplementedError
+
+    def reconcile(self):
+        raise NotImplementedError
+
+    def load(self):
+        """Read the cameras, and on first load which cameras publish"""
+        from .models import Camera
+
+        started = time.monotonic()
+        cameras = self.read_cameras()
+        publishing = None
+        if self._loaded_at is None and self.tracks_publishing:
+            # Afterwards the RTMP callbacks keep this up to date
+            publishing = set(Camera.objects.filter(active=True).values_list('id', flat=True))
+        with self._lock:
+            for camera_id, (changed_at, entry) in self._changes.items():
+                if changed_at < started:
+                    continue
+                if entry is None:
+                    cameras.pop(camera_id, None)
+                else:
+                    cameras[camera_id] = entry
+            self._changes.clear()
+            self._cameras = cameras
+            if publishing is not None:
+                self._publishing |= publishing
+        self._loaded_at = started
+
+    def _change(self, camera_id, entry):
+        with self._lock:
+            self._changes[camera_id] = (time.monotonic(), entry)
+            if entry is None:
+                self._cameras.pop(camera_id, None)
+            else:
+                self._cameras[camera_id] = entry
+        self._wakeup.set()
+
+    def update(self, camera):
+        """Record the settings of a saved camera"""
+        entry = self.camera_entry(camera)
+        if entry is None:
+            if camera.id in self._cameras:
+                self._change(camera.id, None)
+        elif self._cameras.get(camera.id) != entry:
+            self._change(camera.id, entry)
+
+    def update_many(self, cameras):
+        for camera in cameras:
+            self.update(camera)
+
+    def remove(self, camera_id):
+        if camera_id in self._cameras:
+            self._change(camera_id, None)
+
+    def set_publishing(self, camera_id, publishing):
+        """Record that a camera's stream started or stopped publishing"""
+        with self._lock:
+            if publishing:
+                self._publishing.add(camera_id)
+            else:
+                self._publishing.discard(camera_id)
+        if camera_id in self._cameras:
+            self._wakeup.set()
@@ -0,0 +1,114 @@
+import functools
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import condition
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+logger = logging.getLogger(__name__)
+
+# Also SWAGGER_SETTINGS['DEFAULT_INFO'], so manage.py generate_swagger writes the same schema
+API_INFO = openapi.Info(
+    title="CCTV Manager API",
+    default_version='v1',
+    description="API for managing CCTV cameras, streams, and recordings",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="admin@example.com"),
+    license=openapi.License(name="BSD License"),
+)
+
+# Schema document formats: /swagger.json and /swagger.yaml
+FORMATS = {
+    '.json': ('application/json', OpenAPICodecJson),
+    '.yaml': ('application/yaml', OpenAPICodecYaml),
+}
+
+_schema = None
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def read_schema_file():
+    """Return the JSON schema written at build time, or None if SWAGGER_SCHEMA_FILE is unset or missing"""
+    if not settings.SWAGGER_SCHEMA_FILE:
+        return None
+    try:
+        with open(settings.SWAGGER_SCHEMA_FILE, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        logger.warning(f"Cannot read the prebuilt API schema, generating it: {e}")
+        return None
+
+
+def generate_schema():
+    """
+    Generate the public schema of the API once per process
+
+    It does not depend on the request: without a host, Swagger UI and
+    ReDoc send requests to the host that served the page.
+    """
+    global _schema
+    if _schema is None:
+        _schema = OpenAPISchemaGenerator(info=API_INFO).get_schema(request=None, public=True)
+    return _schema
+
+
+def get_schema_document(extension='.json'):
+    """
+    Return the API schema rendered in one format, rendering it at most once per process
+
+    The JSON document is the one manage.py generate_swagger wrote to
+    SWAGGER_SCHEMA_FILE at build time when there is one; the schema only
+    changes with the code, so nothing is generated while serving.
+
+    Args:
+        extension: '.json' or '.yaml'
+
+    Returns:
+        tuple: (document, ETag)
+    """
+    document = _documents.get(extension)
+    if document is None:
+        with _documents_lock:
+            document = _documents.get(extension)
+            if document is None:
+                body = read_schema_file() if extension == '.json' else None
+                if body is None:
+                    body = FORMATS[extension][1](validators=[]).encode(generate_schema())
+                document = _documents[extension] = (body, hashlib.sha1(body).hexdigest())
+    return document
+
+
+def _schema_etag(request, format='.json'):
+    return get_schema_document(format)[1] if format in FORMATS else None
+
+
+@condition(etag_func=_schema_etag)
+def schema_document_view(request, format='.json'):
+    """Serve the API schema as JSON or YAML, revalidated by ETag"""
+    if format not in FORMATS:
+        raise Http404('Unknown schema format')
+    body, _ = get_schema_document(format)
+    response = HttpResponse(body, content_type=FORMATS[format][0])
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def with_schema_document(view):
+    """
+    Answer the ?format=openapi request of a Swagger UI or ReDoc page with schema_document_view
+
+    The pages load the schema from their own URL; drf_yasg would generate
+    it again for every load.
+    """
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.GET.get('format') == 'openapi':
+            return schema_document_view(request)
+        return view(request, *args, **kwargs)
+    return wrapped
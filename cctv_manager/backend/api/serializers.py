@@ -1,26 +1,235 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Camera
+from .models import LATENCY_LOW, Camera, MotionEvent, RTMPNode
+from .nodes import get_node_registry
+from .probe import MODE_HANDSHAKE, PROBE_MODES
+
+# Every unit of capacity is a point on the hash ring, see api.nodes
+MAX_NODE_CAPACITY = 10000
+
+# Shortest stream key a camera may be created with; generated keys have 32 characters
+MIN_STREAM_KEY_LENGTH = 16
+
+# Rectangles a motion mask may have; each is rasterized when the detector starts
+MAX_MOTION_MASK_RECTANGLES = 32
 
 class CameraSerializer(serializers.ModelSerializer):
     """
     Serializer for the Camera model.
+    
+    On GET requests, a comma-separated ?fields= parameter limits the output
+    to the listed fields.
     """
     rtmp_url = serializers.ReadOnlyField(
         help_text="Computed RTMP URL for the camera stream"
     )
+    node = serializers.SerializerMethodField(
+        help_text="Name of the RTMP node serving the stream; null for the server in settings"
+    )
+    ll_hls_url = serializers.SerializerMethodField(
+        help_text="Low-latency HLS playlist served by the backend; null unless latency is low"
+    )
     
     class Meta:
         model = Camera
-        fields = ['id', 'name', 'ip_address', 'rtmp_port', 'app_name', 
-                 'stream_id', 'hls_url', 'rtmp_url', 'active', 
-                 'created_at', 'updated_at']
-        read_only_fields = ['hls_url', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'site', 'ip_address', 'rtmp_port', 'app_name', 
+                 'stream_id', 'source_url', 'on_demand', 'hls_url', 'rtmp_url', 'active', 
+                 'recording', 'stream_key', 'transcode', 'latency', 'll_hls_url', 'motion',
+                 'motion_threshold', 'motion_min_area', 'motion_mask', 'node', 'created_at', 'updated_at']
+        read_only_fields = ['hls_url', 'recording', 'created_at', 'updated_at']
         extra_kwargs = {
             'name': {'help_text': 'A descriptive name for the camera'},
+            'site': {'help_text': 'Site or location the camera belongs to'},
             'ip_address': {'help_text': 'IP address of the camera'},
             'rtmp_port': {'help_text': 'RTMP port of the camera (default: 1935)'},
             'app_name': {'help_text': 'RTMP application name (e.g., live)'},
             'stream_id': {'help_text': 'RTMP stream ID'},
+            'source_url': {'help_text': 'RTSP/RTMP URL to pull from; leave empty if the camera pushes to the server'},
             'hls_url': {'help_text': 'URL to the HLS stream (auto-generated)'},
             'active': {'help_text': 'Whether the camera stream is currently active'},
-        } 
\ No newline at end of file
+            # Only returned when the camera is created and by stream-key/rotate: list and detail
+            # responses are cached and pushed to every dashboard
+            'stream_key': {'write_only': True, 'required': False,
+                           'help_text': 'Key publishers append to the RTMP URL as ?key=<stream_key>; '
+                                        'generated unless given on create, changed only by rotating it'},
+            'on_demand': {'help_text': 'Pull source_url only while someone watches the stream, '
+                                       'stopping ONDEMAND_IDLE_TIMEOUT seconds after the last viewer'},
+            'transcode': {'help_text': 'When to publish the _low/_mid/_hi renditions: off, always '
+                                       '(while the camera streams) or viewers (while someone watches)'},
+            'latency': {'help_text': 'standard (nginx-rtmp HLS) or low (LL-HLS with partial segments '
+                                     'and blocking reloads, at ll_hls_url)'},
+            'motion': {'help_text': 'Detect motion in the stream and record MotionEvents'},
+            'motion_threshold': {'help_text': 'Gray levels (1-255) a pixel must change by to count as moving'},
+            'motion_min_area': {'help_text': 'Share (0-1) of the unmasked frame that must move for motion'},
+            'motion_mask': {'help_text': 'Rectangles [x, y, width, height], in fractions (0-1) of the '
+                                         'frame, where motion is ignored'},
+        }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+    def get_node(self, camera):
+        return get_node_registry().name(camera.node_id)
+
+    def get_ll_hls_url(self, camera):
+        if camera.latency != LATENCY_LOW:
+            return None
+        return f'{settings.LLHLS_BASE_URL}/{camera.id}/index.m3u8'
+
+    def validate_stream_key(self, value):
+        if self.instance is not None or self.partial:
+            raise serializers.ValidationError('Rotate the stream key with POST stream-key/rotate/.')
+        if len(value) < MIN_STREAM_KEY_LENGTH:
+            raise serializers.ValidationError(f'Expected at least {MIN_STREAM_KEY_LENGTH} characters.')
+        return value
+
+    def validate_motion_threshold(self, value):
+        if not 1 <= value <= 255:
+            raise serializers.ValidationError('Expected 1 to 255 gray levels.')
+        return value
+
+    def validate_motion_min_area(self, value):
+        if not 0 < value <= 1:
+            raise serializers.ValidationError('Expected a share of the frame above 0 and at most 1.')
+        return value
+
+    def validate_motion_mask(self, value):
+        if not isinstance(value, list) or len(value) > MAX_MOTION_MASK_RECTANGLES:
+            raise serializers.ValidationError(
+                f'Expected a list of at most {MAX_MOTION_MASK_RECTANGLES} rectangles.')
+        for rectangle in value:
+            if (not isinstance(rectangle, list) or len(rectangle) != 4
+                    or not all(isinstance(number, (int, float)) and not isinstance(number, bool)
+                               for number in rectangle)):
+                raise serializers.ValidationError('Expected each rectangle as [x, y, width, height].')
+            x, y, width, height = rectangle
+            if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > 1 or y + height > 1:
+                raise serializers.ValidationError('Expected rectangles within the frame, in fractions of it.')
+        return value
+
+
+def requested_fields(request):
+    """
+    Return the set of fields selected with ?fields= on a GET request
+    
+    Args:
+        request: DRF request, or None
+    
+    Returns:
+        set: Valid CameraSerializer field names, or None to return all fields
+    """
+    if request is None or request.method != 'GET':
+        return None
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    fields = {name.strip() for name in value.split(',')} & set(CameraSerializer.Meta.fields)
+    return fields or None
+
+
+class MotionEventSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the MotionEvent model.
+    """
+    duration = serializers.SerializerMethodField(
+        help_text="Seconds from the first to the last frame with motion; null while it lasts"
+    )
+
+    class Meta:
+        model = MotionEvent
+        fields = ['id', 'camera', 'started_at', 'ended_at', 'duration', 'peak_area', 'box', 'frames']
+        read_only_fields = fields
+        extra_kwargs = {
+            'camera': {'help_text': 'ID of the camera'},
+            'ended_at': {'help_text': 'Time of the last frame with motion; null while it lasts'},
+            'peak_area': {'help_text': 'Largest share of the unmasked frame that moved'},
+            'box': {'help_text': 'Where it moved most: [x, y, width, height] in fractions of the frame'},
+            'frames': {'help_text': 'Frames with motion; written when the event ends'},
+        }
+
+    def get_duration(self, event):
+        if event.ended_at is None:
+            return None
+        return round((event.ended_at - event.started_at).total_seconds(), 3)
+
+
+class RTMPNodeSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the RTMPNode model.
+    """
+    cameras = serializers.IntegerField(
+        source='camera_count',
+        read_only=True,
+        help_text="Number of cameras placed on the node"
+    )
+
+    class Meta:
+        model = RTMPNode
+        fields = ['id', 'name', 'ingest_url', 'hls_base_url', 'capacity', 'enabled', 'cameras',
+                  'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+        extra_kwargs = {
+            'name': {'help_text': 'Unique name of the node'},
+            'ingest_url': {'help_text': 'RTMP application URL streams are published to, '
+                                        'e.g. rtmp://rtmp-2:1935/live'},
+            'hls_base_url': {'help_text': 'URL the node serves its HLS output under, '
+                                          'e.g. http://rtmp-2:8080/hls'},
+            'capacity': {'help_text': 'Number of cameras the node takes before others are preferred'},
+            'enabled': {'help_text': 'Whether new and rebalanced cameras are placed on the node'},
+        }
+
+    def validate_ingest_url(self, value):
+        if not value.startswith('rtmp://'):
+            raise serializers.ValidationError('Expected an rtmp:// URL.')
+        return value.rstrip('/')
+
+    def validate_hls_base_url(self, value):
+        if not value.startswith(('http://', 'https://', '/')):
+            raise serializers.ValidationError('Expected an http(s):// URL or an absolute path.')
+        return value.rstrip('/')
+
+    def validate_capacity(self, value):
+        if not 1 <= value <= MAX_NODE_CAPACITY:
+            raise serializers.ValidationError(f'Expected 1 to {MAX_NODE_CAPACITY} cameras.')
+        return value
+
+
+class RebalanceSerializer(serializers.Serializer):
+    """
+    Serializer for moving cameras to the RTMP nodes the hash ring places them on.
+    """
+    dry_run = serializers.BooleanField(
+        default=False,
+        help_text="Only report which cameras would move"
+    )
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """
+    Serializer for bulk operations addressed by camera id.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_ITEMS,
+        help_text="IDs of the cameras to operate on"
+    )
+
+
+class BulkProbeSerializer(BulkIdsSerializer):
+    """
+    Serializer for probing the RTMP endpoints of many cameras.
+    """
+    mode = serializers.ChoiceField(
+        choices=PROBE_MODES,
+        default=MODE_HANDSHAKE,
+        help_text="handshake, connect (handshake + connect) or stream (connect + createStream)"
+    )
+    refresh = serializers.BooleanField(
+        default=False,
+        help_text="Probe again even if a cached result is still fresh"
+    )
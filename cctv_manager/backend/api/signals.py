@@ -1,23 +1,65 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Camera
-from .utils import start_stream, stop_stream
+from .cache import invalidate_cameras
+from .dvr import forget_camera
+from .llhls import get_low_latency
+from .events import publish_cameras, publish_deleted
+from .models import Camera, RTMPNode
+from .motion import get_motion_detector
+from .nodes import assign_nodes, get_node_registry
+from .ondemand import get_on_demand
+from .streamkeys import get_stream_keys
+from .transcode import get_ladder_manager
+from .utils import start_stream, stop_ingest
 
 @receiver(post_save, sender=Camera)
 def camera_post_save(sender, instance, created, **kwargs):
     """
     Signal handler that runs when a Camera model is saved
     
-    If a camera is newly created and active=True, start streaming
+    If a camera is newly created and active=True, start streaming;
+    otherwise push its new state to camera event subscribers
     """
+    invalidate_cameras([instance.id])
+    if created:
+        assign_nodes([instance])
+    deferred = instance.get_deferred_fields()
+    if 'stream_key' not in deferred:
+        get_stream_keys().update(instance)
+        if not deferred & {'transcode', 'node_id'}:
+            get_ladder_manager().update(instance)
+        if not deferred & {'latency', 'node_id'}:
+            get_low_latency().update(instance)
+        if not deferred & {'motion', 'motion_threshold', 'motion_min_area', 'motion_mask', 'node_id'}:
+            get_motion_detector().update(instance)
+    if not deferred & {'on_demand', 'active', 'source_url'}:
+        get_on_demand().update(instance)
     if created and instance.active:
+        # start_stream() saves the camera again, which publishes the event
         start_stream(instance)
+    else:
+        publish_cameras([instance])
 
 @receiver(post_delete, sender=Camera)
 def camera_post_delete(sender, instance, **kwargs):
     """
     Signal handler that runs when a Camera model is deleted
     
-    Stop streaming for deleted cameras
+    Stop the ingest relay and recording for deleted cameras. The row is
+    already gone, so stop_stream() (which saves the camera) must not be
+    used here. Recorded footage is kept.
     """
-    stop_stream(instance) 
\ No newline at end of file
+    stop_ingest(instance)
+    forget_camera(instance.id)
+    get_stream_keys().remove(instance.id)
+    get_ladder_manager().remove(instance.id)
+    get_low_latency().remove(instance.id)
+    get_motion_detector().remove(instance.id)
+    get_on_demand().remove(instance.id)
+    invalidate_cameras([instance.id])
+    publish_deleted([instance.id])
+
+@receiver([post_save, post_delete], sender=RTMPNode)
+def rtmp_node_changed(sender, instance, **kwargs):
+    """Reload the node registry when an RTMP node is added, changed or removed"""
+    get_node_registry().invalidate()
@@ -0,0 +1,295 @@
+import atexit
+import collections
+import concurrent.futures
+import io
+import logging
+import subprocess
+import threading
+
+from django.conf import settings
+from PIL import Image
+
+from .export import scan_segment
+from .hls import get_hls_watcher
+
+logger = logging.getLogger(__name__)
+
+# Widths a snapshot may be scaled to (0 keeps the camera's resolution); a
+# fixed set keeps clients from filling the cache with one entry per width
+SNAPSHOT_WIDTHS = (0, 160, 320, 480, 640, 1280)
+
+Snapshot = collections.namedtuple(
+    'Snapshot', ['camera_id', 'sequence', 'width', 'jpeg', 'etag', 'captured_at'])
+
+
+class SnapshotError(Exception):
+    """A keyframe could not be decoded"""
+
+    def __init__(self, message, sequence=None):
+        super().__init__(message)
+        self.sequence = sequence
+
+
+def keyframe_slice(data):
+    """
+    Cut an MPEG-TS segment down to its last keyframe
+
+    Args:
+        data: Segment bytes
+
+    Returns:
+        bytes: PAT/PMT followed by everything from the last packet with the
+               random access indicator, or the whole segment if none is marked
+    """
+    header_end, starts = scan_segment(data)
+    keyframes = [offset for offset, pts, random_access in starts if random_access]
+    if not keyframes:
+        return data
+    return data[:header_end] + data[keyframes[-1]:]
+
+
+def decode_args(width):
+    """ffmpeg arguments decoding the first keyframe on stdin to a PPM on stdout"""
+    args = [
+        settings.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error',
+        '-skip_frame', 'nokey', '-f', 'mpegts', '-i', 'pipe:0',
+        '-an', '-frames:v', '1',
+    ]
+    if width:
+        args += ['-vf', f'scale={width}:-2']
+    return args + ['-f', 'image2pipe', '-c:v', 'ppm', 'pipe:1']
+
+
+class SnapshotCache:
+    """LRU of encoded snapshots bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return snapshot
+
+    def peek(self, key):
+        """get() without touching recency or counters"""
+        return self._entries.get(key)
+
+    def set(self, key, snapshot):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.jpeg)
+            self._entries[key] = snapshot
+            self.size += len(snapshot.jpeg)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.jpeg)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+            }
+
+
+class SnapshotService:
+    """
+    JPEG stills of the newest keyframe of each camera's HLS output
+
+    Snapshots are keyed by (camera, segment sequence, width), so a camera
+    is decoded at most once per segment however many clients ask.
+    Concurrent requests for the same key share one decode, and decodes run
+    in a bounded pool of workers, each driving one short-lived ffmpeg.
+    """
+
+    def __init__(self, workers=2, max_bytes=32 * 1024 * 1024, quality=75, timeout=5.0):
+        self.quality = quality
+        self.timeout = timeout
+        self.cache = SnapshotCache(max_bytes)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='snapshot')
+        self._pending = {}
+        self._last_good = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+        self.decodes = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _future(self, camera_id, width):
+        """Return the cached snapshot, or a future decoding it, or None without a stream"""
+        latest = get_hls_watcher().latest_segment(camera_id)
+        if latest is None:
+            return None
+        sequence, path, written_at = latest
+        key = (camera_id, sequence, width)
+        snapshot = self.cache.get(key)
+        if snapshot is not None:
+            return snapshot
+        failed = self._failed.get((camera_id, width))
+        if failed is not None and failed.sequence == sequence:
+            # Do not retry a segment that already failed; the next one may work
+            return failed
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                # A decode may have finished since the lookup above
+                snapshot = self.cache.peek(key)
+                if snapshot is not None:
+                    return snapshot
+                future = self._executor.submit(self._decode, key, path, written_at)
+                self._pending[key] = future
+            else:
+                self.coalesced += 1
+        return future
+
+    def _result(self, camera_id, width, future):
+        try:
+            if isinstance(future, SnapshotError):
+                raise future
+            if not isinstance(future, concurrent.futures.Future):
+                return future
+            return future.result(timeout=self.timeout + 1)
+        except (SnapshotError, concurrent.futures.TimeoutError) as e:
+            # The segment may already have been cleaned up; an older still beats none
+            snapshot = self._last_good.get((camera_id, width))
+            if snapshot is None:
+                raise SnapshotError(str(e) or 'Snapshot decode timed out')
+            return snapshot
+
+    def snapshot(self, camera_id, width=0):
+        """
+        Return the newest snapshot of a camera
+
+        Args:
+            camera_id: Camera id
+            width: One of SNAPSHOT_WIDTHS
+
+        Returns:
+            Snapshot: The snapshot, or None if the camera has no HLS output
+
+        Raises:
+            SnapshotError: If decoding failed and no older snapshot exists
+        """
+        future = self._future(camera_id, width)
+        if future is None:
+            return None
+        return self._result(camera_id, width, future)
+
+    def snapshot_many(self, camera_ids, width=0):
+        """
+        Return the newest snapshot of many cameras, decoding them in parallel
+
+        Returns:
+            dict: Snapshot, None (no HLS output) or SnapshotError keyed by camera id
+        """
+        futures = {camera_id: self._future(camera_id, width) for camera_id in camera_ids}
+        results = {}
+        for camera_id, future in futures.items():
+            if future is None:
+                results[camera_id] = None
+                continue
+            try:
+                results[camera_id] = self._result(camera_id, width, future)
+            except SnapshotError as e:
+                results[camera_id] = e
+        return results
+
+    def _decode(self, key, path, written_at):
+        camera_id, sequence, width = key
+        try:
+            snapshot = self.decode(camera_id, sequence, width, path, written_at)
+            self.cache.set(key, snapshot)
+            self._last_good[(camera_id, width)] = snapshot
+            return snapshot
+        except SnapshotError as e:
+            e.sequence = sequence
+            self._failed[(camera_id, width)] = e
+            self.failures += 1
+            logger.warning(f"Snapshot of camera {camera_id} segment {sequence} failed: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def decode(self, camera_id, sequence, width, path, written_at):
+        """Decode the last keyframe of a segment file to a Snapshot"""
+        try:
+            with open(path, 'rb') as f:
+                data = keyframe_slice(f.read())
+        except OSError as e:
+            raise SnapshotError(f'cannot read segment: {e}')
+
+        self.decodes += 1
+        try:
+            result = subprocess.run(decode_args(width), input=data, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise SnapshotError(f'ffmpeg failed: {e}')
+        if result.returncode != 0 or not result.stdout:
+            error = result.stderr.decode(errors='replace').strip().splitlines()
+            raise SnapshotError(f'ffmpeg exited with {result.returncode}: {error[-1] if error else ""}')
+
+        try:
+            image = Image.open(io.BytesIO(result.stdout))
+            output = io.BytesIO()
+            image.convert('RGB').save(output, 'JPEG', quality=self.quality)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f'cannot encode JPEG: {e}')
+        return Snapshot(camera_id, sequence, width, output.getvalue(),
+                        f'"{camera_id}-{sequence}-{width}"', written_at)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update({'decodes': self.decodes, 'coalesced': self.coalesced, 'failures': self.failures,
+                      'pending': len(self._pending)})
+        return stats
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_snapshot_service():
+    """
+    Return the process-wide SnapshotService, created from settings
+
+    Returns:
+        SnapshotService: The service
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                service = SnapshotService(
+                    workers=settings.SNAPSHOT_WORKERS,
+                    max_bytes=settings.SNAPSHOT_CACHE_BYTES,
+                    quality=settings.SNAPSHOT_QUALITY,
+                    timeout=settings.SNAPSHOT_TIMEOUT,
+                )
+                atexit.register(service.shutdown)
+                _service = service
+    return _service
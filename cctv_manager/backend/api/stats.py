@@ -0,0 +1,327 @@
+import atexit
+import collections
+import logging
+import threading
+import time
+import urllib.request
+import xml.etree.ElementTree as ET
+
+from django.conf import settings
+
+from .hls import split_stream_name
+
+logger = logging.getLogger(__name__)
+
+# Columns of the rolling per-stream series
+SERIES_FIELDS = ('t', 'bw_in', 'bw_out', 'bw_video', 'bw_audio', 'clients', 'dropped')
+
+# Totals nginx-rtmp reports for the whole server
+SERVER_FIELDS = ('uptime', 'naccepted', 'bw_in', 'bytes_in', 'bw_out', 'bytes_out')
+
+VIDEO_FIELDS = {'width': int, 'height': int, 'frame_rate': float, 'codec': str,
+                'profile': str, 'level': str}
+AUDIO_FIELDS = {'codec': str, 'profile': str, 'channels': int, 'sample_rate': int}
+
+
+def _number(element, tag, convert=int):
+    text = element.findtext(tag)
+    if not text:
+        return None
+    try:
+        return convert(text)
+    except ValueError:
+        return None
+
+
+def _media(element, fields):
+    if element is None or not len(element):
+        return None
+    media = {}
+    for tag, convert in fields.items():
+        value = _number(element, tag, convert)
+        if value is not None:
+            media[tag] = value
+    return media or None
+
+
+def parse_stream(element):
+    """
+    Read one <stream> element of the nginx-rtmp statistics
+
+    Returns:
+        dict: name, uptime (ms), bandwidths (bits/s), byte counters,
+              publishing, active, clients (players), publisher address,
+              dropped frames and A/V sync of all clients, video and audio
+    """
+    clients = 0
+    dropped = 0
+    publisher = None
+    avsync = None
+    for client in element.iterfind('client'):
+        dropped += _number(client, 'dropped') or 0
+        if client.find('publishing') is not None:
+            publisher = client.findtext('address')
+            avsync = _number(client, 'avsync')
+        else:
+            clients += 1
+    meta = element.find('meta')
+    return {
+        'name': element.findtext('name', ''),
+        'uptime': _number(element, 'time'),
+        'bw_in': _number(element, 'bw_in') or 0,
+        'bw_out': _number(element, 'bw_out') or 0,
+        'bw_video': _number(element, 'bw_video') or 0,
+        'bw_audio': _number(element, 'bw_audio') or 0,
+        'bytes_in': _number(element, 'bytes_in') or 0,
+        'bytes_out': _number(element, 'bytes_out') or 0,
+        'publishing': element.find('publishing') is not None,
+        'active': element.find('active') is not None,
+        'clients': clients,
+        'publisher': publisher,
+        'dropped': dropped,
+        'avsync': avsync,
+        'video': _media(meta.find('video') if meta is not None else None, VIDEO_FIELDS),
+        'audio': _media(meta.find('audio') if meta is not None else None, AUDIO_FIELDS),
+    }
+
+
+def iter_stats(source):
+    """
+    Parse nginx-rtmp statistics XML incrementally
+
+    Each <stream> is yielded as soon as it is complete and then removed
+    from the tree, so memory does not grow with the number of streams.
+
+    Args:
+        source: File-like object (e.g. an HTTP response) or path
+
+    Yields:
+        tuple: ('stream', application name, parse_stream() dict) for each
+               stream, then ('server', None, totals) at the end
+    """
+    application = None
+    containers = []
+    server = {}
+    depth = 0
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if element.tag == 'live':
+                containers.append(element)
+            continue
+        depth -= 1
+        tag = element.tag
+        if tag == 'stream':
+            yield 'stream', application, parse_stream(element)
+            # Streams are only ever children of the innermost <live>
+            if containers:
+                containers[-1].remove(element)
+            element.clear()
+        elif tag == 'name' and depth == 3:
+            # rtmp > server > application > name
+            application = element.text
+        elif tag == 'live':
+            containers.pop()
+            element.clear()
+        elif tag == 'application':
+            element.clear()
+        elif depth == 1 and tag in SERVER_FIELDS:
+            server[tag] = _number(element, '.') or 0
+    yield 'server', None, server
+
+
+class StreamSeries:
+    """Latest statistics and a rolling series for one nginx-rtmp stream"""
+
+    def __init__(self, application, name, history):
+        self.application = application
+        self.name = name
+        self.camera_id, self.suffix = split_stream_name(name)
+        self.samples = collections.deque(maxlen=history)
+        self.latest = None
+        self.last_seen = None
+
+    def add(self, stream, now):
+        self.latest = stream
+        self.last_seen = now
+        self.samples.append((now, stream['bw_in'], stream['bw_out'], stream['bw_video'],
+                             stream['bw_audio'], stream['clients'], stream['dropped']))
+
+    def as_dict(self, since=None):
+        """Latest values plus the series as columns, optionally only samples after since"""
+        samples = [sample for sample in self.samples if since is None or sample[0] >= since]
+        result = dict(self.latest)
+        result['application'] = self.application
+        result['last_seen'] = self.last_seen
+        result['series'] = {field: [sample[index] for sample in samples]
+                            for index, field in enumerate(SERIES_FIELDS)}
+        return result
+
+
+class RTMPStatsCollector:
+    """
+    Polls nginx-rtmp's rtmp_stat page and keeps per-stream metrics
+
+    Streams are keyed by application and name and mapped to cameras the
+    same way HLS directories are ('12' and '12_low' belong to camera 12).
+    A stream missing from the statistics for a whole history window is
+    forgotten.
+    """
+
+    def __init__(self, url, interval=5.0, history=120, timeout=3.0):
+        self.url = url
+        self.interval = interval
+        self.history = history
+        self.timeout = timeout
+        self.server = {}
+        self._streams = {}
+        self._cameras = collections.defaultdict(dict)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.polls = 0
+        self.failures = 0
+        self.last_poll_at = None
+        self.last_error = None
+        self.parse_ms = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='rtmp-stats', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.poll_once()
+            self._stopped.wait(self.interval)
+
+    def poll_once(self):
+        """
+        Fetch and apply the statistics once
+
+        Returns:
+            bool: Whether the statistics could be read
+        """
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+                self.ingest(response)
+        except (OSError, ET.ParseError) as e:
+            self.failures += 1
+            error = str(e)
+            if error != self.last_error:
+                logger.warning(f"Cannot read nginx-rtmp statistics from {self.url}: {error}")
+            self.last_error = error
+            return False
+        if self.last_error is not None:
+            logger.info(f"Reading nginx-rtmp statistics from {self.url} again")
+        self.last_error = None
+        self.parse_ms = round((time.perf_counter() - started) * 1000, 3)
+        return True
+
+    def ingest(self, source, now=None):
+        """Apply one statistics document read from a file-like object or path"""
+        now = time.time() if now is None else now
+        for kind, application, values in iter_stats(source):
+            if kind == 'server':
+                self.server = values
+                continue
+            key = (application, values['name'])
+            with self._lock:
+                series = self._streams.get(key)
+                if series is None:
+                    series = StreamSeries(application, values['name'], self.history)
+                    self._streams[key] = series
+                    if series.camera_id is not None:
+                        self._cameras[series.camera_id][f'{application}/{series.name}'] = series
+                series.add(values, now)
+
+        expired = now - self.history * self.interval
+        with self._lock:
+            for key, series in [*self._streams.items()]:
+                if series.last_seen < expired:
+                    del self._streams[key]
+                    streams = self._cameras.get(series.camera_id)
+                    if streams is not None:
+                        streams.pop(f'{series.application}/{series.name}', None)
+                        if not streams:
+                            del self._cameras[series.camera_id]
+        self.polls += 1
+        self.last_poll_at = now
+
+    def metrics(self, camera_id, window=None, now=None):
+        """
+        Return the metrics of a camera's streams
+
+        Args:
+            camera_id: Camera id
+            window: Only include series samples from the last window seconds
+
+        Returns:
+            dict: Streams keyed by 'application/name', each with the latest
+                  values, media info and the series as columns
+        """
+        now = time.time() if now is None else now
+        since = now - window if window else None
+        with self._lock:
+            streams = {key: series.as_dict(since)
+                       for key, series in self._cameras.get(camera_id, {}).items()}
+        return {'id': camera_id, 'collected_at': self.last_poll_at, 'streams': streams}
+
+    def latest_many(self, camera_ids):
+        """Latest values (without series) of the streams of many cameras, keyed by camera id"""
+        result = {}
+        with self._lock:
+            for camera_id in camera_ids:
+                streams = {}
+                for key, series in self._cameras.get(camera_id, {}).items():
+                    streams[key] = dict(series.latest, last_seen=series.last_seen)
+                result[camera_id] = streams
+        return result
+
+    def status(self):
+        return {
+            'url': self.url,
+            'interval': self.interval,
+            'polls': self.polls,
+            'failures': self.failures,
+            'last_poll_at': self.last_poll_at,
+            'last_error': self.last_error,
+            'parse_ms': self.parse_ms,
+            'streams': len(self._streams),
+            'server': self.server,
+        }
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def get_stats_collector():
+    """
+    Return the process-wide RTMPStatsCollector, starting it from settings
+
+    Returns:
+        RTMPStatsCollector: The collector; it only polls when RTMP_STATS_URL is set
+    """
+    global _collector
+    if _collector is None:
+        with _collector_lock:
+            if _collector is None:
+                collector = RTMPStatsCollector(
+                    settings.RTMP_STATS_URL,
+                    interval=settings.RTMP_STATS_INTERVAL,
+                    history=settings.RTMP_STATS_HISTORY,
+                    timeout=settings.RTMP_STATS_TIMEOUT,
+                )
+                if settings.RTMP_STATS_URL:
+                    collector.start()
+                    atexit.register(collector.stop)
+                _collector = collector
+    return _collector
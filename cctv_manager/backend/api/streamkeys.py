@@ -0,0 +1,270 @@
+import atexit
+import base64
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from .hls import split_stream_name
+
+logger = logging.getLogger(__name__)
+
+# STREAM_AUTH modes: check nothing, only publishers, or publishers and RTMP players
+AUTH_OFF = 'off'
+AUTH_PUBLISH = 'publish'
+AUTH_ALL = 'all'
+STREAM_AUTH_MODES = (AUTH_OFF, AUTH_PUBLISH, AUTH_ALL)
+
+# What a signed token may be used for
+TOKEN_ACTIONS = ('publish', 'play')
+
+# Truncated HMAC-SHA256; 18 bytes encode to 24 URL-safe characters without padding
+SIGNATURE_BYTES = 18
+
+
+def sign(key, action, camera_id, expires):
+    """
+    Signature of a token for one camera and action, keyed by the camera's stream key
+
+    Args:
+        key: Stream key of the camera
+        action: One of TOKEN_ACTIONS
+        camera_id: Camera id
+        expires: Expiry as a Unix timestamp (seconds)
+
+    Returns:
+        str: URL-safe signature
+    """
+    message = f'{action}:{camera_id}:{expires}'.encode()
+    digest = hmac.new(key.encode(), message, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+def make_token(key, action, camera_id, ttl, now=None):
+    """
+    Create a signed token, passed to nginx-rtmp as ?token=<token>
+
+    Tokens are signed with the stream key, so rotating the key revokes
+    them once the rotation grace period is over.
+
+    Returns:
+        tuple: (token, expiry as a Unix timestamp)
+    """
+    expires = int((time.time() if now is None else now) + ttl)
+    return f'{expires}-{sign(key, action, camera_id, expires)}', expires
+
+
+class StreamKeyIndex:
+    """
+    Stream keys of all cameras, held in memory for the RTMP callbacks
+
+    nginx-rtmp holds a publish until on_publish answers, so keys are never
+    read from the database on that path. The index is loaded in the
+    background, updated by the Camera signal handlers and reloaded every
+    reload_interval seconds to pick up changes made by other processes. A
+    stream of an unknown camera is rejected and wakes the reloader, so a
+    camera created elsewhere is accepted on the publisher's next retry.
+    """
+
+    def __init__(self, grace=300.0, reload_interval=60.0):
+        self.grace = grace
+        self.reload_interval = reload_interval
+        self._keys = {}
+        # Changes made while a load is reading the database, re-applied after it
+        self._changes = {}
+        self._changes_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._last_miss = 0.0
+        self.loads = 0
+        self.misses = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='stream-key-index', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def wait_loaded(self, timeout=None):
+        """Block until the first load finished; returns whether it did"""
+        return self._loaded.wait(timeout)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.load()
+            except DatabaseError as e:
+                logger.error(f"Failed to load stream keys: {e}")
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.reload_interval)
+            self._wakeup.clear()
+
+    def _entry(self, stream_key, previous_stream_key, rotated_at):
+        if previous_stream_key and rotated_at is not None:
+            return stream_key, previous_stream_key, rotated_at.timestamp() + self.grace
+        return stream_key, None, 0.0
+
+    def load(self):
+        """Replace the index with the keys currently in the database"""
+        from .models import Camera
+
+        started = time.monotonic()
+        rows = Camera.objects.values_list(
+            'id', 'stream_key', 'previous_stream_key', 'stream_key_rotated_at').iterator(chunk_size=2000)
+        keys = {camera_id: self._entry(*values) for camera_id, *values in rows}
+        with self._changes_lock:
+            for camera_id, (changed_at, entry) in self._changes.items():
+                if changed_at < started:
+                    continue
+                if entry is None:
+                    keys.pop(camera_id, None)
+                else:
+                    keys[camera_id] = entry
+            self._changes.clear()
+        # Rebinding the dict is atomic; lookups never see a half-built index
+        self._keys = keys
+        self.loads += 1
+        self._loaded.set()
+
+    def _change(self, camera_id, entry):
+        with self._changes_lock:
+            self._changes[camera_id] = (time.monotonic(), entry)
+            if entry is None:
+                self._keys.pop(camera_id, None)
+            else:
+                self._keys[camera_id] = entry
+
+    def update(self, camera):
+        """Record the keys of a saved camera"""
+        self._change(camera.id, self._entry(
+            camera.stream_key, camera.previous_stream_key, camera.stream_key_rotated_at))
+
+    def update_many(self, cameras):
+        for camera in cameras:
+            self.update(camera)
+
+    def remove(self, camera_id):
+        self._change(camera_id, None)
+
+    def keys(self, camera_id, now=None):
+        """
+        Keys a stream of the camera may currently be authorized with
+
+        Returns:
+            tuple: The current key, plus the previous one during the grace period;
+                   empty for unknown cameras
+        """
+        entry = self._keys.get(camera_id)
+        if entry is None:
+            self.misses += 1
+            checked_at = time.monotonic()
+            # At most one reload per second however many unknown streams arrive
+            if checked_at - self._last_miss >= 1.0:
+                self._last_miss = checked_at
+                self._wakeup.set()
+            return ()
+        key, previous, previous_until = entry
+        if previous is not None and (time.time() if now is None else now) < previous_until:
+            return key, previous
+        return key,
+
+    def verify(self, action, camera_id, params, now=None):
+        """
+        Check the key or token an nginx-rtmp client passed in its stream URL
+
+        Args:
+            action: 'publish' or 'play'
+            camera_id: Camera id from the stream name
+            params: Callback parameters; 'key' (a stream key) or 'token'
+                    (from make_token()) are checked
+
+        Returns:
+            bool: Whether the client is authorized
+        """
+        now = time.time() if now is None else now
+        keys = self.keys(camera_id, now)
+        if not keys:
+            return False
+        # compare_digest() only takes ASCII str, clients may send anything
+        supplied = params.get('key')
+        if supplied:
+            supplied = supplied.encode()
+            return any(hmac.compare_digest(supplied, key.encode()) for key in keys)
+        token = params.get('token')
+        if not token:
+            return False
+        expires, _, signature = token.partition('-')
+        try:
+            if int(expires) < now:
+                return False
+        except ValueError:
+            return False
+        signature = signature.encode()
+        return any(hmac.compare_digest(signature, sign(key, action, camera_id, expires).encode())
+                   for key in keys)
+
+    def stats(self):
+        return {
+            'cameras': len(self._keys),
+            'loaded': self._loaded.is_set(),
+            'loads': self.loads,
+            'misses': self.misses,
+        }
+
+
+def authorize(action, params):
+    """
+    Decide whether nginx-rtmp may let a client publish or play a stream
+
+    Args:
+        action: 'on_publish' or 'on_play'
+        params: Mapping of the callback parameters
+
+    Returns:
+        bool: True if STREAM_AUTH does not cover the action or the key/token is valid
+    """
+    mode = settings.STREAM_AUTH
+    if mode == AUTH_OFF or (action == 'on_play' and mode != AUTH_ALL):
+        return True
+    camera_id, _ = split_stream_name(params.get('name', ''))
+    if camera_id is None:
+        return False
+    return get_stream_keys().verify(action[3:], camera_id, params)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_stream_keys():
+    """
+    Return the process-wide StreamKeyIndex, loading it in the background
+
+    Returns:
+        StreamKeyIndex: The index
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = StreamKeyIndex(
+                    grace=settings.STREAM_KEY_GRACE,
+                    reload_interval=settings.STREAM_KEY_RELOAD_INTERVAL,
+                )
+                index.start()
+                atexit.register(index.stop)
+                _index = index
+    return _index
@@ -0,0 +1,79 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.dvr import DAY_FORMAT, DVRRecorder, DayWriter, from_ms
+
+DAY_MS = 86400 * 1000
+# 2025-01-01T00:00:00Z
+FIRST_DAY_MS = 1735689600000
+
+
+def open_files():
+    return len(os.listdir('/proc/self/fd'))
+
+
+class SegmentIndexCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix='cctv-test-dvr-')
+        self.addCleanup(directory.cleanup)
+        self.recorder = DVRRecorder(directory.name)
+        self.addCleanup(self.recorder.close_indexes)
+        source = os.path.join(directory.name, 'segment.ts')
+        with open(source, 'wb') as f:
+            f.write(b'\x47' * 188)
+        # Three days of one camera, two segments each
+        self.days = []
+        for day in range(3):
+            day_ms = FIRST_DAY_MS + day * DAY_MS
+            self.days.append(from_ms(day_ms).strftime(DAY_FORMAT))
+            writer = DayWriter(os.path.join(self.recorder.camera_directory(1), self.days[-1]))
+            writer.append(source, day_ms, 2000)
+            writer.append(source, day_ms + 2000, 2000)
+            writer.close()
+
+    @mock.patch('api.dvr.INDEX_CACHE_SIZE', 1)
+    def test_evicted_indexes_are_closed(self):
+        before = open_files()
+        for _ in range(3):
+            for day in range(3):
+                self.assertIsNotNone(self.recorder.seek(1, from_ms(FIRST_DAY_MS + day * DAY_MS + 1000)))
+        # Only the one cached mapping is left open
+        self.assertEqual(open_files(), before + 1)
+        self.recorder.close_indexes()
+        self.assertEqual(open_files(), before)
+
+    @mock.patch('api.dvr.INDEX_CACHE_SIZE', 1)
+    def test_index_in_use_is_closed_after_its_reader(self):
+        with self.recorder.index(1, self.days[0]) as first:
+            # Evicts the first day's index while it is being read
+            with self.recorder.index(1, self.days[1]):
+                pass
+            self.assertTrue(first.retired)
+            self.assertEqual(first.record(1).start_ms, FIRST_DAY_MS + 2000)
+        self.assertIsNone(first._map)
+
+    def test_segments_hold_the_index_while_iterated(self):
+        segments = self.recorder.segments(1, from_ms(FIRST_DAY_MS), from_ms(FIRST_DAY_MS + 3 * DAY_MS))
+        next(segments)
+        with mock.patch('api.dvr.INDEX_CACHE_SIZE', 0):
+            with self.recorder.index(1, self.days[2]):
+                pass
+        self.assertEqual(len([*segments]), 5)
+
+    def test_grown_index_replaces_the_snapshot(self):
+        with self.recorder.index(1, self.days[0]) as index:
+            self.assertEqual(len(index), 2)
+        writer = DayWriter(os.path.join(self.recorder.camera_directory(1), self.days[0]))
+        writer.append(os.path.join(self.recorder.root, 'segment.ts'), FIRST_DAY_MS + 4000, 2000)
+        writer.close()
+        with self.recorder.index(1, self.days[0]) as grown:
+            self.assertEqual(len(grown), 3)
+        self.assertIsNone(index._map)
+
+    def test_missing_day(self):
+        with self.recorder.index(1, '2000-01-01') as index:
+            self.assertIsNone(index)
@@ -0,0 +1,142 @@
+import collections
+
+from django.test import SimpleTestCase, TestCase
+
+from api.models import Camera, RTMPNode
+from api.nodes import HashRing, get_node_registry, hash64, place
+from api.utils import rebalance_cameras
+
+CAMERAS = range(1, 2001)
+
+
+def owners(ring, camera_ids=CAMERAS):
+    return {camera_id: ring.owner(camera_id) for camera_id in camera_ids}
+
+
+def nodes(count, capacity=100):
+    return [(f'rtmp-{index}', capacity) for index in range(count)]
+
+
+class HashRingTests(SimpleTestCase):
+
+    def test_hash_is_stable(self):
+        # Placements must agree across processes and Python versions, unlike hash()
+        self.assertEqual(hash64('camera'), 3805785035293225439)
+        self.assertEqual(hash64('rtmp-1#0'), 11171126217254255221)
+
+    def test_placement_is_stable(self):
+        ring = HashRing(nodes(4))
+        self.assertEqual(owners(ring), owners(HashRing(nodes(4))))
+        self.assertEqual(owners(ring), owners(HashRing(reversed(nodes(4)))))
+
+    def test_candidates_list_every_node_once(self):
+        ring = HashRing(nodes(4))
+        for camera_id in range(1, 50):
+            candidates = list(ring.candidates(camera_id))
+            self.assertEqual(sorted(candidates), [name for name, _ in nodes(4)])
+            self.assertEqual(candidates[0], ring.owner(camera_id))
+
+    def test_empty_ring(self):
+        ring = HashRing([])
+        self.assertIsNone(ring.owner(1))
+        self.assertEqual(place([1, 2], ring, {}), {})
+
+    def test_cameras_spread_by_capacity(self):
+        ring = HashRing([('small', 50), ('large', 150)])
+        counts = collections.Counter(owners(ring).values())
+        self.assertAlmostEqual(counts['large'] / len(CAMERAS), 0.75, delta=0.08)
+
+    def test_added_node_takes_only_its_share(self):
+        before = owners(HashRing(nodes(4)))
+        after = owners(HashRing(nodes(5)))
+        moved = [camera_id for camera_id in CAMERAS if before[camera_id] != after[camera_id]]
+        # Every camera that moves goes to the new node, about a fifth of them
+        self.assertEqual({after[camera_id] for camera_id in moved}, {'rtmp-4'})
+        self.assertAlmostEqual(len(moved) / len(CAMERAS), 0.2, delta=0.08)
+
+    def test_removed_node_gives_up_only_its_cameras(self):
+        before = owners(HashRing(nodes(5)))
+        after = owners(HashRing(nodes(4)))
+        moved = [camera_id for camera_id in CAMERAS if before[camera_id] != after[camera_id]]
+        self.assertEqual(sorted(moved), sorted(camera_id for camera_id, name in before.items() if name == 'rtmp-4'))
+        self.assertNotIn('rtmp-4', after.values())
+
+
+class PlaceTests(SimpleTestCase):
+
+    def test_follows_the_ring_with_room_left(self):
+        ring = HashRing(nodes(4, capacity=1000))
+        self.assertEqual(place(CAMERAS, ring, dict(nodes(4, capacity=1000))), owners(ring))
+
+    def test_bounded_loads(self):
+        ring = HashRing(nodes(4))
+        counts = collections.Counter(place(range(1, 401), ring, dict(nodes(4))).values())
+        self.assertEqual(counts, dict.fromkeys(counts, 100))
+        # Over capacity, cameras go to their first node
+        placement = place(range(1, 402), ring, dict(nodes(4)))
+        self.assertEqual(placement[401], ring.owner(401))
+
+    def test_counts_of_placed_cameras(self):
+        ring = HashRing(nodes(2))
+        counts = {'rtmp-0': 100}
+        placement = place(range(1, 51), ring, dict(nodes(2)), counts)
+        self.assertEqual(set(placement.values()), {'rtmp-1'})
+        self.assertEqual(counts, {'rtmp-0': 100, 'rtmp-1': 50})
+
+    def test_added_node_moves_its_share(self):
+        camera_ids = range(1, 351)
+        before = place(camera_ids, HashRing(nodes(4)), dict(nodes(4)))
+        after = place(camera_ids, HashRing(nodes(5)), dict(nodes(5)))
+        moved = [camera_id for camera_id in camera_ids if before[camera_id] != after[camera_id]]
+        self.assertEqual({after[camera_id] for camera_id in moved}, {'rtmp-4'})
+        self.assertLessEqual(len(moved), 100)
+
+
+class RebalanceTests(TestCase):
+
+    def setUp(self):
+        for name, capacity in nodes(4, capacity=1000):
+            RTMPNode.objects.create(name=name, ingest_url=f'rtmp://{name}:1935/live',
+                                    hls_base_url=f'http://{name}:8080/hls', capacity=capacity)
+        Camera.objects.bulk_create(Camera(id=camera_id, name=f'Camera {camera_id}', ip_address='10.0.0.1')
+                                   for camera_id in range(1, 501))
+        self.addCleanup(get_node_registry().invalidate)
+        rebalance_cameras()
+
+    def placement(self):
+        return dict(Camera.objects.values_list('id', 'node__name'))
+
+    def test_rebalance_is_stable(self):
+        placement = self.placement()
+        self.assertNotIn(None, placement.values())
+        self.assertEqual(rebalance_cameras()['moved'], [])
+        self.assertEqual(self.placement(), placement)
+
+    def test_added_node_moves_only_its_share(self):
+        before = self.placement()
+        RTMPNode.objects.create(name='rtmp-4', ingest_url='rtmp://rtmp-4:1935/live',
+                                hls_base_url='http://rtmp-4:8080/hls', capacity=1000)
+        report = rebalance_cameras()
+        after = self.placement()
+        moved = [camera_id for camera_id in before if before[camera_id] != after[camera_id]]
+        self.assertEqual(sorted(move['id'] for move in report['moved']), sorted(moved))
+        self.assertEqual({move['to'] for move in report['moved']}, {'rtmp-4'})
+        self.assertAlmostEqual(len(moved) / len(before), 0.2, delta=0.1)
+        self.assertEqual(report['nodes']['rtmp-4']['after'], len(moved))
+
+    def test_disabled_node_gives_up_only_its_cameras(self):
+        before = self.placement()
+        RTMPNode.objects.filter(name='rtmp-3').update(enabled=False)
+        report = rebalance_cameras()
+        after = self.placement()
+        moved = [camera_id for camera_id in before if before[camera_id] != after[camera_id]]
+        self.assertEqual(sorted(moved), sorted(camera_id for camera_id, name in before.items() if name == 'rtmp-3'))
+        self.assertEqual({move['from'] for move in report['moved']}, {'rtmp-3'})
+        self.assertEqual(report['nodes']['rtmp-3']['after'], 0)
+
+    def test_dry_run_moves_nothing(self):
+        before = self.placement()
+        RTMPNode.objects.filter(name='rtmp-3').update(enabled=False)
+        report = rebalance_cameras(dry_run=True)
+        self.assertTrue(report['moved'])
+        self.assertEqual(self.placement(), before)
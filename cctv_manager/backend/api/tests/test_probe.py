@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import socket
+import time
+
+from django.test import SimpleTestCase
+
+from api.probe import (
+    MODE_CONNECT, MODE_HANDSHAKE, MODE_STREAM, STATUS_OK, STATUS_REFUSED, STATUS_REJECTED, STATUS_TIMEOUT,
+    RTMPProber, probe_rtmp,
+)
+from benchmarks.fake_rtmp import FakeRTMPServer
+
+
+class RecordingRTMPServer(FakeRTMPServer):
+    """Stand-in RTMP server noting when each connection arrived and from which address"""
+
+    def __init__(self, reject=(), delay=0.0):
+        super().__init__(reject, delay)
+        self.arrivals = []
+        # Handler tasks of the open connections
+        self.clients = set()
+
+    async def handle(self, reader, writer):
+        self.arrivals.append((time.monotonic(), writer.get_extra_info('sockname')[0]))
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            await super().handle(reader, writer)
+        except asyncio.CancelledError:
+            # Cancelled by close(); the connection is closed on the way out
+            pass
+        finally:
+            self.clients.discard(task)
+
+    async def close(self):
+        """Stop listening and close the open connections, so no handler is left to the loop's shutdown"""
+        self.server.close()
+        clients = list(self.clients)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients)
+        await self.server.wait_closed()
+
+
+@contextlib.asynccontextmanager
+async def serving(host='127.0.0.1', **kwargs):
+    """Run a RecordingRTMPServer for the duration of the block, yielding it and its port"""
+    server = RecordingRTMPServer(**kwargs)
+    port = await server.start(host)
+    try:
+        yield server, port
+    finally:
+        await server.close()
+
+
+def closed_port():
+    """A local port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ProbeTests(SimpleTestCase):
+
+    async def test_handshake(self):
+        async with serving() as (server, port):
+            result = await probe_rtmp('127.0.0.1', port, 'live', MODE_HANDSHAKE)
+        self.assertEqual(result['status'], STATUS_OK)
+        self.assertIsNone(result['error'])
+        self.assertIsNotNone(result['handshake_ms'])
+        self.assertIsNone(result['connect_ms'])
+        self.assertEqual(server.connections, 1)
+
+    async def test_connect_and_create_stream(self):
+        async with serving() as (_, port):
+            for mode in (MODE_CONNECT, MODE_STREAM):
+                result = await probe_rtmp('127.0.0.1', port, 'live', mode)
+                self.assertEqual(result['status'], STATUS_OK, mode)
+                self.assertEqual(result['mode'], mode)
+                self.assertIsNotNone(result['connect_ms'])
+                self.assertGreaterEqual(result['total_ms'], result['handshake_ms'] + result['connect_ms'])
+
+    async def test_refused(self):
+        result = await probe_rtmp('127.0.0.1', closed_port(), 'live', MODE_CONNECT)
+        self.assertEqual(result['status'], STATUS_REFUSED)
+        self.assertIsNone(result['handshake_ms'])
+
+    async def test_rejected_application(self):
+        async with serving(reject=['private']) as (_, port):
+            result = await probe_rtmp('127.0.0.1', port, 'private', MODE_CONNECT)
+            self.assertEqual(result['status'], STATUS_REJECTED)
+            self.assertEqual(result['error'], 'Application private rejected')
+            self.assertIsNotNone(result['handshake_ms'])
+            # Only connect is refused
+            result = await probe_rtmp('127.0.0.1', port, 'private', MODE_HANDSHAKE)
+            self.assertEqual(result['status'], STATUS_OK)
+
+    async def test_timeout(self):
+        async with serving(delay=1.0) as (_, port):
+            result = await probe_rtmp('127.0.0.1', port, 'live', MODE_HANDSHAKE, timeout=0.2)
+        self.assertEqual(result['status'], STATUS_TIMEOUT)
+        self.assertIsNone(result['handshake_ms'])
+        self.assertLess(result['total_ms'], 1000)
+
+
+class ProberTests(SimpleTestCase):
+
+    async def test_results_per_target(self):
+        refused = closed_port()
+        prober = RTMPProber(host_rate=0, timeout=1.0)
+        async with serving(reject=['private']) as (_, port):
+            targets = [('127.0.0.1', port, 'live'), ('127.0.0.1', port, 'private'), ('127.0.0.1', refused, 'live')]
+            results = await prober.probe_many(targets, MODE_CONNECT)
+        self.assertEqual({target: result['status'] for target, result in results.items()},
+                         dict(zip(targets, (STATUS_OK, STATUS_REJECTED, STATUS_REFUSED))))
+        self.assertFalse(any(result['cached'] for result in results.values()))
+
+    async def test_results_are_cached_per_mode(self):
+        prober = RTMPProber(host_rate=0, ttl=60.0)
+        async with serving() as (server, port):
+            target = ('127.0.0.1', port, 'live')
+            await prober.probe_many([target], MODE_HANDSHAKE)
+            results = await prober.probe_many([target, target], MODE_HANDSHAKE)
+            self.assertTrue(results[target]['cached'])
+            self.assertEqual(server.connections, 1)
+            results = await prober.probe_many([target], MODE_CONNECT)
+            self.assertFalse(results[target]['cached'])
+            results = await prober.probe_many([target], MODE_HANDSHAKE, refresh=True)
+            self.assertFalse(results[target]['cached'])
+            self.assertEqual(server.connections, 3)
+
+    async def test_probes_of_one_host_are_spaced(self):
+        prober = RTMPProber(host_rate=20.0)
+        async with serving('0.0.0.0') as (server, port):
+            # Five cameras behind one NVR and one on another host, all loopback addresses
+            targets = [('127.0.0.1', port, f'camera{index}') for index in range(5)] + [('127.0.0.2', port, 'live')]
+            started = time.monotonic()
+            results = await prober.probe_many(targets)
+        self.assertTrue(all(result['status'] == STATUS_OK for result in results.values()))
+
+        nvr = sorted(arrived for arrived, address in server.arrivals if address == '127.0.0.1')
+        self.assertEqual(len(nvr), 5)
+        for earlier, later in zip(nvr, nvr[1:]):
+            # 1 / host_rate apart, give or take the timer resolution
+            self.assertGreaterEqual(later - earlier, 0.045)
+        self.assertGreaterEqual(nvr[-1] - started, 0.19)
+        # The other host does not wait for the NVR's slots
+        other = [arrived for arrived, address in server.arrivals if address == '127.0.0.2']
+        self.assertLess(other[0] - started, 0.04)
@@ -0,0 +1,118 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from api.models import Camera
+from api.stats import RTMPStatsCollector
+from benchmarks.fake_stats import FakeStatsServer
+
+
+class FixtureServerMixin:
+    """Serve benchmarks/fixtures/stats.xml, recorded from nginx-rtmp, and poll it once"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeStatsServer()
+        self.addCleanup(self.server.stop)
+        self.collector = RTMPStatsCollector(self.server.start(), history=10)
+        self.assertTrue(self.collector.poll_once())
+
+
+class StatsFixtureTests(FixtureServerMixin, SimpleTestCase):
+
+    def test_publishing_stream_with_viewers(self):
+        stream = self.collector.metrics(1)['streams']['live/1']
+        self.assertEqual(stream['bw_in'], 2131496)
+        self.assertEqual(stream['bw_out'], 4262992)
+        self.assertEqual(stream['bw_video'], 2067616)
+        self.assertEqual(stream['bw_audio'], 63880)
+        self.assertEqual(stream['uptime'], 86120312)
+        self.assertTrue(stream['publishing'])
+        self.assertTrue(stream['active'])
+        # Three clients, one of which is the publisher
+        self.assertEqual(stream['clients'], 2)
+        self.assertEqual(stream['publisher'], '172.18.0.3')
+        self.assertEqual(stream['dropped'], 12)
+        self.assertEqual(stream['avsync'], -11)
+        self.assertEqual(stream['video'], {'width': 1920, 'height': 1080, 'frame_rate': 25.0, 'codec': 'H264',
+                                           'profile': 'High', 'level': '4.0'})
+        self.assertEqual(stream['audio'], {'codec': 'AAC', 'profile': 'LC', 'channels': 1,
+                                           'sample_rate': 44100})
+        self.assertEqual(stream['series']['bw_in'], [2131496])
+
+    def test_stream_without_audio(self):
+        stream = self.collector.metrics(2)['streams']['live/2']
+        self.assertEqual(stream['bw_in'], 1020832)
+        self.assertEqual(stream['clients'], 1)
+        self.assertEqual(stream['dropped'], 0)
+        self.assertEqual(stream['video']['codec'], 'H264')
+        self.assertEqual(stream['video']['height'], 720)
+        self.assertIsNone(stream['audio'])
+
+    def test_stream_not_yet_active(self):
+        stream = self.collector.metrics(7)['streams']['live/7']
+        self.assertTrue(stream['publishing'])
+        self.assertFalse(stream['active'])
+        self.assertEqual(stream['clients'], 0)
+        self.assertIsNone(stream['video'])
+        self.assertIsNone(stream['avsync'])
+
+    def test_streams_map_to_cameras(self):
+        # The same stream name in every application belongs to the camera
+        self.assertEqual(sorted(self.collector.metrics(1)['streams']), ['hls/1', 'live/1'])
+        self.assertEqual(sorted(self.collector.metrics(2)['streams']), ['hls/2', 'live/2'])
+        self.assertEqual(sorted(self.collector.metrics(7)['streams']), ['live/7'])
+        self.assertEqual(self.collector.metrics(3)['streams'], {})
+        self.assertEqual(self.collector.metrics(1)['streams']['hls/1']['clients'], 0)
+        # Non-numeric stream names are kept but belong to no camera
+        self.assertEqual(self.collector.status()['streams'], 6)
+        latest = self.collector.latest_many([1, 7, 3])
+        self.assertEqual(sorted(latest), [1, 3, 7])
+        self.assertEqual(latest[7]['live/7']['bw_in'], 0)
+        self.assertNotIn('series', latest[1]['live/1'])
+
+    def test_server_totals(self):
+        status = self.collector.status()
+        self.assertEqual(status['polls'], 1)
+        self.assertEqual(status['failures'], 0)
+        self.assertEqual(status['server'], {'uptime': 86412, 'naccepted': 57, 'bw_in': 5436176,
+                                            'bytes_in': 41262813520, 'bw_out': 7713472,
+                                            'bytes_out': 58551294977})
+        self.assertEqual(self.server.requests, 1)
+
+    def test_unreachable_server(self):
+        url = self.collector.url
+        self.server.stop()
+        collector = RTMPStatsCollector(url, timeout=1.0)
+        self.assertFalse(collector.poll_once())
+        self.assertEqual(collector.failures, 1)
+        self.assertIsNotNone(collector.last_error)
+
+
+class MetricsEndpointTests(FixtureServerMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.views.get_stats_collector', return_value=self.collector)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def test_camera_metrics(self):
+        camera = Camera.objects.create(id=1, name='Gate', ip_address='10.0.0.1')
+        response = self.client.get(f'/api/cameras/{camera.id}/metrics/')
+        self.assertEqual(response.status_code, 200)
+        streams = response.json()['streams']
+        self.assertEqual(sorted(streams), ['hls/1', 'live/1'])
+        self.assertEqual(streams['live/1']['video']['codec'], 'H264')
+        self.assertEqual(streams['live/1']['clients'], 2)
+
+    def test_bulk_metrics(self):
+        Camera.objects.create(id=2, name='Yard', ip_address='10.0.0.2')
+        Camera.objects.create(id=7, name='Door', ip_address='10.0.0.7')
+        response = self.client.get('/api/cameras/bulk/metrics/', {'ids': '2,7'})
+        self.assertEqual(response.status_code, 200)
+        metrics = response.json()
+        self.assertEqual(metrics['2']['live/2']['bw_in'], 1020832)
+        self.assertEqual(metrics['7']['live/7']['dropped'], 0)
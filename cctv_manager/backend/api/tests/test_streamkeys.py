@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.models import Camera
+
+
+class RotateStreamKeyTests(TestCase):
+
+    def setUp(self):
+        self.camera = Camera.objects.create(name='Gate', ip_address='10.0.0.1')
+        self.key = self.camera.stream_key
+        self.client = APIClient()
+        self.url = f'/api/cameras/{self.camera.id}/stream-key/rotate/'
+
+    def assertKeyUnchanged(self):
+        self.camera.refresh_from_db()
+        self.assertEqual(self.camera.stream_key, self.key)
+        self.assertIsNone(self.camera.stream_key_rotated_at)
+
+    def test_anonymous_is_refused(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('stream_key', response.json())
+        self.assertKeyUnchanged()
+
+    def test_user_is_refused(self):
+        self.client.force_authenticate(get_user_model().objects.create_user('viewer'))
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('stream_key', response.json())
+        self.assertKeyUnchanged()
+
+    def test_staff_rotates(self):
+        self.client.force_authenticate(get_user_model().objects.create_user('admin', is_staff=True))
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.camera.refresh_from_db()
+        self.assertEqual(response.json()['stream_key'], self.camera.stream_key)
+        self.assertNotEqual(self.camera.stream_key, self.key)
+        self.assertEqual(self.camera.previous_stream_key, self.key)
@@ -0,0 +1,458 @@
+import atexit
+import collections
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .ingest import get_supervisor
+from .metrics import TRANSCODE_CORES, TRANSCODE_LADDERS, TRANSCODE_RUNG_FPS, TRANSCODE_SPEED
+from .models import TRANSCODE_ALWAYS, TRANSCODE_OFF, TRANSCODE_VIEWERS
+from .nodes import get_node_registry
+from .scheduling import CameraScheduler
+
+logger = logging.getLogger(__name__)
+
+# Ladder states reported per camera
+LADDER_OFF = 'off'
+LADDER_IDLE = 'idle'
+LADDER_QUEUED = 'queued'
+LADDER_RUNNING = 'running'
+LADDER_STATES = (LADDER_IDLE, LADDER_QUEUED, LADDER_RUNNING)
+
+Rung = collections.namedtuple('Rung', ['suffix', 'width', 'height', 'fps', 'kbps'])
+
+# Renditions published next to each camera's stream; suffixes and sizes match
+# the hls_variant lines in nginx.conf, bitrates leave room for the audio
+LADDER = (
+    Rung('_low', 640, 360, 15, 700),
+    Rung('_mid', 842, 480, 20, 1100),
+    Rung('_hi', 1280, 720, 25, 2200),
+)
+
+# The source is copied into this variant so the master playlist nginx writes is complete
+SOURCE_SUFFIX = '_source'
+
+# Seconds between forced keyframes; hls_fragment in nginx.conf, so every rung
+# starts its segments at the same times and players can switch between them
+KEYFRAME_INTERVAL = 3
+
+# Share of a core that decoding and scaling one source takes, on top of the encoders
+DECODE_COST = 0.25
+
+# Below this speed a ladder does not keep up with its camera
+SATURATED_SPEED = 0.95
+
+# Marks the transcoder's own play of a camera stream, which is not a viewer
+LADDER_CLIENT = 'ladder'
+
+
+def _cgroup_quota():
+    """CPU quota of the process's cgroup in cores (docker --cpus), None if unlimited"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        return int(quota) / int(period) if quota != 'max' else None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 and period > 0 else None
+
+
+def available_cores():
+    """
+    Cores this process may use: its CPU affinity, capped by a cgroup quota
+
+    Returns:
+        float: Number of cores
+    """
+    try:
+        cores = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cores = float(os.cpu_count() or 1)
+    quota = _cgroup_quota()
+    return min(cores, quota) if quota else cores
+
+
+def rung_cost(rung, pixels_per_core):
+    """Cores one rung's encoder needs at real time"""
+    return rung.width * rung.height * rung.fps / pixels_per_core
+
+
+def ladder_cost(rungs, pixels_per_core):
+    """Cores one ladder needs at real time: one decode plus an encoder per rung"""
+    return DECODE_COST + sum(rung_cost(rung, pixels_per_core) for rung in rungs)
+
+
+def build_ladder_args(source_url, target_url, stream_key, rungs=LADDER, pixels_per_core=40e6):
+    """
+    Build the ffmpeg arguments of one camera's bitrate ladder
+
+    The stream is decoded once; split hands the frames to one fps and scale
+    chain and one libx264 encoder per rung. The source is copied to the
+    _source variant without decoding. Thread counts are pinned so that the
+    cost estimate holds: libx264 otherwise starts 1.5 threads per core for
+    every encoder. Progress is reported on stdout.
+
+    Args:
+        source_url: RTMP URL of the camera's stream
+        target_url: RTMP URL the rung suffixes are appended to
+        stream_key: Stream key the renditions are published with
+        rungs: Renditions to encode
+        pixels_per_core: Encoded pixels per second one core sustains
+
+    Returns:
+        list: ffmpeg arguments (without the binary)
+    """
+    outputs = ''.join(f'[split{index}]' for index in range(len(rungs)))
+    chains = [f'[0:v]split={len(rungs)}{outputs}']
+    chains += [f'[split{index}]fps={rung.fps},scale=-2:{rung.height}[rung{index}]'
+               for index, rung in enumerate(rungs)]
+    args = [
+        '-hide_banner', '-loglevel', 'error', '-nostats', '-nostdin', '-progress', 'pipe:1',
+        '-threads', '1', '-i', source_url,
+        '-filter_complex_threads', '1', '-filter_complex', ';'.join(chains),
+    ]
+    for index, rung in enumerate(rungs):
+        gop = str(rung.fps * KEYFRAME_INTERVAL)
+        args += [
+            '-map', f'[rung{index}]', '-map', '0:a?',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-tune', 'zerolatency',
+            '-b:v', f'{rung.kbps}k', '-maxrate', f'{rung.kbps}k', '-bufsize', f'{rung.kbps * 2}k',
+            '-g', gop, '-keyint_min', gop, '-sc_threshold', '0',
+            '-threads', str(max(1, math.ceil(rung_cost(rung, pixels_per_core)))),
+            '-c:a', 'copy', '-f', 'flv', f'{target_url}{rung.suffix}?key={stream_key}',
+        ]
+    args += ['-map', '0:v', '-map', '0:a?', '-c', 'copy', '-f', 'flv',
+             f'{target_url}{SOURCE_SUFFIX}?key={stream_key}']
+    return args
+
+
+class LadderManager(CameraScheduler):
+    """
+    Run adaptive bitrate ladders for cameras within the node's core budget
+
+    Cameras with transcode='always' get a ladder while they publish;
+    'viewers' only while someone plays one of their RTMP streams or fetched
+    one of their HLS playlists in the last hls_timeout seconds, and for
+    idle_timeout seconds after the last one left. Ladders are admitted in
+    the order they were wanted as long as their cost fits in capacity
+    cores, and queue otherwise. A running ladder costs what it was
+    measured to use, scaled up if it is slower than real time, or the
+    estimate until it has been sampled. The processes are driven by the
+    shared ingest supervisor, keyed 'ladder-<camera id>'. Each ladder reads
+    from and publishes to the RTMP node of its camera, resolved by
+    node_urls(node_id) to (RTMP URL, HLS base URL); without it every camera
+    uses rtmp_url and hls_base_url.
+
+    All frames pass through split, so the rungs advance in lockstep and each
+    encodes its fps times the ladder's speed frames per second.
+    """
+
+    thread_name = 'ladder-manager'
+    key_prefix = 'ladder'
+    loads = 'transcoding settings'
+    schedules = 'bitrate ladders'
+
+    def __init__(self, supervisor, rtmp_url, hls_base_url='', capacity=1.0, rungs=LADDER,
+                 pixels_per_core=40e6, idle_timeout=60.0, interval=5.0, node_urls=None, hls_timeout=15.0):
+        super().__init__(supervisor, interval)
+        self.rtmp_url = rtmp_url
+        self.hls_base_url = hls_base_url
+        self.node_urls = node_urls
+        self.capacity = capacity
+        self.rungs = rungs
+        self.pixels_per_core = pixels_per_core
+        self.idle_timeout = idle_timeout
+        self.hls_timeout = hls_timeout
+        self.estimated_cost = ladder_cost(rungs, pixels_per_core)
+        self._viewers = collections.Counter()
+        # Camera id -> {client address: last playlist fetch}; HLS players have no on_done
+        self._hls_viewers = collections.defaultdict(dict)
+        # Camera id -> when its last viewer left
+        self._last_viewer = {}
+        self._wanted_since = {}
+        self._states = {}
+
+    # Camera settings, publish state and viewers; called from request threads and callbacks
+
+    def read_cameras(self):
+        from .models import Camera
+
+        return {camera_id: entry for camera_id, *entry in Camera.objects.exclude(
+            transcode=TRANSCODE_OFF).values_list('id', 'transcode', 'stream_key', 'node_id')}
+
+    def camera_entry(self, camera):
+        """The transcode mode, stream key and node of a saved camera"""
+        if camera.transcode == TRANSCODE_OFF:
+            return None
+        return [camera.transcode, camera.stream_key, camera.node_id]
+
+    def viewer_joined(self, camera_id):
+        with self._lock:
+            self._viewers[camera_id] += 1
+            first = self._viewers[camera_id] == 1
+        if first and camera_id in self._cameras:
+            self._wakeup.set()
+
+    def viewer_left(self, camera_id):
+        with self._lock:
+            if self._viewers[camera_id] <= 1:
+                # A missed on_play must not leave the count negative
+                self._viewers.pop(camera_id, None)
+                self._last_viewer[camera_id] = time.monotonic()
+            else:
+                self._viewers[camera_id] -= 1
+
+    def hls_request(self, camera_id, client):
+        """Record a fetch of one of a camera's HLS playlists by a client address"""
+        now = time.monotonic()
+        with self._lock:
+            watched = self._watched(camera_id, now)
+            self._hls_viewers[camera_id][client] = now
+        if not watched and camera_id in self._cameras:
+            self._wakeup.set()
+
+    # Scheduling
+
+    def _hls_count(self, camera_id, now):
+        sessions = self._hls_viewers.get(camera_id, {})
+        return sum(1 for seen in sessions.values() if now - seen < self.hls_timeout)
+
+    def _watched(self, camera_id, now):
+        return bool(self._viewers[camera_id] or self._hls_count(camera_id, now))
+
+    def _is_wanted(self, camera_id, mode, now):
+        if camera_id not in self._publishing:
+            return False
+        if mode == TRANSCODE_ALWAYS or self._watched(camera_id, now):
+            return True
+        left = self._last_viewer.get(camera_id)
+        return mode == TRANSCODE_VIEWERS and left is not None and now - left < self.idle_timeout
+
+    def _urls(self, node_id):
+        if self.node_urls is None:
+            return self.rtmp_url, self.hls_base_url
+        return self.node_urls(node_id)
+
+    def ladder_args(self, camera_id, stream_key, node_id=None):
+        """ffmpeg arguments of a camera's ladder"""
+        rtmp_url, _ = self._urls(node_id)
+        source_url = f'{rtmp_url}/{camera_id}?key={stream_key}&client={LADDER_CLIENT}'
+        return build_ladder_args(source_url, f'{rtmp_url}/{camera_id}', stream_key,
+                                 self.rungs, self.pixels_per_core)
+
+    def _cost(self, process):
+        """Cores a running ladder takes, from its supervisor status"""
+        if process is None or not process['cpu_percent']:
+            return self.estimated_cost
+        cost = process['cpu_percent'] / 100
+        progress = process['progress']
+        if progress and 0 < progress['speed'] < 1:
+            # What it would take to keep up
+            cost /= progress['speed']
+        return cost
+
+    def reconcile(self, now=None):
+        """
+        Start and stop ladders to match the cameras that want one, within capacity
+
+        Returns:
+            dict: Ladder state of every camera with a ladder enabled
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for camera_id, sessions in [*self._hls_viewers.items()]:
+                for client, seen in [*sessions.items()]:
+                    if now - seen >= self.hls_timeout:
+                        del sessions[client]
+                        if not sessions and not self._viewers[camera_id]:
+                            self._last_viewer[camera_id] = seen + self.hls_timeout
+                if not sessions:
+                    del self._hls_viewers[camera_id]
+            cameras = dict(self._cameras)
+            wanted = {camera_id: entry for camera_id, entry in cameras.items()
+                      if self._is_wanted(camera_id, entry[0], now)}
+            for camera_id in [*self._wanted_since]:
+                if camera_id not in wanted:
+                    del self._wanted_since[camera_id]
+            for camera_id in wanted:
+                self._wanted_since.setdefault(camera_id, now)
+            for camera_id, left in [*self._last_viewer.items()]:
+                if now - left >= self.idle_timeout:
+                    del self._last_viewer[camera_id]
+            order = sorted(wanted, key=self._wanted_since.__getitem__)
+
+        unwanted = [camera_id for camera_id in self._running if camera_id not in wanted]
+        if unwanted:
+            self.supervisor.stop_many(self._key(camera_id) for camera_id in unwanted)
+            for camera_id in unwanted:
+                logger.info(f"Stopped bitrate ladder of camera {camera_id}")
+                del self._running[camera_id]
+        for camera_id in [*self._running]:
+            # Gone from the supervisor, e.g. after stop_all_streams()
+            if not self.supervisor.is_running(self._key(camera_id)):
+                del self._running[camera_id]
+
+        used = sum(self._cost(self.supervisor.status(self._key(camera_id))) for camera_id in self._running)
+        states = dict.fromkeys(cameras, LADDER_IDLE)
+        spawn = []
+        for camera_id in order:
+            _, stream_key, node_id = wanted[camera_id]
+            args = self.ladder_args(camera_id, stream_key, node_id)
+            if camera_id in self._running:
+                states[camera_id] = LADDER_RUNNING
+                if self._running[camera_id] != args:
+                    # The stream key was rotated or the camera moved; spawn() replaces the process
+                    spawn.append((camera_id, args))
+            elif used + self.estimated_cost <= self.capacity:
+                used += self.estimated_cost
+                states[camera_id] = LADDER_RUNNING
+                spawn.append((camera_id, args))
+            else:
+                states[camera_id] = LADDER_QUEUED
+
+        if spawn:
+            results = self.supervisor.spawn_many((self._key(camera_id), args) for camera_id, args in spawn)
+            for camera_id, args in spawn:
+                result = results.get(self._key(camera_id))
+                if isinstance(result, Exception):
+                    logger.warning(f"Cannot start bitrate ladder of camera {camera_id}: {result}")
+                    self._running.pop(camera_id, None)
+                    states[camera_id] = LADDER_QUEUED
+                else:
+                    logger.info(f"Started bitrate ladder of camera {camera_id}")
+                    self._running[camera_id] = args
+
+        queued = sum(1 for state in states.values() if state == LADDER_QUEUED)
+        if queued:
+            logger.debug(f"{queued} bitrate ladders wait for cores ({used:.2f} of {self.capacity:.2f} used)")
+        self._states = states
+        self._export_metrics()
+        return states
+
+    # Reporting
+
+    def _export_metrics(self):
+        counts = collections.Counter(self._states.values())
+        for state in LADDER_STATES:
+            TRANSCODE_LADDERS.labels(state).set(counts[state])
+        speeds = []
+        used = 0.0
+        for camera_id in [*self._running]:
+            process = self.supervisor.status(self._key(camera_id))
+            used += self._cost(process)
+            if process is not None and process['progress']:
+                speeds.append(process['progress']['speed'])
+        TRANSCODE_CORES.labels('capacity').set(self.capacity)
+        TRANSCODE_CORES.labels('used').set(used)
+        TRANSCODE_SPEED.set(min(speeds) if speeds else 0)
+        for rung in self.rungs:
+            TRANSCODE_RUNG_FPS.labels(rung.suffix.lstrip('_')).set(sum(speeds) * rung.fps)
+
+    def ladder(self, camera_id):
+        """
+        Return the state of a camera's ladder
+
+        Returns:
+            dict: Mode, state, viewers, supervisor state, cores, speed and the
+                  encoded fps of every rung (None until measured)
+        """
+        with self._lock:
+            mode, _, node_id = self._cameras.get(camera_id, (TRANSCODE_OFF, None, None))
+            viewers = self._viewers[camera_id] + self._hls_count(camera_id, time.monotonic())
+            publishing = camera_id in self._publishing
+        state = LADDER_OFF if mode == TRANSCODE_OFF else self._states.get(camera_id, LADDER_IDLE)
+        process = self.supervisor.status(self._key(camera_id)) if camera_id in self._running else None
+        progress = process['progress'] if process else None
+        speed = progress['speed'] if progress else None
+        return {
+            'id': camera_id,
+            'mode': mode,
+            'state': state,
+            'publishing': publishing,
+            'viewers': viewers,
+            'process': process['state'] if process else None,
+            'restarts': process['restarts'] if process else 0,
+            'cores': round(self._cost(process), 3) if process else None,
+            'cpu_percent': process['cpu_percent'] if process else None,
+            'speed': speed,
+            'saturated': speed is not None and speed < SATURATED_SPEED,
+            'master_url': f'{self._urls(node_id)[1]}/{camera_id}.m3u8' if state == LADDER_RUNNING else None,
+            'rungs': [{
+                'variant': rung.suffix,
+                'width': rung.width,
+                'height': rung.height,
+                'kbps': rung.kbps,
+                'target_fps': rung.fps,
+                'fps': round(rung.fps * speed, 2) if speed is not None else None,
+            } for rung in self.rungs],
+        }
+
+    def status(self):
+        """
+        Return the core budget and the ladders of all cameras that have one enabled
+
+        Returns:
+            dict: cores, capacity, used and estimated cores per ladder, counts
+                  by state, saturated camera ids and per-camera ladder states
+        """
+        ladders = [self.ladder(camera_id) for camera_id in sorted(self._cameras)]
+        counts = collections.Counter(ladder['state'] for ladder in ladders)
+        return {
+            'cores': available_cores(),
+            'capacity': self.capacity,
+            'used': round(sum(ladder['cores'] or 0 for ladder in ladders), 3),
+            'estimated_cores_per_ladder': round(self.estimated_cost, 3),
+            'ladders': {state: counts[state] for state in LADDER_STATES},
+            'saturated': [ladder['id'] for ladder in ladders if ladder['saturated']],
+            'cameras': ladders,
+        }
+
+
+def ladder_capacity():
+    """Cores bitrate ladders may use according to settings"""
+    if settings.TRANSCODE_CORES > 0:
+        return settings.TRANSCODE_CORES
+    return max(available_cores() - settings.TRANSCODE_RESERVED_CORES, 0.0)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_ladder_manager():
+    """
+    Return the process-wide LadderManager, starting it from settings
+
+    Returns:
+        LadderManager: The shared manager
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                manager = LadderManager(
+                    get_supervisor(),
+                    settings.RTMP_INGEST_URL,
+                    hls_base_url=settings.HLS_BASE_URL,
+                    capacity=ladder_capacity(),
+                    pixels_per_core=settings.TRANSCODE_PIXELS_PER_CORE,
+                    idle_timeout=settings.TRANSCODE_IDLE_TIMEOUT,
+                    interval=settings.TRANSCODE_INTERVAL,
+                    node_urls=get_node_registry().urls,
+                    hls_timeout=settings.TRANSCODE_HLS_VIEWER_TIMEOUT,
+                )
+                manager.start()
+                atexit.register(manager.stop)
+                _manager = manager
+    return _manager
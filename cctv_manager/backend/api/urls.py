@@ -1,15 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CameraViewSet, RTMPCallbackView
+from .views import CameraViewSet, MotionEventViewSet, RTMPCallbackView, RTMPNodeViewSet
 
 router = DefaultRouter()
 router.register(r'cameras', CameraViewSet)
+router.register(r'nodes', RTMPNodeViewSet)
+router.register(r'motion-events', MotionEventViewSet)
 
 urlpatterns = [
+    # Without the trailing slash the router would add, as befits a file name
+    path('cameras/<int:pk>/snapshot.jpg', CameraViewSet.as_view({'get': 'snapshot'}), name='camera-snapshot'),
     path('', include(router.urls)),
-    path('stream/on_connect', RTMPCallbackView.as_view({'post': 'on_connect'})),
-    path('stream/on_publish', RTMPCallbackView.as_view({'post': 'on_publish'})),
-    path('stream/on_publish_done', RTMPCallbackView.as_view({'post': 'on_publish_done'})),
-    path('stream/on_play', RTMPCallbackView.as_view({'post': 'on_play'})),
-    path('stream/on_done', RTMPCallbackView.as_view({'post': 'on_done'})),
+    path('stream/on_connect', RTMPCallbackView.as_view({'get': 'on_connect', 'post': 'on_connect'}), name='stream-on-connect'),
+    path('stream/on_publish', RTMPCallbackView.as_view({'get': 'on_publish', 'post': 'on_publish'}), name='stream-on-publish'),
+    path('stream/on_publish_done', RTMPCallbackView.as_view({'get': 'on_publish_done', 'post': 'on_publish_done'}), name='stream-on-publish-done'),
+    path('stream/on_play', RTMPCallbackView.as_view({'get': 'on_play', 'post': 'on_play'}), name='stream-on-play'),
+    path('stream/on_done', RTMPCallbackView.as_view({'get': 'on_done', 'post': 'on_done'}), name='stream-on-done'),
+    path('stream/on_hls', RTMPCallbackView.as_view({'get': 'on_hls', 'post': 'on_hls'}), name='stream-on-hls'),
 ] 
\ No newline at end of file
@@ -1,14 +1,64 @@
-import subprocess
+import collections
 import logging
 import os
-import signal
 from django.conf import settings
+from django.utils import timezone
+from .cache import invalidate_cameras
+from .events import publish_cameras
+from .ingest import build_ffmpeg_args, get_supervisor
+from .metrics import timed_operation
+from .models import Camera
+from .nodes import assign_nodes, get_node_registry, place, stream_hls_url, stream_ingest_url
+from .llhls import get_low_latency
+from .motion import get_motion_detector
+from .ondemand import get_on_demand
+from .transcode import get_ladder_manager
 
 logger = logging.getLogger(__name__)
 
-# Store running ffmpeg processes
-ffmpeg_processes = {}
 
+def start_ingest(camera):
+    """
+    Start (or replace) the supervised ffmpeg relay for a pull-mode camera
+
+    Cameras without a source_url push to nginx-rtmp themselves, so
+    nothing is launched for them; on-demand cameras are started by
+    api.ondemand when someone watches them.
+
+    Args:
+        camera: Camera model instance
+
+    Returns:
+        dict: Supervisor status of the process, or None for push cameras
+    """
+    if not camera.source_url or camera.on_demand:
+        return None
+    return get_supervisor().spawn(camera.id, ingest_args(camera))
+
+
+def ingest_args(camera):
+    """ffmpeg arguments relaying a pull-mode camera into the RTMP server"""
+    target_url = f"{stream_ingest_url(camera)}?key={camera.stream_key}"
+    return build_ffmpeg_args(camera.source_url, target_url, on_demand=camera.on_demand)
+
+
+def stop_ingest(camera):
+    """
+    Stop the supervised ffmpeg relay for a camera, if there is one
+
+    Args:
+        camera: Camera model instance
+
+    Returns:
+        bool: True if a relay was running
+    """
+    supervisor = get_supervisor()
+    if not supervisor.is_running(camera.id):
+        return False
+    return supervisor.stop_process(camera.id)
+
+
+@timed_operation('start_stream')
 def start_stream(camera):
     """
     Set up HLS streaming for a camera's RTMP stream
@@ -25,13 +75,18 @@ def start_stream(camera):
         os.makedirs(hls_path, exist_ok=True)
         
         # Set HLS URL for frontend to access
-        # This should match the URL exposed by the RTMP server's HLS output
-        camera.hls_url = f"{settings.HLS_BASE_URL}/{camera.id}/index.m3u8"
+        # This should match the URL exposed by the camera's RTMP node
+        assign_nodes([camera])
+        camera.hls_url = stream_hls_url(camera)
         camera.active = True
         camera.save()
         
+        process = start_ingest(camera)
+        
         logger.info(f"Stream setup for camera {camera.id} - RTMP URL: {camera.rtmp_url}")
         logger.info(f"HLS URL set to: {camera.hls_url}")
+        if process:
+            logger.info(f"Ingest started for camera {camera.id} from {camera.source_url}")
         
         return True
         
@@ -42,6 +97,7 @@ def start_stream(camera):
         return False
 
 
+@timed_operation('stop_stream')
 def stop_stream(camera):
     """
     Stop streaming for a camera
@@ -53,6 +109,8 @@ def stop_stream(camera):
         bool: True if stream stopped successfully, False otherwise
     """
     try:
+        stop_ingest(camera)
+        
         # Update camera status
         camera.active = False
         camera.save()
@@ -65,6 +123,7 @@ def stop_stream(camera):
         return False
 
 
+@timed_operation('restart_stream')
 def restart_stream(camera):
     """
     Restart stream for a camera
@@ -75,21 +134,211 @@ def restart_stream(camera):
     Returns:
         bool: True if stream restarted successfully, False otherwise
     """
+    supervisor = get_supervisor()
+    if camera.source_url and supervisor.is_running(camera.id):
+        # Keep the camera active and bounce only the relay process
+        return supervisor.restart_process(camera.id)
     stop_stream(camera)
     return start_stream(camera)
 
 
+@timed_operation('start_streams')
+def start_streams(cameras):
+    """
+    Set up HLS streaming for many cameras in one batch
+    
+    Equivalent to calling start_stream() for each camera, but the rows are
+    written with a single bulk update and the relays of pull-mode cameras
+    are handed to the supervisor in one call. Running relays are replaced.
+    
+    Args:
+        cameras: List of Camera model instances
+    
+    Returns:
+        dict: Mapping of camera id to True if the stream was set up
+    """
+    now = timezone.now()
+    placed = assign_nodes(cameras)
+    get_ladder_manager().update_many(placed)
+    get_low_latency().update_many(placed)
+    get_motion_detector().update_many(placed)
+    for camera in cameras:
+        os.makedirs(os.path.join(settings.HLS_ROOT, str(camera.id)), exist_ok=True)
+        camera.hls_url = stream_hls_url(camera)
+        camera.active = True
+        camera.updated_at = now
+    Camera.objects.bulk_update(cameras, ['hls_url', 'active', 'updated_at'], batch_size=500)
+    
+    get_on_demand().update_many(cameras)
+    pull_cameras = [camera for camera in cameras if camera.source_url and not camera.on_demand]
+    spawned = {}
+    if pull_cameras:
+        spawned = get_supervisor().spawn_many(
+            (camera.id, ingest_args(camera)) for camera in pull_cameras
+        )
+    
+    failed = [camera for camera in pull_cameras if isinstance(spawned.get(camera.id), Exception)]
+    for camera in failed:
+        logger.error(f"Failed to start ingest for camera {camera.id}: {spawned[camera.id]}")
+        camera.active = False
+    if failed:
+        Camera.objects.bulk_update(failed, ['active'], batch_size=500)
+    invalidate_cameras(camera.id for camera in cameras)
+    publish_cameras(cameras)
+    
+    logger.info(f"Stream setup for {len(cameras) - len(failed)} of {len(cameras)} cameras")
+    return {camera.id: camera.active for camera in cameras}
+
+
+@timed_operation('stop_streams')
+def stop_streams(cameras):
+    """
+    Stop streaming for many cameras in one batch
+    
+    Args:
+        cameras: List of Camera model instances
+    
+    Returns:
+        dict: Mapping of camera id to True if the stream was stopped
+    """
+    supervisor = get_supervisor()
+    running = [camera.id for camera in cameras if supervisor.is_running(camera.id)]
+    if running:
+        supervisor.stop_many(running)
+    
+    now = timezone.now()
+    for camera in cameras:
+        camera.active = False
+        camera.updated_at = now
+    Camera.objects.bulk_update(cameras, ['active', 'updated_at'], batch_size=500)
+    get_on_demand().update_many(cameras)
+    invalidate_cameras(camera.id for camera in cameras)
+    publish_cameras(cameras)
+    
+    logger.info(f"Stopped streams for {len(cameras)} cameras")
+    return {camera.id: True for camera in cameras}
+
+
+def restart_streams(cameras):
+    """
+    Restart streams for many cameras in one batch
+    
+    Starting a stream replaces any running relay, so this is start_streams().
+    
+    Args:
+        cameras: List of Camera model instances
+    
+    Returns:
+        dict: Mapping of camera id to True if the stream was restarted
+    """
+    return start_streams(cameras)
+
+
 def stop_all_streams():
     """Stop all running FFmpeg streams"""
-    for camera_id, process in list(ffmpeg_processes.items()):
-        if process.poll() is None:  # Process is still running
-            try:
-                process.terminate()
-                process.wait(timeout=5)
-            except (subprocess.TimeoutExpired, ProcessLookupError):
-                process.kill()
-            
-            logger.info(f"Stopped stream for camera {camera_id}")
-            
-    ffmpeg_processes.clear()
-    logger.info("All streams stopped") 
\ No newline at end of file
+    get_supervisor().shutdown()
+    logger.info("All streams stopped") 
+
+
+def move_cameras(cameras):
+    """
+    Save the node of cameras whose node changed and follow it with their streams
+
+    HLS URLs are rebuilt for the new node, running pull-mode relays are
+    restarted towards it and bitrate ladders follow.
+
+    Args:
+        cameras: Camera model instances with the new node_id set
+    """
+    now = timezone.now()
+    for camera in cameras:
+        if camera.hls_url:
+            camera.hls_url = stream_hls_url(camera)
+        camera.updated_at = now
+    Camera.objects.bulk_update(cameras, ['node', 'hls_url', 'updated_at'], batch_size=500)
+
+    supervisor = get_supervisor()
+    relays = [camera for camera in cameras if camera.source_url and supervisor.is_running(camera.id)]
+    if relays:
+        supervisor.spawn_many((camera.id, ingest_args(camera)) for camera in relays)
+    get_ladder_manager().update_many(cameras)
+    get_low_latency().update_many(cameras)
+    get_motion_detector().update_many(cameras)
+    invalidate_cameras(camera.id for camera in cameras)
+    publish_cameras(cameras)
+
+
+def refresh_hls_urls(batch_size=500):
+    """
+    Rebuild the HLS URLs of cameras that have one, e.g. after HLS_ORIGIN_BASE_URL changed
+
+    Returns:
+        list: Cameras whose hls_url changed
+    """
+    now = timezone.now()
+    changed = []
+    cameras = Camera.objects.exclude(hls_url__isnull=True).exclude(hls_url='')
+    for camera in cameras.only('id', 'node', 'hls_url', 'active', 'updated_at'):
+        hls_url = stream_hls_url(camera)
+        if camera.hls_url != hls_url:
+            camera.hls_url = hls_url
+            camera.updated_at = now
+            changed.append(camera)
+    Camera.objects.bulk_update(changed, ['hls_url', 'updated_at'], batch_size=batch_size)
+    invalidate_cameras(camera.id for camera in changed)
+    publish_cameras(changed)
+    return changed
+
+
+def rebalance_cameras(dry_run=False, batch_size=500):
+    """
+    Move every camera to the node the hash ring places it on
+
+    Run after nodes were added, removed, disabled or resized. A camera only
+    moves when the ring's preference for it changed or its node is full,
+    so about the capacity that joined or left is moved. Cameras go back to
+    the server in settings when no node is enabled. Cameras that push
+    their stream must then be pointed at their new node.
+
+    Args:
+        dry_run: Only report what would move
+        batch_size: Cameras moved per database round trip
+
+    Returns:
+        dict: Capacity and cameras of every node before and after, the
+              moves, and the active push cameras that must republish
+    """
+    nodes, ring, capacities = get_node_registry().snapshot(refresh=True)
+    ids = {node.name: node.id for node in nodes.values()}
+    current = dict(Camera.objects.order_by('id').values_list('id', 'node_id'))
+    placement = place(current, ring, capacities)
+    targets = {camera_id: ids.get(placement.get(camera_id)) for camera_id in current}
+    moving = [camera_id for camera_id, node_id in current.items() if targets[camera_id] != node_id]
+
+    moves = []
+    republish = []
+    for start in range(0, len(moving), batch_size):
+        cameras = list(Camera.objects.filter(id__in=moving[start:start + batch_size]).order_by('id'))
+        for camera in cameras:
+            moves.append({'id': camera.id, 'from': get_node_registry().name(camera.node_id),
+                          'to': get_node_registry().name(targets[camera.id])})
+            if camera.active and not camera.source_url:
+                republish.append(camera.id)
+            camera.node_id = targets[camera.id]
+        if not dry_run:
+            move_cameras(cameras)
+
+    before = collections.Counter(current.values())
+    after = collections.Counter(targets.values())
+    if moves and not dry_run:
+        logger.info(f"Rebalanced {len(moves)} of {len(current)} cameras over {ring.nodes} RTMP nodes")
+    return {
+        'dry_run': dry_run,
+        'cameras': len(current),
+        'nodes': {node.name: {'capacity': node.capacity, 'enabled': node.enabled,
+                              'before': before[node.id], 'after': after[node.id]}
+                  for node in nodes.values()},
+        'default': {'before': before[None], 'after': after[None]},
+        'moved': moves,
+        'republish': republish,
+    }
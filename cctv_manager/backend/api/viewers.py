@@ -0,0 +1,419 @@
+import atexit
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions and their periods in seconds, aligned to Unix time (UTC)
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 3600,
+}
+
+# Most periods one series request may span
+MAX_SERIES_POINTS = 10080
+
+# Key of the fleet-wide totals, kept like a camera's
+FLEET = None
+
+# Seconds between deletions of rollups past their retention
+PRUNE_INTERVAL = 3600
+
+
+def _datetime(seconds):
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+
+
+def _models():
+    from .models import ViewerHour, ViewerMinute
+    return {'minute': ViewerMinute, 'hour': ViewerHour}
+
+
+class ViewerTracker:
+    """
+    Track RTMP viewing sessions in memory and roll them up per minute and hour
+
+    A session is one client address playing one stream, from its first
+    on_play to the on_done of its last connection; several connections of
+    one address to one stream are one viewer. Streams count for the camera
+    they belong to, renditions (12_low) included.
+
+    Callbacks only change in-memory counts. Per camera and for the fleet
+    the tracker keeps the viewers watching now and, per minute, the most
+    watching at once, the sessions started and the seconds watched, which
+    are accrued whenever the count changes. Every flush_interval seconds a
+    background thread adds what accumulated to the ViewerMinute and
+    ViewerHour rows of those periods, reading and writing only the rows of
+    the periods that changed; nothing is recomputed from sessions.
+    """
+
+    def __init__(self, flush_interval=10.0, minute_retention=7, hour_retention=400, clock=time.time):
+        self.flush_interval = flush_interval
+        # Days rollups are kept per resolution, 0 forever
+        self.retention = {'minute': minute_retention, 'hour': hour_retention}
+        self.clock = clock
+        # (stream name, client address) -> [camera id, connections]
+        self._sessions = {}
+        # Camera id (FLEET for all) -> viewers watching now, and until when their watching is accrued
+        self._viewers = {}
+        self._accrued = {}
+        # (camera id, minute start) -> [peak viewers, sessions, watch seconds] not written yet
+        self._minutes = {}
+        self.plays = 0
+        self.dones = 0
+        self.unmatched = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_ms = None
+        self.last_error = None
+        self._pruned_at = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='viewer-rollups', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Write what accumulated and stop the flush thread; open sessions are accrued up to now"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            self.flush()
+        except DatabaseError as e:
+            logger.error(f"Failed to write viewer rollups: {e}")
+        finally:
+            close_old_connections()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            if self._stopped:
+                break
+            try:
+                self.flush()
+                self.prune()
+                self.last_error = None
+            except DatabaseError as e:
+                self.last_error = str(e)
+                logger.error(f"Failed to write viewer rollups: {e}")
+            finally:
+                close_old_connections()
+
+    # Sessions; called with the lock held
+
+    def _bucket(self, key, minute):
+        bucket = self._minutes.get((key, minute))
+        if bucket is None:
+            bucket = self._minutes[(key, minute)] = [0, 0, 0.0]
+        return bucket
+
+    def _accrue(self, key, now):
+        """Add the seconds watched since the last change of key's viewers to the minutes they fall in"""
+        viewers = self._viewers.get(key, 0)
+        start = self._accrued.get(key, now)
+        while start < now:
+            minute = int(start // 60) * 60
+            end = min(minute + 60, now)
+            bucket = self._bucket(key, minute)
+            bucket[0] = max(bucket[0], viewers)
+            bucket[2] += (end - start) * viewers
+            start = end
+        self._accrued[key] = now
+
+    def _change(self, key, delta, now):
+        self._accrue(key, now)
+        viewers = self._viewers.get(key, 0) + delta
+        bucket = self._bucket(key, int(now // 60) * 60)
+        if delta > 0:
+            bucket[0] = max(bucket[0], viewers)
+            bucket[1] += 1
+        if viewers:
+            self._viewers[key] = viewers
+        else:
+            # Nothing to accrue until someone watches again
+            self._viewers.pop(key, None)
+            self._accrued.pop(key, None)
+
+    def play(self, name, addr, camera_id):
+        """Count an on_play of a viewer; a new session unless the address already plays the stream"""
+        now = self.clock()
+        with self._lock:
+            self.plays += 1
+            session = self._sessions.get((name, addr))
+            if session is not None:
+                session[1] += 1
+                return
+            self._sessions[(name, addr)] = [camera_id, 1]
+            self._change(camera_id, 1, now)
+            self._change(FLEET, 1, now)
+
+    def done(self, name, addr):
+        """Count an on_done of a viewer; ends the session with the address's last connection"""
+        now = self.clock()
+        with self._lock:
+            self.dones += 1
+            session = self._sessions.get((name, addr))
+            if session is None:
+                # Played before a restart, or rejected
+                self.unmatched += 1
+                return
+            session[1] -= 1
+            if session[1]:
+                return
+            del self._sessions[(name, addr)]
+            self._change(session[0], -1, now)
+            self._change(FLEET, -1, now)
+
+    def viewers(self, camera_id=FLEET):
+        """Viewers watching a camera, or any camera, now"""
+        return self._viewers.get(camera_id, 0)
+
+    # Rollups
+
+    def _take(self):
+        """Accrue every open session up to now and return the minutes accumulated since the last call"""
+        now = self.clock()
+        with self._lock:
+            for key in list(self._viewers):
+                self._accrue(key, now)
+            minutes, self._minutes = self._minutes, {}
+        return minutes
+
+    def _restore(self, minutes):
+        """Put back minutes that could not be written, for the next flush"""
+        with self._lock:
+            for key, values in minutes.items():
+                bucket = self._minutes.get(key)
+                if bucket is None:
+                    self._minutes[key] = values
+                else:
+                    bucket[0] = max(bucket[0], values[0])
+                    bucket[1] += values[1]
+                    bucket[2] += values[2]
+
+    @staticmethod
+    def _roll_up(minutes, period):
+        """Combine minute buckets into buckets of a longer period"""
+        if period == 60:
+            return minutes
+        buckets = {}
+        for (key, minute), (peak, sessions, seconds) in minutes.items():
+            start = minute - minute % period
+            bucket = buckets.get((key, start))
+            if bucket is None:
+                buckets[(key, start)] = [peak, sessions, seconds]
+            else:
+                bucket[0] = max(bucket[0], peak)
+                bucket[1] += sessions
+                bucket[2] += seconds
+        return buckets
+
+    def flush(self):
+        """
+        Add the viewing accumulated since the last flush to the minute and hour rollups
+
+        Returns:
+            int: Rows created or updated
+        """
+        from .models import Camera
+
+        minutes = self._take()
+        if not minutes:
+            return 0
+        started = time.perf_counter()
+        ids = {key for key, _ in minutes if key is not FLEET}
+        try:
+            # Cameras deleted meanwhile have no rows to add to
+            cameras = set(Camera.objects.filter(id__in=ids).values_list('id', flat=True)) if ids else set()
+            buckets = {key: values for key, values in minutes.items() if key[0] is FLEET or key[0] in cameras}
+            written = 0
+            with transaction.atomic():
+                for resolution, model in _models().items():
+                    written += self._merge(model, self._roll_up(buckets, RESOLUTIONS[resolution]))
+        except DatabaseError:
+            self._restore(minutes)
+            raise
+        self.flushes += 1
+        self.rows_written += written
+        self.flush_ms = round((time.perf_counter() - started) * 1000, 3)
+        return written
+
+    @staticmethod
+    def _merge(model, buckets):
+        """Add buckets to the rows of their periods, creating the missing ones"""
+        starts = {start for _, start in buckets}
+        current = model.objects.filter(start__in=[_datetime(start) for start in starts]).values_list(
+            'camera_id', 'start', 'peak_viewers', 'sessions', 'watch_seconds')
+        existing = {(camera_id, int(start.timestamp())): values for camera_id, start, *values in current}
+        rows = []
+        fleet = []
+        for (key, start), (peak, sessions, seconds) in buckets.items():
+            values = existing.get((key, start))
+            if values is not None:
+                peak = max(peak, values[0])
+                sessions += values[1]
+                seconds += values[2]
+            row = model(camera_id=key, start=_datetime(start), peak_viewers=peak, sessions=sessions,
+                        watch_seconds=seconds)
+            if key is not FLEET:
+                rows.append(row)
+            elif values is None:
+                fleet.append(row)
+            else:
+                model.objects.filter(camera__isnull=True, start=row.start).update(
+                    peak_viewers=peak, sessions=sessions, watch_seconds=seconds)
+        # One upsert instead of bulk_update(), whose CASE expressions take far longer to build
+        # than to run; the fleet's rows are unique by a partial index it cannot target
+        if rows:
+            model.objects.bulk_create(rows, update_conflicts=True, unique_fields=['camera', 'start'],
+                                      update_fields=['peak_viewers', 'sessions', 'watch_seconds'])
+        if fleet:
+            model.objects.bulk_create(fleet)
+        return len(buckets)
+
+    def prune(self):
+        """Delete rollups past their retention, at most every PRUNE_INTERVAL seconds"""
+        now = self.clock()
+        if now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        for resolution, model in _models().items():
+            days = self.retention[resolution]
+            if days:
+                deleted, _ = model.objects.filter(start__lt=_datetime(now - days * 86400)).delete()
+                if deleted:
+                    logger.info(f"Deleted {deleted} per-{resolution} viewer rollups older than {days} days")
+
+    def pending(self, camera_id, resolution):
+        """
+        Return the viewing of a camera, or the fleet, not written to the rollups yet
+
+        Returns:
+            dict: Period start (Unix time) -> [peak viewers, sessions, watch seconds]
+        """
+        now = self.clock()
+        with self._lock:
+            if camera_id in self._viewers:
+                self._accrue(camera_id, now)
+            minutes = {key: list(values) for key, values in self._minutes.items() if key[0] == camera_id}
+        return {start: values for (_, start), values in self._roll_up(minutes, RESOLUTIONS[resolution]).items()}
+
+    def series(self, camera_id, resolution, since, until):
+        """
+        Return the viewing of a camera, or the fleet, per period
+
+        Args:
+            camera_id: Camera id, or FLEET for all cameras
+            resolution: 'minute' or 'hour'
+            since: Aware datetime; periods it falls in are included
+            until: Aware datetime; periods starting at or after it are not
+
+        Returns:
+            list: One dict per period, oldest first, with zeros for periods
+                  nobody watched in: start, peak and average viewers,
+                  sessions started and seconds watched
+
+        Raises:
+            ValueError: If the range is empty or spans more than MAX_SERIES_POINTS periods
+        """
+        period = RESOLUTIONS[resolution]
+        first = int(since.timestamp()) // period * period
+        end = until.timestamp()
+        if end <= first:
+            raise ValueError('until must be after since')
+        if (end - first) / period > MAX_SERIES_POINTS:
+            raise ValueError(f'At most {MAX_SERIES_POINTS} {resolution}s per request')
+
+        queryset = _models()[resolution].objects.filter(start__gte=_datetime(first), start__lt=until)
+        if camera_id is FLEET:
+            queryset = queryset.filter(camera__isnull=True)
+        else:
+            queryset = queryset.filter(camera_id=camera_id)
+        buckets = {int(start.timestamp()): [peak, sessions, seconds] for start, peak, sessions, seconds
+                   in queryset.values_list('start', 'peak_viewers', 'sessions', 'watch_seconds')}
+        for start, (peak, sessions, seconds) in self.pending(camera_id, resolution).items():
+            bucket = buckets.setdefault(start, [0, 0, 0.0])
+            bucket[0] = max(bucket[0], peak)
+            bucket[1] += sessions
+            bucket[2] += seconds
+
+        points = []
+        start = first
+        while start < end:
+            peak, sessions, seconds = buckets.get(start, (0, 0, 0.0))
+            points.append({
+                'start': _datetime(start),
+                'peak_viewers': peak,
+                'average_viewers': round(seconds / period, 3),
+                'sessions': sessions,
+                'watch_seconds': round(seconds, 1),
+            })
+            start += period
+        return points
+
+    def status(self):
+        """
+        Return the open sessions and the state of the rollup writer
+
+        Returns:
+            dict: Viewers and sessions now, the cameras watched most, callbacks
+                  counted, on_done callbacks without a session, flushes and rows
+                  written, the duration of the last flush and its error
+        """
+        with self._lock:
+            cameras = sorted(((camera_id, viewers) for camera_id, viewers in self._viewers.items()
+                              if camera_id is not FLEET), key=lambda item: (-item[1], item[0]))
+            pending = len(self._minutes)
+        return {
+            'viewers': self.viewers(FLEET),
+            'sessions': len(self._sessions),
+            'cameras_watched': len(cameras),
+            'top_cameras': [{'id': camera_id, 'viewers': viewers} for camera_id, viewers in cameras[:10]],
+            'plays': self.plays,
+            'dones': self.dones,
+            'unmatched_dones': self.unmatched,
+            'flush_interval': self.flush_interval,
+            'pending_buckets': pending,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'last_flush_ms': self.flush_ms,
+            'last_error': self.last_error,
+        }
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_viewer_tracker():
+    """
+    Return the process-wide ViewerTracker, starting it from settings
+
+    Returns:
+        ViewerTracker: The shared tracker
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                tracker = ViewerTracker(
+                    flush_interval=settings.VIEWER_FLUSH_INTERVAL,
+                    minute_retention=settings.VIEWER_MINUTE_RETENTION,
+                    hour_retention=settings.VIEWER_HOUR_RETENTION,
+                )
+                tracker.start()
+                atexit.register(tracker.stop)
+                _tracker = tracker
+    return _tracker
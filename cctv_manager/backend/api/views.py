@@ -1,16 +1,311 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
-from drf_yasg.utils import swagger_auto_schema
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from drf_yasg.utils import no_body, swagger_auto_schema
 from drf_yasg import openapi
-from .models import Camera
-from .serializers import CameraSerializer
-from .utils import start_stream, stop_stream, restart_stream
+from .models import Camera, MotionEvent, RTMPNode, generate_stream_key
+from .nodes import assign_nodes
+from .ondemand import get_on_demand
+from .pagination import MotionEventPagination
+from .permissions import CanSignStreamTokens
+from .serializers import (
+    BulkIdsSerializer, BulkProbeSerializer, CameraSerializer, MotionEventSerializer, RebalanceSerializer,
+    RTMPNodeSerializer, requested_fields,
+)
+from .cache import etag_matches, get_response_cache, invalidate_cameras, CachedResponse
+from .callbacks import handle_callback
+from .dvr import get_recorder
+from .export import (
+    CONTAINER_MP4, CONTAINER_TS, EXPORT_CONTAINERS, build_clip, clip_response, remux_available,
+)
+from .events import get_event_log, publish_cameras
+from .hls import get_hls_watcher
+from .ingest import get_supervisor
+from .llhls import get_low_latency
+from .metrics import CALLBACK_ERRORS
+from .motion import get_motion_detector
+from .origin import get_origin_cache
+from .probe import MODE_HANDSHAKE, PROBE_MODES, STATUS_OK, get_prober
+from .snapshot import SNAPSHOT_WIDTHS, SnapshotError, get_snapshot_service
+from .stats import get_stats_collector
+from .streamkeys import TOKEN_ACTIONS, get_stream_keys, make_token
+from .transcode import get_ladder_manager
+from .viewers import FLEET, RESOLUTIONS, get_viewer_tracker
+from .utils import (
+    start_stream, stop_stream, restart_stream,
+    start_streams, stop_streams, restart_streams,
+    move_cameras, rebalance_cameras,
+)
+import base64
+import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+BULK_RESULT_EXAMPLE = {
+    "succeeded": 1,
+    "failed": 1,
+    "results": [
+        {"index": 0, "id": 1, "status": "ok"},
+        {"index": 1, "id": 99, "status": "not_found"}
+    ]
+}
+
+
+def is_camera_id(value):
+    """Whether a bulk item's id is an integer (JSON true and false are not)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def bulk_response(results):
+    """Build the response of a bulk operation from its per-item results"""
+    failed = sum(1 for result in results if result['status'] not in ('ok', 'created', 'updated', 'deleted'))
+    return Response({
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'results': results,
+    }, status=status.HTTP_200_OK)
+
+
+HEALTH_EXAMPLE = {
+    "id": 1,
+    "status": "live",
+    "playlists": {
+        "": {
+            "status": "live",
+            "last_segment_age": 1.2,
+            "target_duration": 3.0,
+            "media_sequence": 118,
+            "last_sequence": 137,
+            "segment_duration": 3.0,
+            "duration_jitter": 0.04,
+            "bitrate": 1843200,
+            "discontinuities": 0,
+            "restarts": 0,
+            "updated_at": 1744124460.5
+        }
+    }
+}
+
+
+PROBE_EXAMPLE = {
+    "status": "ok",
+    "mode": "connect",
+    "error": None,
+    "handshake_ms": 1.8,
+    "connect_ms": 2.4,
+    "total_ms": 5.1,
+    "probed_at": 1744124460.5,
+    "cached": False,
+    "url": "rtmp://192.168.1.100:1935/live/stream1"
+}
+
+
+RECORDINGS_EXAMPLE = {
+    "id": 1,
+    "recording": True,
+    "days": [
+        {
+            "date": "2025-04-08",
+            "start": "2025-04-08T00:00:01.200000Z",
+            "end": "2025-04-08T23:59:59.100000Z",
+            "segments": 28790,
+            "bytes": 19805306880
+        }
+    ]
+}
+
+
+SEEK_EXAMPLE = {
+    "requested": "2025-04-08T14:32:05Z",
+    "start": "2025-04-08T14:32:03.900000Z",
+    "duration": 3.0,
+    "offset": 1.1,
+    "gap": False,
+    "discontinuity": False,
+    "file": "1/2025-04-08/14.ts",
+    "byte_offset": 714223616,
+    "byte_length": 688720
+}
+
+
+METRICS_STREAM_EXAMPLE = {
+    "name": "1",
+    "application": "live",
+    "uptime": 86120312,
+    "bw_in": 2131496,
+    "bw_out": 4262992,
+    "bw_video": 2067616,
+    "bw_audio": 63880,
+    "bytes_in": 22911063211,
+    "bytes_out": 45701388043,
+    "publishing": True,
+    "active": True,
+    "clients": 2,
+    "publisher": "172.18.0.3",
+    "dropped": 12,
+    "avsync": -11,
+    "video": {"width": 1920, "height": 1080, "frame_rate": 25.0, "codec": "H264",
+              "profile": "High", "level": "4.0"},
+    "audio": {"codec": "AAC", "profile": "LC", "channels": 1, "sample_rate": 44100},
+    "last_seen": 1744124460.5
+}
+
+
+LADDER_EXAMPLE = {
+    "id": 1,
+    "mode": "viewers",
+    "state": "running",
+    "publishing": True,
+    "viewers": 3,
+    "process": "running",
+    "restarts": 0,
+    "cores": 1.046,
+    "cpu_percent": 104.6,
+    "speed": 0.998,
+    "saturated": False,
+    "master_url": "http://localhost:8080/hls/1.m3u8",
+    "rungs": [
+        {"variant": "_low", "width": 640, "height": 360, "kbps": 700, "target_fps": 15, "fps": 14.97},
+        {"variant": "_mid", "width": 842, "height": 480, "kbps": 1100, "target_fps": 20, "fps": 19.96},
+        {"variant": "_hi", "width": 1280, "height": 720, "kbps": 2200, "target_fps": 25, "fps": 24.95}
+    ]
+}
+
+
+ON_DEMAND_EXAMPLE = {
+    "id": 1,
+    "on_demand": True,
+    "state": "running",
+    "started_by": "viewer",
+    "viewers": {"rtmp": 0, "hls": 2},
+    "idle_seconds": None,
+    "preroll_seconds": None,
+    "savings": {
+        "enabled_seconds": 86400.0,
+        "running_seconds": 7560.0,
+        "duty_cycle": 0.088,
+        "cpu_seconds": 226.8,
+        "bytes": 1935360000,
+        "always_on_cpu_seconds": 2592.0,
+        "cpu_seconds_saved": 2365.2,
+        "always_on_bytes": 22118400000,
+        "bytes_saved": 20183040000
+    }
+}
+
+LOW_LATENCY_EXAMPLE = {
+    "id": 1,
+    "state": "running",
+    "playlist_url": "/llhls/1/index.m3u8",
+    "process": "running",
+    "restarts": 0,
+    "stream": {
+        "segments": 6,
+        "last_msn": 1792345678,
+        "parts": 27,
+        "bytes": 3145728,
+        "target_duration": 2,
+        "part_target": 0.5,
+        "last_part_age": 0.213
+    }
+}
+
+MOTION_EXAMPLE = {
+    "id": 1,
+    "state": "running",
+    "process": "running",
+    "restarts": 0,
+    "frames": 18230,
+    "area": 0.0213,
+    "event": {
+        "id": 4711,
+        "started_at": "2025-06-01T10:15:02.400000Z",
+        "peak_area": 0.0452,
+        "box": [0.412, 0.3, 0.122, 0.417],
+        "frames": 9
+    }
+}
+
+MOTION_EVENT_EXAMPLE = {
+    "id": 4711,
+    "camera": 1,
+    "started_at": "2025-06-01T10:15:02.400000Z",
+    "ended_at": "2025-06-01T10:15:09.800000Z",
+    "duration": 7.4,
+    "peak_area": 0.0452,
+    "box": [0.412, 0.3, 0.122, 0.417],
+    "frames": 31
+}
+
+VIEWERS_EXAMPLE = {
+    "id": 1,
+    "resolution": "minute",
+    "since": "2025-06-01T21:00:00Z",
+    "until": "2025-06-01T21:02:00Z",
+    "viewers": 3,
+    "series": [
+        {"start": "2025-06-01T21:00:00Z", "peak_viewers": 4, "average_viewers": 3.5, "sessions": 2,
+         "watch_seconds": 210.0},
+        {"start": "2025-06-01T21:01:00Z", "peak_viewers": 4, "average_viewers": 3.2, "sessions": 0,
+         "watch_seconds": 192.0}
+    ]
+}
+
+VIEWER_SERIES_PARAMETERS = [
+    openapi.Parameter('resolution', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(RESOLUTIONS),
+                      description="Length of each period: minute (default) or hour"),
+    openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                      description="Start of the series (default: an hour, or with resolution=hour a day, "
+                                  "before until)"),
+    openapi.Parameter('until', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                      description="End of the series (default: now)"),
+]
+
+
+REBALANCE_EXAMPLE = {
+    "dry_run": False,
+    "cameras": 1200,
+    "nodes": {
+        "rtmp-1": {"capacity": 500, "enabled": True, "before": 600, "after": 412},
+        "rtmp-2": {"capacity": 500, "enabled": True, "before": 600, "after": 396},
+        "rtmp-3": {"capacity": 500, "enabled": True, "before": 0, "after": 392}
+    },
+    "default": {"before": 0, "after": 0},
+    "moved": [{"id": 7, "from": "rtmp-1", "to": "rtmp-3"}],
+    "republish": [7]
+}
+
+
+# Model columns needed to render each computed serializer field
+COMPUTED_FIELD_COLUMNS = {
+    'rtmp_url': ['ip_address', 'rtmp_port', 'app_name', 'stream_id'],
+    'node': ['node'],
+    'll_hls_url': ['latency'],
+}
+
+LIST_FILTER_PARAMETERS = [
+    openapi.Parameter('active', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                      description="Only cameras whose stream is (in)active"),
+    openapi.Parameter('site', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Only cameras of this site"),
+    openapi.Parameter('updated_since', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      format=openapi.FORMAT_DATETIME,
+                      description="Only cameras updated after this ISO 8601 timestamp"),
+    openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Comma-separated list of fields to return, e.g. id,name,active"),
+]
+
+
 class CameraViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows cameras to be viewed or edited.
@@ -18,6 +313,179 @@ class CameraViewSet(viewsets.ModelViewSet):
     queryset = Camera.objects.all()
     serializer_class = CameraSerializer
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # The schema is generated without a request, see api.schema
+        if getattr(self, 'swagger_fake_view', False):
+            return queryset
+        params = self.request.query_params
+        
+        if self.action == 'list':
+            active = params.get('active')
+            if active is not None:
+                if active.lower() not in ('true', 'false', '1', '0'):
+                    raise ValidationError({'active': 'Expected true or false.'})
+                queryset = queryset.filter(active=active.lower() in ('true', '1'))
+            
+            site = params.get('site')
+            if site is not None:
+                queryset = queryset.filter(site=site)
+            
+            updated_since = params.get('updated_since')
+            if updated_since is not None:
+                try:
+                    since = parse_datetime(updated_since)
+                except ValueError:
+                    since = None
+                if since is None:
+                    raise ValidationError({'updated_since': 'Expected an ISO 8601 datetime.'})
+                if timezone.is_naive(since):
+                    since = timezone.make_aware(since, timezone.utc)
+                queryset = queryset.filter(updated_at__gt=since)
+        
+        if self.action in ('list', 'retrieve'):
+            fields = requested_fields(self.request)
+            if fields:
+                # Only load the columns the trimmed serializer will read
+                columns = {'id', 'updated_at'}
+                for name in fields:
+                    columns.update(COMPUTED_FIELD_COLUMNS.get(name, [name]))
+                queryset = queryset.only(*columns)
+        return queryset
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        # stream_key is write-only; whoever creates the camera gets it once
+        data = dict(serializer.data, stream_key=serializer.instance.stream_key)
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+    @swagger_auto_schema(manual_parameters=LIST_FILTER_PARAMETERS)
+    def list(self, request, *args, **kwargs):
+        # Taken before the query so no change can fall between the list and the cursor
+        cursor = get_event_log().cursor
+        return self._cached_response(
+            request, lambda: super(CameraViewSet, self).list(request, *args, **kwargs),
+            headers={'X-Events-Cursor': cursor},
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            camera_id = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except (KeyError, ValueError):
+            return super().retrieve(request, *args, **kwargs)
+        return self._cached_response(
+            request, lambda: super(CameraViewSet, self).retrieve(request, *args, **kwargs),
+            camera_id=camera_id,
+        )
+
+    def _cached_response(self, request, render, camera_id=None, headers=None):
+        """
+        Serve a read from the response cache, rendering it on a miss
+
+        Responses carry a strong ETag of the body; a matching If-None-Match
+        is answered with 304. Only JSON responses are cached, so the
+        browsable API always renders fresh.
+
+        Args:
+            request: The DRF request
+            render: Callable producing the uncached DRF Response
+            camera_id: Camera id for detail reads, None for lists
+            headers: Extra headers to store with the response
+
+        Returns:
+            HttpResponse: The cached, fresh or 304 response
+        """
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            return render()
+
+        cache = get_response_cache()
+        key = f'{request.accepted_media_type}:{request.get_full_path()}'
+        entry = cache.get(key, camera_id)
+        if entry is None:
+            # Read before querying; a change while rendering keeps the entry out
+            generation = cache.generation(camera_id)
+            response = render()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            body = renderer.render(response.data, request.accepted_media_type,
+                                   self.get_renderer_context())
+            content_type = request.accepted_media_type
+            if renderer.charset:
+                content_type = f'{content_type}; charset={renderer.charset}'
+            entry = CachedResponse(body, content_type, headers)
+            cache.set(key, entry, camera_id, generation)
+
+        if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), entry.etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(entry.body, content_type=entry.content_type)
+        response['ETag'] = entry.etag
+        response['Cache-Control'] = 'no-cache'
+        for name, value in entry.headers.items():
+            response[name] = value
+        return response
+
+    @swagger_auto_schema(
+        operation_description="Hit and miss counters of the camera response cache",
+        responses={
+            200: openapi.Response(
+                description="Response cache statistics",
+                examples={
+                    "application/json": {
+                        "backend": "LRUResponseCache",
+                        "entries": 12,
+                        "max_entries": 1024,
+                        "ttl": 30.0,
+                        "hits": 950,
+                        "misses": 50,
+                        "hit_ratio": 0.95,
+                        "evictions": 0,
+                        "invalidations": 7
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        """Hit and miss counters of the camera response cache"""
+        return Response(get_response_cache().stats(), status=status.HTTP_200_OK)
+
+    def _bulk_payloads(self, request):
+        """Validate that the request body is a non-empty list of bounded size"""
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return None, Response({'detail': 'Expected a non-empty list of cameras.'},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BULK_MAX_ITEMS:
+            return None, Response({'detail': f'At most {settings.BULK_MAX_ITEMS} cameras per request.'},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        return items, None
+    
+    def _bulk_cameras(self, request):
+        """Resolve the 'ids' of a bulk request to cameras, preserving request order"""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        found = Camera.objects.in_bulk(ids)
+        return ids, found
+    
+    def _bulk_stream_action(self, request, operation):
+        ids, found = self._bulk_cameras(request)
+        outcome = operation(list(found.values())) if found else {}
+        results = []
+        for index, camera_id in enumerate(ids):
+            if camera_id not in found:
+                results.append({'index': index, 'id': camera_id, 'status': 'not_found'})
+            elif outcome.get(camera_id):
+                results.append({'index': index, 'id': camera_id, 'status': 'ok'})
+            else:
+                results.append({'index': index, 'id': camera_id, 'status': 'failed'})
+        return bulk_response(results)
+    
     @swagger_auto_schema(
         operation_description="Start streaming from the camera's RTMP URL",
         responses={
@@ -92,117 +560,1315 @@ class CameraViewSet(viewsets.ModelViewSet):
             return Response({'status': 'stream restarted'}, status=status.HTTP_200_OK)
         return Response({'status': 'failed to restart stream'}, 
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @swagger_auto_schema(
+        operation_description="Get the state of the camera's supervised ingest process",
+        responses={
+            200: openapi.Response(
+                description="Ingest process status",
+                examples={
+                    "application/json": {
+                        "key": 1,
+                        "state": "running",
+                        "pid": 4242,
+                        "restarts": 0,
+                        "uptime": 120.5,
+                        "last_exit_code": None,
+                        "cpu_seconds": 3.1,
+                        "cpu_percent": 2.5,
+                        "rss_bytes": 31457280,
+                        "stderr_tail": []
+                    }
+                }
+            ),
+            404: "No ingest process for this camera"
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def ingest(self, request, pk=None):
+        """Get the state of the camera's supervised ingest process"""
+        camera = self.get_object()
+        process = get_supervisor().status(camera.id)
+        
+        if process is None:
+            return Response({'status': 'no ingest process'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(process, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Get the live health of the camera's HLS output, derived from the "
+                              "playlists nginx-rtmp writes",
+        responses={
+            200: openapi.Response(
+                description="HLS stream health",
+                examples={
+                    "application/json": HEALTH_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def health(self, request, pk=None):
+        """Get the live health of the camera's HLS output"""
+        camera = self.get_object()
+        return Response(get_hls_watcher().health(camera.id), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Get the HLS health of many cameras; defaults to all active cameras",
+        manual_parameters=[
+            openapi.Parameter('ids', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Comma-separated camera ids")
+        ],
+        responses={
+            200: openapi.Response(
+                description="HLS stream health keyed by camera id",
+                examples={
+                    "application/json": {"1": HEALTH_EXAMPLE}
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='bulk/health')
+    def bulk_health(self, request):
+        """Get the HLS health of many cameras"""
+        ids = self._query_ids(request)
+        return Response(get_hls_watcher().health_many(ids), status=status.HTTP_200_OK)
+
+    def _query_ids(self, request, required=False):
+        """Existing camera ids from the 'ids' query parameter, or all active cameras unless required"""
+        ids = request.query_params.get('ids')
+        if not ids and required:
+            raise ValidationError({'ids': 'Expected comma-separated camera ids.'})
+        if ids:
+            try:
+                ids = list(dict.fromkeys(int(camera_id) for camera_id in ids.split(',') if camera_id))
+            except ValueError:
+                raise ValidationError({'ids': 'Expected comma-separated camera ids.'})
+            if len(ids) > settings.BULK_MAX_ITEMS:
+                raise ValidationError({'ids': f'At most {settings.BULK_MAX_ITEMS} cameras per request.'})
+            return list(Camera.objects.filter(id__in=ids).order_by('id').values_list('id', flat=True))
+        return list(Camera.objects.filter(active=True).order_by('id').values_list('id', flat=True))
+
+    def _snapshot_width(self, request):
+        try:
+            width = int(request.query_params.get('width', settings.SNAPSHOT_WIDTH))
+        except ValueError:
+            width = None
+        if width not in SNAPSHOT_WIDTHS:
+            raise ValidationError({'width': f'Expected one of {", ".join(map(str, SNAPSHOT_WIDTHS))}.'})
+        return width
+
+    # Routed in api.urls: the router would append a slash to snapshot.jpg
+    @swagger_auto_schema(
+        operation_description="JPEG still of the newest keyframe of the camera's live stream. "
+                              "Each HLS segment is decoded at most once; revalidate with the ETag.",
+        manual_parameters=[
+            openapi.Parameter('width', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              enum=[*SNAPSHOT_WIDTHS],
+                              description="Scale to this width (0 keeps the source size)")
+        ],
+        responses={
+            200: "The JPEG",
+            304: "Unchanged since the ETag in If-None-Match",
+            404: "The camera has no live HLS output",
+            503: "The keyframe could not be decoded"
+        }
+    )
+    def snapshot(self, request, pk=None):
+        """JPEG still of the newest keyframe of the camera's live stream"""
+        camera = self.get_object()
+        width = self._snapshot_width(request)
+        try:
+            snapshot = get_snapshot_service().snapshot(camera.id, width)
+        except SnapshotError as e:
+            return Response({'detail': f'Snapshot failed: {e}'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if snapshot is None:
+            return Response({'detail': 'The camera has no live stream.'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), snapshot.etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(snapshot.jpeg, content_type='image/jpeg')
+        response['ETag'] = snapshot.etag
+        response['Cache-Control'] = 'no-cache'
+        response['X-Segment-Sequence'] = str(snapshot.sequence)
+        return response
+
+    @swagger_auto_schema(
+        operation_description="JPEG stills of many cameras in one response, base64-encoded. "
+                              "Stills whose ETag is listed in etags are reported unchanged, without the JPEG.",
+        manual_parameters=[
+            openapi.Parameter('ids', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                              description=f"Comma-separated camera ids, at most {settings.BULK_MAX_ITEMS}"),
+            openapi.Parameter('etags', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Comma-separated ETags of the stills the client already has"),
+            openapi.Parameter('width', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              enum=[*SNAPSHOT_WIDTHS],
+                              description="Scale to this width (0 keeps the source size)"),
+        ],
+        responses={
+            200: openapi.Response(
+                description="Snapshots keyed by camera id",
+                examples={
+                    "application/json": {
+                        "1": {"status": "ok", "sequence": 137, "captured_at": 1744124460.5,
+                              "etag": "\"1-137-480\"", "jpeg": "/9j/4AAQSkZJRg..."},
+                        "2": {"status": "unchanged", "sequence": 140, "etag": "\"2-140-480\""},
+                        "3": {"status": "missing"},
+                        "4": {"status": "failed", "error": "ffmpeg exited with 1"}
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='bulk/snapshots')
+    def bulk_snapshots(self, request):
+        """JPEG stills of many cameras in one response"""
+        ids = self._query_ids(request, required=True)
+        width = self._snapshot_width(request)
+        etags = request.query_params.get('etags')
+        results = {}
+        for camera_id, snapshot in get_snapshot_service().snapshot_many(ids, width).items():
+            if snapshot is None:
+                results[camera_id] = {'status': 'missing'}
+            elif isinstance(snapshot, SnapshotError):
+                results[camera_id] = {'status': 'failed', 'error': str(snapshot)}
+            elif etag_matches(etags, snapshot.etag):
+                results[camera_id] = {'status': 'unchanged', 'sequence': snapshot.sequence, 'etag': snapshot.etag}
+            else:
+                results[camera_id] = {
+                    'status': 'ok',
+                    'sequence': snapshot.sequence,
+                    'captured_at': snapshot.captured_at,
+                    'etag': snapshot.etag,
+                    'jpeg': base64.b64encode(snapshot.jpeg).decode('ascii'),
+                }
+        return Response(results, status=status.HTTP_200_OK)
+
+    def _query_datetime(self, request, name, default=None):
+        """Parse an ISO 8601 query parameter, required unless a default is given; naive values are UTC"""
+        if default is not None and name not in request.query_params:
+            return default
+        try:
+            value = parse_datetime(request.query_params.get(name, ''))
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValidationError({name: 'Expected an ISO 8601 datetime.'})
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.utc)
+        return value
+
+    def _set_recording(self, camera, recording):
+        camera.recording = recording
+        camera.save(update_fields=['recording', 'updated_at'])
+        recorder = get_recorder()
+        if recording:
+            recorder.start_recording(camera.id)
+        else:
+            recorder.stop_recording(camera.id)
+
+    @swagger_auto_schema(
+        operation_description="Start archiving the camera's HLS segments. Footage is kept in "
+                              "per-day directories until RECORDING_RETENTION_DAYS expires it.",
+        responses={
+            200: openapi.Response(
+                description="Recording started",
+                examples={
+                    "application/json": {
+                        "status": "recording started"
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['post'], url_path='recording/start')
+    def start_recording(self, request, pk=None):
+        """Start archiving the camera's HLS segments"""
+        camera = self.get_object()
+        self._set_recording(camera, True)
+        return Response({'status': 'recording started'}, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Stop archiving the camera's HLS segments; recorded footage is kept",
+        responses={
+            200: openapi.Response(
+                description="Recording stopped",
+                examples={
+                    "application/json": {
+                        "status": "recording stopped"
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['post'], url_path='recording/stop')
+    def stop_recording(self, request, pk=None):
+        """Stop archiving the camera's HLS segments"""
+        camera = self.get_object()
+        self._set_recording(camera, False)
+        return Response({'status': 'recording stopped'}, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Replace the camera's stream key. The previous key keeps working "
+                              "for STREAM_KEY_GRACE seconds so publishers can be reconfigured; "
+                              "tokens signed with it expire with it. Needs staff: the new key "
+                              "lets its holder publish.",
+        request_body=no_body,
+        responses={
+            200: openapi.Response(
+                description="New stream key",
+                examples={
+                    "application/json": {
+                        "id": 1,
+                        "stream_key": "3q2Ov3VJb9mXQ0c1Yk8pZr7nTgWfLh2a",
+                        "previous_key_valid_until": "2025-04-08T12:05:00Z"
+                    }
+                }
+            ),
+            403: "Not staff"
+        }
+    )
+    @action(detail=True, methods=['post'], url_path='stream-key/rotate', permission_classes=[IsAdminUser])
+    def rotate_stream_key(self, request, pk=None):
+        """Replace the camera's stream key"""
+        camera = self.get_object()
+        camera.previous_stream_key = camera.stream_key
+        camera.stream_key = generate_stream_key()
+        camera.stream_key_rotated_at = timezone.now()
+        # post_save updates the stream key index
+        camera.save(update_fields=['stream_key', 'previous_stream_key', 'stream_key_rotated_at', 'updated_at'])
+        valid_until = camera.stream_key_rotated_at + datetime.timedelta(seconds=settings.STREAM_KEY_GRACE)
+        return Response({
+            'id': camera.id,
+            'stream_key': camera.stream_key,
+            'previous_key_valid_until': valid_until,
+        }, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Sign a token that lets an RTMP client publish or play the camera's "
+                              "stream until it expires; append the query to the stream URL. Needs an "
+                              "authenticated user, and staff for publish tokens. To have an on-demand "
+                              "relay running when the player starts, POST warm/ as well.",
+        request_body=openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+            'action': openapi.Schema(type=openapi.TYPE_STRING, enum=[*TOKEN_ACTIONS],
+                                     description="What the token allows (default: play)"),
+            'ttl': openapi.Schema(type=openapi.TYPE_INTEGER,
+                                  description="Lifetime in seconds (default: STREAM_TOKEN_TTL)"),
+        }),
+        responses={
+            200: openapi.Response(
+                description="Signed token",
+                examples={
+                    "application/json": {
+                        "id": 1,
+                        "action": "play",
+                        "token": "1744117200-kq3Z2n0y5m8V1c7xR4tW9bLs",
+                        "expires": "2025-04-08T13:00:00Z",
+                        "query": "token=1744117200-kq3Z2n0y5m8V1c7xR4tW9bLs"
+                    }
+                }
+            ),
+            400: "Invalid action or ttl",
+            403: "Not authenticated, or not staff for a publish token"
+        }
+    )
+    @action(detail=True, methods=['post'], url_path='stream-token', permission_classes=[CanSignStreamTokens])
+    def stream_token(self, request, pk=None):
+        """Sign a publish or play token for the camera's stream"""
+        camera = self.get_object()
+        token_action = request.data.get('action', 'play')
+        if token_action not in TOKEN_ACTIONS:
+            raise ValidationError({'action': f'Expected one of {", ".join(TOKEN_ACTIONS)}.'})
+        try:
+            ttl = int(request.data.get('ttl', settings.STREAM_TOKEN_TTL))
+        except (TypeError, ValueError):
+            raise ValidationError({'ttl': 'Expected a number of seconds.'})
+        if not 0 < ttl <= 7 * 86400:
+            raise ValidationError({'ttl': 'Expected between 1 second and 7 days.'})
+        token, expires = make_token(camera.stream_key, token_action, camera.id, ttl)
+        return Response({
+            'id': camera.id,
+            'action': token_action,
+            'token': token,
+            'expires': datetime.datetime.fromtimestamp(expires, tz=datetime.timezone.utc),
+            'query': f'token={token}',
+        }, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="List the days recorded for the camera",
+        responses={
+            200: openapi.Response(
+                description="Recorded days",
+                examples={
+                    "application/json": RECORDINGS_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def recordings(self, request, pk=None):
+        """List the days recorded for the camera"""
+        camera = self.get_object()
+        return Response(get_recorder().summary(camera.id), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Find the recorded segment covering a point in time, or the next "
+                              "recorded segment if the camera was not recording then",
+        manual_parameters=[
+            openapi.Parameter('at', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                              description="ISO 8601 timestamp, e.g. 2025-04-08T14:32:05Z")
+        ],
+        responses={
+            200: openapi.Response(
+                description="Segment location",
+                examples={
+                    "application/json": SEEK_EXAMPLE
+                }
+            ),
+            404: "Nothing recorded at or after that time"
+        }
+    )
+    @action(detail=True, methods=['get'], url_path='recordings/seek')
+    def seek(self, request, pk=None):
+        """Find the recorded segment covering a point in time"""
+        camera = self.get_object()
+        at = self._query_datetime(request, 'at')
+        result = get_recorder().seek(camera.id, at)
+        if result is None:
+            return Response({'detail': 'Nothing recorded at or after that time.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(result, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Download recorded footage between two times as one file. Whole "
+                              "segments are copied as recorded; only the first and last are trimmed, "
+                              "at keyframe and packet boundaries. TS downloads support Range requests.",
+        manual_parameters=[
+            openapi.Parameter('start', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                              description="ISO 8601 start time"),
+            openapi.Parameter('end', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                              description="ISO 8601 end time"),
+            openapi.Parameter('container', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              enum=[*EXPORT_CONTAINERS],
+                              description="ts (default, concatenated segments) or mp4 (remuxed "
+                                          "without re-encoding)"),
+        ],
+        responses={
+            200: "The clip",
+            206: "Part of the clip (Range request)",
+            404: "Nothing recorded in that range",
+            416: "Range not satisfiable",
+            503: "ffmpeg is not available for MP4 exports"
+        }
+    )
+    @action(detail=True, methods=['get'], url_path='recordings/export')
+    def export(self, request, pk=None):
+        """Download recorded footage between two times as one file"""
+        camera = self.get_object()
+        start = self._query_datetime(request, 'start')
+        end = self._query_datetime(request, 'end')
+        container = request.query_params.get('container', CONTAINER_TS)
+        if container not in EXPORT_CONTAINERS:
+            raise ValidationError({'container': f'Expected one of {", ".join(EXPORT_CONTAINERS)}.'})
+        if end <= start:
+            raise ValidationError({'end': 'Must be after start.'})
+        if (end - start).total_seconds() > settings.CLIP_EXPORT_MAX_HOURS * 3600:
+            raise ValidationError({'end': f'Clips are limited to {settings.CLIP_EXPORT_MAX_HOURS:g} hours.'})
+
+        if container == CONTAINER_MP4 and not remux_available():
+            return Response({'detail': 'ffmpeg is not available for MP4 exports.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        clip = build_clip(get_recorder(), camera.id, start, end)
+        if not clip.size:
+            return Response({'detail': 'Nothing recorded in that range.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return clip_response(request, clip, container)
+
+    @swagger_auto_schema(
+        operation_description="Bandwidth, clients, dropped frames and codecs of the camera's "
+                              "nginx-rtmp streams, with a rolling time series",
+        manual_parameters=[
+            openapi.Parameter('window', openapi.IN_QUERY, type=openapi.TYPE_NUMBER,
+                              description="Only include series samples from the last this many seconds")
+        ],
+        responses={
+            200: openapi.Response(
+                description="Stream metrics keyed by 'application/name'",
+                examples={
+                    "application/json": {
+                        "id": 1,
+                        "collected_at": 1744124460.5,
+                        "streams": {
+                            "live/1": dict(METRICS_STREAM_EXAMPLE, series={
+                                "t": [1744124455.5, 1744124460.5],
+                                "bw_in": [2130112, 2131496],
+                                "bw_out": [4260224, 4262992],
+                                "bw_video": [2066240, 2067616],
+                                "bw_audio": [63872, 63880],
+                                "clients": [2, 2],
+                                "dropped": [12, 12]
+                            })
+                        }
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def metrics(self, request, pk=None):
+        """Stream metrics of the camera from nginx-rtmp's statistics"""
+        camera = self.get_object()
+        window = request.query_params.get('window')
+        if window is not None:
+            try:
+                window = float(window)
+            except ValueError:
+                raise ValidationError({'window': 'Expected a number of seconds.'})
+        return Response(get_stats_collector().metrics(camera.id, window), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Latest nginx-rtmp stream metrics of many cameras, without series; "
+                              "defaults to all active cameras",
+        manual_parameters=[
+            openapi.Parameter('ids', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Comma-separated camera ids")
+        ],
+        responses={
+            200: openapi.Response(
+                description="Stream metrics keyed by camera id, then by 'application/name'",
+                examples={
+                    "application/json": {"1": {"live/1": METRICS_STREAM_EXAMPLE}}
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='bulk/metrics')
+    def bulk_metrics(self, request):
+        """Latest nginx-rtmp stream metrics of many cameras"""
+        ids = self._query_ids(request)
+        return Response(get_stats_collector().latest_many(ids), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="State of the nginx-rtmp statistics collector and server totals",
+        responses={
+            200: openapi.Response(
+                description="Collector status",
+                examples={
+                    "application/json": {
+                        "url": "http://rtmp_server:8080/stats",
+                        "interval": 5.0,
+                        "polls": 1440,
+                        "failures": 0,
+                        "last_poll_at": 1744124460.5,
+                        "last_error": None,
+                        "parse_ms": 3.2,
+                        "streams": 6,
+                        "server": {"uptime": 86412, "naccepted": 57, "bw_in": 5436176,
+                                   "bytes_in": 41262813520, "bw_out": 7713472,
+                                   "bytes_out": 58551294977}
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='metrics/status')
+    def metrics_status(self, request):
+        """State of the nginx-rtmp statistics collector and server totals"""
+        return Response(get_stats_collector().status(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="State of the camera's adaptive bitrate ladder (see the camera's "
+                              "'transcode' field) and the encoded fps of every rung",
+        responses={
+            200: openapi.Response(
+                description="Ladder state",
+                examples={
+                    "application/json": LADDER_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def ladder(self, request, pk=None):
+        """State of the camera's adaptive bitrate ladder"""
+        camera = self.get_object()
+        return Response(get_ladder_manager().ladder(camera.id), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Cores available to and used by bitrate ladders on this node, and the "
+                              "ladders of all cameras that have one enabled",
+        responses={
+            200: openapi.Response(
+                description="Transcoding status",
+                examples={
+                    "application/json": {
+                        "cores": 8.0,
+                        "capacity": 7.0,
+                        "used": 6.28,
+                        "estimated_cores_per_ladder": 1.115,
+                        "ladders": {"idle": 3, "queued": 1, "running": 6},
+                        "saturated": [],
+                        "cameras": [LADDER_EXAMPLE]
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='ladders/status')
+    def ladders_status(self, request):
+        """Core budget and state of the bitrate ladders"""
+        return Response(get_ladder_manager().status(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Relay state, viewers and savings of an on-demand camera",
+        responses={
+            200: openapi.Response(
+                description="On-demand relay",
+                examples={
+                    "application/json": ON_DEMAND_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'], url_path='on-demand')
+    def on_demand(self, request, pk=None):
+        """State of the camera's on-demand relay"""
+        camera = self.get_object()
+        return Response(get_on_demand().camera(camera.id), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Start an on-demand camera's relay ahead of its viewer and keep it "
+                              "running for ONDEMAND_PREROLL seconds without one.",
+        request_body=no_body,
+        responses={
+            200: openapi.Response(
+                description="Relay warming up",
+                examples={
+                    "application/json": ON_DEMAND_EXAMPLE
+                }
+            ),
+            409: "The camera is not an active on-demand pull camera"
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def warm(self, request, pk=None):
+        """Start an on-demand relay ahead of its viewer"""
+        camera = self.get_object()
+        manager = get_on_demand()
+        if not manager.warm(camera.id):
+            return Response({'detail': 'The camera is not an active on-demand pull camera.'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(manager.camera(camera.id), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Relays and viewers of all on-demand cameras, waits for a first frame, "
+                              "and CPU time and traffic saved against running every relay all the time",
+        responses={
+            200: openapi.Response(
+                description="On-demand ingest status",
+                examples={
+                    "application/json": {
+                        "relays": {"idle": 180, "starting": 1, "running": 19},
+                        "viewers": {"rtmp": 2, "hls": 23},
+                        "idle_timeout": 60.0,
+                        "preroll": 30.0,
+                        "first_frame": {"samples": 412, "p50": 0.0, "p95": 1.84, "max": 3.1},
+                        "window_seconds": 86400.0,
+                        "savings": {
+                            "enabled_seconds": 17280000.0,
+                            "running_seconds": 1641600.0,
+                            "duty_cycle": 0.095,
+                            "cpu_seconds": 49248.0,
+                            "bytes": 424673280000,
+                            "always_on_cpu_seconds": 518400.0,
+                            "cpu_seconds_saved": 469152.0,
+                            "always_on_bytes": 4468531200000,
+                            "bytes_saved": 4043857920000,
+                            "cores_saved": 5.43,
+                            "mbps_saved": 374.431
+                        },
+                        "cameras": [ON_DEMAND_EXAMPLE]
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='on-demand/status')
+    def on_demand_status(self, request):
+        """Relays, viewers and savings of the on-demand cameras"""
+        return Response(get_on_demand().status(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="State of the camera's LL-HLS packager and the segments it holds in memory",
+        responses={
+            200: openapi.Response(
+                description="LL-HLS packager",
+                examples={
+                    "application/json": LOW_LATENCY_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'], url_path='low-latency')
+    def low_latency(self, request, pk=None):
+        """State of the camera's LL-HLS packager"""
+        camera = self.get_object()
+        return Response(get_low_latency().camera(camera.id), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Part and segment targets and the LL-HLS packagers of all low-latency cameras",
+        responses={
+            200: openapi.Response(
+                description="LL-HLS status",
+                examples={
+                    "application/json": {
+                        "part_target": 0.5,
+                        "segment_target": 2.0,
+                        "window": 6,
+                        "packagers": {"idle": 2, "starting": 0, "running": 10},
+                        "bytes": 31457280,
+                        "cameras": [LOW_LATENCY_EXAMPLE]
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='low-latency/status')
+    def low_latency_status(self, request):
+        """State of the LL-HLS packagers"""
+        return Response(get_low_latency().status(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="State of the camera's motion detector, the share of the frame moving "
+                              "in its last analysed frame and the event in progress",
+        responses={
+            200: openapi.Response(
+                description="Motion detector",
+                examples={
+                    "application/json": MOTION_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def motion(self, request, pk=None):
+        """State of the camera's motion detector"""
+        camera = self.get_object()
+        return Response(get_motion_detector().camera(camera.id), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Frame size and rate, throughput and the detectors of all cameras "
+                              "with motion detection",
+        responses={
+            200: openapi.Response(
+                description="Motion detection status",
+                examples={
+                    "application/json": {
+                        "width": 320,
+                        "height": 180,
+                        "fps": 5.0,
+                        "detectors": {"idle": 3, "starting": 0, "running": 120},
+                        "frames": 5432100,
+                        "dropped": 12,
+                        "batch_size": 118.6,
+                        "frames_per_cpu_second": 2400,
+                        "open_events": 7,
+                        "bytes": 48660480,
+                        "cameras": [MOTION_EXAMPLE]
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='motion/status')
+    def motion_status(self, request):
+        """State of the motion detectors"""
+        return Response(get_motion_detector().status(), status=status.HTTP_200_OK)
+
+    def _viewer_series(self, request, camera_id):
+        resolution = request.query_params.get('resolution', 'minute')
+        if resolution not in RESOLUTIONS:
+            raise ValidationError({'resolution': f"Expected one of {', '.join(RESOLUTIONS)}."})
+        until = self._query_datetime(request, 'until', default=timezone.now())
+        # An hour of minutes or a day of hours
+        since = self._query_datetime(request, 'since',
+                                     default=until - datetime.timedelta(seconds=RESOLUTIONS[resolution] * 60))
+        tracker = get_viewer_tracker()
+        try:
+            series = tracker.series(camera_id, resolution, since, until)
+        except ValueError as e:
+            raise ValidationError({'since': str(e)})
+        return {
+            'resolution': resolution,
+            'since': since,
+            'until': until,
+            'viewers': tracker.viewers(camera_id),
+            'series': series,
+        }
+
+    @swagger_auto_schema(
+        operation_description="Viewers of the camera's RTMP streams per minute or hour: most watching "
+                              "at once, average watching, sessions started and seconds watched",
+        manual_parameters=VIEWER_SERIES_PARAMETERS,
+        responses={
+            200: openapi.Response(
+                description="Viewer series, with the viewers watching now",
+                examples={
+                    "application/json": VIEWERS_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def viewers(self, request, pk=None):
+        """Viewers of the camera per minute or hour"""
+        camera = self.get_object()
+        return Response(dict(id=camera.id, **self._viewer_series(request, camera.id)),
+                        status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Viewers of all cameras together per minute or hour, for capacity planning; "
+                              "peaks are of the whole fleet, not sums of the cameras' peaks",
+        manual_parameters=VIEWER_SERIES_PARAMETERS,
+        responses={
+            200: openapi.Response(
+                description="Fleet viewer series, with the viewers watching now",
+                examples={
+                    "application/json": {key: value for key, value in VIEWERS_EXAMPLE.items() if key != 'id'}
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='viewers')
+    def fleet_viewers(self, request):
+        """Viewers of all cameras per minute or hour"""
+        return Response(self._viewer_series(request, FLEET), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Open viewing sessions, the cameras watched most and the state of the "
+                              "viewer rollup writer",
+        responses={
+            200: openapi.Response(
+                description="Viewer tracking status",
+                examples={
+                    "application/json": {
+                        "viewers": 412,
+                        "sessions": 412,
+                        "cameras_watched": 97,
+                        "top_cameras": [{"id": 17, "viewers": 23}, {"id": 3, "viewers": 18}],
+                        "plays": 18230,
+                        "dones": 17818,
+                        "unmatched_dones": 4,
+                        "flush_interval": 10.0,
+                        "pending_buckets": 98,
+                        "flushes": 8640,
+                        "rows_written": 1723104,
+                        "last_flush_ms": 21.4,
+                        "last_error": None
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='viewers/status')
+    def viewers_status(self, request):
+        """State of the viewer tracking"""
+        return Response(get_viewer_tracker().status(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Playlists and segments the HLS origin of this worker holds in memory, "
+                              "and how its requests were answered",
+        responses={
+            200: openapi.Response(
+                description="HLS origin cache",
+                examples={
+                    "application/json": {
+                        "root": "/hls",
+                        "playlists": 300,
+                        "segments": 1200,
+                        "bytes": 157286400,
+                        "capacity": 268435456,
+                        "disk_reads": 48211,
+                        "evictions": 0,
+                        "requests": {
+                            "playlist": {"hit": 1843200, "miss": 36000, "coalesced": 912, "uncached": 0,
+                                         "missing": 14, "hit_ratio": 0.9809},
+                            "segment": {"hit": 921600, "miss": 12000, "coalesced": 4310, "uncached": 211,
+                                        "missing": 3, "hit_ratio": 0.9867}
+                        }
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='hls-origin/status')
+    def hls_origin_status(self, request):
+        """State of the HLS origin cache"""
+        return Response(get_origin_cache().status(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Check that the camera's RTMP endpoint answers, without starting a stream",
+        manual_parameters=[
+            openapi.Parameter('mode', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=[*PROBE_MODES],
+                              description="handshake (default), connect (handshake + connect) "
+                                          "or stream (connect + createStream)"),
+            openapi.Parameter('refresh', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                              description="Probe again even if a cached result is still fresh"),
+        ],
+        responses={
+            200: openapi.Response(
+                description="Probe result",
+                examples={
+                    "application/json": PROBE_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def probe(self, request, pk=None):
+        """Check that the camera's RTMP endpoint answers"""
+        camera = self.get_object()
+        mode = request.query_params.get('mode', MODE_HANDSHAKE)
+        if mode not in PROBE_MODES:
+            raise ValidationError({'mode': f'Expected one of {", ".join(PROBE_MODES)}.'})
+        refresh = request.query_params.get('refresh', '').lower() in ('true', '1')
+        result = get_prober().probe_cameras([camera], mode, refresh)[camera.id]
+        return Response(result, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Probe the RTMP endpoints of many cameras concurrently",
+        request_body=BulkProbeSerializer,
+        responses={200: openapi.Response(description="Per-item results", examples={
+            "application/json": BULK_RESULT_EXAMPLE})}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk/probe')
+    def bulk_probe(self, request):
+        """Probe the RTMP endpoints of many cameras concurrently"""
+        serializer = BulkProbeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        found = Camera.objects.in_bulk(ids)
+        probes = get_prober().probe_cameras(found.values(), serializer.validated_data['mode'],
+                                            serializer.validated_data['refresh'])
+        results = []
+        for index, camera_id in enumerate(ids):
+            if camera_id not in found:
+                results.append({'index': index, 'id': camera_id, 'status': 'not_found'})
+            else:
+                probe = probes[camera_id]
+                results.append({'index': index, 'id': camera_id,
+                                'status': 'ok' if probe['status'] == STATUS_OK else 'failed',
+                                'probe': probe})
+        return bulk_response(results)
+
+    @swagger_auto_schema(
+        operation_description="Return camera state changes since a cursor. Clients that can use "
+                              "Server-Sent Events should subscribe to /api/events/cameras/ instead.",
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Cursor from X-Events-Cursor or a previous response")
+        ],
+        responses={
+            200: openapi.Response(
+                description="Camera deltas since the cursor",
+                examples={
+                    "application/json": {
+                        "cursor": "3f2a9c1b:42",
+                        "reset": False,
+                        "events": [
+                            {"id": 1, "active": True, "hls_url": "http://localhost:8080/hls/1/index.m3u8",
+                             "updated_at": "2025-04-08T15:11:00Z"}
+                        ]
+                    }
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['get'])
+    def events(self, request):
+        """Return camera state changes since a cursor"""
+        events, cursor, reset = get_event_log().since(request.query_params.get('cursor'))
+        return Response({'cursor': cursor, 'reset': reset, 'events': events},
+                        status=status.HTTP_200_OK)
+    
+    @swagger_auto_schema(
+        operation_description="Create many cameras in one transaction. Cameras created with "
+                              "active=true are started as a single batch.",
+        request_body=CameraSerializer(many=True),
+        responses={200: openapi.Response(description="Per-item results", examples={
+            "application/json": BULK_RESULT_EXAMPLE})}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk/create')
+    def bulk_create(self, request):
+        """Create many cameras in one transaction"""
+        items, error = self._bulk_payloads(request)
+        if error:
+            return error
+        
+        serializer = self.get_serializer(data=items, many=True)
+        if serializer.is_valid():
+            item_errors = [{}] * len(items)
+            validated = serializer.validated_data
+        else:
+            item_errors = serializer.errors
+            valid_items = [item for item, errors in zip(items, item_errors) if not errors]
+            retry = self.get_serializer(data=valid_items, many=True)
+            retry.is_valid()
+            validated = retry.validated_data
+        
+        cameras = [Camera(**data) for data in validated]
+        with transaction.atomic():
+            Camera.objects.bulk_create(cameras, batch_size=500)
+        
+        # Same side effects as camera_post_save, which bulk_create does not fire
+        invalidate_cameras(camera.id for camera in cameras)
+        assign_nodes(cameras)
+        get_stream_keys().update_many(cameras)
+        get_ladder_manager().update_many(cameras)
+        get_low_latency().update_many(cameras)
+        get_motion_detector().update_many(cameras)
+        get_on_demand().update_many(cameras)
+        to_start = [camera for camera in cameras if camera.active]
+        if to_start:
+            start_streams(to_start)
+        publish_cameras([camera for camera in cameras if not camera.active])
+        
+        results = []
+        created = iter(cameras)
+        for index, errors in enumerate(item_errors):
+            if errors:
+                results.append({'index': index, 'status': 'invalid', 'errors': errors})
+            else:
+                camera = next(created)
+                results.append({'index': index, 'id': camera.id, 'status': 'created',
+                                'camera': dict(self.get_serializer(camera).data, stream_key=camera.stream_key)})
+        return bulk_response(results)
+    
+    @swagger_auto_schema(
+        operation_description="Partially update many cameras in one transaction. "
+                              "Each item must include the camera 'id'.",
+        request_body=CameraSerializer(many=True),
+        responses={200: openapi.Response(description="Per-item results", examples={
+            "application/json": BULK_RESULT_EXAMPLE})}
+    )
+    @action(detail=False, methods=['patch'], url_path='bulk/update')
+    def bulk_update(self, request):
+        """Partially update many cameras in one transaction"""
+        items, error = self._bulk_payloads(request)
+        if error:
+            return error
+        
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        found = Camera.objects.in_bulk([camera_id for camera_id in ids if is_camera_id(camera_id)])
+        results = [None] * len(items)
+        changed = {}
+        fields = set()
+        now = timezone.now()
+        for index, camera_id in enumerate(ids):
+            if not is_camera_id(camera_id):
+                results[index] = {'index': index, 'id': camera_id, 'status': 'invalid',
+                                  'errors': {'id': ['Expected an integer camera id.']}}
+                continue
+            camera = found.get(camera_id)
+            if camera is None:
+                results[index] = {'index': index, 'id': camera_id, 'status': 'not_found'}
+                continue
+            # Validated once, against the camera it updates
+            serializer = self.get_serializer(camera, data=items[index], partial=True)
+            if not serializer.is_valid():
+                results[index] = {'index': index, 'id': camera_id, 'status': 'invalid',
+                                  'errors': serializer.errors}
+                continue
+            for attr, value in serializer.validated_data.items():
+                setattr(camera, attr, value)
+                fields.add(attr)
+            camera.updated_at = now
+            changed[index] = camera
+        
+        if changed and fields:
+            with transaction.atomic():
+                Camera.objects.bulk_update(list(changed.values()), sorted(fields) + ['updated_at'],
+                                           batch_size=500)
+            invalidate_cameras(camera.id for camera in changed.values())
+            if 'transcode' in fields:
+                get_ladder_manager().update_many(changed.values())
+            if 'latency' in fields:
+                get_low_latency().update_many(changed.values())
+            if fields & {'motion', 'motion_threshold', 'motion_min_area', 'motion_mask'}:
+                get_motion_detector().update_many(changed.values())
+            if fields & {'on_demand', 'active', 'source_url'}:
+                get_on_demand().update_many(changed.values())
+            publish_cameras(changed.values())
+        for index, camera in changed.items():
+            results[index] = {'index': index, 'id': camera.id, 'status': 'updated',
+                              'camera': self.get_serializer(camera).data}
+        return bulk_response(results)
+    
+    @swagger_auto_schema(
+        operation_description="Delete many cameras, stopping their streams first",
+        request_body=BulkIdsSerializer,
+        responses={200: openapi.Response(description="Per-item results", examples={
+            "application/json": BULK_RESULT_EXAMPLE})}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk/delete')
+    def bulk_delete(self, request):
+        """Delete many cameras in one transaction"""
+        ids, found = self._bulk_cameras(request)
+        if found:
+            supervisor = get_supervisor()
+            running = [camera_id for camera_id in found if supervisor.is_running(camera_id)]
+            if running:
+                supervisor.stop_many(running)
+            with transaction.atomic():
+                Camera.objects.filter(id__in=list(found)).delete()
+        
+        results = [
+            {'index': index, 'id': camera_id,
+             'status': 'deleted' if camera_id in found else 'not_found'}
+            for index, camera_id in enumerate(ids)
+        ]
+        return bulk_response(results)
+    
+    @swagger_auto_schema(
+        operation_description="Start streaming for many cameras as one batch",
+        request_body=BulkIdsSerializer,
+        responses={200: openapi.Response(description="Per-item results", examples={
+            "application/json": BULK_RESULT_EXAMPLE})}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk/start')
+    def bulk_start(self, request):
+        """Start streaming for many cameras as one batch"""
+        return self._bulk_stream_action(request, start_streams)
+    
+    @swagger_auto_schema(
+        operation_description="Stop streaming for many cameras as one batch",
+        request_body=BulkIdsSerializer,
+        responses={200: openapi.Response(description="Per-item results", examples={
+            "application/json": BULK_RESULT_EXAMPLE})}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk/stop')
+    def bulk_stop(self, request):
+        """Stop streaming for many cameras as one batch"""
+        return self._bulk_stream_action(request, stop_streams)
+    
+    @swagger_auto_schema(
+        operation_description="Restart streaming for many cameras as one batch",
+        request_body=BulkIdsSerializer,
+        responses={200: openapi.Response(description="Per-item results", examples={
+            "application/json": BULK_RESULT_EXAMPLE})}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk/restart')
+    def bulk_restart(self, request):
+        """Restart streaming for many cameras as one batch"""
+        return self._bulk_stream_action(request, restart_streams)
+
+
+class RTMPNodeViewSet(viewsets.ModelViewSet):
+    """
+    API endpoint that allows the RTMP nodes cameras are placed on to be viewed or edited.
+
+    New cameras are placed on the enabled nodes by a consistent hash ring.
+    Cameras already placed stay on their node when nodes are added,
+    disabled or resized until the nodes are rebalanced.
+    """
+    queryset = RTMPNode.objects.annotate(camera_count=Count('cameras')).order_by('id')
+    serializer_class = RTMPNodeSerializer
+
+    def perform_create(self, serializer):
+        serializer.save().camera_count = 0
+
+    def perform_update(self, serializer):
+        old = serializer.instance
+        urls = (old.ingest_url, old.hls_base_url)
+        name = old.name
+        node = serializer.save()
+        if (node.ingest_url, node.hls_base_url) != urls or node.name != name:
+            # Point the node's cameras at the new URLs and show the new name
+            move_cameras(list(Camera.objects.filter(node=node)))
+
+    @swagger_auto_schema(
+        operation_description="Delete a node that no camera is placed on",
+        responses={204: "Node deleted", 409: "Cameras are still placed on the node"}
+    )
+    def destroy(self, request, *args, **kwargs):
+        node = self.get_object()
+        if node.camera_count:
+            return Response({'detail': f'{node.camera_count} cameras are placed on the node; '
+                                       f'disable it and rebalance first.'},
+                            status=status.HTTP_409_CONFLICT)
+        return super().destroy(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        operation_description="Move every camera to the node the hash ring places it on. Run "
+                              "after nodes were added, disabled or resized. Pull-mode relays are "
+                              "restarted towards their new node; cameras that push their stream "
+                              "are listed under 'republish' and must be pointed at the new node.",
+        request_body=RebalanceSerializer,
+        responses={
+            200: openapi.Response(
+                description="Placement before and after, and the cameras moved",
+                examples={
+                    "application/json": REBALANCE_EXAMPLE
+                }
+            )
+        }
+    )
+    @action(detail=False, methods=['post'])
+    def rebalance(self, request):
+        """Move cameras to the nodes the hash ring places them on"""
+        serializer = RebalanceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        report = rebalance_cameras(dry_run=serializer.validated_data['dry_run'])
+        return Response(report, status=status.HTTP_200_OK)
+
+
+MOTION_EVENT_FILTER_PARAMETERS = [
+    openapi.Parameter('camera', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Only events of these cameras, e.g. 1,2,3"),
+    openapi.Parameter('site', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description="Only events of cameras of this site"),
+    openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                      description="Only events that started at or after this ISO 8601 timestamp"),
+    openapi.Parameter('until', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                      description="Only events that started before this ISO 8601 timestamp"),
+    openapi.Parameter('ongoing', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                      description="Only events that have (not) ended"),
+]
+
+
+class MotionEventViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows motion events to be searched.
+
+    Events are listed oldest first by the time they started, with keyset
+    pagination; filter by camera, site and time range to find what happened
+    where.
+    """
+    queryset = MotionEvent.objects.all()
+    serializer_class = MotionEventSerializer
+    pagination_class = MotionEventPagination
+
+    def _query_datetime(self, name):
+        """Parse an optional ISO 8601 query parameter; naive values are UTC"""
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: 'Expected an ISO 8601 datetime.'})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.utc)
+        return parsed
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        params = self.request.query_params
+
+        cameras = params.get('camera')
+        if cameras is not None:
+            try:
+                ids = [int(camera_id) for camera_id in cameras.split(',')]
+            except ValueError:
+                raise ValidationError({'camera': 'Expected comma-separated camera IDs.'})
+            queryset = queryset.filter(camera_id__in=ids)
+
+        site = params.get('site')
+        if site is not None:
+            queryset = queryset.filter(camera__site=site)
+
+        since = self._query_datetime('since')
+        if since is not None:
+            queryset = queryset.filter(started_at__gte=since)
+        until = self._query_datetime('until')
+        if until is not None:
+            queryset = queryset.filter(started_at__lt=until)
+
+        ongoing = params.get('ongoing')
+        if ongoing is not None:
+            if ongoing.lower() not in ('true', 'false', '1', '0'):
+                raise ValidationError({'ongoing': 'Expected true or false.'})
+            queryset = queryset.filter(ended_at__isnull=ongoing.lower() in ('true', '1'))
+        return queryset
+
+    @swagger_auto_schema(
+        manual_parameters=MOTION_EVENT_FILTER_PARAMETERS,
+        responses={
+            200: openapi.Response(
+                description="A page of motion events",
+                examples={
+                    "application/json": {
+                        "next": "http://localhost:8000/api/motion-events/?camera=1&cursor=eyJ0Ijo...",
+                        "previous": None,
+                        "results": [MOTION_EVENT_EXAMPLE]
+                    }
+                }
+            )
+        }
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
 
 class RTMPCallbackView(viewsets.ViewSet):
     """
     API endpoints for RTMP server callbacks
+
+    Under ASGI these paths are served by api.callbacks.callback_application
+    without going through Django; this view handles them for WSGI and the
+    development server. Both only queue state changes, see
+    api.callbacks.ActiveStateWriter.
     """
     
+    def _handle(self, action, request):
+        params = request.data or request.query_params
+        try:
+            status_code = handle_callback(action, params)
+            return Response({'status': 'OK' if status_code < 400 else 'Forbidden'}, status=status_code)
+        except Exception as e:
+            logger.exception(f"Error in {action} callback: {e}", extra={'event': action, 'stream': params.get('name')})
+            CALLBACK_ERRORS.labels(action).inc()
+            return Response({'status': 'Error'}, status=status.HTTP_200_OK)
+    
     def on_connect(self, request):
         """
         Callback from Nginx RTMP server when a client connects
         """
-        try:
-            app = request.data.get('app', '')
-            name = request.data.get('name', '')
-            addr = request.data.get('addr', '')
-            
-            logger.info(f"RTMP connect - app: {app}, name: {name}, addr: {addr}")
-            
-            # Always return 200 to allow connection
-            return Response({'status': 'OK'}, status=status.HTTP_200_OK)
-        except Exception as e:
-            logger.error(f"Error in on_connect callback: {e}")
-            return Response({'status': 'Error'}, status=status.HTTP_200_OK)
+        return self._handle('on_connect', request)
 
     def on_publish(self, request):
         """
         Callback from Nginx RTMP server when a stream starts publishing
         """
-        try:
-            stream_name = request.data.get('name', '')
-            app = request.data.get('app', '')
-            addr = request.data.get('addr', '')
-            
-            logger.info(f"Stream publish started - app: {app}, name: {stream_name}, addr: {addr}")
-            
-            # Try to find the camera by id (stream name)
-            try:
-                camera_id = int(stream_name)
-                try:
-                    camera = Camera.objects.get(id=camera_id)
-                    camera.active = True
-                    camera.save()
-                    logger.info(f"Camera {camera_id} marked as active")
-                except Camera.DoesNotExist:
-                    logger.warning(f"Camera with ID {camera_id} not found")
-            except ValueError:
-                logger.warning(f"Non-numeric stream name: {stream_name}")
-            
-            # Always return 200 to allow publishing
-            return Response({'status': 'OK'}, status=status.HTTP_200_OK)
-        except Exception as e:
-            logger.error(f"Error in on_publish callback: {e}")
-            return Response({'status': 'Error'}, status=status.HTTP_200_OK)
+        return self._handle('on_publish', request)
     
     def on_publish_done(self, request):
         """
         Callback from Nginx RTMP server when a stream stops publishing
         """
-        try:
-            stream_name = request.data.get('name', '')
-            app = request.data.get('app', '')
-            addr = request.data.get('addr', '')
-            
-            logger.info(f"Stream publish ended - app: {app}, name: {stream_name}, addr: {addr}")
-            
-            # Try to find the camera by id (stream name)
-            try:
-                camera_id = int(stream_name)
-                try:
-                    camera = Camera.objects.get(id=camera_id)
-                    camera.active = False
-                    camera.save()
-                    logger.info(f"Camera {camera_id} marked as inactive")
-                except Camera.DoesNotExist:
-                    logger.warning(f"Camera with ID {camera_id} not found")
-            except ValueError:
-                logger.warning(f"Non-numeric stream name: {stream_name}")
-            
-            return Response({'status': 'OK'}, status=status.HTTP_200_OK)
-        except Exception as e:
-            logger.error(f"Error in on_publish_done callback: {e}")
-            return Response({'status': 'Error'}, status=status.HTTP_200_OK)
+        return self._handle('on_publish_done', request)
 
     def on_play(self, request):
         """
         Callback from Nginx RTMP server when a client starts playing a stream
         """
-        try:
-            app = request.data.get('app', '')
-            name = request.data.get('name', '')
-            addr = request.data.get('addr', '')
-            
-            logger.info(f"Stream play started - app: {app}, name: {name}, addr: {addr}")
-            
-            return Response({'status': 'OK'}, status=status.HTTP_200_OK)
-        except Exception as e:
-            logger.error(f"Error in on_play callback: {e}")
-            return Response({'status': 'Error'}, status=status.HTTP_200_OK)
+        return self._handle('on_play', request)
 
     def on_done(self, request):
         """
         Callback from Nginx RTMP server when a client stops playing
         """
-        try:
-            app = request.data.get('app', '')
-            name = request.data.get('name', '')
-            addr = request.data.get('addr', '')
-            
-            logger.info(f"Stream done - app: {app}, name: {name}, addr: {addr}")
-            
-            return Response({'status': 'OK'}, status=status.HTTP_200_OK)
-        except Exception as e:
-            logger.error(f"Error in on_done callback: {e}")
-            return Response({'status': 'Error'}, status=status.HTTP_200_OK) 
\ No newline at end of file
+        return self._handle('on_done', request)
+
+    def on_hls(self, request):
+        """
+        Copy of an HLS playlist request, mirrored by the nginx HTTP server
+        """
+        return self._handle('on_hls', request)
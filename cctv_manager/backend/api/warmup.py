@@ -0,0 +1,202 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.urls import get_resolver
+
+from .metrics import observe_request
+from .schema import get_schema_document
+from .streamkeys import get_stream_keys
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts at the steps that failed, e.g. while the database is unreachable
+RETRY_SECONDS = 2.0
+
+
+def pending_migrations():
+    """
+    Return the migrations of the installed apps not applied to the database yet
+
+    Returns:
+        list: (migration, backwards) pairs, empty when the schema is current
+    """
+    executor = MigrationExecutor(connection)
+    return executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+
+def check_stream_keys():
+    if not get_stream_keys().wait_loaded(0):
+        raise RuntimeError('stream keys are not loaded yet')
+
+
+def check_database():
+    try:
+        pending = pending_migrations()
+    except DatabaseError as e:
+        raise RuntimeError(f'database unavailable: {e}')
+    if pending:
+        raise RuntimeError(f'{len(pending)} migrations are not applied')
+
+
+def load_urls():
+    # Building the reverse lookups imports every URL pattern and view module
+    get_resolver().reverse_dict
+
+
+def load_schema():
+    get_schema_document('.json')
+
+
+# Name and function of each step; a step fails by raising
+STEPS = (
+    ('stream_keys', check_stream_keys),
+    ('database', check_database),
+    ('urls', load_urls),
+    ('schema', load_schema),
+)
+
+
+class Warmup:
+    """
+    Startup work a worker finishes before it reports itself ready
+
+    The server accepts connections once the stream keys are in memory, so
+    publishers reconnecting after a restart are not kept waiting. The other
+    steps run in a background thread afterwards: the database is reachable
+    and migrated, the URL patterns and views are imported so the first API
+    requests do not pay for it, and the API schema is loaded. Failed steps
+    are retried every RETRY_SECONDS; until all succeeded the readiness
+    endpoint answers 503.
+    """
+
+    def __init__(self, steps=STEPS):
+        self.steps = steps
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        # Step name -> seconds it took, and the last error of steps not done
+        self._done = {}
+        self._errors = {}
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def run_steps(self):
+        """
+        Run the steps not done yet once
+
+        Returns:
+            bool: Whether all steps are done
+        """
+        for name, step in self.steps:
+            if name in self._done:
+                continue
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                if self._errors.get(name) != str(e):
+                    logger.warning(f"Startup step {name} not done: {e}")
+                self._errors[name] = str(e)
+            else:
+                self._done[name] = time.perf_counter() - started
+                self._errors.pop(name, None)
+            finally:
+                close_old_connections()
+        return len(self._done) == len(self.steps)
+
+    def _run(self):
+        while not self._stopped:
+            if self.run_steps():
+                self.ready_at = time.monotonic()
+                logger.info(f"Ready {self.ready_at - self.started_at:.2f}s after startup")
+                return
+            self._wakeup.wait(RETRY_SECONDS)
+
+    def status(self):
+        """
+        Return whether the worker is ready and how far its startup got
+
+        Returns:
+            dict: Readiness, seconds from startup to ready (None while
+                  warming up) and per step whether it is done, how long it
+                  took and its last error
+        """
+        return {
+            'ready': self.ready,
+            'seconds': round(self.ready_at - self.started_at, 3) if self.ready else None,
+            'steps': {
+                name: {
+                    'done': name in self._done,
+                    'seconds': round(self._done[name], 3) if name in self._done else None,
+                    'error': self._errors.get(name),
+                }
+                for name, _ in self.steps
+            },
+        }
+
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+def get_warmup():
+    """
+    Return the process-wide Warmup, starting it
+
+    Returns:
+        Warmup: The shared warm-up
+    """
+    global _warmup
+    if _warmup is None:
+        with _warmup_lock:
+            if _warmup is None:
+                warmup = Warmup()
+                warmup.start()
+                atexit.register(warmup.stop)
+                _warmup = warmup
+    return _warmup
+
+
+async def readiness_application(scope, receive, send):
+    """
+    ASGI application answering readiness probes under /api/ready/
+
+    200 once every startup step is done, 503 before; the body is
+    Warmup.status() either way.
+    """
+    started = time.perf_counter()
+    warmup = get_warmup()
+    status = 200 if warmup.ready else 503
+    payload = json.dumps(warmup.status()).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'cache-control', b'no-cache'),
+            (b'content-length', str(len(payload)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': payload if scope['method'] != 'HEAD' else b''})
+    observe_request(scope['method'], 'ready', status, time.perf_counter() - started)
@@ -0,0 +1,113 @@
+"""
+Compare single-item and bulk camera endpoints.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_bulk --cameras 200
+
+Creates, starts, stops and deletes N cameras once through the per-camera
+endpoints and once through the /api/cameras/bulk/ endpoints, and reports
+items per second for each operation.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.django_setup import setup_django
+
+
+def camera_payload(index):
+    return {
+        'name': f'Camera {index}',
+        'ip_address': f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}',
+        'stream_id': f'stream{index}',
+    }
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def run_single(client, count):
+    ids = []
+
+    def create():
+        for index in range(count):
+            response = client.post('/api/cameras/', camera_payload(index),
+                                   content_type='application/json')
+            ids.append(response.json()['id'])
+
+    def each(action):
+        def run():
+            for camera_id in ids:
+                client.post(f'/api/cameras/{camera_id}/{action}/')
+        return run
+
+    def delete():
+        for camera_id in ids:
+            client.delete(f'/api/cameras/{camera_id}/')
+
+    return {
+        'create': timed(create),
+        'start': timed(each('start')),
+        'stop': timed(each('stop')),
+        'delete': timed(delete),
+    }
+
+
+def run_bulk(client, count):
+    ids = []
+
+    def create():
+        response = client.post('/api/cameras/bulk/create/',
+                               [camera_payload(index) for index in range(count)],
+                               content_type='application/json')
+        ids.extend(result['id'] for result in response.json()['results'])
+
+    def each(action):
+        def run():
+            client.post(f'/api/cameras/bulk/{action}/', {'ids': ids},
+                        content_type='application/json')
+        return run
+
+    return {
+        'create': timed(create),
+        'start': timed(each('start')),
+        'stop': timed(each('stop')),
+        'delete': timed(each('delete')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=200)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        from django.test import Client
+        client = Client()
+        single = run_single(client, args.cameras)
+        bulk = run_bulk(client, args.cameras)
+    finally:
+        teardown()
+
+    report = {'cameras': args.cameras, 'operations': {}}
+    for operation in single:
+        report['operations'][operation] = {
+            'single_items_per_second': round(args.cameras / single[operation], 1),
+            'bulk_items_per_second': round(args.cameras / bulk[operation], 1),
+            'speedup': round(single[operation] / bulk[operation], 1),
+        }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
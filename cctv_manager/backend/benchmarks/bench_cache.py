@@ -0,0 +1,125 @@
+"""
+Measure camera read latency with and without the response cache.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_cache --cameras 1000
+
+Seeds that many Camera rows and times a list page and a single camera
+through CameraViewSet three ways: with the cache cleared before every
+request (miss), served from the cache (hit), and revalidated with
+If-None-Match (304). Also checks that a publish callback invalidates the
+cached list.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.django_setup import percentile, setup_django
+
+
+def seed(count):
+    from api.models import Camera
+    Camera.objects.all().delete()
+    Camera.objects.bulk_create(
+        (Camera(name=f'Camera {index}', ip_address=f'10.0.{index // 256 % 256}.{index % 256}',
+                stream_id=f'stream{index}')
+         for index in range(count)),
+        batch_size=1000,
+    )
+
+
+def measure(view, factory, path, repeat, before=None, **headers):
+    samples = []
+    status_code = None
+    for _ in range(repeat):
+        if before:
+            before()
+        request = factory.get(path, **headers)
+        started = time.perf_counter()
+        response = view(request)
+        if hasattr(response, 'render'):
+            response.render()
+        samples.append((time.perf_counter() - started) * 1000)
+        status_code = response.status_code
+    return {
+        'status': status_code,
+        'p50_ms': round(statistics.median(samples), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+    }
+
+
+def run(cameras, page_size, repeat):
+    from rest_framework.test import APIRequestFactory
+    from api.cache import get_response_cache
+    from api.callbacks import get_state_writer
+    from api.models import Camera
+    from api.views import CameraViewSet
+
+    seed(cameras)
+    cache = get_response_cache()
+    factory = APIRequestFactory()
+    list_view = CameraViewSet.as_view({'get': 'list'})
+    detail = CameraViewSet.as_view({'get': 'retrieve'})
+    camera_id = Camera.objects.order_by('id').values_list('id', flat=True)[cameras // 2]
+
+    def detail_view(request):
+        return detail(request, pk=str(camera_id))
+
+    results = {}
+    for name, view, path in (
+        ('list', list_view, f'/api/cameras/?page_size={page_size}'),
+        ('retrieve', detail_view, f'/api/cameras/{camera_id}/'),
+    ):
+        cache.clear()
+        miss = measure(view, factory, path, repeat, before=cache.clear)
+        view(factory.get(path))
+        etag = view(factory.get(path))['ETag']
+        results[name] = {
+            'miss': miss,
+            'hit': measure(view, factory, path, repeat),
+            'not_modified': measure(view, factory, path, repeat, HTTP_IF_NONE_MATCH=etag),
+        }
+
+    # A publish callback for a listed camera must invalidate the cached list
+    path = f'/api/cameras/?page_size={page_size}'
+    first_id = Camera.objects.order_by('updated_at', 'id').values_list('id', flat=True)[0]
+    etag = list_view(factory.get(path))['ETag']
+    writer = get_state_writer()
+    writer.submit(first_id, True)
+    writer.flush()
+    after = list_view(factory.get(path, HTTP_IF_NONE_MATCH=etag))
+    results['invalidated_by_callback'] = after.status_code == 200
+
+    results['stats'] = cache.stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        report = {
+            'cameras': args.cameras,
+            'page_size': args.page_size,
+            'results': run(args.cameras, args.page_size, args.repeat),
+        }
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Measure the write paths under concurrency for the configured database.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_db --threads 1 4 16
+    SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL SQLITE_TRANSACTION_MODE=DEFERRED \\
+        SQLITE_BUSY_TIMEOUT=0 DB_CONN_MAX_AGE=0 python -m benchmarks.bench_db
+    DB_ENGINE=postgresql POSTGRES_HOST=localhost python -m benchmarks.bench_db
+
+Worker threads each run a mix of on_publish state writes (as applied by the
+callback state writer), start_stream, stop_stream and camera list reads
+against a throw-away database for a fixed duration. Reports throughput,
+p50/p99 latency and failed operations (e.g. 'database is locked') per
+operation and thread count.
+"""
+import argparse
+import itertools
+import json
+import logging
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmarks.django_setup import percentile, setup_django
+
+
+class ErrorCounter(logging.Handler):
+    """Count error records logged by the code under test"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        # Handler.handle() already serialises calls to emit()
+        self.count += 1
+
+
+def seed(count):
+    from api.models import Camera
+    Camera.objects.all().delete()
+    Camera.objects.bulk_create(
+        (Camera(name=f'Camera {index}', ip_address=f'10.0.{index // 256 % 256}.{index % 256}',
+                stream_id=f'stream{index}')
+         for index in range(count)),
+        batch_size=1000,
+    )
+    return list(Camera.objects.values_list('id', flat=True))
+
+
+def worker(index, ids, deadline, samples, errors):
+    from django.db import close_old_connections, connection
+    from rest_framework.test import APIRequestFactory
+    from api.callbacks import ActiveStateWriter
+    from api.models import Camera
+    from api.utils import start_stream, stop_stream
+    from api.views import CameraViewSet
+
+    rng = random.Random(index)
+    writer = ActiveStateWriter(window=0)
+    list_view = CameraViewSet.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+
+    def on_publish():
+        writer.submit(rng.choice(ids), rng.random() < 0.5)
+        writer.flush()
+
+    def start():
+        return start_stream(Camera.objects.get(id=rng.choice(ids)))
+
+    def stop():
+        return stop_stream(Camera.objects.get(id=rng.choice(ids)))
+
+    def read():
+        response = list_view(factory.get('/api/cameras/?page_size=50'))
+        if hasattr(response, 'render'):
+            response.render()
+        return response.status_code == 200
+
+    operations = itertools.cycle([('on_publish', on_publish), ('start_stream', start),
+                                  ('stop_stream', stop), ('list', read)])
+    try:
+        while time.monotonic() < deadline:
+            name, operation = next(operations)
+            started = time.perf_counter()
+            try:
+                ok = operation() is not False
+            except Exception:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            samples[name].append(elapsed)
+            if not ok:
+                errors[name] += 1
+            # Mirrors the end of a request
+            close_old_connections()
+    finally:
+        connection.close()
+
+
+def run(cameras, thread_counts, duration):
+    from django.db import connection
+    from api.cache import get_response_cache
+
+    ids = seed(cameras)
+    counter = ErrorCounter()
+    logging.getLogger('api').addHandler(counter)
+    results = {}
+    for threads in thread_counts:
+        get_response_cache().clear()
+        names = ('on_publish', 'start_stream', 'stop_stream', 'list')
+        samples = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        counter.count = 0
+        deadline = time.monotonic() + duration
+        pool = [threading.Thread(target=worker, args=(index, ids, deadline, samples, errors))
+                for index in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+        total = sum(len(values) for values in samples.values())
+        results[threads] = {
+            'ops_per_second': round(total / duration, 1),
+            'logged_errors': counter.count,
+            'operations': {
+                name: {
+                    'count': len(values),
+                    'failed': errors[name],
+                    'p50_ms': round(statistics.median(values), 3) if values else None,
+                    'p99_ms': round(percentile(values, 0.99), 3) if values else None,
+                }
+                for name, values in samples.items()
+            },
+        }
+    logging.getLogger('api').removeHandler(counter)
+
+    options = {key: value for key, value in connection.settings_dict['OPTIONS'].items()}
+    return {
+        'vendor': connection.vendor,
+        'engine': connection.settings_dict['ENGINE'],
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'options': options,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=500)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds to run each thread count')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    teardown = setup_django(file_database=True)
+    from django.conf import settings
+    settings.HLS_ROOT = tempfile.mkdtemp(prefix='cctv-bench-hls-')
+    try:
+        report = {'cameras': args.cameras, 'duration': args.duration}
+        report.update(run(args.cameras, args.threads, args.duration))
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
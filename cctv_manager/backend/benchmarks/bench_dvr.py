@@ -0,0 +1,124 @@
+"""
+Measure DVR archiving throughput and seek latency.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_dvr --hours 24 --fragment 2
+
+Archives one day of segments for a camera into a temporary recordings
+root, reporting segments and MB per second appended. It then resolves
+random timestamps through the memory-mapped index and, for comparison,
+through the naive layout of one file per segment named by its start time,
+which needs a directory listing for every seek.
+"""
+import argparse
+import bisect
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile
+
+
+def seek_by_listing(directory, when_ms):
+    """Baseline: list one file per segment, sort by start time and bisect"""
+    starts = sorted(int(name[:-3]) for name in os.listdir(directory))
+    position = bisect.bisect_right(starts, when_ms) - 1
+    return starts[max(position, 0)]
+
+
+def timings(samples):
+    return {
+        'p50_us': round(percentile(samples, 0.5) * 1e6, 2),
+        'p99_us': round(percentile(samples, 0.99) * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--fragment', type=float, default=2.0, help='segment duration in seconds')
+    parser.add_argument('--segment-bytes', type=int, default=16 * 1024)
+    parser.add_argument('--seeks', type=int, default=2000)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cctv_manager.settings')
+    from api.dvr import DVRRecorder, DayWriter, day_of, from_ms
+
+    root = tempfile.mkdtemp(prefix='cctv-bench-dvr-')
+    try:
+        source = os.path.join(root, 'segment.ts')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(args.segment_bytes))
+
+        count = int(args.hours * 3600 / args.fragment)
+        duration_ms = int(args.fragment * 1000)
+        day_start = datetime.datetime(2025, 4, 8, tzinfo=datetime.timezone.utc)
+        first_ms = int(day_start.timestamp() * 1000)
+        recorder = DVRRecorder(os.path.join(root, 'recordings'))
+        naive = os.path.join(root, 'naive')
+        os.makedirs(naive)
+
+        writers = {}
+        started = time.perf_counter()
+        for position in range(count):
+            start_ms = first_ms + position * duration_ms
+            day = day_of(start_ms)
+            if day not in writers:
+                writers[day] = DayWriter(os.path.join(recorder.camera_directory(1), day))
+            writers[day].append(source, start_ms, duration_ms)
+        elapsed = time.perf_counter() - started
+        for writer in writers.values():
+            writer.close()
+
+        for position in range(count):
+            open(os.path.join(naive, f'{first_ms + position * duration_ms}.ts'), 'wb').close()
+
+        end_ms = first_ms + count * duration_ms
+        targets = [from_ms(random.randrange(first_ms, end_ms)) for _ in range(args.seeks)]
+        recorder.seek(1, targets[0])
+
+        indexed = []
+        for when in targets:
+            t0 = time.perf_counter()
+            result = recorder.seek(1, when)
+            indexed.append(time.perf_counter() - t0)
+            assert result is not None and not result['gap']
+
+        listing = []
+        for when in targets[:max(1, args.seeks // 10)]:
+            t0 = time.perf_counter()
+            seek_by_listing(naive, int(when.timestamp() * 1000))
+            listing.append(time.perf_counter() - t0)
+
+        report = {
+            'segments': count,
+            'segment_bytes': args.segment_bytes,
+            'archive': {
+                'seconds': round(elapsed, 3),
+                'segments_per_second': round(count / elapsed, 1),
+                'mb_per_second': round(count * args.segment_bytes / elapsed / 1e6, 1),
+            },
+            'seek_indexed': timings(indexed),
+            'seek_directory_listing': timings(listing),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Measure clip export throughput for multi-hour recordings.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_export --hours 1 4 --bitrate 2
+
+Archives the requested hours of MPEG-TS segments for one camera into a
+temporary recordings root, then exports the whole range (trimmed a few
+seconds into the first and last segment) through the export endpoint,
+synchronously (WSGI) and as an asynchronous iterator (ASGI). Reports MB/s,
+time to first byte, resident memory growth during the export, and the
+time to answer a 1 MB Range request from the middle of the clip.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, setup_django
+from benchmarks.fake_hls import make_ts_segment
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def archive(recorder, camera_id, first_ms, hours, fragment, bitrate):
+    from api.dvr import DayWriter, day_of
+
+    directory = tempfile.mkdtemp(prefix='cctv-bench-segment-')
+    source = os.path.join(directory, 'segment.ts')
+    frame_bytes = int(bitrate * 1e6 / 8 / 25)
+    with open(source, 'wb') as f:
+        f.write(make_ts_segment(0, fragment, frame_bytes=frame_bytes))
+
+    writers = {}
+    duration_ms = int(fragment * 1000)
+    count = int(hours * 3600 / fragment)
+    for position in range(count):
+        start_ms = first_ms + position * duration_ms
+        day = day_of(start_ms)
+        if day not in writers:
+            writers[day] = DayWriter(os.path.join(recorder.camera_directory(camera_id), day))
+        writers[day].append(source, start_ms, duration_ms)
+    for writer in writers.values():
+        writer.close()
+    shutil.rmtree(directory)
+    return count
+
+
+def consume_sync(response):
+    started = time.perf_counter()
+    first_byte = None
+    total = 0
+    for chunk in response.streaming_content:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        total += len(chunk)
+    return total, time.perf_counter() - started, first_byte
+
+
+async def consume_async(response):
+    started = time.perf_counter()
+    first_byte = None
+    total = 0
+    async for chunk in response.streaming_content:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        total += len(chunk)
+    return total, time.perf_counter() - started, first_byte
+
+
+def result(total, elapsed, first_byte, rss_before):
+    return {
+        'bytes': total,
+        'seconds': round(elapsed, 3),
+        'mb_per_second': round(total / elapsed / 1e6, 1),
+        'first_byte_ms': round(first_byte * 1000, 2),
+        'rss_growth_mb': round(rss_mb() - rss_before, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hours', type=float, nargs='+', default=[1, 4])
+    parser.add_argument('--fragment', type=float, default=2.0, help='segment duration in seconds')
+    parser.add_argument('--bitrate', type=float, default=2.0, help='recorded Mbit/s')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    root = tempfile.mkdtemp(prefix='cctv-bench-export-')
+    os.environ['RECORDINGS_ROOT'] = root
+    teardown = setup_django()
+    try:
+        from django.test import AsyncClient, Client
+        from api.dvr import get_recorder
+        from api.models import Camera
+
+        client = Client(HTTP_HOST='localhost')
+        async_client = AsyncClient(HTTP_HOST='localhost')
+        recorder = get_recorder()
+        first = datetime.datetime(2025, 4, 8, tzinfo=datetime.timezone.utc)
+        report = {'fragment': args.fragment, 'bitrate_mbps': args.bitrate, 'results': {}}
+
+        for hours in args.hours:
+            camera = Camera.objects.create(name=f'Bench {hours}h', ip_address='10.0.0.1',
+                                           stream_id=f'bench{hours}')
+            segments = archive(recorder, camera.id, int(first.timestamp() * 1000),
+                               hours, args.fragment, args.bitrate)
+            params = {
+                'start': (first + datetime.timedelta(seconds=args.fragment * 0.6)).isoformat(),
+                'end': (first + datetime.timedelta(hours=hours, seconds=-args.fragment * 0.4)).isoformat(),
+            }
+            url = f'/api/cameras/{camera.id}/recordings/export/'
+
+            rss_before = rss_mb()
+            response = client.get(url, params)
+            size = int(response['Content-Length'])
+            total, elapsed, first_byte = consume_sync(response)
+            assert total == size, (total, size)
+            sync_result = result(total, elapsed, first_byte, rss_before)
+
+            rss_before = rss_mb()
+            response = asyncio.run(async_client.get(url, params))
+            async_result = result(*asyncio.run(consume_async(response)), rss_before)
+
+            started = time.perf_counter()
+            response = client.get(url, params, HTTP_RANGE=f'bytes={size // 2}-{size // 2 + 2 ** 20 - 1}')
+            body = b''.join(response.streaming_content)
+            assert response.status_code == 206 and len(body) == 2 ** 20
+            range_ms = (time.perf_counter() - started) * 1000
+
+            report['results'][hours] = {
+                'segments': segments,
+                'wsgi': sync_result,
+                'asgi': async_result,
+                'range_1mb_ms': round(range_ms, 2),
+            }
+    finally:
+        teardown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
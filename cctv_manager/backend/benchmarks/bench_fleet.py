@@ -0,0 +1,374 @@
+"""
+Load-test the backend with a simulated camera fleet and nginx-rtmp callback storms.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_fleet --cameras 500 --duration 20 --output fleet.json
+    python -m benchmarks.bench_fleet --cameras 500 --duration 20 --compare fleet.json
+
+Seeds N cameras, a --pull-fraction of them pull-mode so starting them runs
+benchmarks/fake_ffmpeg.py under the ingest supervisor, and keeps
+benchmarks/fake_hls.py writing segments for every camera that is publishing.
+For --duration seconds it then, at the same time:
+
+- replays nginx-rtmp callback sessions (on_connect, on_publish, on_play and
+  on_done per viewer, on_publish_done) at --callback-rate requests per second
+- runs --clients API clients issuing list, retrieve, start and stop requests
+  (weighted by --mix) back to back
+
+Requests go through cctv_manager.asgi.application in-process, exactly as
+uvicorn would call it, so the run needs no network, nginx or cameras and is
+repeatable with --seed. Callback latency is measured from when the request
+was due, so a backend that falls behind shows up as queueing delay. The JSON
+report lists count, errors, p50/p90/p99 and throughput per operation, plus
+the commit it ran against; --compare adds the change against an earlier
+report.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+from benchmarks.fake_hls import FakeHLSWriter
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+
+DEFAULT_MIX = 'list=4,retrieve=4,start=1,stop=1'
+API_OPERATIONS = ('list', 'retrieve', 'start', 'stop', 'health')
+
+
+def parse_mix(text):
+    """Parse 'list=4,retrieve=4,...' into operation weights"""
+    weights = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in API_OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def asgi_request(application, method, path, query='', body=b'', content_type=None):
+    """
+    Call an ASGI application with one HTTP request
+
+    Returns:
+        tuple: (status, response body)
+    """
+    headers = [(b'host', b'localhost')]
+    if content_type:
+        headers.append((b'content-type', content_type.encode()))
+        headers.append((b'content-length', str(len(body)).encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '', 'headers': headers,
+        'client': ('127.0.0.1', 40000), 'server': ('localhost', 8000),
+    }
+    received = False
+    connected = asyncio.Event()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # The client stays connected until the response has been sent
+        await connected.wait()
+        return {'type': 'http.disconnect'}
+
+    response = {'status': None, 'body': []}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+
+    try:
+        await application(scope, receive, send)
+    finally:
+        connected.set()
+    return response['status'], b''.join(response['body'])
+
+
+class Recorder:
+    """Latency samples and errors per operation, ignoring the warm-up period"""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def add(self, operation, started, elapsed, ok):
+        if started < self.measure_from:
+            return
+        self.samples[operation].append(elapsed)
+        if not ok:
+            self.errors[operation] += 1
+
+    def summary(self, seconds):
+        operations = {}
+        for operation in sorted(self.samples):
+            samples = self.samples[operation]
+            operations[operation] = {
+                'count': len(samples),
+                'errors': self.errors[operation],
+                'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+                'p90_ms': round(percentile(samples, 0.9) * 1000, 3),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+                'max_ms': round(max(samples) * 1000, 3),
+                'per_second': round(len(samples) / seconds, 1),
+            }
+        return operations
+
+
+class CallbackSessions:
+    """
+    Endless nginx-rtmp callback sequences over the fleet
+
+    Each session is one camera connecting, publishing, being watched by a
+    few viewers and unpublishing; sessions of different cameras interleave.
+    """
+
+    def __init__(self, camera_ids, rng, max_viewers=4, concurrent=32):
+        self.camera_ids = camera_ids
+        self.rng = rng
+        self.max_viewers = max_viewers
+        self.sessions = collections.deque(
+            self._session(camera_id) for camera_id in rng.sample(camera_ids, min(concurrent, len(camera_ids))))
+        self.client_id = 0
+
+    def _session(self, camera_id):
+        viewers = self.rng.randint(0, self.max_viewers)
+        events = ['on_connect', 'on_publish'] + ['on_play'] * viewers + ['on_done'] * viewers
+        events.append('on_publish_done')
+        for action in events:
+            self.client_id += 1
+            yield action, camera_id, self.client_id
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            session = self.sessions[0]
+            self.sessions.rotate(-1)
+            try:
+                return next(session)
+            except StopIteration:
+                self.sessions.remove(session)
+                self.sessions.append(self._session(self.rng.choice(self.camera_ids)))
+
+
+async def callback_storm(application, recorder, sessions, rate, deadline, publishing, stream_keys):
+    """Send callbacks at a fixed rate until the deadline, independent of response times"""
+    tasks = set()
+
+    async def issue(action, camera_id, client_id, due):
+        params = {'app': 'live', 'name': camera_id, 'addr': '10.1.0.5',
+                  'clientid': client_id, 'call': action[3:]}
+        if action in ('on_publish', 'on_play'):
+            # nginx-rtmp passes the stream URL's query along
+            params['key'] = stream_keys[camera_id]
+        body = urlencode(params).encode()
+        status, _ = await asgi_request(application, 'POST', f'/api/stream/{action}', body=body,
+                                       content_type='application/x-www-form-urlencoded')
+        recorder.add(f'callback.{action}', due, time.perf_counter() - due, status == 200)
+
+    interval = 1.0 / rate
+    due = time.perf_counter()
+    while due < deadline:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        action, camera_id, client_id = next(sessions)
+        if action == 'on_publish':
+            publishing.add(camera_id)
+        elif action == 'on_publish_done':
+            publishing.discard(camera_id)
+        task = asyncio.create_task(issue(action, camera_id, client_id, due))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        due += interval
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def api_client(application, recorder, rng, camera_ids, weights, deadline, page_count):
+    """Issue API requests back to back until the deadline"""
+    operations = [*weights]
+    operation_weights = [*weights.values()]
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, operation_weights)[0]
+        camera_id = rng.choice(camera_ids)
+        if operation == 'list':
+            request = ('GET', '/api/cameras/', f'page={rng.randint(1, page_count)}')
+        elif operation == 'retrieve':
+            request = ('GET', f'/api/cameras/{camera_id}/', '')
+        elif operation == 'health':
+            request = ('GET', f'/api/cameras/{camera_id}/health/', '')
+        else:
+            request = ('POST', f'/api/cameras/{camera_id}/{operation}/', '')
+        started = time.perf_counter()
+        status, _ = await asgi_request(application, *request)
+        recorder.add(operation, started, time.perf_counter() - started, status is not None and status < 400)
+
+
+def hls_loop(writer, publishing, fragment, stopped):
+    """Write one segment per fragment for the cameras that are publishing"""
+    while not stopped.wait(fragment):
+        writer.frozen = set(writer.names) - publishing
+        writer.tick()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, operations):
+    """Percent change of latency and throughput against an earlier report"""
+    changes = {}
+    for operation, current in operations.items():
+        previous = baseline.get('operations', {}).get(operation)
+        if not previous:
+            continue
+        changes[operation] = {
+            field: round((current[field] - previous[field]) / previous[field] * 100, 1)
+            if previous[field] else None
+            for field in ('p50_ms', 'p99_ms', 'per_second')
+        }
+    return {'baseline_commit': baseline.get('commit'), 'percent_change': changes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=500)
+    parser.add_argument('--pull-fraction', type=float, default=0.1,
+                        help='share of cameras relayed by the (fake) ffmpeg supervisor')
+    parser.add_argument('--duration', type=float, default=20.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds before measuring starts')
+    parser.add_argument('--callback-rate', type=float, default=500.0, help='callbacks per second')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent API clients')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'API operation weights out of {", ".join(API_OPERATIONS)} '
+                             f'(default: {DEFAULT_MIX})')
+    parser.add_argument('--fragment', type=float, default=1.0, help='fake HLS segment duration')
+    parser.add_argument('--segment-bytes', type=int, default=16 * 1024)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='earlier JSON report to compare against')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    root = tempfile.mkdtemp(prefix='cctv-bench-fleet-')
+    os.environ['HLS_ROOT'] = root
+    os.environ['HLS_WATCH_ROOT'] = root
+    os.environ['FFMPEG_BIN'] = FAKE_FFMPEG
+    os.environ['FAKE_FFMPEG_INTERVAL'] = '1'
+    teardown = setup_django(file_database=True)
+    stopped = threading.Event()
+    try:
+        from django.conf import settings
+        from api.callbacks import get_state_writer
+        from api.hls import get_hls_watcher
+        from api.ingest import get_supervisor
+        from api.models import Camera
+        from api.streamkeys import get_stream_keys
+        from cctv_manager.asgi import application
+
+        rng = random.Random(args.seed)
+        pull = int(args.cameras * args.pull_fraction)
+        cameras = Camera.objects.bulk_create(
+            Camera(name=f'Camera {index}', ip_address=f'10.0.{index // 256 % 256}.{index % 256}',
+                   stream_id=f'stream{index}',
+                   source_url=f'rtsp://10.0.{index // 256 % 256}.{index % 256}/stream' if index < pull else '')
+            for index in range(args.cameras))
+        camera_ids = [camera.id for camera in cameras]
+        stream_keys = {camera.id: camera.stream_key for camera in cameras}
+        page_count = max(1, -(-args.cameras // settings.REST_FRAMEWORK['PAGE_SIZE']))
+
+        publishing = set()
+        writer = FakeHLSWriter(root, camera_ids, fragment=args.fragment, segment_bytes=args.segment_bytes)
+        writer.frozen = set(camera_ids)
+        watcher = get_hls_watcher()
+        get_stream_keys().wait_loaded(10)
+        hls_thread = threading.Thread(target=hls_loop, args=(writer, publishing, args.fragment, stopped),
+                                      daemon=True)
+        hls_thread.start()
+
+        async def run():
+            started = time.perf_counter()
+            recorder = Recorder(started + args.warmup)
+            deadline = started + args.warmup + args.duration
+            sessions = CallbackSessions(camera_ids, rng)
+            clients = [api_client(application, recorder, random.Random(args.seed + index), camera_ids,
+                                  args.mix, deadline, page_count)
+                       for index in range(args.clients)]
+            await asyncio.gather(
+                callback_storm(application, recorder, sessions, args.callback_rate, deadline, publishing,
+                               stream_keys),
+                *clients)
+            return recorder, time.perf_counter() - started - args.warmup
+
+        recorder, elapsed = asyncio.run(run())
+        stopped.set()
+        hls_thread.join()
+        get_state_writer().flush()
+
+        operations = recorder.summary(elapsed)
+        api = [name for name in operations if not name.startswith('callback.')]
+        callbacks = [name for name in operations if name.startswith('callback.')]
+        report = {
+            'commit': git_commit(),
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'seconds': round(elapsed, 3),
+            'operations': operations,
+            'totals': {
+                'api_per_second': round(sum(operations[name]['count'] for name in api) / elapsed, 1),
+                'callbacks_per_second': round(sum(operations[name]['count'] for name in callbacks) / elapsed, 1),
+                'errors': sum(operations[name]['errors'] for name in operations),
+            },
+            'fleet': {
+                'cameras': args.cameras,
+                'pull_cameras': pull,
+                'active_after': Camera.objects.filter(active=True).count(),
+                'supervised_after': len(get_supervisor().processes),
+                'publishing_after': len(publishing),
+                'segments_written': sum(writer.sequence.values()),
+            },
+        }
+        if args.compare:
+            with open(args.compare) as f:
+                report['compare'] = compare(json.load(f), operations)
+        get_supervisor().shutdown()
+        watcher.stop()
+    finally:
+        stopped.set()
+        teardown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
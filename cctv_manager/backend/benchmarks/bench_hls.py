@@ -0,0 +1,109 @@
+"""
+Measure the HLS health watcher in inotify and polling mode.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_hls --cameras 100 500
+
+A fake nginx-rtmp writer appends one segment per camera per round to a
+temporary HLS root. For each round the benchmark records how long the
+watcher takes to see every new segment, and it reports the process CPU
+time used while idle between rounds and the latency of a bulk health
+lookup for all cameras.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks.django_setup import percentile
+from benchmarks.fake_hls import FakeHLSWriter
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+def run_mode(mode, cameras, rounds, interval, poll_interval):
+    from api.hls import HLSWatcher
+
+    root = tempfile.mkdtemp(prefix='cctv-bench-hls-')
+    try:
+        writer = FakeHLSWriter(root, range(1, cameras + 1), fragment=interval,
+                               segment_bytes=16 * 1024)
+        writer.tick()
+        watcher = HLSWatcher(root, mode=mode, poll_interval=poll_interval)
+        watcher.start()
+        ids = list(range(1, cameras + 1))
+
+        detection = []
+        idle_cpu = 0.0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            writer.tick()
+            written = time.perf_counter()
+            expected = writer.sequence[1]
+            while True:
+                health = watcher.health_many(ids)
+                if all(item['playlists'].get('', {}).get('last_sequence') == expected
+                       for item in health.values()):
+                    break
+                if time.perf_counter() - written > 10:
+                    raise RuntimeError(f'{mode} watcher did not catch up')
+                time.sleep(0.005)
+            detection.append((time.perf_counter() - written) * 1000)
+
+            cpu_before = cpu_seconds()
+            time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+            idle_cpu += cpu_seconds() - cpu_before
+
+        lookups = []
+        for _ in range(50):
+            started = time.perf_counter()
+            watcher.health_many(ids)
+            lookups.append((time.perf_counter() - started) * 1000)
+
+        active_mode = watcher.active_mode
+        watcher.stop()
+        return {
+            'active_mode': active_mode,
+            'detection_p50_ms': round(statistics.median(detection), 3),
+            'detection_p99_ms': round(percentile(detection, 0.99), 3),
+            'idle_cpu_seconds': round(idle_cpu, 4),
+            'bulk_health_p50_ms': round(statistics.median(lookups), 3),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, nargs='+', default=[100, 500])
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='seconds between segments (the fake hls_fragment)')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = {'rounds': args.rounds, 'interval': args.interval,
+              'poll_interval': args.poll_interval, 'results': {}}
+    for cameras in args.cameras:
+        report['results'][cameras] = {
+            mode: run_mode(mode, cameras, args.rounds, args.interval, args.poll_interval)
+            for mode in ('inotify', 'poll')
+        }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Measure the overhead of the ingest supervisor with N fake ffmpeg processes.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_ingest --processes 200 --duration 10
+
+Reports spawn and shutdown latency, the CPU time the supervisor itself
+consumed while the children were running, and the children's aggregate
+resource usage as seen by the supervisor's accounting.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from api.ingest import STATE_RUNNING, IngestSupervisor
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def run(processes, duration, interval, exit_after):
+    os.environ['FAKE_FFMPEG_INTERVAL'] = str(interval)
+    os.environ['FAKE_FFMPEG_EXIT_AFTER'] = str(exit_after)
+    supervisor = IngestSupervisor(
+        ffmpeg_bin=sys.executable,
+        max_processes=processes,
+        backoff_initial=0.5,
+        sample_interval=1.0,
+    )
+    supervisor.start()
+
+    started = time.perf_counter()
+    for key in range(processes):
+        supervisor.spawn(key, [FAKE_FFMPEG, '-i', f'rtsp://camera-{key}/stream'])
+    spawn_seconds = time.perf_counter() - started
+    all_running = wait_until(
+        lambda: all(p['state'] == STATE_RUNNING for p in supervisor.status()), 60
+    )
+    ready_seconds = time.perf_counter() - started
+
+    # Only the supervisor thread does work while the main thread sleeps
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+    time.sleep(duration)
+    supervisor_cpu = time.process_time() - cpu_before
+    wall = time.perf_counter() - wall_before
+
+    statuses = supervisor.status()
+    stopping = time.perf_counter()
+    supervisor.shutdown()
+    shutdown_seconds = time.perf_counter() - stopping
+
+    return {
+        'processes': processes,
+        'duration': duration,
+        'stderr_interval': interval,
+        'all_running': all_running,
+        'spawn_seconds': round(spawn_seconds, 4),
+        'ready_seconds': round(ready_seconds, 4),
+        'spawn_ms_per_process': round(1000 * spawn_seconds / processes, 3),
+        'supervisor_cpu_seconds': round(supervisor_cpu, 4),
+        'supervisor_cpu_percent': round(100 * supervisor_cpu / wall, 2),
+        'stderr_lines_per_second': round(processes / interval, 1),
+        'children_rss_mb': round(sum(p['rss_bytes'] for p in statuses) / 2 ** 20, 1),
+        'children_cpu_percent': round(sum(p['cpu_percent'] for p in statuses), 2),
+        'restarts': sum(p['restarts'] for p in statuses),
+        'shutdown_seconds': round(shutdown_seconds, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='seconds between stderr lines per fake ffmpeg')
+    parser.add_argument('--exit-after', type=float, default=0.0,
+                        help='make fake ffmpeg exit after N seconds to exercise restarts')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = run(args.processes, args.duration, args.interval, args.exit_after)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
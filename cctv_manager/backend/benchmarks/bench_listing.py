@@ -0,0 +1,115 @@
+"""
+Compare camera listing latency with offset and keyset pagination.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_listing --sizes 1000 10000 100000
+
+For each table size, seeds that many Camera rows and times the first page,
+a page 90% deep and an active-only page, both through the previous
+PageNumberPagination setup (COUNT(*) + OFFSET) and through the keyset
+pagination now used by CameraViewSet.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.django_setup import percentile, setup_django
+
+
+def seed(count):
+    from api.models import Camera
+    Camera.objects.all().delete()
+    Camera.objects.bulk_create(
+        (Camera(name=f'Camera {index}', site=f'site-{index % 20}',
+                ip_address=f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}',
+                stream_id=f'stream{index}', active=index % 4 == 0)
+         for index in range(count)),
+        batch_size=1000,
+    )
+
+
+def measure(view, factory, path, repeat):
+    samples = []
+    for _ in range(repeat):
+        request = factory.get(path)
+        started = time.perf_counter()
+        response = view(request)
+        response.render()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+    }
+
+
+def run(sizes, page_size, repeat):
+    from rest_framework.pagination import PageNumberPagination
+    from rest_framework.test import APIRequestFactory
+    from api.models import Camera
+    from api.pagination import KeysetPagination
+    from api.views import CameraViewSet
+
+    class LegacyPagination(PageNumberPagination):
+        page_size_query_param = 'page_size'
+
+    class LegacyCameraViewSet(CameraViewSet):
+        queryset = Camera.objects.order_by('id')
+        pagination_class = LegacyPagination
+
+    legacy = LegacyCameraViewSet.as_view({'get': 'list'})
+    keyset = CameraViewSet.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+    results = {}
+
+    for size in sizes:
+        seed(size)
+        deep_offset = int(size * 0.9)
+        deep_page = deep_offset // page_size + 1
+        boundary = Camera.objects.order_by('updated_at', 'id')[deep_offset]
+        paginator = KeysetPagination()
+        paginator.base_url = '/api/cameras/'
+        deep_cursor = paginator.encode_cursor(boundary, reverse=False).split('cursor=')[1]
+
+        base = f'/api/cameras/?page_size={page_size}'
+        results[size] = {
+            'offset_first_page': measure(legacy, factory, base, repeat),
+            'offset_deep_page': measure(legacy, factory, f'{base}&page={deep_page}', repeat),
+            'offset_active_page': measure(legacy, factory, f'{base}&active=true', repeat),
+            'keyset_first_page': measure(keyset, factory, base, repeat),
+            'keyset_deep_page': measure(keyset, factory, f'{base}&cursor={deep_cursor}', repeat),
+            'keyset_active_page': measure(keyset, factory, f'{base}&active=true', repeat),
+            'keyset_deep_page_trimmed': measure(
+                keyset, factory, f'{base}&cursor={deep_cursor}&fields=id,name,active', repeat
+            ),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        report = {
+            'page_size': args.page_size,
+            'results': run(args.sizes, args.page_size, args.repeat),
+        }
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
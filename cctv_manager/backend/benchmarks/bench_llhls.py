@@ -0,0 +1,235 @@
+"""
+Measure end-to-end latency of low-latency HLS against standard HLS.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_llhls --cameras 4 --duration 30
+
+benchmarks/fake_ffmpeg.py stands in for the packagers: it writes fragmented
+MP4 at 25 fps with a keyframe every --gop seconds, and stamps every frame
+with the time it was captured. The backend's LL-HLS packager serves it
+through llhls_application, called in-process.
+
+Two players watch every camera at the same time:
+
+- standard: reloads the playlist every target duration and fetches the
+  complete segments, as players do with nginx-rtmp's HLS (hls_fragment 3,
+  so --gop and the segment target default to 3 s); it plays HOLD-BACK,
+  three target durations, behind the newest segment
+- low-latency: issues blocking playlist reloads and fetches the part named
+  by the preload hint as soon as it is announced; it plays PART-HOLD-BACK,
+  three part targets, behind the newest part
+
+Delivery is how old the newest frame of a segment or part is when the
+player has it; latency adds the hold-back the player keeps behind it,
+which is what a viewer sees against the camera's clock.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import struct
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_fleet import asgi_request
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+
+HINT_PATTERN = re.compile(r'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part-([0-9]+)\.([0-9]+)\.m4s"')
+SEGMENT_PATTERN = re.compile(r'^seg-([0-9]+)\.m4s$', re.MULTILINE)
+HOLD_BACK_PATTERN = re.compile(r'(?<![-A-Z])HOLD-BACK=([0-9.]+)')
+PART_HOLD_BACK_PATTERN = re.compile(r'PART-HOLD-BACK=([0-9.]+)')
+
+
+def captured(data):
+    """Capture times fake_ffmpeg stamped on the frames of a part or segment"""
+    from api.llhls import find_box, iter_boxes
+
+    times = []
+    for kind, start, end in iter_boxes(data):
+        if kind != b'moof':
+            continue
+        trun = find_box(data, [b'traf', b'trun'], start, end)
+        count, offset = struct.unpack_from('>Ii', data, trun[0] + 4)
+        # Sample data follows the moof (default-base-is-moof)
+        position = start - 8 + offset
+        for index in range(count):
+            size = struct.unpack_from('>I', data, trun[0] + 12 + 12 * index + 4)[0]
+            times.append(struct.unpack_from('>d', data, position)[0])
+            position += size
+    return times
+
+
+class Player:
+    def __init__(self, application, camera_id):
+        self.application = application
+        self.base = f'/llhls/{camera_id}'
+        self.delivery = []
+        self.hold_back = None
+        self.statuses = {}
+
+    async def get(self, name, query=''):
+        status, body = await asgi_request(self.application, 'GET', f'{self.base}/{name}', query)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        return status, body
+
+    def delivered(self, data):
+        times = captured(data)
+        if times:
+            self.delivery.append(time.time() - max(times))
+
+
+async def standard_player(player, deadline, phase):
+    """Poll the playlist every target duration and fetch new complete segments"""
+    fetched = None
+    # Players join at any point of a segment
+    await asyncio.sleep(phase)
+    while time.monotonic() < deadline:
+        status, body = await player.get('index.m3u8')
+        if status == 200:
+            text = body.decode()
+            target = int(re.search(r'#EXT-X-TARGETDURATION:([0-9]+)', text)[1])
+            player.hold_back = float(HOLD_BACK_PATTERN.search(text)[1])
+            for msn in map(int, SEGMENT_PATTERN.findall(text)):
+                if fetched is None or msn > fetched:
+                    if fetched is not None:
+                        status, data = await player.get(f'seg-{msn}.m4s')
+                        if status == 200:
+                            player.delivered(data)
+                    fetched = msn
+        else:
+            target = 1
+        await asyncio.sleep(target)
+
+
+async def low_latency_player(player, deadline):
+    """Blocking reloads for the hinted part, fetching the part alongside"""
+    status, body = await player.get('index.m3u8')
+    if status != 200:
+        return
+    hint = HINT_PATTERN.search(body.decode())
+    player.hold_back = float(PART_HOLD_BACK_PATTERN.search(body.decode())[1])
+    while hint and time.monotonic() < deadline:
+        msn, index = hint.groups()
+        (status, body), (part_status, data) = await asyncio.gather(
+            player.get('index.m3u8', f'_HLS_msn={msn}&_HLS_part={index}'),
+            player.get(f'part-{msn}.{index}.m4s'))
+        if part_status == 404:
+            # The hinted part was independent and began the next segment
+            part_status, data = await player.get(f'part-{int(msn) + 1}.0.m4s')
+        if part_status == 200:
+            player.delivered(data)
+        if status != 200:
+            status, body = await player.get('index.m3u8')
+            if status != 200:
+                return
+        hint = HINT_PATTERN.search(body.decode())
+
+
+def summary(player_list):
+    delivery = [age for player in player_list for age in player.delivery]
+    hold_back = max((player.hold_back or 0.0) for player in player_list)
+    statuses = {}
+    for player in player_list:
+        for status, count in player.statuses.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    return {
+        'samples': len(delivery),
+        'delivery_p50_seconds': round(percentile(delivery, 0.5), 3),
+        'delivery_p95_seconds': round(percentile(delivery, 0.95), 3),
+        'hold_back_seconds': hold_back,
+        'latency_p50_seconds': round(percentile(delivery, 0.5) + hold_back, 3),
+        'latency_p95_seconds': round(percentile(delivery, 0.95) + hold_back, 3),
+        'responses': statuses,
+    }
+
+
+async def watch(application, cameras, duration, segment_target, seed):
+    rng = random.Random(seed)
+    deadline = time.monotonic() + duration
+    standard = [Player(application, camera.id) for camera in cameras]
+    low = [Player(application, camera.id) for camera in cameras]
+    await asyncio.gather(*(standard_player(player, deadline, rng.uniform(0, segment_target)) for player in standard),
+                         *(low_latency_player(player, deadline) for player in low))
+    return standard, low
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds the players watch')
+    parser.add_argument('--gop', type=float, default=3.0, help='seconds between keyframes')
+    parser.add_argument('--segment-target', type=float, default=3.0)
+    parser.add_argument('--part-target', type=float, default=0.5)
+    parser.add_argument('--kbps', type=float, default=2048)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ['HLS_ROOT'] = tempfile.mkdtemp(prefix='cctv-bench-hls-')
+    os.environ['FFMPEG_BIN'] = FAKE_FFMPEG
+    os.environ['LLHLS_PART_TARGET'] = str(args.part_target)
+    os.environ['LLHLS_SEGMENT_TARGET'] = str(args.segment_target)
+    os.environ['FAKE_FFMPEG_GOP'] = str(args.gop)
+    os.environ['FAKE_FFMPEG_KBPS'] = str(args.kbps)
+    teardown = setup_django(file_database=True)
+    try:
+        from api.ingest import get_supervisor
+        from api.llhls import get_low_latency, llhls_application
+        from api.models import LATENCY_LOW, Camera
+
+        cameras = Camera.objects.bulk_create(
+            Camera(name=f'Camera {index}', ip_address='10.0.0.1', stream_id=f'stream{index}',
+                   latency=LATENCY_LOW)
+            for index in range(args.cameras))
+        packager = get_low_latency()
+        packager.update_many(cameras)
+        for camera in cameras:
+            packager.set_publishing(camera.id, True)
+        # One whole segment before the players join, as after any earlier viewer
+        assert wait_until(lambda: all(packager.stream(camera.id).as_dict()['segments'] for camera in cameras),
+                          args.segment_target * 3 + 10), 'packagers did not start'
+
+        standard, low = asyncio.run(watch(llhls_application, cameras, args.duration,
+                                                 args.segment_target, args.seed))
+        status = packager.status()
+        report = {
+            'cameras': args.cameras,
+            'gop_seconds': args.gop,
+            'segment_target': args.segment_target,
+            'part_target': args.part_target,
+            'standard': summary(standard),
+            'low_latency': summary(low),
+            'packager_bytes': status['bytes'],
+            'restarts': sum(camera['restarts'] for camera in status['cameras']),
+        }
+        packager.stop()
+        get_supervisor().shutdown()
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
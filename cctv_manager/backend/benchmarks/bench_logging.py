@@ -0,0 +1,165 @@
+"""
+Measure nginx-rtmp callback latency with the logging pipeline on and off.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_logging --duration 10 --callback-rate 500
+    python -m benchmarks.bench_logging --write-latency 2 --output logging.json
+
+Each mode runs in its own process, so its logging configuration is the one
+settings.LOGGING builds from the environment, with LOG_FILE in a temporary
+directory and the console going to /dev/null:
+
+- direct: LOG_PIPELINE=False, every record is formatted and written to the
+  console and the file by the request that logged it
+- pipeline: LOG_PIPELINE=True, records are queued for the writer thread,
+  repeated per-stream events are sampled (LOG_EVENT_BURST per
+  LOG_EVENT_WINDOW seconds)
+
+In both, callback sessions as in benchmarks.bench_fleet are sent through
+cctv_manager.asgi.application at --callback-rate for --duration seconds,
+with latency measured from when each request was due. --write-latency adds
+that many milliseconds to every write to the log file, as a busy or network
+disk would. Reported per mode are p50/p90/p99 callback latency, the lines in
+the log file and the records suppressed and dropped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+
+MODES = ('direct', 'pipeline')
+
+
+def count_lines(directory):
+    """Lines in the log file and its rotated backups"""
+    lines = 0
+    for name in os.listdir(directory):
+        if name.startswith('debug.log'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                lines += sum(1 for _ in f)
+    return lines
+
+
+def run_mode(args):
+    """Run the callback storm in this process, configured by the environment"""
+    teardown = setup_django(quiet=False, file_database=True)
+    try:
+        import logging
+
+        from api import logs
+        from api.callbacks import get_state_writer
+        from api.models import Camera
+        from api.streamkeys import get_stream_keys
+        from benchmarks.bench_fleet import CallbackSessions, Recorder, callback_storm
+        from cctv_manager.asgi import application
+
+        if args.write_latency:
+            write = logs.LogFileHandler._write
+
+            def slow_write(self, data):
+                time.sleep(args.write_latency / 1000)
+                write(self, data)
+            logs.LogFileHandler._write = slow_write
+
+        cameras = Camera.objects.bulk_create(
+            Camera(name=f'Camera {index}', ip_address=f'10.0.{index // 256 % 256}.{index % 256}',
+                   stream_id=f'stream{index}')
+            for index in range(args.cameras))
+        camera_ids = [camera.id for camera in cameras]
+        stream_keys = {camera.id: camera.stream_key for camera in cameras}
+        get_stream_keys().wait_loaded(10)
+
+        async def run():
+            started = time.perf_counter()
+            recorder = Recorder(started + args.warmup)
+            sessions = CallbackSessions(camera_ids, random.Random(args.seed), max_viewers=args.max_viewers)
+            await callback_storm(application, recorder, sessions, args.callback_rate,
+                                 started + args.warmup + args.duration, set(), stream_keys)
+            return recorder, time.perf_counter() - started - args.warmup
+
+        recorder, elapsed = asyncio.run(run())
+        get_state_writer().flush()
+
+        # Everything logged has to reach the file before it is counted
+        suppressed = dropped = 0
+        for handler in logging.getLogger().handlers:
+            for log_filter in handler.filters:
+                suppressed += getattr(log_filter, 'suppressed', 0)
+            if isinstance(handler, logs.PipelineHandler):
+                handler.stop()
+                dropped += handler.dropped
+        samples = [sample for name, values in recorder.samples.items() for sample in values]
+        result = {
+            'callbacks': len(samples),
+            'errors': sum(recorder.errors.values()),
+            'per_second': round(len(samples) / elapsed, 1),
+            'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+            'p90_ms': round(percentile(samples, 0.9) * 1000, 3),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            'max_ms': round(max(samples) * 1000, 3) if samples else 0.0,
+            'lines_written': count_lines(os.path.dirname(os.environ['LOG_FILE'])),
+            'suppressed': suppressed,
+            'dropped': dropped,
+        }
+    finally:
+        teardown()
+    print(json.dumps(result))
+
+
+def spawn(mode, args):
+    """Run one mode in a fresh process with its logging settings"""
+    with tempfile.TemporaryDirectory(prefix='cctv-bench-logging-') as directory:
+        env = dict(os.environ, LOG_PIPELINE=str(mode == 'pipeline'),
+                   LOG_FILE=os.path.join(directory, 'debug.log'), HLS_ROOT=os.path.join(directory, 'hls'))
+        command = [sys.executable, '-m', 'benchmarks.bench_logging', '--mode', mode,
+                   '--cameras', str(args.cameras), '--duration', str(args.duration),
+                   '--warmup', str(args.warmup), '--callback-rate', str(args.callback_rate),
+                   '--max-viewers', str(args.max_viewers), '--write-latency', str(args.write_latency),
+                   '--seed', str(args.seed)]
+        output = subprocess.run(command, cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds before measuring starts')
+    parser.add_argument('--callback-rate', type=float, default=500.0, help='callbacks per second')
+    parser.add_argument('--max-viewers', type=int, default=16, help='most viewers per publishing session')
+    parser.add_argument('--write-latency', type=float, default=0.0,
+                        help='milliseconds added to every log file write')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    report = {
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('mode', 'output')},
+        'modes': {mode: spawn(mode, args) for mode in MODES},
+    }
+    direct, pipeline = report['modes']['direct'], report['modes']['pipeline']
+    report['p99_speedup'] = round(direct['p99_ms'] / pipeline['p99_ms'], 1) if pipeline['p99_ms'] else None
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Measure the cost of Prometheus instrumentation on the request path.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_metrics --requests 2000
+    python -m benchmarks.bench_metrics --multiprocess
+
+Times a camera detail request through Django with and without
+MetricsMiddleware, and an nginx-rtmp callback through the ASGI fast path,
+then reports the raw cost of one histogram observation and one counter
+increment and how long a scrape of /metrics takes. --multiprocess
+measures prometheus_client's per-process file mode (PROMETHEUS_MULTIPROC_DIR),
+which is what several gunicorn workers need.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+
+
+def summary(samples):
+    return {
+        'p50_us': round(percentile(samples, 0.5) * 1e6, 2),
+        'p99_us': round(percentile(samples, 0.99) * 1e6, 2),
+    }
+
+
+def timed(*functions, repeat):
+    """Time functions in turns so drift affects all of them alike"""
+    samples = [[] for _ in functions]
+    for _ in range(repeat):
+        for function, function_samples in zip(functions, samples):
+            started = time.perf_counter()
+            function()
+            function_samples.append(time.perf_counter() - started)
+    return [summary(function_samples) for function_samples in samples]
+
+
+def per_call_ns(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return round((time.perf_counter() - started) / repeat * 1e9, 1)
+
+
+async def callback_storm(callback_application, count):
+    body = b'app=live&name=1&addr=10.0.0.5'
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        pass
+
+    samples = []
+    for index in range(count):
+        scope = {'type': 'http', 'method': 'POST', 'query_string': b'',
+                 'path': '/api/stream/on_play' if index % 2 else '/api/stream/on_done'}
+        started = time.perf_counter()
+        await callback_application(scope, receive, send)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--callbacks', type=int, default=20000)
+    parser.add_argument('--multiprocess', action='store_true')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    directory = None
+    if args.multiprocess:
+        directory = tempfile.mkdtemp(prefix='cctv-bench-metrics-')
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = directory
+    teardown = setup_django()
+    try:
+        from django.conf import settings
+        from django.test import Client, override_settings
+        from api.callbacks import callback_application
+        from api.metrics import CALLBACK_EVENTS, MULTIPROCESS, observe_request
+        from api.models import Camera
+
+        camera = Camera.objects.create(name='Bench', ip_address='10.0.0.1', stream_id='bench')
+        url = f'/api/cameras/{camera.id}/'
+        client = Client(HTTP_HOST='localhost')
+        client.get(url)
+        without = [name for name in settings.MIDDLEWARE if name != 'api.metrics.MetricsMiddleware']
+        with override_settings(MIDDLEWARE=without):
+            # The middleware chain is built on the first request and kept
+            plain_client = Client(HTTP_HOST='localhost')
+            plain_client.get(url)
+        instrumented, plain = timed(lambda: client.get(url), lambda: plain_client.get(url),
+                                    repeat=args.requests)
+
+        samples = asyncio.run(callback_storm(callback_application, args.callbacks))
+        counter = CALLBACK_EVENTS.labels('on_play')
+        scrape, = timed(lambda: client.get('/metrics'), repeat=50)
+        report = {
+            'multiprocess': MULTIPROCESS,
+            'camera_detail': {
+                'with_middleware': instrumented,
+                'without_middleware': plain,
+                'overhead_us': round(instrumented['p50_us'] - plain['p50_us'], 2),
+            },
+            'callback_fast_path': dict(summary(samples), per_second=round(len(samples) / sum(samples))),
+            'histogram_observe_ns': per_call_ns(
+                lambda: observe_request('GET', 'camera-detail', 200, 0.003), 100000),
+            'counter_inc_ns': per_call_ns(counter.inc, 100000),
+            'scrape': scrape,
+            'scrape_bytes': len(client.get('/metrics').content),
+        }
+    finally:
+        teardown()
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
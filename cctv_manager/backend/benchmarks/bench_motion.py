@@ -0,0 +1,252 @@
+"""
+Measure motion detection throughput per core and event accuracy.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_motion --cameras 1,16,64,256 --pipeline-cameras 8
+
+Two phases:
+
+- kernel: grayscale frames of --width x --height are written into one
+  MotionBatch for every camera count in --cameras and analysed, either
+  all cameras in one pass (batched, as the detector runs) or one camera
+  per pass (per camera). Reported is frames analysed per CPU second of
+  the analysing thread, i.e. per core, in the fastest of --repeat runs,
+  and how many cameras one core keeps up with at MOTION_FPS.
+- pipeline: --pipeline-cameras cameras with motion detection publish for
+  --duration seconds. benchmarks/fake_ffmpeg.py stands in for their
+  decoders: a noisy scene that a square crosses for --motion-on seconds
+  of every --motion-period, at its own offset per camera. The MotionEvents
+  written are matched with the scripted moves.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, setup_django
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+
+# Frames analysed per camera count and mode
+KERNEL_ROUNDS = 100
+
+
+def scene_frames(width, height, seed):
+    """Noisy frames of one scene, without and with a moving square"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    scene = rng.integers(40, 160, size=(height, width), dtype=np.int16)
+    size = height // 6
+    still, moving = [], []
+    for index in range(4):
+        frame = np.clip(scene + rng.integers(-6, 7, size=scene.shape), 0, 255).astype(np.uint8)
+        still.append(frame.tobytes())
+        left = index * (width - size) // 4
+        frame[(height - size) // 2:(height + size) // 2, left:left + size] = 250
+        moving.append(frame.tobytes())
+    return still, moving
+
+
+def run_kernel(count, width, height, rounds, batched):
+    """Frames per CPU second of write() and process() for count cameras"""
+    from api.motion import MotionBatch
+
+    still, moving = scene_frames(width, height, count)
+    batch = MotionBatch(width, height, warmup=2)
+    for camera_id in range(count):
+        batch.configure(camera_id, 25, 0.005, [[0.0, 0.0, 1.0, 0.1]])
+    # The first pass touches freshly allocated pages, which is not measured
+    for camera_id in range(count):
+        batch.write(camera_id, still[0])
+    batch.process()
+    frames = detected = 0
+    cpu = time.thread_time()
+    for index in range(rounds):
+        # A tenth of the cameras see motion at any time
+        for camera_id in range(count):
+            frame = moving if (camera_id + index // 10) % 10 == 0 else still
+            batch.write(camera_id, frame[index % 4])
+            if not batched:
+                results = batch.process()
+                frames += len(results)
+                detected += sum(1 for _, _, box in results if box)
+        if batched:
+            results = batch.process()
+            frames += len(results)
+            detected += sum(1 for _, _, box in results if box)
+    cpu = time.thread_time() - cpu
+    return {
+        'frames': frames,
+        'frames_with_motion': detected,
+        'cpu_seconds': round(cpu, 3),
+        'frames_per_core_second': round(frames / cpu) if cpu else None,
+        'array_bytes': batch.nbytes,
+    }
+
+
+def read_moves(path):
+    """Scripted moves per source URL: (first start, period, seconds on)"""
+    moves = {}
+    with open(path) as f:
+        for line in f:
+            source, first, period, moving = line.split()
+            moves[source] = (float(first), float(period), float(moving))
+    return moves
+
+
+def match_events(moves, events, begin, end, tolerance):
+    """
+    Match the scripted moves within [begin, end] with detected events
+
+    Returns:
+        dict: Moves expected and found, events that match no move, and the
+              delay from a move's start to its event's
+    """
+    expected = found = 0
+    delays = []
+    unmatched = 0
+    for source, (first, period, moving) in moves.items():
+        camera_events = sorted(events.get(source, []))
+        starts = []
+        start = first
+        while start < end:
+            # Moves whose whole run falls within the detector's window
+            if start >= begin and start + moving <= end:
+                starts.append(start)
+            start += period
+        expected += len(starts)
+        used = set()
+        for start in starts:
+            for index, (started_at, ended_at) in enumerate(camera_events):
+                if index not in used and start - tolerance <= started_at <= start + moving:
+                    used.add(index)
+                    found += 1
+                    delays.append(started_at - start)
+                    break
+        unmatched += sum(1 for index, (started_at, _) in enumerate(camera_events)
+                         if index not in used and begin + tolerance <= started_at <= end - moving)
+    delays.sort()
+    return {
+        'moves': expected,
+        'detected': found,
+        'recall': round(found / expected, 3) if expected else None,
+        'unmatched_events': unmatched,
+        'detection_delay_p50_seconds': round(delays[len(delays) // 2], 3) if delays else None,
+        'detection_delay_max_seconds': round(delays[-1], 3) if delays else None,
+    }
+
+
+def run_pipeline(count, duration, fps):
+    from django.utils import timezone
+    from api.ingest import get_supervisor
+    from api.models import Camera, MotionEvent
+    from api.motion import get_motion_detector
+
+    cameras = Camera.objects.bulk_create(
+        Camera(name=f'Camera {index}', ip_address='10.0.0.1', stream_id=f'stream{index}', motion=True)
+        for index in range(count))
+    detector = get_motion_detector()
+    detector.update_many(cameras)
+    for camera in cameras:
+        detector.set_publishing(camera.id, True)
+    # Decoders need their first frames and the background its warm-up
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        states = detector.status()['detectors']
+        if states['running'] == count:
+            break
+        time.sleep(0.1)
+    begin = time.time() + 2.5
+    time.sleep(duration)
+    status = detector.status()
+    end = time.time()
+    detector.stop()
+    get_supervisor().shutdown()
+
+    # Moves are logged by the source URL the decoder was given
+    sources = {}
+    for camera in cameras:
+        decoder_args = detector.detector_args(camera.id, camera.stream_key, camera.node_id)
+        sources[camera.id] = decoder_args[decoder_args.index('-i') + 1]
+    events = {}
+    for event in MotionEvent.objects.all():
+        ended_at = event.ended_at or timezone.now()
+        events.setdefault(sources[event.camera_id], []).append(
+            (event.started_at.timestamp(), ended_at.timestamp()))
+    return status, events, begin, end
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', default='1,16,64,256', help='camera counts of the kernel phase')
+    parser.add_argument('--width', type=int, default=320)
+    parser.add_argument('--height', type=int, default=180)
+    parser.add_argument('--rounds', type=int, default=KERNEL_ROUNDS, help='frames per camera in the kernel phase')
+    parser.add_argument('--repeat', type=int, default=3, help='kernel runs per count and mode, the fastest is reported')
+    parser.add_argument('--pipeline-cameras', type=int, default=8, help='0 skips the pipeline phase')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of the pipeline phase')
+    parser.add_argument('--fps', type=float, default=5.0)
+    parser.add_argument('--motion-period', type=float, default=10.0)
+    parser.add_argument('--motion-on', type=float, default=3.0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    motion_log = os.path.join(tempfile.mkdtemp(prefix='cctv-bench-motion-'), 'moves.txt')
+    os.environ['HLS_ROOT'] = tempfile.mkdtemp(prefix='cctv-bench-hls-')
+    os.environ['FFMPEG_BIN'] = FAKE_FFMPEG
+    os.environ['MOTION_WIDTH'] = str(args.width)
+    os.environ['MOTION_HEIGHT'] = str(args.height)
+    os.environ['MOTION_FPS'] = str(args.fps)
+    os.environ['MOTION_INTERVAL'] = '0.5'
+    os.environ['FAKE_FFMPEG_MOTION_PERIOD'] = str(args.motion_period)
+    os.environ['FAKE_FFMPEG_MOTION_ON'] = str(args.motion_on)
+    os.environ['FAKE_FFMPEG_MOTION_LOG'] = motion_log
+    teardown = setup_django(file_database=True)
+    try:
+        kernel = {}
+        for count in (int(value) for value in args.cameras.split(',')):
+            results = {}
+            for mode in ('batched', 'per_camera'):
+                runs = [run_kernel(count, args.width, args.height, args.rounds, mode == 'batched')
+                        for _ in range(args.repeat)]
+                results[mode] = max(runs, key=lambda run: run['frames_per_core_second'] or 0)
+            for result in results.values():
+                rate = result['frames_per_core_second']
+                result['cameras_per_core'] = round(rate / args.fps, 1) if rate else None
+            kernel[count] = results
+
+        report = {
+            'frame': f'{args.width}x{args.height}',
+            'fps': args.fps,
+            'kernel': kernel,
+        }
+        if args.pipeline_cameras:
+            status, events, begin, end = run_pipeline(args.pipeline_cameras, args.duration, args.fps)
+            report['pipeline'] = {
+                'cameras': args.pipeline_cameras,
+                'seconds': round(end - begin, 1),
+                'frames': status['frames'],
+                'dropped': status['dropped'],
+                'batch_size': status['batch_size'],
+                'frames_per_cpu_second': status['frames_per_cpu_second'],
+                # Allow for the frame interval and the square entering the frame
+                'events': match_events(read_moves(motion_log), events, begin, end, 2.0 / args.fps),
+            }
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Measure camera placement on RTMP nodes: balance, movement and rebalance time.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_nodes --cameras 10000 --nodes 4
+
+The placement phase needs no database: cameras are placed on --nodes nodes
+of mixed capacity, then one node joins and one is disabled. For each step
+the report gives the load of every node against its capacity and the share
+of cameras that moved, against the ideal (the capacity that joined or left)
+and against naive id % nodes placement. The fleet phase registers fake
+nodes in a test database, starts --fleet cameras of which --relays pull
+through benchmarks/fake_ffmpeg.py, adds a node and times POST
+/api/nodes/rebalance/, checking that moved cameras get their new node's
+HLS URL and that their relays are restarted towards its ingest URL.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, setup_django
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+
+
+def node_capacities(nodes, cameras):
+    """Mixed capacities adding up to about 1.25 times the cameras"""
+    weights = [1 + index % 3 for index in range(nodes)]
+    return {f'rtmp-{index + 1}': max(1, round(cameras * 1.25 * weight / sum(weights)))
+            for index, weight in enumerate(weights)}
+
+
+def balance(placement, capacities):
+    counts = {name: 0 for name in capacities}
+    for name in placement.values():
+        counts[name] += 1
+    total = sum(capacities.values())
+    cameras = len(placement)
+    # Load relative to the node's fair share of the cameras
+    ratios = [counts[name] / (cameras * capacity / total) for name, capacity in capacities.items()]
+    return {
+        'per_node': {name: {'capacity': capacities[name], 'cameras': counts[name]} for name in capacities},
+        'max_share_ratio': round(max(ratios), 3),
+        'min_share_ratio': round(min(ratios), 3),
+        'over_capacity': sum(max(0, counts[name] - capacities[name]) for name in capacities),
+    }
+
+
+def moved(before, after):
+    return sum(1 for camera_id in before if before[camera_id] != after[camera_id]) / len(before)
+
+
+def modulo(camera_ids, names):
+    return {camera_id: names[camera_id % len(names)] for camera_id in camera_ids}
+
+
+def run_placement(cameras, nodes):
+    from api.nodes import HashRing, place
+
+    camera_ids = list(range(1, cameras + 1))
+    capacities = node_capacities(nodes, cameras)
+
+    def placed(capacities):
+        started = time.perf_counter()
+        ring = HashRing(capacities.items())
+        placement = place(camera_ids, ring, capacities)
+        return placement, time.perf_counter() - started
+
+    initial, seconds = placed(capacities)
+    report = {'nodes': len(capacities), 'place_seconds': round(seconds, 3),
+              'initial': balance(initial, capacities)}
+
+    joined = dict(capacities, **{f'rtmp-{nodes + 1}': capacities['rtmp-1']})
+    after_join, _ = placed(joined)
+    names = sorted(capacities)
+    report['join'] = {
+        'balance': balance(after_join, joined),
+        'moved': round(moved(initial, after_join), 4),
+        'ideal': round(joined[f'rtmp-{nodes + 1}'] / sum(joined.values()), 4),
+        'modulo_moved': round(moved(modulo(camera_ids, names), modulo(camera_ids, sorted(joined))), 4),
+    }
+
+    disabled = dict(capacities)
+    left = disabled.pop('rtmp-2')
+    after_disable, _ = placed(disabled)
+    report['disable'] = {
+        'balance': balance(after_disable, disabled),
+        'moved': round(moved(initial, after_disable), 4),
+        'ideal': round(sum(1 for name in initial.values() if name == 'rtmp-2') / cameras, 4),
+        'modulo_moved': round(moved(modulo(camera_ids, names), modulo(camera_ids, sorted(disabled))), 4),
+        'removed_capacity': left,
+    }
+    return report
+
+
+def run_fleet(cameras, relays, nodes):
+    from django.test import Client
+    from api.ingest import get_supervisor
+    from api.models import Camera, RTMPNode
+    from api.utils import start_streams
+
+    client = Client(HTTP_HOST='localhost')
+    for index in range(nodes):
+        response = client.post('/api/nodes/', {
+            'name': f'rtmp-{index + 1}', 'ingest_url': f'rtmp://rtmp-{index + 1}:1935/live',
+            'hls_base_url': f'http://rtmp-{index + 1}:8080/hls', 'capacity': cameras,
+        }, content_type='application/json')
+        assert response.status_code == 201, response.content
+
+    fleet = Camera.objects.bulk_create(
+        Camera(name=f'Camera {index}', ip_address='10.0.0.1', stream_id=f'stream{index}',
+               source_url=f'rtsp://10.0.0.1/stream{index}' if index < relays else '')
+        for index in range(cameras))
+    start_streams(fleet)
+    nodes_before = dict(Camera.objects.values_list('id', 'node__name'))
+
+    response = client.post('/api/nodes/', {
+        'name': f'rtmp-{nodes + 1}', 'ingest_url': f'rtmp://rtmp-{nodes + 1}:1935/live',
+        'hls_base_url': f'http://rtmp-{nodes + 1}:8080/hls', 'capacity': cameras,
+    }, content_type='application/json')
+    assert response.status_code == 201, response.content
+    started = time.perf_counter()
+    report = client.post('/api/nodes/rebalance/', {}, content_type='application/json').json()
+    seconds = time.perf_counter() - started
+
+    supervisor = get_supervisor()
+    moved_ids = {move['id'] for move in report['moved']}
+    stale_urls = stale_relays = 0
+    for camera in Camera.objects.filter(id__in=moved_ids).select_related('node'):
+        stale_urls += not camera.hls_url.startswith(camera.node.hls_base_url + '/')
+        if camera.source_url:
+            process = supervisor.processes.get(camera.id)
+            target = process.args[-1] if process is not None else ''
+            stale_relays += not target.startswith(f'{camera.node.ingest_url}/{camera.id}?')
+    assert all(nodes_before[camera_id] != name for camera_id, name in
+               Camera.objects.filter(id__in=moved_ids).values_list('id', 'node__name'))
+    return {
+        'cameras': cameras,
+        'relays': relays,
+        'moved': len(moved_ids),
+        'moved_relays': Camera.objects.filter(id__in=moved_ids).exclude(source_url='').count(),
+        'republish': len(report['republish']),
+        'rebalance_seconds': round(seconds, 3),
+        'stale_hls_urls': stale_urls,
+        'stale_relays': stale_relays,
+        'per_node': {name: node['after'] for name, node in report['nodes'].items()},
+        'registered_nodes': RTMPNode.objects.count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=10000)
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--fleet', type=int, default=1000, help='cameras of the rebalance phase')
+    parser.add_argument('--relays', type=int, default=40, help='pull-mode cameras of the rebalance phase')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    root = tempfile.mkdtemp(prefix='cctv-bench-hls-')
+    os.environ['HLS_ROOT'] = root
+    os.environ['FFMPEG_BIN'] = FAKE_FFMPEG
+    os.environ['INGEST_MAX_PROCESSES'] = str(max(args.relays, 1))
+    teardown = setup_django(file_database=True)
+    try:
+        from api.ingest import get_supervisor
+
+        report = {
+            'placement': run_placement(args.cameras, args.nodes),
+            'rebalance': run_fleet(args.fleet, args.relays, args.nodes),
+        }
+        get_supervisor().shutdown()
+        assert report['rebalance']['stale_hls_urls'] == 0, report['rebalance']
+        assert report['rebalance']['stale_relays'] == 0, report['rebalance']
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Measure on-demand ingest: time to first frame, and CPU and traffic saved.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_ondemand --cameras 20 --duration 30
+
+benchmarks/fake_ffmpeg.py stands in for the relays: it connects after
+--connect-delay seconds and probes the source for --probe-delay seconds
+(a camera without audio keeps ffmpeg probing for its full 5 s), capped by
+the relay's -analyzeduration, then relays --kbps using --load cores.
+
+Three phases run against on-demand cameras:
+
+- cold: a viewer fetches the playlist of an idle camera; the wait until
+  the relay's first frame is measured with the fast-start probe limit and,
+  for comparison, with ffmpeg's default probing
+- warm: the relay is warmed (POST warm/) --think seconds before the
+  viewer's first fetch, as a player page would, so it is pre-rolled
+- usage: viewers come and go for --duration seconds, each camera watched
+  about --watch-fraction of the time; the manager's savings report is
+  compared with running every relay for the same time
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def fetch(camera_id, client):
+    """One mirrored HLS playlist request, as nginx sends it"""
+    from api.callbacks import handle_callback
+
+    handle_callback('on_hls', {'name': str(camera_id), 'addr': client})
+
+
+def first_frame(manager, camera_id):
+    manager.check_frames()
+    return manager.camera(camera_id)['state'] == 'running'
+
+
+def timed_start(manager, camera_id, before=None):
+    """Seconds from a viewer's first fetch to the relay's first frame"""
+    if before is not None:
+        before()
+    started = time.perf_counter()
+    fetch(camera_id, '10.9.0.1')
+    wait_until(lambda: first_frame(manager, camera_id), 30)
+    return time.perf_counter() - started
+
+
+def summary(waits):
+    return {
+        'samples': len(waits),
+        'p50_seconds': round(percentile(waits, 0.5), 3),
+        'p95_seconds': round(percentile(waits, 0.95), 3),
+        'max_seconds': round(max(waits, default=0.0), 3),
+    }
+
+
+def idle_out(manager, cameras, timeout):
+    """Wait for the relays to stop once their viewers are gone, so the next phase starts cold"""
+    assert wait_until(lambda: all(manager.camera(camera.id)['state'] == 'idle' for camera in cameras),
+                      timeout), 'relays did not stop after their viewers left'
+
+
+def without_probe_limit(args):
+    """Relay arguments as ffmpeg probes by default"""
+    result = []
+    for arg in args:
+        if result and result[-1] in ('-analyzeduration', '-probesize'):
+            result.pop()
+            continue
+        result.append(arg)
+    return result
+
+
+def run_usage(cameras, duration, fraction, session, seed):
+    """Markov viewers: each second an unwatched camera may start being watched, a watched one may stop"""
+    rng = random.Random(seed)
+    stop = 1.0 / session
+    begin = fraction / (1 - fraction) * stop if fraction < 1 else 1.0
+    watched = {camera.id: rng.random() < fraction for camera in cameras}
+    watched_ticks = ticks = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for camera in cameras:
+            if watched[camera.id]:
+                watched[camera.id] = rng.random() >= stop
+            else:
+                watched[camera.id] = rng.random() < begin
+            if watched[camera.id]:
+                fetch(camera.id, f'10.9.1.{camera.id % 250}')
+                watched_ticks += 1
+        ticks += len(cameras)
+        time.sleep(1.0)
+    return watched_ticks / ticks if ticks else 0.0
+
+
+def run_always_on(supervisor, manager, cameras, duration):
+    """Run every relay for the duration; returns (cpu seconds, bytes)"""
+    supervisor.spawn_many((camera.id, manager.relay_args(camera)) for camera in cameras)
+    time.sleep(duration)
+    cpu_seconds = total = 0
+    for camera in cameras:
+        process = supervisor.processes[camera.id]
+        process.sample(time.monotonic())
+        cpu_seconds += process.cpu_seconds
+        total += int((process.progress or {}).get('total_size', 0))
+    supervisor.stop_many(camera.id for camera in cameras)
+    return cpu_seconds, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of the usage phase')
+    parser.add_argument('--watch-fraction', type=float, default=0.2)
+    parser.add_argument('--session', type=float, default=8.0, help='mean seconds a viewer watches')
+    parser.add_argument('--samples', type=int, default=5, help='starts timed per cold and warm phase')
+    parser.add_argument('--think', type=float, default=1.5,
+                        help='seconds between warming the relay and the first playlist fetch')
+    parser.add_argument('--connect-delay', type=float, default=0.3)
+    parser.add_argument('--probe-delay', type=float, default=5.0)
+    parser.add_argument('--load', type=float, default=0.01, help='cores one fake relay keeps busy')
+    parser.add_argument('--kbps', type=float, default=2048)
+    parser.add_argument('--idle-timeout', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ['HLS_ROOT'] = tempfile.mkdtemp(prefix='cctv-bench-hls-')
+    os.environ['FFMPEG_BIN'] = FAKE_FFMPEG
+    os.environ['INGEST_MAX_PROCESSES'] = str(args.cameras * 2)
+    os.environ['ONDEMAND_IDLE_TIMEOUT'] = str(args.idle_timeout)
+    os.environ['ONDEMAND_HLS_VIEWER_TIMEOUT'] = '2.5'
+    os.environ['ONDEMAND_PREROLL'] = str(args.think * 2)
+    os.environ['ONDEMAND_INTERVAL'] = '0.5'
+    os.environ['FAKE_FFMPEG_CONNECT_DELAY'] = str(args.connect_delay)
+    os.environ['FAKE_FFMPEG_PROBE_DELAY'] = str(args.probe_delay)
+    os.environ['FAKE_FFMPEG_LOAD'] = str(args.load)
+    os.environ['FAKE_FFMPEG_KBPS'] = str(args.kbps)
+    teardown = setup_django(file_database=True)
+    try:
+        from django.test import Client
+        from api.ingest import get_supervisor
+        from api.models import Camera
+        from api.ondemand import get_on_demand
+        from api.utils import start_streams
+
+        cameras = Camera.objects.bulk_create(
+            Camera(name=f'Camera {index}', ip_address='10.0.0.1', stream_id=f'stream{index}',
+                   source_url=f'rtsp://10.0.0.1/stream{index}', on_demand=True)
+            for index in range(args.cameras))
+        start_streams(cameras)
+        manager = get_on_demand()
+        assert wait_until(lambda: all(manager.manages(camera.id) for camera in cameras), 10)
+        assert not any(get_supervisor().is_running(camera.id) for camera in cameras)
+        client = Client(HTTP_HOST='localhost')
+        samples = cameras[:args.samples]
+        # Viewers are forgotten after the HLS timeout, then relays idle out
+        settle = 2.5 + args.idle_timeout + 5
+
+        # Usage first, while the manager has counted nothing else
+        watched = run_usage(cameras, args.duration, args.watch_fraction, args.session, args.seed)
+        manager.reconcile()
+        status = client.get('/api/cameras/on-demand/status/').json()
+        idle_out(manager, cameras, settle)
+
+        cold = [timed_start(manager, camera.id) for camera in samples]
+        idle_out(manager, samples, settle)
+
+        relay_args = manager.relay_args
+        manager.relay_args = lambda camera: without_probe_limit(relay_args(camera))
+        slow = [timed_start(manager, camera.id) for camera in samples]
+        manager.relay_args = relay_args
+        idle_out(manager, samples, settle)
+
+        def pre_roll(camera_id):
+            def before():
+                assert client.post(f'/api/cameras/{camera_id}/warm/').status_code == 200
+                time.sleep(args.think)
+            return before
+
+        warm = [timed_start(manager, camera.id, pre_roll(camera.id)) for camera in samples]
+        idle_out(manager, samples, settle + args.think * 2)
+        # Without the manager, which would stop the relays as unwatched
+        manager.stop()
+        always_cpu, always_bytes = run_always_on(get_supervisor(), manager, cameras, status['window_seconds'])
+
+        savings = status['savings']
+        report = {
+            'cameras': args.cameras,
+            'first_frame': {
+                'cold_fast_start': summary(cold),
+                'cold_default_probe': summary(slow),
+                'warm_preroll': summary(warm),
+            },
+            'usage': {
+                'seconds': status['window_seconds'],
+                'watched_fraction': round(watched, 3),
+                'duty_cycle': savings['duty_cycle'],
+                'cpu_seconds': savings['cpu_seconds'],
+                'bytes': savings['bytes'],
+                'estimated_always_on_cpu_seconds': savings['always_on_cpu_seconds'],
+                'estimated_always_on_bytes': savings['always_on_bytes'],
+                # The same relays all running for as long
+                'measured_always_on_cpu_seconds': round(always_cpu, 2),
+                'measured_always_on_bytes': always_bytes,
+                'cpu_saved_percent': round(100 * (1 - savings['cpu_seconds'] / always_cpu), 1)
+                if always_cpu else None,
+                'bytes_saved_percent': round(100 * (1 - savings['bytes'] / always_bytes), 1)
+                if always_bytes else None,
+            },
+        }
+        get_supervisor().shutdown()
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Measure HLS requests per second from the origin cache against direct file serving.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_origin --cameras 4 --viewers 400 --duration 10
+
+benchmarks/fake_hls.py writes live HLS for --cameras cameras the way
+nginx-rtmp does, one segment of --segment-bytes every --fragment seconds.
+--viewers players, spread over the cameras, reload the playlist and fetch
+each new segment, every --poll seconds (0: as fast as they are answered,
+which measures throughput). Every request is an ASGI call in this process.
+
+Two servers answer them in turn:
+
+- origin: origin_application, with playlists and live-edge segments in
+  memory, invalidated by the HLS watcher, and misses coalesced
+- direct: opens and reads the file for every request, as a plain file
+  server does (from the page cache, as the files are fresh)
+
+Reported are requests per second of each, their latency, and how many
+files were read.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_fleet import asgi_request
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+from benchmarks.fake_hls import FakeHLSWriter
+
+SEGMENT_PATTERN = re.compile(r'^([0-9]+\.ts)$', re.MULTILINE)
+
+
+class DirectServer:
+    """ASGI application reading the requested file for every request"""
+
+    def __init__(self, root):
+        self.root = root
+        self.disk_reads = 0
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    async def __call__(self, scope, receive, send):
+        relative = scope['path'][len('/hls/'):]
+        body = None
+        if '..' not in relative.split('/'):
+            self.disk_reads += 1
+            body = await asyncio.to_thread(self.read, os.path.join(self.root, relative))
+        status = 200 if body is not None else 404
+        body = body if body is not None else b'No such file'
+        content_type = b'application/vnd.apple.mpegurl' if relative.endswith('.m3u8') else b'video/mp2t'
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', content_type), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+async def viewer(application, camera_id, deadline, poll, samples):
+    newest = None
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        status, body = await asgi_request(application, 'GET', f'/hls/{camera_id}/index.m3u8')
+        samples.append(('playlist', status, time.perf_counter() - started))
+        if status == 200:
+            segments = SEGMENT_PATTERN.findall(body.decode())
+            if segments and segments[-1] != newest:
+                newest = segments[-1]
+                started = time.perf_counter()
+                status, _ = await asgi_request(application, 'GET', f'/hls/{camera_id}/{newest}')
+                samples.append(('segment', status, time.perf_counter() - started))
+        await asyncio.sleep(poll)
+
+
+async def watch(application, cameras, viewers, duration, poll):
+    samples = []
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(viewer(application, cameras[index % len(cameras)], deadline, poll, samples)
+                           for index in range(viewers)))
+    return samples, time.perf_counter() - started
+
+
+def summary(samples, elapsed):
+    report = {'requests_per_second': round(len(samples) / elapsed)}
+    for kind in ('playlist', 'segment'):
+        latencies = [seconds * 1000 for sample_kind, _, seconds in samples if sample_kind == kind]
+        report[kind] = {
+            'requests': len(latencies),
+            'requests_per_second': round(len(latencies) / elapsed),
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+        }
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    report['responses'] = statuses
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--viewers', type=int, default=400)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds each server is measured')
+    parser.add_argument('--fragment', type=float, default=2.0, help='seconds between segments')
+    parser.add_argument('--segment-bytes', type=int, default=512 * 1024)
+    parser.add_argument('--poll', type=float, default=0.0, help='seconds between a viewer\'s playlist reloads')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    root = tempfile.mkdtemp(prefix='cctv-bench-origin-')
+    os.environ['HLS_WATCH_ROOT'] = root
+    os.environ['HLS_ROOT'] = tempfile.mkdtemp(prefix='cctv-bench-hls-')
+    cameras = list(range(1, args.cameras + 1))
+    writer = FakeHLSWriter(root, cameras, fragment=args.fragment, segment_bytes=args.segment_bytes)
+    writer.tick()
+    stopped = threading.Event()
+
+    def write():
+        while not stopped.wait(args.fragment):
+            writer.tick()
+
+    teardown = setup_django(file_database=True)
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    try:
+        from api.hls import get_hls_watcher
+        from api.origin import get_origin_cache, origin_application
+
+        origin = get_origin_cache()
+        # The watcher reads the existing playlists before it reports rewrites
+        deadline = time.monotonic() + 10
+        while get_hls_watcher().latest_segment(cameras[-1]) is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        direct = DirectServer(root)
+        report = {
+            'cameras': args.cameras,
+            'viewers': args.viewers,
+            'poll_seconds': args.poll,
+            'segment_bytes': args.segment_bytes,
+            'watcher_mode': get_hls_watcher().active_mode,
+        }
+        samples, elapsed = asyncio.run(watch(origin_application, cameras, args.viewers, args.duration, args.poll))
+        report['origin'] = dict(summary(samples, elapsed), disk_reads=origin.disk_reads, cache=origin.status())
+        samples, elapsed = asyncio.run(watch(direct, cameras, args.viewers, args.duration, args.poll))
+        report['direct'] = dict(summary(samples, elapsed), disk_reads=direct.disk_reads)
+        report['speedup'] = round(report['origin']['requests_per_second']
+                                  / max(report['direct']['requests_per_second'], 1), 2)
+        get_hls_watcher().stop()
+    finally:
+        stopped.set()
+        thread.join()
+        teardown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
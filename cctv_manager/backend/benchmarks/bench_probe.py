@@ -0,0 +1,100 @@
+"""
+Measure RTMP probe throughput against a local stand-in server.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_probe --targets 1000 10000
+
+Starts benchmarks.fake_rtmp in a separate process and probes that many
+distinct endpoints (spread over 127.0.0.0/8 addresses so per-host rate
+limits do not serialise them) in handshake, connect and stream mode.
+Reports probes per second, p50/p99 probe latency and failures, plus the
+time to answer the same batch again from the TTL cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile
+
+
+def start_server(port, delay):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_rtmp', '--port', str(port), '--delay', str(delay)],
+        cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True,
+    )
+    process.stdout.readline()
+    return process
+
+
+def targets(count, port):
+    return [(f'127.{1 + index // 65536 % 254}.{index // 256 % 256}.{index % 256}', port, 'live')
+            for index in range(count)]
+
+
+async def measure(prober, batch, mode):
+    started = time.perf_counter()
+    results = await prober.probe_many(batch, mode, refresh=True)
+    elapsed = time.perf_counter() - started
+    latencies = [result['total_ms'] for result in results.values()]
+    failures = {}
+    for result in results.values():
+        if result['status'] != 'ok':
+            failures[result['status']] = failures.get(result['status'], 0) + 1
+
+    started = time.perf_counter()
+    await prober.probe_many(batch, mode)
+    cached = time.perf_counter() - started
+    return {
+        'seconds': round(elapsed, 3),
+        'probes_per_second': round(len(batch) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'failures': failures,
+        'cached_seconds': round(cached, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--targets', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=19350)
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='seconds the stand-in waits before each reply, to mimic a WAN')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    from api.probe import PROBE_MODES, RTMPProber
+
+    server = start_server(args.port, args.delay)
+    try:
+        report = {'concurrency': args.concurrency, 'delay': args.delay,
+                  'cpus': os.cpu_count(), 'results': {}}
+        for count in args.targets:
+            batch = targets(count, args.port)
+            report['results'][count] = {}
+            for mode in PROBE_MODES:
+                prober = RTMPProber(concurrency=args.concurrency, host_rate=5.0,
+                                    timeout=args.timeout, ttl=300)
+                report['results'][count][mode] = asyncio.run(measure(prober, batch, mode))
+    finally:
+        server.terminate()
+        server.wait()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
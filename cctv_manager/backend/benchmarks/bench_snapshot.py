@@ -0,0 +1,151 @@
+"""
+Measure snapshot serving for dashboards polling many cameras.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_snapshot --cameras 40 --clients 20 --rounds 5
+
+A fake nginx-rtmp writer appends one segment per camera per round and
+benchmarks/fake_ffmpeg.py stands in for the decoder (FAKE_FFMPEG_DECODE_DELAY
+seconds per keyframe). Every round, each simulated dashboard fetches a
+still of every camera, revalidating with If-None-Match, and then the same
+through one bulk request. Reports latency, the number of decodes against
+the number of requests (one decode per request without the cache) and the
+bytes an hls.js tile would have downloaded instead.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+from benchmarks.fake_hls import FakeHLSWriter
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+
+
+def dashboard_refresh(client, ids, etags):
+    samples = []
+    received = 0
+    for camera_id in ids:
+        headers = {'HTTP_IF_NONE_MATCH': etags[camera_id]} if camera_id in etags else {}
+        started = time.perf_counter()
+        response = client.get(f'/api/cameras/{camera_id}/snapshot.jpg', **headers)
+        samples.append(time.perf_counter() - started)
+        if response.status_code == 200:
+            etags[camera_id] = response['ETag']
+            received += len(response.content)
+        elif response.status_code != 304:
+            raise RuntimeError(f'snapshot of camera {camera_id} returned {response.status_code}')
+    return samples, received
+
+
+def bulk_refresh(client, ids):
+    started = time.perf_counter()
+    response = client.get('/api/cameras/bulk/snapshots/', {'ids': ','.join(map(str, ids))})
+    elapsed = time.perf_counter() - started
+    assert all(item['status'] == 'ok' for item in response.json().values())
+    return elapsed, len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=40)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--segment-bytes', type=int, default=512 * 1024)
+    parser.add_argument('--decode-delay', type=float, default=0.05,
+                        help='seconds the fake decoder takes per keyframe')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    root = tempfile.mkdtemp(prefix='cctv-bench-snapshot-')
+    os.environ['HLS_WATCH_ROOT'] = root
+    os.environ['FFMPEG_BIN'] = FAKE_FFMPEG
+    os.environ['FAKE_FFMPEG_DECODE_DELAY'] = str(args.decode_delay)
+    teardown = setup_django()
+    try:
+        from django.test import Client
+        from api.hls import get_hls_watcher
+        from api.models import Camera
+        from api.snapshot import get_snapshot_service
+
+        cameras = Camera.objects.bulk_create(
+            Camera(name=f'Camera {index}', ip_address='10.0.0.1', stream_id=f'stream{index}')
+            for index in range(args.cameras))
+        ids = [camera.id for camera in cameras]
+        writer = FakeHLSWriter(root, ids, fragment=1.0, segment_bytes=args.segment_bytes)
+        watcher = get_hls_watcher()
+        service = get_snapshot_service()
+        clients = [Client(HTTP_HOST='localhost') for _ in range(args.clients)]
+        etags = [{} for _ in clients]
+
+        tile_samples, bulk_samples = [], []
+        tile_bytes = bulk_bytes = requests = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.clients) as pool:
+            for _ in range(args.rounds):
+                writer.tick()
+                expected = writer.sequence[ids[0]]
+                deadline = time.monotonic() + 10
+                while any((watcher.latest_segment(camera_id) or (None,))[0] != expected
+                          for camera_id in ids):
+                    if time.monotonic() > deadline:
+                        raise RuntimeError('HLS watcher did not catch up')
+                    time.sleep(0.005)
+
+                for samples, received in pool.map(dashboard_refresh, clients, [ids] * args.clients, etags):
+                    tile_samples += samples
+                    tile_bytes += received
+                    requests += len(samples)
+                # Twice per round: the second refresh is answered with 304s
+                for samples, received in pool.map(dashboard_refresh, clients, [ids] * args.clients, etags):
+                    tile_samples += samples
+                    tile_bytes += received
+                    requests += len(samples)
+                for elapsed, received in pool.map(bulk_refresh, clients, [ids] * args.clients):
+                    bulk_samples.append(elapsed)
+                    bulk_bytes += received
+                    requests += len(ids)
+
+        segments = args.cameras * args.rounds
+        report = {
+            'cameras': args.cameras,
+            'clients': args.clients,
+            'rounds': args.rounds,
+            'decode_delay': args.decode_delay,
+            'snapshot_requests': requests,
+            'decodes': service.decodes,
+            'decodes_per_segment': round(service.decodes / segments, 3),
+            'tile': {
+                'p50_ms': round(percentile(tile_samples, 0.5) * 1000, 3),
+                'p99_ms': round(percentile(tile_samples, 0.99) * 1000, 3),
+                'bytes': tile_bytes,
+            },
+            'bulk': {
+                'p50_ms': round(percentile(bulk_samples, 0.5) * 1000, 3),
+                'p99_ms': round(percentile(bulk_samples, 0.99) * 1000, 3),
+                'bytes': bulk_bytes,
+            },
+            'hls_players_bytes': args.clients * segments * args.segment_bytes,
+            'service': service.stats(),
+        }
+        watcher.stop()
+    finally:
+        teardown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Measure cold start: import time, container preparation and time to the first request.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_startup --runs 5
+
+Everything runs in fresh processes against a throw-away SQLite database,
+static root and schema file, prepared first as the image build does.
+
+- import: wall time of importing cctv_manager.asgi in a new interpreter,
+  and whether NumPy (only needed for motion detection) was imported
+- prepare: the entrypoint's work before the server starts, on a container
+  restart where nothing changed. before runs collectstatic, makemigrations
+  and migrate as separate commands, as the entrypoint did; after runs
+  manage.py prestart, which skips what is current
+- serve: uvicorn is started with the ASGI application; reported are the
+  seconds until it answers /api/ready/ at all (listening) and with 200
+  (ready), and the latency of the first API request (GET /api/cameras/)
+  and of the first schema request, sent either as soon as the server
+  listens (cold) or once it is ready (warm)
+
+Medians of --runs runs are reported.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.django_setup import BACKEND_DIR
+
+IMPORT_SCRIPT = ("import sys, time; started = time.perf_counter(); import cctv_manager.asgi; "
+                 "print(time.perf_counter() - started, 'numpy' in sys.modules)")
+
+
+def manage(*args):
+    """Run a management command, returning its wall time in seconds"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, 'manage.py', *args], cwd=BACKEND_DIR, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def measure_import():
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=BACKEND_DIR, check=True,
+                            capture_output=True, text=True).stdout.split()
+    return float(output[0]), output[1] == 'True'
+
+
+def get(port, path):
+    """GET a path of the local server: (status, seconds), status None if it does not listen yet"""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_serve(warm):
+    """Start uvicorn and time readiness and the first requests, sent cold or once ready"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'cctv_manager.asgi:application', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            status, _ = get(port, '/api/ready/')
+            if status is not None and 'listening' not in result:
+                result['listening'] = time.perf_counter() - started
+                if not warm:
+                    break
+            if status == 200:
+                result['ready'] = time.perf_counter() - started
+                break
+            time.sleep(0.005)
+        status, result['first_api_request'] = get(port, '/api/cameras/')
+        if status != 200:
+            raise RuntimeError(f'GET /api/cameras/ answered {status}')
+        status, result['first_schema_request'] = get(port, '/swagger/?format=openapi')
+        if status != 200:
+            raise RuntimeError(f'GET /swagger/?format=openapi answered {status}')
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def medians(runs):
+    return {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='cctv-bench-startup-')
+    os.environ['SQLITE_PATH'] = os.path.join(directory, 'db.sqlite3')
+    os.environ['STATIC_ROOT'] = os.path.join(directory, 'static')
+    os.environ['SWAGGER_SCHEMA_FILE'] = os.path.join(directory, 'swagger.json')
+    os.environ['HLS_ROOT'] = os.path.join(directory, 'hls')
+    manifest = os.path.join(directory, 'staticfiles.build.json')
+    try:
+        # What the image build and the first start of a container leave behind
+        manage('collectstatic', '--noinput')
+        shutil.copy(os.path.join(os.environ['STATIC_ROOT'], 'staticfiles.json'), manifest)
+        manage('generate_swagger', '--overwrite', os.environ['SWAGGER_SCHEMA_FILE'])
+        manage('migrate', '--noinput')
+
+        imports = [measure_import() for _ in range(args.runs)]
+        before = [{
+            'collectstatic': manage('collectstatic', '--noinput'),
+            'makemigrations': manage('makemigrations', '--check', '--dry-run'),
+            'migrate': manage('migrate', '--noinput'),
+        } for _ in range(args.runs)]
+        for run in before:
+            run['total'] = sum(run.values())
+        after = [{'total': manage('prestart', '--build-manifest', manifest)} for _ in range(args.runs)]
+        report = {
+            'runs': args.runs,
+            'import': {
+                'seconds': round(statistics.median(seconds for seconds, _ in imports), 4),
+                'numpy_imported': any(numpy for _, numpy in imports),
+            },
+            'prepare': {
+                'before': medians(before),
+                'after': medians(after),
+            },
+            'serve': {
+                'cold': medians([measure_serve(False) for _ in range(args.runs)]),
+                'warm': medians([measure_serve(True) for _ in range(args.runs)]),
+            },
+        }
+        prepare = report['prepare']
+        prepare['speedup'] = round(prepare['before']['total'] / prepare['after']['total'], 1)
+        # From starting a container to serving API requests without paying for imports:
+        # before, the old entrypoint and then the server listening; after, prestart and ready
+        report['time_to_ready'] = {
+            'before': round(prepare['before']['total'] + report['serve']['cold']['listening'], 3),
+            'after': round(prepare['after']['total'] + report['serve']['warm']['ready'], 3),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
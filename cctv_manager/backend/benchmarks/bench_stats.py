@@ -0,0 +1,131 @@
+"""
+Measure nginx-rtmp statistics ingestion for many streams.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_stats --streams 100 1000 5000
+
+For each stream count, benchmarks/fake_stats.py serves a statistics
+document over HTTP and the collector polls it repeatedly. Reports the poll
+time (fetch and parse), the peak memory of incremental parsing against
+building the whole tree with ElementTree.fromstring, and the latency of the
+metrics endpoints answered from the collected values.
+"""
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+from benchmarks.fake_stats import FakeStatsServer, make_stats
+
+
+def parse_whole(document):
+    """Parse the statistics the straightforward way, holding the whole tree"""
+    from api.stats import parse_stream
+
+    root = ET.fromstring(document)
+    return [(application.findtext('name'), parse_stream(stream))
+            for application in root.iter('application')
+            for stream in application.iter('stream')]
+
+
+def peak_kb(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return {
+        'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--streams', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    teardown = setup_django()
+    try:
+        from django.test import Client
+        from api.models import Camera
+        from api.stats import RTMPStatsCollector, iter_stats
+
+        client = Client(HTTP_HOST='localhost')
+        report = {'polls': args.polls, 'results': {}}
+        created = 0
+        for streams in args.streams:
+            document = make_stats(streams)
+            server = FakeStatsServer(document)
+            url = server.start()
+            collector = RTMPStatsCollector(url, interval=5.0, history=720)
+            try:
+                poll = timed(collector.poll_once, args.polls)
+            finally:
+                server.stop()
+
+            assert collector.polls == args.polls, collector.status()
+            incremental_kb = peak_kb(lambda: sum(1 for _ in iter_stats(io.BytesIO(document))))
+            whole_kb = peak_kb(parse_whole, document)
+
+            # Stream names are camera ids, so make sure those cameras exist
+            if streams > created:
+                Camera.objects.bulk_create(
+                    Camera(name=f'Camera {index}', ip_address='10.0.0.1', stream_id=f'stream{index}')
+                    for index in range(created, streams))
+                created = streams
+            ids = [*Camera.objects.order_by('id').values_list('id', flat=True)[:streams]]
+            mapped = sum(1 for value in collector.latest_many(ids).values() if value)
+            assert mapped == streams, (mapped, streams)
+
+            from api import views
+            previous, views.get_stats_collector = views.get_stats_collector, lambda: collector
+            try:
+                detail = timed(lambda: client.get(f'/api/cameras/{ids[0]}/metrics/', {'window': 300}),
+                               args.requests)
+                page = ','.join(map(str, ids[:100]))
+                bulk = timed(lambda: client.get('/api/cameras/bulk/metrics/', {'ids': page}),
+                             max(args.requests // 10, 1))
+            finally:
+                views.get_stats_collector = previous
+
+            report['results'][streams] = {
+                'document_kb': round(len(document) / 1024, 1),
+                'poll': poll,
+                'parse_peak_kb': {'iterparse': incremental_kb, 'fromstring': whole_kb},
+                'cameras_mapped': mapped,
+                'series_samples': len(collector.metrics(ids[0])['streams'][f'live/{ids[0]}']['series']['t']),
+                'metrics_endpoint': detail,
+                'bulk_metrics_100_endpoint': bulk,
+            }
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
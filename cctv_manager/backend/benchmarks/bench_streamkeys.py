@@ -0,0 +1,177 @@
+"""
+Measure stream key checks in the RTMP callbacks during a reconnect storm.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_streamkeys --cameras 1000 --rounds 5
+
+Every round, all cameras send on_publish at once, as after an nginx-rtmp
+restart or a network blip, through the ASGI callback fast path. Reports
+callback latency and throughput with the in-memory key index, against
+looking the key up in the database per callback, and checks that wrong
+keys, expired tokens and retired keys are rejected while signed tokens and
+the previous key during the rotation grace period are accepted.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+import time
+from urllib.parse import urlencode
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+
+
+async def callback(application, action, params):
+    body = urlencode(params).encode()
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': f'/api/stream/{action}', 'query_string': b''}
+    await application(scope, receive, send)
+    return sent[0]['status']
+
+
+async def storm(application, action, params_list):
+    """Send all callbacks concurrently; returns (latencies, statuses, seconds)"""
+    async def timed(params):
+        started = time.perf_counter()
+        status = await callback(application, action, params)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(timed(params) for params in params_list))
+    return [latency for latency, _ in results], [status for _, status in results], time.perf_counter() - started
+
+
+def summary(latencies, seconds):
+    return {
+        'p50_us': round(percentile(latencies, 0.5) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 0.99) * 1e6, 1),
+        'callbacks_per_second': round(len(latencies) / seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    teardown = setup_django(file_database=True)
+    try:
+        from asgiref.sync import sync_to_async
+        from api import callbacks
+        from api.callbacks import callback_application, get_state_writer
+        from api.models import Camera
+        from api.streamkeys import get_stream_keys, make_token
+        from django.test import Client
+        from django.utils import timezone
+
+        cameras = Camera.objects.bulk_create(
+            Camera(name=f'Camera {index}', ip_address='10.0.0.1', stream_id=f'stream{index}')
+            for index in range(args.cameras))
+        index = get_stream_keys()
+        assert index.wait_loaded(10)
+        publishes = [{'app': 'live', 'name': camera.id, 'addr': '10.1.0.5', 'key': camera.stream_key}
+                     for camera in cameras]
+
+        def run_rounds(application):
+            latencies, seconds = [], 0.0
+            for _ in range(args.rounds):
+                round_latencies, statuses, elapsed = asyncio.run(storm(application, 'on_publish', publishes))
+                assert set(statuses) == {200}, set(statuses)
+                latencies += round_latencies
+                seconds += elapsed
+            get_state_writer().flush()
+            return summary(latencies, seconds)
+
+        memory = run_rounds(callback_application)
+
+        # The same storm if on_publish had to read the key from the database
+        authorize = callbacks.authorize
+
+        def database_authorize(action, params):
+            key = Camera.objects.filter(id=int(params['name'])).values_list('stream_key', flat=True).first()
+            return key is not None and key == params.get('key')
+
+        async def database_application(scope, receive, send):
+            message = await receive()
+            params = dict(item.split('=', 1) for item in message['body'].decode().split('&'))
+            allowed = await sync_to_async(database_authorize)('on_publish', params)
+
+            async def replay():
+                return message
+            callbacks.authorize = lambda action, params: allowed
+            try:
+                await callback_application(scope, replay, send)
+            finally:
+                callbacks.authorize = authorize
+
+        database = run_rounds(database_application)
+
+        # Rejections, tokens and rotation
+        camera = cameras[0]
+        base = {'app': 'live', 'name': camera.id, 'addr': '10.1.0.5'}
+        play_token, _ = make_token(camera.stream_key, 'play', camera.id, 60)
+        publish_token, _ = make_token(camera.stream_key, 'publish', camera.id, 60)
+        expired_token, _ = make_token(camera.stream_key, 'publish', camera.id, -1)
+        checks = {
+            'wrong_key': asyncio.run(callback(callback_application, 'on_publish', dict(base, key='nope'))),
+            'no_key': asyncio.run(callback(callback_application, 'on_publish', base)),
+            'unknown_camera': asyncio.run(callback(callback_application, 'on_publish',
+                                                   dict(base, name=10 ** 9, key=camera.stream_key))),
+            'publish_token': asyncio.run(callback(callback_application, 'on_publish',
+                                                  dict(base, token=publish_token))),
+            'play_token_for_publish': asyncio.run(callback(callback_application, 'on_publish',
+                                                           dict(base, token=play_token))),
+            'expired_token': asyncio.run(callback(callback_application, 'on_publish',
+                                                  dict(base, token=expired_token))),
+        }
+        old_key = camera.stream_key
+        client = Client(HTTP_HOST='localhost')
+        new_key = client.post(f'/api/cameras/{camera.id}/stream-key/rotate/').json()['stream_key']
+        checks['new_key'] = asyncio.run(callback(callback_application, 'on_publish', dict(base, key=new_key)))
+        checks['old_key_in_grace'] = asyncio.run(callback(callback_application, 'on_publish',
+                                                          dict(base, key=old_key)))
+        Camera.objects.filter(id=camera.id).update(
+            stream_key_rotated_at=timezone.now() - datetime.timedelta(hours=1))
+        index.load()
+        checks['old_key_after_grace'] = asyncio.run(callback(callback_application, 'on_publish',
+                                                             dict(base, key=old_key)))
+        expected = {'wrong_key': 403, 'no_key': 403, 'unknown_camera': 403, 'publish_token': 200,
+                    'play_token_for_publish': 403, 'expired_token': 403, 'new_key': 200,
+                    'old_key_in_grace': 200, 'old_key_after_grace': 403}
+        assert checks == expected, checks
+
+        report = {
+            'cameras': args.cameras,
+            'rounds': args.rounds,
+            'memory_index': memory,
+            'database_lookup': database,
+            'checks': checks,
+            'index': index.stats(),
+        }
+        get_state_writer().stop()
+        index.stop()
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Measure bitrate ladder scheduling against the node's cores with fake encoders.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_transcode --cameras 8 --duration 10
+
+benchmarks/fake_ffmpeg.py stands in for ffmpeg: every ladder keeps the cores
+the manager estimates for it busy while it keeps up with real time, and
+reports -progress like ffmpeg. All cameras want a ladder at once. The run is
+done with the core budget (--cores, default the cores this process may use)
+and again without a limit, reporting how many ladders ran, their speed and
+the encoded fps per rung. A last phase checks that a 'viewers' ladder starts
+with its first viewer and stops idle_timeout after the last one left.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ffmpeg.py')
+RTMP_URL = 'rtmp://127.0.0.1:1935/live'
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def make_manager(capacity, cameras, pixels_per_core, idle_timeout=60.0):
+    from api.ingest import IngestSupervisor
+    from api.transcode import LadderManager
+
+    supervisor = IngestSupervisor(ffmpeg_bin=FAKE_FFMPEG, max_processes=max(len(cameras), 1),
+                                  sample_interval=1.0, stop_timeout=2.0)
+    manager = LadderManager(supervisor, RTMP_URL, capacity=capacity,
+                            pixels_per_core=pixels_per_core, idle_timeout=idle_timeout)
+    os.environ['FAKE_FFMPEG_LOAD'] = str(manager.estimated_cost)
+    for camera in cameras:
+        manager.update(camera)
+        manager.set_publishing(camera.id, True)
+    return manager
+
+
+def run_fleet(capacity, cameras, pixels_per_core, duration):
+    manager = make_manager(capacity, cameras, pixels_per_core)
+    try:
+        states = manager.reconcile()
+        time.sleep(duration)
+        ladders = [ladder for ladder in manager.status()['cameras'] if ladder['state'] == 'running']
+    finally:
+        manager.stop()
+        manager.supervisor.shutdown()
+
+    speeds = [ladder['speed'] for ladder in ladders if ladder['speed'] is not None]
+    rung_fps = {}
+    for index, rung in enumerate(manager.rungs):
+        fps = [ladder['rungs'][index]['fps'] for ladder in ladders if ladder['speed'] is not None]
+        rung_fps[rung.suffix] = {
+            'target': rung.fps,
+            'p50': percentile(fps, 0.5),
+            'min': min(fps, default=0.0),
+            'total': round(sum(fps), 1),
+        }
+    return {
+        'capacity': capacity if capacity != float('inf') else None,
+        'estimated_cores_per_ladder': round(manager.estimated_cost, 3),
+        'running': sum(1 for state in states.values() if state == 'running'),
+        'queued': sum(1 for state in states.values() if state == 'queued'),
+        'speed_p50': percentile(speeds, 0.5),
+        'speed_min': min(speeds, default=0.0),
+        'saturated': sum(1 for ladder in ladders if ladder['saturated']),
+        'cpu_percent': round(sum(ladder['cpu_percent'] or 0 for ladder in ladders), 1),
+        'rung_fps': rung_fps,
+    }
+
+
+def run_viewers(camera, pixels_per_core, idle_timeout):
+    """Start on the first viewer, linger for idle_timeout after the last one, then stop"""
+    manager = make_manager(float('inf'), [camera], pixels_per_core, idle_timeout)
+    try:
+        checks = {'without_viewers': manager.reconcile()[camera.id]}
+        manager.viewer_joined(camera.id)
+        started = time.perf_counter()
+        checks['first_viewer'] = manager.reconcile()[camera.id]
+        wait_until(lambda: manager.ladder(camera.id)['speed'] is not None, 10)
+        checks['first_progress_seconds'] = round(time.perf_counter() - started, 2)
+        manager.viewer_left(camera.id)
+        checks['last_viewer_left'] = manager.reconcile()[camera.id]
+        time.sleep(idle_timeout)
+        checks['after_idle_timeout'] = manager.reconcile()[camera.id]
+        checks['process_stopped'] = not manager.supervisor.is_running(f'ladder-{camera.id}')
+    finally:
+        manager.stop()
+        manager.supervisor.shutdown()
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--cores', type=float, default=0.0,
+                        help='core budget of the scheduled run (default: available cores)')
+    parser.add_argument('--pixels-per-core', type=float, default=200e6,
+                        help='sizes the estimated (and simulated) cost of one ladder')
+    parser.add_argument('--idle-timeout', type=float, default=1.0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    teardown = setup_django()
+    try:
+        from api.models import TRANSCODE_ALWAYS, TRANSCODE_VIEWERS, Camera
+        from api.transcode import available_cores
+
+        cores = args.cores or available_cores()
+        cameras = [Camera(id=index + 1, transcode=TRANSCODE_ALWAYS, stream_key=f'key{index}')
+                   for index in range(args.cameras)]
+        report = {
+            'cameras': args.cameras,
+            'duration': args.duration,
+            'cores': cores,
+            'scheduled': run_fleet(cores, cameras, args.pixels_per_core, args.duration),
+            'unscheduled': run_fleet(float('inf'), cameras, args.pixels_per_core, args.duration),
+        }
+        checks = run_viewers(Camera(id=1, transcode=TRANSCODE_VIEWERS, stream_key='key'),
+                             args.pixels_per_core, args.idle_timeout)
+        assert checks['without_viewers'] == 'idle', checks
+        assert checks['first_viewer'] == 'running', checks
+        assert checks['last_viewer_left'] == 'running', checks
+        assert checks['after_idle_timeout'] == 'idle' and checks['process_stopped'], checks
+        report['viewers'] = checks
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
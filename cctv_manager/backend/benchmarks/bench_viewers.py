@@ -0,0 +1,186 @@
+"""
+Measure viewer session tracking: callback cost, rollup writes and series queries.
+
+Usage (from cctv_manager/backend):
+
+    python -m benchmarks.bench_viewers --cameras 500 --viewers 2000 --hours 1
+
+Simulates --hours of viewing on a clock of its own, so an hour takes
+seconds: --viewers viewers on average watch --cameras cameras, picked with
+Zipf-like popularity, for sessions lasting --session-minutes on average;
+some play a stream on a second connection. Every --flush-interval
+simulated seconds the tracker writes its rollups, as its thread would.
+
+- callbacks: wall time of ViewerTracker.play() and done(), the work the
+  on_play and on_done callbacks gained
+- flush: wall time and rows written per flush
+- accuracy: sessions, seconds watched and peak concurrent viewers of the
+  fleet from the rollups, against the exact values of the simulated sessions
+- queries: latency of GET /api/cameras/<id>/viewers/ for the most watched
+  camera and of GET /api/cameras/viewers/ over the simulated span, per
+  resolution (median of --repeat requests)
+"""
+import argparse
+import datetime
+import heapq
+import json
+import random
+import statistics
+import sys
+import time
+
+from benchmarks.django_setup import BACKEND_DIR, percentile, setup_django
+
+
+class SimulatedClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def timed_get(client, path, params, repeat):
+    """Median seconds of GET requests, failing on anything but 200"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path, params)
+        samples.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {path} answered {response.status_code}')
+    return statistics.median(samples), len(response.json()['series'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=500)
+    parser.add_argument('--viewers', type=int, default=2000, help='viewers watching at once on average')
+    parser.add_argument('--hours', type=float, default=1.0, help='simulated hours of viewing')
+    parser.add_argument('--session-minutes', type=float, default=10.0, help='average session length')
+    parser.add_argument('--flush-interval', type=float, default=10.0, help='simulated seconds between flushes')
+    parser.add_argument('--repeat', type=int, default=20, help='requests per query')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    teardown = setup_django(file_database=True)
+    try:
+        from django.test import Client
+
+        from api import viewers
+        from api.models import Camera
+
+        rng = random.Random(args.seed)
+        cameras = Camera.objects.bulk_create(
+            Camera(name=f'Camera {index}', ip_address=f'10.0.{index // 256 % 256}.{index % 256}')
+            for index in range(args.cameras))
+        camera_ids = [camera.id for camera in cameras]
+        popularity = [1.0 / (rank + 1) for rank in range(len(camera_ids))]
+
+        # Start on an hour boundary, as dashboards would look at it
+        start = time.time() // 3600 * 3600 - args.hours * 3600
+        end = start + args.hours * 3600
+        clock = SimulatedClock(start)
+        tracker = viewers.ViewerTracker(flush_interval=args.flush_interval, minute_retention=0,
+                                        hour_retention=0, clock=clock)
+        viewers._tracker = tracker
+
+        # Viewers arrive at the rate that keeps --viewers watching; (end, camera id, addr, connections)
+        arrival_rate = args.viewers / (args.session_minutes * 60)
+        ending = []
+        next_arrival = start
+        next_flush = start + args.flush_interval
+        addr = 0
+        exact = {'sessions': 0, 'watch_seconds': 0.0, 'peak_viewers': 0}
+        play_seconds, done_seconds, flushes = [], [], []
+        while True:
+            now = min(next_arrival, next_flush, ending[0][0] if ending else end, end)
+            if now >= end:
+                break
+            clock.now = now
+            if ending and ending[0][0] == now:
+                _, camera_id, viewer, connections = heapq.heappop(ending)
+                for _ in range(connections):
+                    started = time.perf_counter()
+                    tracker.done(str(camera_id), viewer)
+                    done_seconds.append(time.perf_counter() - started)
+            elif next_arrival == now:
+                addr += 1
+                viewer = f'10.{addr // 65536 % 256}.{addr // 256 % 256}.{addr % 256}'
+                camera_id = rng.choices(camera_ids, popularity)[0]
+                duration = rng.expovariate(1 / (args.session_minutes * 60))
+                connections = 2 if rng.random() < 0.1 else 1
+                for _ in range(connections):
+                    started = time.perf_counter()
+                    tracker.play(str(camera_id), viewer, camera_id)
+                    play_seconds.append(time.perf_counter() - started)
+                watched_until = min(now + duration, end)
+                exact['sessions'] += 1
+                exact['watch_seconds'] += watched_until - now
+                heapq.heappush(ending, (now + duration, camera_id, viewer, connections))
+                exact['peak_viewers'] = max(exact['peak_viewers'], len(ending))
+                next_arrival = now + rng.expovariate(arrival_rate)
+            else:
+                started = time.perf_counter()
+                rows = tracker.flush()
+                flushes.append((time.perf_counter() - started, rows))
+                next_flush += args.flush_interval
+        clock.now = end
+        tracker.flush()
+
+        client = Client()
+        since = datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc).isoformat()
+        until = datetime.datetime.fromtimestamp(end, tz=datetime.timezone.utc).isoformat()
+        fleet = client.get('/api/cameras/viewers/', {'since': since, 'until': until, 'resolution': 'hour'}).json()
+        top = camera_ids[0]
+        queries = {}
+        for resolution in viewers.RESOLUTIONS:
+            params = {'since': since, 'until': until, 'resolution': resolution}
+            for name, path in (('camera', f'/api/cameras/{top}/viewers/'), ('fleet', '/api/cameras/viewers/')):
+                seconds, points = timed_get(client, path, params, args.repeat)
+                queries[f'{name}_{resolution}'] = {'points': points, 'ms': round(seconds * 1000, 3)}
+
+        flush_seconds = [seconds for seconds, _ in flushes]
+        report = {
+            'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+            'callbacks': {
+                'plays': len(play_seconds),
+                'dones': len(done_seconds),
+                'play_p50_us': round(percentile(play_seconds, 0.5) * 1e6, 2),
+                'play_p99_us': round(percentile(play_seconds, 0.99) * 1e6, 2),
+                'done_p50_us': round(percentile(done_seconds, 0.5) * 1e6, 2),
+                'done_p99_us': round(percentile(done_seconds, 0.99) * 1e6, 2),
+            },
+            'flush': {
+                'count': len(flushes),
+                'rows_per_flush': round(statistics.mean(rows for _, rows in flushes), 1) if flushes else 0,
+                'p50_ms': round(percentile(flush_seconds, 0.5) * 1000, 3),
+                'p99_ms': round(percentile(flush_seconds, 0.99) * 1000, 3),
+                'max_ms': round(max(flush_seconds) * 1000, 3) if flushes else 0.0,
+            },
+            'accuracy': {
+                'exact': {key: round(value, 1) for key, value in exact.items()},
+                'rollups': {
+                    'sessions': sum(point['sessions'] for point in fleet['series']),
+                    'watch_seconds': round(sum(point['watch_seconds'] for point in fleet['series']), 1),
+                    'peak_viewers': max((point['peak_viewers'] for point in fleet['series']), default=0),
+                },
+            },
+            'queries': queries,
+        }
+        tracker.stop()
+    finally:
+        teardown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Helpers for benchmarks that exercise the Django application.
+"""
+import logging
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(quiet=True, file_database=False):
+    """
+    Configure Django against a throw-away test database
+
+    Args:
+        quiet: Silence INFO logging so it does not dominate the measurements
+        file_database: Put an SQLite test database in a temporary file instead
+                       of memory, so journal and locking settings apply
+
+    Returns:
+        callable: Teardown function destroying the test database
+    """
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cctv_manager.settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    if quiet:
+        logging.disable(logging.INFO)
+    setup_test_environment()
+    if file_database and connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp(prefix='cctv-bench-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'test.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0)
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    return teardown
+
+
+def percentile(samples, fraction):
+    """Return the given percentile (0..1) of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
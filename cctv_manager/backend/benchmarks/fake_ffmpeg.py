@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Stand-in for ffmpeg used by the benchmarks.
+
+Accepts any ffmpeg command line, then writes a progress line to stderr every
+FAKE_FFMPEG_INTERVAL seconds until it is terminated. If FAKE_FFMPEG_EXIT_AFTER
+is set, it exits with status 1 after that many seconds to exercise restarts.
+
+Two invocations that read from stdin are imitated instead: keyframe
+snapshots (-f image2pipe) read stdin, wait FAKE_FFMPEG_DECODE_DELAY seconds
+and write a PPM of the requested scale width, and remuxes to pipe:1 copy
+stdin to stdout.
+
+With -progress pipe:1 (bitrate ladders, on-demand relays) it keeps
+FAKE_FFMPEG_LOAD cores busy while encoding at the first fps= filter's rate
+(25 without one), never faster than real time, and writes ffmpeg -progress
+reports to stdout, counting FAKE_FFMPEG_KBPS of output. Without enough CPU
+it falls behind and reports a speed below 1. The first frame comes after
+FAKE_FFMPEG_CONNECT_DELAY seconds plus FAKE_FFMPEG_PROBE_DELAY, the time
+probing the source takes, capped by -analyzeduration.
+
+With -frag_duration (LL-HLS packagers) it writes fragmented MP4 to stdout
+the way ffmpeg's mp4 muxer does with frag_keyframe: one video track at 25
+fps with a keyframe every FAKE_FFMPEG_GOP seconds, a fragment closed before
+each keyframe and before the first frame past -frag_duration, FAKE_FFMPEG_KBPS
+of payload. The first 8 bytes of every sample are the Unix time the frame
+was captured, so benchmarks can measure latency from capture.
+
+With -pix_fmt gray (motion decoders) it writes grayscale rawvideo of the
+scale= size at the fps= rate: a fixed noisy scene with sensor noise, and a
+bright square crossing it for FAKE_FFMPEG_MOTION_ON seconds out of every
+FAKE_FFMPEG_MOTION_PERIOD. The moves of each source start at their own
+offset into the period, which FAKE_FFMPEG_MOTION_LOG, if set, gets a line
+for: "<source URL> <Unix time of the first move> <period> <seconds on>".
+"""
+import os
+import random
+import re
+import signal
+import struct
+import sys
+import time
+import zlib
+
+
+def snapshot(args):
+    sys.stdin.buffer.read()
+    time.sleep(float(os.getenv('FAKE_FFMPEG_DECODE_DELAY', '0.02')))
+    width = 1280
+    for arg in args:
+        match = re.match(r'scale=(\d+):', arg)
+        if match:
+            width = int(match.group(1))
+    height = width * 9 // 16 // 2 * 2
+    row = bytes(x * 255 // max(width - 1, 1) for x in range(width) for _ in range(3))
+    sys.stdout.buffer.write(f'P6\n{width} {height}\n255\n'.encode() + row * height)
+
+
+def remux():
+    while True:
+        chunk = sys.stdin.buffer.read1(1024 * 1024)
+        if not chunk:
+            break
+        sys.stdout.buffer.write(chunk)
+
+
+def transcode(args):
+    load = float(os.getenv('FAKE_FFMPEG_LOAD', '0.5'))
+    kbps = float(os.getenv('FAKE_FFMPEG_KBPS', '2048'))
+    probe = float(os.getenv('FAKE_FFMPEG_PROBE_DELAY', '0'))
+    if '-analyzeduration' in args:
+        probe = min(probe, int(args[args.index('-analyzeduration') + 1]) / 1e6)
+    time.sleep(float(os.getenv('FAKE_FFMPEG_CONNECT_DELAY', '0')) + probe)
+    fps = 25
+    for arg in args:
+        match = re.search(r'fps=(\d+)', arg)
+        if match:
+            fps = int(match.group(1))
+            break
+
+    started = reported = time.monotonic()
+    frame = 0
+    while True:
+        busy_until = time.process_time() + load / fps
+        while time.process_time() < busy_until:
+            pass
+        frame += 1
+        media = frame / fps
+        now = time.monotonic()
+        # A live source delivers no faster than real time
+        if started + media > now:
+            time.sleep(started + media - now)
+            now = time.monotonic()
+        if frame == 1 or now - reported >= 0.5:
+            reported = now
+            elapsed = now - started
+            sys.stdout.write(f"frame={frame}\nfps={frame / elapsed:.2f}\ntotal_size={int(media * kbps * 125)}\n"
+                             f"out_time_us={int(media * 1e6)}\nspeed={media / elapsed:.3f}x\nprogress=continue\n")
+            sys.stdout.flush()
+
+
+def box(kind, *payloads):
+    payload = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def full_box(kind, version, flags, *payloads):
+    return box(kind, struct.pack('>I', version << 24 | flags), *payloads)
+
+
+# Timescale of the fake video track
+TIMESCALE = 90000
+# Sample flags: a keyframe, and a frame depending on others
+KEY_SAMPLE = 0x02000000
+DELTA_SAMPLE = 0x01010000
+
+
+def init_segment():
+    tkhd = full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, 1, 0, 0), bytes(60))
+    mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIII', 0, 0, TIMESCALE, 0), bytes(4))
+    hdlr = full_box(b'hdlr', 0, 0, bytes(4), b'vide', bytes(12), b'VideoHandler\x00')
+    trex = full_box(b'trex', 0, 0, struct.pack('>5I', 1, 1, 0, 0, 0))
+    return (box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomiso6mp41')
+            + box(b'moov', full_box(b'mvhd', 0, 0, bytes(96)),
+                  box(b'trak', tkhd, box(b'mdia', mdhd, hdlr)),
+                  box(b'mvex', trex)))
+
+
+def fragment(sequence, samples, base):
+    """moof + mdat of (duration, flags, payload) samples starting at base"""
+    entries = b''.join(struct.pack('>III', duration, len(payload), flags) for duration, flags, payload in samples)
+    mdat = box(b'mdat', *(payload for _, _, payload in samples))
+
+    def moof(data_offset):
+        trun = full_box(b'trun', 0, 0x701, struct.pack('>Ii', len(samples), data_offset), entries)
+        traf = box(b'traf', full_box(b'tfhd', 0, 0x020000, struct.pack('>I', 1)),
+                   full_box(b'tfdt', 1, 0, struct.pack('>Q', base)), trun)
+        return box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)), traf)
+
+    header = moof(0)
+    return moof(len(header) + 8) + mdat
+
+
+def fragments(args):
+    kbps = float(os.getenv('FAKE_FFMPEG_KBPS', '2048'))
+    gop = float(os.getenv('FAKE_FFMPEG_GOP', '3'))
+    probe = float(os.getenv('FAKE_FFMPEG_PROBE_DELAY', '0'))
+    if '-analyzeduration' in args:
+        probe = min(probe, int(args[args.index('-analyzeduration') + 1]) / 1e6)
+    time.sleep(float(os.getenv('FAKE_FFMPEG_CONNECT_DELAY', '0')) + probe)
+    limit = int(args[args.index('-frag_duration') + 1]) * TIMESCALE // 1000000
+    fps = 25
+    duration = TIMESCALE // fps
+    filler = bytes(max(int(kbps * 125 / fps) - 8, 0))
+    out = sys.stdout.buffer
+    out.write(init_segment())
+    out.flush()
+
+    started = time.monotonic()
+    samples = []
+    base = sequence = frame = 0
+    while True:
+        due = started + frame / fps
+        now = time.monotonic()
+        if due > now:
+            time.sleep(due - now)
+        key = frame % max(int(gop * fps), 1) == 0
+        # ffmpeg writes a fragment when the next packet would not fit in it
+        if samples and (key or len(samples) * duration >= limit):
+            sequence += 1
+            out.write(fragment(sequence, samples, base))
+            out.flush()
+            base += len(samples) * duration
+            samples = []
+        samples.append((duration, KEY_SAMPLE if key else DELTA_SAMPLE, struct.pack('>d', time.time()) + filler))
+        frame += 1
+
+
+def gray_frames(args):
+    width, height, fps = 320, 180, 5.0
+    for arg in args:
+        match = re.search(r'scale=(\d+):(\d+)', arg)
+        if match:
+            width, height = int(match.group(1)), int(match.group(2))
+        match = re.search(r'fps=([0-9.]+)', arg)
+        if match:
+            fps = float(match.group(1))
+    period = float(os.getenv('FAKE_FFMPEG_MOTION_PERIOD', '10'))
+    moving = float(os.getenv('FAKE_FFMPEG_MOTION_ON', '3'))
+    source = args[args.index('-i') + 1]
+    rng = random.Random(zlib.crc32(source.encode()))
+    scene = bytes(rng.randrange(40, 160) for _ in range(width * height))
+    # A few frames of sensor noise to cycle through
+    noisy = []
+    for _ in range(4):
+        frame = bytearray(scene)
+        for index in range(rng.randrange(7), len(frame), 7):
+            frame[index] = max(0, min(255, frame[index] + rng.randrange(-6, 7)))
+        noisy.append(frame)
+    size = max(height // 6, 2)
+    row = bytes([250]) * size
+
+    time.sleep(float(os.getenv('FAKE_FFMPEG_CONNECT_DELAY', '0')))
+    started = time.time()
+    offset = zlib.crc32(source.encode()) % int(period * 1000) / 1000
+    if os.getenv('FAKE_FFMPEG_MOTION_LOG'):
+        with open(os.environ['FAKE_FFMPEG_MOTION_LOG'], 'a') as f:
+            f.write(f'{source} {started + offset:.3f} {period} {moving}\n')
+    out = sys.stdout.buffer
+    frame_number = 0
+    while True:
+        due = started + frame_number / fps
+        now = time.time()
+        if due > now:
+            time.sleep(due - now)
+        frame = noisy[frame_number % len(noisy)]
+        phase = (frame_number / fps - offset) % period
+        if frame_number / fps >= offset and phase < moving:
+            frame = bytearray(frame)
+            left = int(phase / moving * (width - size))
+            top = (height - size) // 2
+            for y in range(top, top + size):
+                frame[y * width + left:y * width + left + size] = row
+        out.write(frame)
+        out.flush()
+        frame_number += 1
+
+
+def main():
+    args = sys.argv[1:]
+    if 'image2pipe' in args:
+        return snapshot(args)
+    if '-frag_duration' in args or '-pix_fmt' in args:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            return fragments(args) if '-frag_duration' in args else gray_frames(args)
+        except BrokenPipeError:
+            return
+    if args and args[-1] == 'pipe:1':
+        return remux()
+
+    interval = float(os.getenv('FAKE_FFMPEG_INTERVAL', '1'))
+    exit_after = float(os.getenv('FAKE_FFMPEG_EXIT_AFTER', '0'))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if '-progress' in args:
+        return transcode(args)
+
+    started = time.monotonic()
+    frame = 0
+    while True:
+        frame += int(25 * interval)
+        elapsed = time.monotonic() - started
+        sys.stderr.write(f"frame={frame} fps=25 time={elapsed:.2f} bitrate=2048.0kbits/s speed=1x\n")
+        sys.stderr.flush()
+        if exit_after and elapsed >= exit_after:
+            sys.exit(1)
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Stand-in for nginx-rtmp's HLS output, used by benchmarks.
+
+Writes <root>/<camera id>/index.m3u8 and sequential .ts segments the way
+nginx-rtmp does with hls_nested and hls_fragment_naming sequential: each
+segment is written first, then the playlist is rewritten to a temporary
+file and renamed over index.m3u8. Old segments beyond the playlist length
+are removed.
+
+Can also run standalone:
+
+    python -m benchmarks.fake_hls /tmp/hls --cameras 10 --fragment 3
+"""
+import argparse
+import os
+import struct
+import time
+
+TS_PACKET_SIZE = 188
+VIDEO_PID = 0x100
+PMT_PID = 0x1000
+
+
+def _pts_bytes(pts):
+    return bytes([
+        0x21 | ((pts >> 29) & 0x0e), (pts >> 22) & 0xff, 0x01 | ((pts >> 14) & 0xfe),
+        (pts >> 7) & 0xff, 0x01 | ((pts << 1) & 0xfe),
+    ])
+
+
+def make_ts_segment(first_pts, duration, fps=25, gop=50, frame_bytes=4000):
+    """
+    Build an MPEG-TS segment shaped like nginx-rtmp's output
+
+    PAT and PMT come first, then one video PES per frame with a PTS; the
+    first packet of every gop-th frame carries the random access indicator.
+    Payloads are filler, so the result is not decodable video.
+
+    Args:
+        first_pts: PTS of the first frame (90 kHz)
+        duration: Segment duration in seconds
+        fps: Frames per second
+        gop: Frames between keyframes
+        frame_bytes: Approximate size of every frame
+
+    Returns:
+        bytes: The segment
+    """
+    packets = [
+        b'\x47\x40\x00\x10' + b'\x00' + bytes(TS_PACKET_SIZE - 5),
+        struct.pack('>BH', 0x47, 0x4000 | PMT_PID) + b'\x10' + b'\x00' + bytes(TS_PACKET_SIZE - 5),
+    ]
+    counter = 0
+    for frame in range(int(duration * fps)):
+        pts = (first_pts + frame * 90000 // fps) % (1 << 33)
+        flags = 0x50 if frame % gop == 0 else 0x10
+        header = struct.pack('>BH', 0x47, 0x4000 | VIDEO_PID) + bytes([0x30 | counter])
+        adaptation = bytes([7, flags]) + bytes(6)
+        pes = b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05' + _pts_bytes(pts)
+        first = header + adaptation + pes
+        packets.append(first + b'\xff' * (TS_PACKET_SIZE - len(first)))
+        counter = (counter + 1) % 16
+        for _ in range(frame_bytes // (TS_PACKET_SIZE - 4)):
+            header = struct.pack('>BH', 0x47, VIDEO_PID) + bytes([0x10 | counter])
+            packets.append(header + b'\xaa' * (TS_PACKET_SIZE - 4))
+            counter = (counter + 1) % 16
+    return b''.join(packets)
+
+
+class FakeHLSWriter:
+    """Generate live HLS playlists and segments for a set of stream names"""
+
+    def __init__(self, root, names, fragment=3.0, segment_bytes=256 * 1024, playlist_length=5):
+        self.root = root
+        self.names = list(names)
+        self.fragment = fragment
+        self.segment_bytes = segment_bytes
+        self.playlist_length = playlist_length
+        self.sequence = {name: 0 for name in self.names}
+        self.frozen = set()
+        self._payload = os.urandom(min(segment_bytes, 64 * 1024))
+        for name in self.names:
+            os.makedirs(os.path.join(root, str(name)), exist_ok=True)
+
+    def _write_segment(self, path):
+        with open(path, 'wb') as f:
+            remaining = self.segment_bytes
+            while remaining > 0:
+                chunk = self._payload[:remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+
+    def write_playlist(self, name, discontinuity=False):
+        directory = os.path.join(self.root, str(name))
+        last = self.sequence[name]
+        first = max(0, last - self.playlist_length + 1)
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-MEDIA-SEQUENCE:{first}',
+            f'#EXT-X-TARGETDURATION:{int(round(self.fragment))}',
+        ]
+        for sequence in range(first, last + 1):
+            if discontinuity and sequence == last:
+                lines.append('#EXT-X-DISCONTINUITY')
+            lines.append(f'#EXTINF:{self.fragment:.3f},')
+            lines.append(f'{sequence}.ts')
+        temporary = os.path.join(directory, 'index.m3u8.tmp')
+        with open(temporary, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(temporary, os.path.join(directory, 'index.m3u8'))
+
+    def tick(self, discontinuity=False):
+        """Append one segment to every stream that is not frozen"""
+        for name in self.names:
+            if name in self.frozen:
+                continue
+            directory = os.path.join(self.root, str(name))
+            self.sequence[name] += 1
+            sequence = self.sequence[name]
+            self._write_segment(os.path.join(directory, f'{sequence}.ts'))
+            self.write_playlist(name, discontinuity)
+            stale = sequence - self.playlist_length - 2
+            if stale >= 0:
+                try:
+                    os.remove(os.path.join(directory, f'{stale}.ts'))
+                except FileNotFoundError:
+                    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('root')
+    parser.add_argument('--cameras', type=int, default=10)
+    parser.add_argument('--fragment', type=float, default=3.0)
+    parser.add_argument('--segment-bytes', type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    writer = FakeHLSWriter(args.root, range(1, args.cameras + 1), args.fragment, args.segment_bytes)
+    while True:
+        writer.tick()
+        time.sleep(args.fragment)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Stand-in RTMP server, used to test and benchmark the RTMP prober.
+
+Answers the simple handshake, connect and createStream like nginx-rtmp
+does, without ever carrying media. Applications listed in --reject get an
+_error for connect; --delay adds latency before each reply.
+
+    python -m benchmarks.fake_rtmp --port 19350 --reject private
+"""
+import argparse
+import asyncio
+import os
+import struct
+
+from api.probe import (
+    HANDSHAKE_SIZE, MSG_COMMAND_AMF0, MSG_SET_CHUNK_SIZE, RTMP_VERSION,
+    ChunkReader, amf_decode_all, amf_encode, encode_message,
+)
+
+
+class FakeRTMPServer:
+
+    def __init__(self, reject=(), delay=0.0):
+        self.reject = set(reject)
+        self.delay = delay
+        self.connections = 0
+        self.server = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            c0 = await reader.readexactly(1)
+            await reader.readexactly(HANDSHAKE_SIZE)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            s1 = bytes(8) + os.urandom(HANDSHAKE_SIZE - 8)
+            writer.write(bytes([RTMP_VERSION]) + s1 + bytes(HANDSHAKE_SIZE))
+            await writer.drain()
+            if c0[0] != RTMP_VERSION:
+                return
+            await reader.readexactly(HANDSHAKE_SIZE)
+
+            chunks = ChunkReader(reader)
+            writer.write(encode_message(2, MSG_SET_CHUNK_SIZE, struct.pack('>I', 4096)))
+            chunk_size = 4096
+            while True:
+                message_type, payload = await chunks.read_message()
+                if message_type != MSG_COMMAND_AMF0:
+                    continue
+                values = amf_decode_all(payload)
+                name, transaction_id = values[0], values[1]
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if name == 'connect':
+                    app = values[2].get('app', '') if isinstance(values[2], dict) else ''
+                    if app in self.reject:
+                        reply = [amf_encode('_error'), amf_encode(transaction_id), amf_encode(None),
+                                 amf_encode({'level': 'error', 'code': 'NetConnection.Connect.Rejected',
+                                             'description': f'Application {app} rejected'})]
+                    else:
+                        reply = [amf_encode('_result'), amf_encode(transaction_id),
+                                 amf_encode({'fmsVer': 'FMS/3,0,1,123', 'capabilities': 31}),
+                                 amf_encode({'level': 'status', 'code': 'NetConnection.Connect.Success',
+                                             'description': 'Connection succeeded.'})]
+                elif name == 'createStream':
+                    reply = [amf_encode('_result'), amf_encode(transaction_id), amf_encode(None),
+                             amf_encode(1)]
+                else:
+                    continue
+                writer.write(encode_message(3, MSG_COMMAND_AMF0, b''.join(reply), chunk_size=chunk_size))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=4096)
+        return self.server.sockets[0].getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=19350)
+    parser.add_argument('--reject', nargs='*', default=[], help='applications to reject on connect')
+    parser.add_argument('--delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    async def serve():
+        server = FakeRTMPServer(args.reject, args.delay)
+        port = await server.start(args.host, args.port)
+        print(f'Fake RTMP server listening on port {port}', flush=True)
+        await server.server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Stand-in nginx-rtmp statistics page, used to test and benchmark the collector.
+
+Serves benchmarks/fixtures/stats.xml at /stats, or with --streams a
+document of the same shape with that many publishing streams named 1..N in
+the live application (one viewer each, every tenth dropping frames).
+
+    python -m benchmarks.fake_stats --port 18080 --streams 1000
+"""
+import argparse
+import http.server
+import os
+import re
+import threading
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'stats.xml')
+
+
+def load_fixture():
+    with open(FIXTURE, 'rb') as f:
+        return f.read()
+
+
+def make_stats(streams):
+    """
+    Build a statistics document with many streams from the fixture
+
+    Args:
+        streams: Number of streams in the live application
+
+    Returns:
+        bytes: The XML document
+    """
+    fixture = load_fixture().decode()
+    head, rest = fixture.split('<server>', 1)
+    # The first stream of the fixture is a 1080p camera with viewers
+    template = re.search(r'<stream>\s*<name>1</name>.*?</stream>', rest, re.S).group(0)
+    blocks = []
+    for index in range(1, streams + 1):
+        block = template.replace('<name>1</name>', f'<name>{index}</name>', 1)
+        if index % 10:
+            block = block.replace('<dropped>12</dropped>', '<dropped>0</dropped>')
+        blocks.append(block)
+    return (f'{head}<server>\n<application>\n<name>live</name>\n<live>\n'
+            + '\n'.join(blocks)
+            + f'\n<nclients>{streams * 3}</nclients>\n</live>\n</application>\n</server>\n</rtmp>\n').encode()
+
+
+class FakeStatsServer:
+
+    def __init__(self, document=None):
+        self.document = load_fixture() if document is None else document
+        self.requests = 0
+        self.server = None
+        self._thread = None
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the statistics URL"""
+        owner = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/stats':
+                    self.send_error(404)
+                    return
+                owner.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(owner.document)))
+                self.end_headers()
+                self.wfile.write(owner.document)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return f'http://{host}:{self.server.server_address[1]}/stats'
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--streams', type=int, default=0,
+                        help='generate this many streams instead of serving the fixture')
+    args = parser.parse_args()
+
+    server = FakeStatsServer(make_stats(args.streams) if args.streams else None)
+    url = server.start(args.host, args.port)
+    print(f'Fake nginx-rtmp statistics at {url}', flush=True)
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
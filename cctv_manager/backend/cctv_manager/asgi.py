@@ -2,12 +2,85 @@
 ASGI config for cctv_manager project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+
+nginx-rtmp callbacks under /api/stream/, the camera event stream under
+/api/events/cameras/, low-latency HLS under /llhls/, the HLS origin
+under /hls/ and the readiness probe /api/ready/ are served by lightweight
+ASGI apps that skip Django's middleware stack; everything else goes to
+Django.
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cctv_manager.settings')
 
-application = get_asgi_application() 
\ No newline at end of file
+django_application = get_asgi_application()
+
+# Imported after Django is set up because it uses the ORM
+from api.callbacks import callback_application, get_state_writer  # noqa: E402
+from api.dvr import get_recorder  # noqa: E402
+from api.events import camera_events_application  # noqa: E402
+from api.hls import get_hls_watcher  # noqa: E402
+from api.llhls import get_low_latency, llhls_application  # noqa: E402
+from api.motion import get_motion_detector  # noqa: E402
+from api.ondemand import get_on_demand  # noqa: E402
+from api.origin import get_origin_cache, origin_application  # noqa: E402
+from api.stats import get_stats_collector  # noqa: E402
+from api.streamkeys import get_stream_keys  # noqa: E402
+from api.transcode import get_ladder_manager  # noqa: E402
+from api.viewers import get_viewer_tracker  # noqa: E402
+from api.warmup import get_warmup, readiness_application  # noqa: E402
+
+CALLBACK_PREFIX = '/api/stream/'
+CAMERA_EVENTS_PATH = '/api/events/cameras/'
+LLHLS_PREFIX = '/llhls/'
+HLS_ORIGIN_PREFIX = '/hls/'
+READY_PATH = '/api/ready/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].startswith(CALLBACK_PREFIX):
+        return await callback_application(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'] == CAMERA_EVENTS_PATH:
+        return await camera_events_application(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'].startswith(LLHLS_PREFIX):
+        return await llhls_application(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'].startswith(HLS_ORIGIN_PREFIX):
+        return await origin_application(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'] == READY_PATH:
+        return await readiness_application(scope, receive, send)
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                get_recorder()
+                get_stats_collector()
+                get_ladder_manager()
+                get_on_demand()
+                get_low_latency()
+                get_motion_detector()
+                get_origin_cache()
+                # Publishers are rejected until the stream keys are in memory
+                await asyncio.to_thread(get_stream_keys().wait_loaded, 10)
+                # Views, schema and database checks finish in the background
+                get_warmup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Their last writes use the ORM, which must not run on the event loop
+                await asyncio.to_thread(get_state_writer().stop)
+                await asyncio.to_thread(get_viewer_tracker().stop)
+                get_recorder().stop()
+                get_stats_collector().stop()
+                get_stream_keys().stop()
+                get_ladder_manager().stop()
+                get_on_demand().stop()
+                get_low_latency().stop()
+                get_motion_detector().stop()
+                get_hls_watcher().stop()
+                get_warmup().stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    return await django_application(scope, receive, send)
@@ -0,0 +1,116 @@
+"""
+PostgreSQL backend with a psycopg 3 connection pool
+
+Set OPTIONS['pool'] to a dict of psycopg_pool.ConnectionPool arguments
+(min_size, max_size, timeout, max_idle, ...) to enable pooling. Django
+then checks a connection out of the pool when a request first touches the
+database and returns it when the request ends, instead of opening a new
+server connection each time. CONN_MAX_AGE must be 0 in that mode.
+Without 'pool' this behaves exactly like django.db.backends.postgresql.
+"""
+import atexit
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import DatabaseCreation as BaseDatabaseCreation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel, is_psycopg3
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    ConnectionPool = None
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def close_pools(alias=None):
+    """Close the connection pools of one database alias, or all of them"""
+    with _pools_lock:
+        keys = [key for key in _pools if alias is None or key[0] == alias]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_pools)
+
+
+class DatabaseCreation(BaseDatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections to the test database would block DROP DATABASE
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    @property
+    def pool(self):
+        """The pool for this alias and database, or None if pooling is off"""
+        pool_options = self.settings_dict['OPTIONS'].get('pool')
+        if not pool_options or self.settings_dict['NAME'] is None:
+            # Maintenance connections to the 'postgres' database are not pooled
+            return None
+        if not is_psycopg3 or ConnectionPool is None:
+            raise ImproperlyConfigured(
+                "Database connection pooling requires psycopg 3 and psycopg_pool"
+            )
+        if self.settings_dict['CONN_MAX_AGE']:
+            raise ImproperlyConfigured(
+                "CONN_MAX_AGE must be 0 when database connection pooling is enabled"
+            )
+
+        settings_dict = self.settings_dict
+        key = (self.alias, settings_dict['NAME'], settings_dict['HOST'],
+               settings_dict['PORT'], settings_dict['USER'])
+        pool = _pools.get(key)
+        if pool is None:
+            with _pools_lock:
+                pool = _pools.get(key)
+                if pool is None:
+                    options = dict(pool_options) if isinstance(pool_options, dict) else {}
+                    options.setdefault('check', ConnectionPool.check_connection)
+                    pool = ConnectionPool(
+                        kwargs=self.get_connection_params(),
+                        name=f'django-{self.alias}',
+                        open=True,
+                        **options,
+                    )
+                    _pools[key] = pool
+        return pool
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        try:
+            self.isolation_level = IsolationLevel(isolation_level or IsolationLevel.READ_COMMITTED)
+        except ValueError:
+            raise ImproperlyConfigured(
+                f"Invalid transaction isolation level {isolation_level} specified."
+            )
+        connection = pool.getconn()
+        if isolation_level:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return None
+        pool = self.pool
+        if pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            # The pool rolls back anything left open before reusing it
+            pool.putconn(self.connection)
+            self.connection = None
@@ -0,0 +1,51 @@
+"""
+SQLite backend tuned for concurrent API reads and callback writes
+
+Accepts these extra keys in OPTIONS, applied to every new connection:
+
+    journal_mode      PRAGMA journal_mode, e.g. 'WAL' so readers never
+                      block the writer and vice versa
+    synchronous       PRAGMA synchronous, e.g. 'NORMAL' (safe with WAL)
+    busy_timeout      PRAGMA busy_timeout in milliseconds; how long a
+                      connection waits for a lock before 'database is locked'
+    cache_size        PRAGMA cache_size (negative values are KiB)
+    mmap_size         PRAGMA mmap_size in bytes
+    transaction_mode  'DEFERRED', 'IMMEDIATE' or 'EXCLUSIVE'; IMMEDIATE takes
+                      the write lock when a transaction starts, so the busy
+                      timeout applies instead of failing on lock upgrade
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PRAGMA_OPTIONS = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size')
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for name in PRAGMA_OPTIONS + ('transaction_mode',):
+            params.pop(name, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        options = self.settings_dict['OPTIONS']
+        for name in PRAGMA_OPTIONS:
+            value = options.get(name)
+            if value not in (None, ''):
+                connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    @property
+    def transaction_mode(self):
+        mode = (self.settings_dict['OPTIONS'].get('transaction_mode') or 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"Invalid SQLite transaction_mode {mode!r}; use one of {', '.join(TRANSACTION_MODES)}"
+            )
+        return mode
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
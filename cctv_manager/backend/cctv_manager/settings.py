@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 # Load environment variables from .env file
 load_dotenv()
@@ -36,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',  # First, so latency includes the other middleware
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # WhiteNoise middleware
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -74,6 +76,10 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'last-event-id',
+]
+CORS_EXPOSE_HEADERS = [
+    'x-events-cursor',
 ]
 
 ROOT_URLCONF = 'cctv_manager.urls'
@@ -95,14 +101,58 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'cctv_manager.wsgi.application'
+ASGI_APPLICATION = 'cctv_manager.asgi.application'
 
 # Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE selects 'sqlite' (default) or 'postgresql'
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+# Seconds to keep a connection open between requests (not used with pooling)
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '600'))
+
+if DB_ENGINE == 'postgresql':
+    # Connections are pooled unless DB_POOL_MAX_SIZE is 0
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'cctv_manager.db.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'cctv'),
+            'USER': os.getenv('POSTGRES_USER', 'cctv'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'db'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': DB_POOL_MAX_SIZE,
+            # Seconds a request waits for a free connection
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'cctv_manager.db.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # WAL lets API reads proceed while callbacks write
+                'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+                # NORMAL only syncs at checkpoints, which is durable enough with WAL
+                'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+                # Milliseconds to wait for the write lock instead of failing
+                'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),
+                # Take the write lock up front so waits go through busy_timeout
+                'transaction_mode': os.getenv('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unsupported DB_ENGINE {DB_ENGINE!r}; use 'sqlite' or 'postgresql'")
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -128,7 +178,7 @@ USE_TZ = True
 
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = os.getenv('STATIC_URL', '/static/')
-STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+STATIC_ROOT = os.getenv('STATIC_ROOT', os.path.join(BASE_DIR, 'static'))
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Default primary key field type
@@ -139,10 +189,13 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10,
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
+# Maximum number of cameras accepted by a single bulk request
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '1000'))
+
 # Swagger settings
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -155,17 +208,221 @@ SWAGGER_SETTINGS = {
     'DEFAULT_MODEL_RENDERING': 'model',
     'DEFAULT_MODEL_DEPTH': 3,
     'VALIDATOR_URL': None,
+    # Lets manage.py generate_swagger write the schema the API serves
+    'DEFAULT_INFO': 'api.schema.API_INFO',
 }
+# JSON schema written at build time by manage.py generate_swagger; served instead of
+# generating it in every worker (unset: generated on the first request)
+SWAGGER_SCHEMA_FILE = os.getenv('SWAGGER_SCHEMA_FILE', '')
 
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # HLS Settings
-HLS_ROOT = os.path.join(MEDIA_ROOT, 'hls')
+HLS_ROOT = os.getenv('HLS_ROOT', os.path.join(MEDIA_ROOT, 'hls'))
 HLS_BASE_URL = os.getenv('HLS_BASE_URL', '/media/hls')
 
+# HLS origin shield settings (served by the backend under /hls/ from HLS_WATCH_ROOT)
+# Where players reach the origin; when set, hls_url points there instead of at the RTMP nodes
+HLS_ORIGIN_BASE_URL = os.getenv('HLS_ORIGIN_BASE_URL', '').rstrip('/')
+# Total size of the playlists and live-edge segments held in memory, per worker
+HLS_ORIGIN_CACHE_BYTES = int(os.getenv('HLS_ORIGIN_CACHE_BYTES', str(256 * 1024 * 1024)))
+# Seconds players and proxies may reuse a playlist; keep it well below the segment duration
+HLS_ORIGIN_PLAYLIST_MAX_AGE = int(os.getenv('HLS_ORIGIN_PLAYLIST_MAX_AGE', '1'))
+# Seconds players and proxies may reuse a segment, which never changes once listed
+HLS_ORIGIN_SEGMENT_MAX_AGE = int(os.getenv('HLS_ORIGIN_SEGMENT_MAX_AGE', '60'))
+
+# HLS health watcher settings
+# Directory nginx-rtmp writes HLS to (its hls_path), as mounted in this container
+HLS_WATCH_ROOT = os.getenv('HLS_WATCH_ROOT', HLS_ROOT)
+# 'auto' uses inotify where available and polls otherwise; 'inotify' or 'poll' force one
+HLS_WATCH_MODE = os.getenv('HLS_WATCH_MODE', 'auto')
+# Seconds between playlist checks in polling mode
+HLS_POLL_INTERVAL = float(os.getenv('HLS_POLL_INTERVAL', '1'))
+# Number of recent segments used for duration jitter and bitrate
+HLS_HEALTH_WINDOW = int(os.getenv('HLS_HEALTH_WINDOW', '20'))
+# A stream is stale when no segment arrived for this many target durations
+HLS_STALE_FACTOR = float(os.getenv('HLS_STALE_FACTOR', '3'))
+
+# Recording (DVR) settings
+# Directory holding archived segments and their seek index, per camera and day
+RECORDINGS_ROOT = os.getenv('RECORDINGS_ROOT', os.path.join(MEDIA_ROOT, 'recordings'))
+# Days of footage kept per camera (0 keeps everything)
+RECORDING_RETENTION_DAYS = int(os.getenv('RECORDING_RETENTION_DAYS', '0'))
+# Longest clip one export request may cover
+CLIP_EXPORT_MAX_HOURS = float(os.getenv('CLIP_EXPORT_MAX_HOURS', '24'))
+
+# Snapshot settings
+# Keyframe decodes (ffmpeg processes) running at once
+SNAPSHOT_WORKERS = int(os.getenv('SNAPSHOT_WORKERS', '2'))
+# Total size of cached JPEGs
+SNAPSHOT_CACHE_BYTES = int(os.getenv('SNAPSHOT_CACHE_BYTES', str(32 * 1024 * 1024)))
+SNAPSHOT_QUALITY = int(os.getenv('SNAPSHOT_QUALITY', '75'))
+# Width snapshots are scaled to unless the request asks otherwise (0 keeps the source size)
+SNAPSHOT_WIDTH = int(os.getenv('SNAPSHOT_WIDTH', '480'))
+# Seconds allowed for one decode
+SNAPSHOT_TIMEOUT = float(os.getenv('SNAPSHOT_TIMEOUT', '5'))
+
+# Ingest supervisor settings (pull-mode cameras)
+FFMPEG_BIN = os.getenv('FFMPEG_BIN', 'ffmpeg')
+RTMP_INGEST_URL = os.getenv('RTMP_INGEST_URL', 'rtmp://rtmp_server:1935/live')
+INGEST_MAX_PROCESSES = int(os.getenv('INGEST_MAX_PROCESSES', '256'))
+INGEST_BACKOFF_INITIAL = float(os.getenv('INGEST_BACKOFF_INITIAL', '1'))
+INGEST_BACKOFF_MAX = float(os.getenv('INGEST_BACKOFF_MAX', '60'))
+INGEST_STOP_TIMEOUT = float(os.getenv('INGEST_STOP_TIMEOUT', '5'))
+
+# Adaptive bitrate ladder settings (Camera.transcode)
+# Cores ladders may use; 0 takes the cores the backend may run on (CPU affinity
+# and cgroup quota) minus TRANSCODE_RESERVED_CORES
+TRANSCODE_CORES = float(os.getenv('TRANSCODE_CORES', '0'))
+# Cores left for nginx-rtmp, the ingest relays and the backend itself
+TRANSCODE_RESERVED_CORES = float(os.getenv('TRANSCODE_RESERVED_CORES', '1'))
+# Encoded pixels per second one core sustains with libx264 veryfast; sizes the cost estimate of a ladder
+TRANSCODE_PIXELS_PER_CORE = float(os.getenv('TRANSCODE_PIXELS_PER_CORE', '40000000'))
+# Seconds a ladder of a 'viewers' camera keeps running after its last viewer left
+TRANSCODE_IDLE_TIMEOUT = float(os.getenv('TRANSCODE_IDLE_TIMEOUT', '60'))
+# Seconds an HLS playlist fetch counts as a viewer of a 'viewers' camera
+TRANSCODE_HLS_VIEWER_TIMEOUT = float(os.getenv('TRANSCODE_HLS_VIEWER_TIMEOUT', '15'))
+# Seconds between scheduling passes
+TRANSCODE_INTERVAL = float(os.getenv('TRANSCODE_INTERVAL', '5'))
+
+# On-demand ingest settings (Camera.on_demand)
+# Seconds a relay keeps running after its last viewer left
+ONDEMAND_IDLE_TIMEOUT = float(os.getenv('ONDEMAND_IDLE_TIMEOUT', '60'))
+# Seconds an HLS playlist fetch counts as a viewer; players refetch every segment duration
+ONDEMAND_HLS_VIEWER_TIMEOUT = float(os.getenv('ONDEMAND_HLS_VIEWER_TIMEOUT', '15'))
+# Seconds a relay started ahead of a viewer (warm/) runs without one
+ONDEMAND_PREROLL = float(os.getenv('ONDEMAND_PREROLL', '30'))
+# Seconds between passes stopping idle relays
+ONDEMAND_INTERVAL = float(os.getenv('ONDEMAND_INTERVAL', '2'))
+
+# Low-latency HLS settings (Camera.latency)
+# Where players reach the backend's LL-HLS origin; nginx proxies /llhls to it
+LLHLS_BASE_URL = os.getenv('LLHLS_BASE_URL', '/llhls')
+# Seconds of media per partial segment; three of them are the player's hold-back
+LLHLS_PART_TARGET = float(os.getenv('LLHLS_PART_TARGET', '0.5'))
+# Shortest segment; segments start on keyframes, so they last a whole number of GOPs
+LLHLS_SEGMENT_TARGET = float(os.getenv('LLHLS_SEGMENT_TARGET', '2'))
+# Complete segments kept in memory and listed in the playlist
+LLHLS_SEGMENTS = int(os.getenv('LLHLS_SEGMENTS', '6'))
+# Seconds between passes starting and stopping packagers
+LLHLS_INTERVAL = float(os.getenv('LLHLS_INTERVAL', '5'))
+
+# Motion detection settings (Camera.motion)
+# Size of the grayscale frames motion is detected in
+MOTION_WIDTH = int(os.getenv('MOTION_WIDTH', '320'))
+MOTION_HEIGHT = int(os.getenv('MOTION_HEIGHT', '180'))
+# Frames per second analysed per camera
+MOTION_FPS = float(os.getenv('MOTION_FPS', '5'))
+# Seconds without motion that end an event
+MOTION_COOLDOWN = float(os.getenv('MOTION_COOLDOWN', '3'))
+# Seconds between passes starting and stopping decoders
+MOTION_INTERVAL = float(os.getenv('MOTION_INTERVAL', '5'))
+
+# RTMP callback settings
+# Seconds to collect on_publish/on_publish_done events before writing them
+CALLBACK_COALESCE_WINDOW = float(os.getenv('CALLBACK_COALESCE_WINDOW', '0.25'))
+# Streams that need a key or token: 'off', 'publish' or 'all' (publish and RTMP play)
+STREAM_AUTH = os.getenv('STREAM_AUTH', 'publish')
+# Seconds the previous stream key keeps working after a rotation
+STREAM_KEY_GRACE = float(os.getenv('STREAM_KEY_GRACE', '300'))
+# Seconds between reloads of the in-memory stream key index
+STREAM_KEY_RELOAD_INTERVAL = float(os.getenv('STREAM_KEY_RELOAD_INTERVAL', '60'))
+# Default lifetime of signed stream tokens in seconds
+STREAM_TOKEN_TTL = int(os.getenv('STREAM_TOKEN_TTL', '3600'))
+
+# Camera event stream settings
+# Number of camera deltas kept for resuming clients
+CAMERA_EVENT_LOG_SIZE = int(os.getenv('CAMERA_EVENT_LOG_SIZE', '10000'))
+# Seconds between keepalive comments on idle event streams
+CAMERA_EVENT_KEEPALIVE = float(os.getenv('CAMERA_EVENT_KEEPALIVE', '15'))
+
+# RTMP reachability prober settings
+# Probes in flight at once
+RTMP_PROBE_CONCURRENCY = int(os.getenv('RTMP_PROBE_CONCURRENCY', '200'))
+# Probes per second to any one host (0 disables the limit)
+RTMP_PROBE_HOST_RATE = float(os.getenv('RTMP_PROBE_HOST_RATE', '5'))
+# Seconds allowed for one probe, connection included
+RTMP_PROBE_TIMEOUT = float(os.getenv('RTMP_PROBE_TIMEOUT', '3'))
+# Seconds a probe result is reused
+RTMP_PROBE_TTL = float(os.getenv('RTMP_PROBE_TTL', '60'))
+
+# nginx-rtmp statistics collector settings
+# rtmp_stat page to poll; empty disables the collector
+RTMP_STATS_URL = os.getenv('RTMP_STATS_URL', '')
+# Seconds between polls
+RTMP_STATS_INTERVAL = float(os.getenv('RTMP_STATS_INTERVAL', '5'))
+# Samples kept per stream (history x interval seconds of series)
+RTMP_STATS_HISTORY = int(os.getenv('RTMP_STATS_HISTORY', '720'))
+RTMP_STATS_TIMEOUT = float(os.getenv('RTMP_STATS_TIMEOUT', '3'))
+
+# Viewer analytics settings, see api.viewers
+# Seconds between writes of the viewer rollups
+VIEWER_FLUSH_INTERVAL = float(os.getenv('VIEWER_FLUSH_INTERVAL', '10'))
+# Days per-minute and per-hour rollups are kept (0 keeps them forever)
+VIEWER_MINUTE_RETENTION = int(os.getenv('VIEWER_MINUTE_RETENTION', '7'))
+VIEWER_HOUR_RETENTION = int(os.getenv('VIEWER_HOUR_RETENTION', '400'))
+
+# Camera response cache settings
+# Cache implementation: api.cache.LRUResponseCache (in-process) or
+# api.cache.DjangoResponseCache (Django's CACHES, shareable between workers)
+CAMERA_RESPONSE_CACHE = os.getenv('CAMERA_RESPONSE_CACHE', 'api.cache.LRUResponseCache')
+CAMERA_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('CAMERA_RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+# Seconds an entry may be served; changes invalidate entries immediately
+CAMERA_RESPONSE_CACHE_TTL = float(os.getenv('CAMERA_RESPONSE_CACHE_TTL', '30'))
+
 # Logging
+# Records are queued and written in batches by a background thread; False
+# writes them from the logging thread, as plain handlers do
+LOG_PIPELINE = os.getenv('LOG_PIPELINE', 'True') == 'True'
+# Log file, rotated by size and by time; empty logs to the console only
+LOG_FILE = os.getenv('LOG_FILE', os.path.join(BASE_DIR, 'debug.log'))
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+# Seconds per log file, aligned to Unix time (86400: one per UTC day); 0 rotates by size only
+LOG_ROTATE_SECONDS = int(os.getenv('LOG_ROTATE_SECONDS', '86400'))
+# Rotated files kept
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '7'))
+# 'text', or 'json' for one object per line with the structured fields (event, stream, ...)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Records waiting for the writer; past it records below ERROR are dropped and counted
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Records of one event per stream (e.g. on_play of one camera) written per
+# LOG_EVENT_WINDOW seconds; the rest are counted and reported with the next one
+LOG_EVENT_BURST = int(os.getenv('LOG_EVENT_BURST', '10'))
+LOG_EVENT_WINDOW = float(os.getenv('LOG_EVENT_WINDOW', '10'))
+
+LOG_FORMATTER = 'json' if LOG_FORMAT == 'json' else 'verbose'
+if LOG_PIPELINE:
+    LOG_HANDLERS = {
+        'pipeline': {
+            '()': 'api.logs.PipelineHandler',
+            'filename': LOG_FILE or None,
+            'max_bytes': LOG_MAX_BYTES,
+            'rotate_seconds': LOG_ROTATE_SECONDS,
+            'backup_count': LOG_BACKUP_COUNT,
+            'capacity': LOG_QUEUE_SIZE,
+            'formatter': LOG_FORMATTER,
+            'filters': ['events'],
+        },
+    }
+else:
+    LOG_HANDLERS = {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMATTER,
+        },
+    }
+    if LOG_FILE:
+        LOG_HANDLERS['file'] = {
+            '()': 'api.logs.LogFileHandler',
+            'filename': LOG_FILE,
+            'max_bytes': LOG_MAX_BYTES,
+            'rotate_seconds': LOG_ROTATE_SECONDS,
+            'backup_count': LOG_BACKUP_COUNT,
+            'formatter': LOG_FORMATTER,
+        }
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -178,32 +435,32 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
-    },
-    'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+        'json': {
+            '()': 'api.logs.JSONFormatter',
         },
-        'file': {
-            'class': 'logging.FileHandler',
-            'filename': os.path.join(BASE_DIR, 'debug.log'),
-            'formatter': 'verbose',
+    },
+    'filters': {
+        'events': {
+            '()': 'api.logs.EventRateFilter',
+            'burst': LOG_EVENT_BURST,
+            'window': LOG_EVENT_WINDOW,
         },
     },
+    'handlers': LOG_HANDLERS,
     'root': {
-        'handlers': ['console', 'file'],
+        'handlers': list(LOG_HANDLERS),
         'level': 'INFO',
     },
     'loggers': {
         'django': {
-            'handlers': ['console', 'file'],
+            'handlers': list(LOG_HANDLERS),
             'level': 'INFO',
             'propagate': False,
         },
         'api': {
-            'handlers': ['console', 'file'],
+            'handlers': list(LOG_HANDLERS),
             'level': 'INFO',
             'propagate': False,
         },
     },
-} 
\ No newline at end of file
+}
@@ -4,18 +4,13 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from api.metrics import metrics_view
+from api.schema import API_INFO, schema_document_view, with_schema_document
 
-# Schema view for API documentation using Swagger
+# Schema view for API documentation using Swagger; the schema documents
+# themselves are rendered once per process by api.schema
 schema_view = get_schema_view(
-    openapi.Info(
-        title="CCTV Manager API",
-        default_version='v1',
-        description="API for managing CCTV cameras, streams, and recordings",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="admin@example.com"),
-        license=openapi.License(name="BSD License"),
-    ),
+    API_INFO,
     public=True,
     permission_classes=(permissions.AllowAny,),
 )
@@ -23,11 +18,12 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    path('metrics', metrics_view, name='metrics'),
     
     # Swagger documentation
-    path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('swagger<format>/', schema_document_view, name='schema-json'),
+    path('swagger/', with_schema_document(schema_view.with_ui('swagger', cache_timeout=0)), name='schema-swagger-ui'),
+    path('redoc/', with_schema_document(schema_view.with_ui('redoc', cache_timeout=0)), name='schema-redoc'),
 ]
 
 # Serve media files in development
@@ -0,0 +1,12 @@
+"""
+gunicorn settings, read automatically when gunicorn starts in this directory.
+"""
+import os
+
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a worker that exited from the Prometheus metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
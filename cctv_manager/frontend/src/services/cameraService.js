@@ -34,9 +34,9 @@ apiClient.interceptors.response.use(
 );
 
 export default {
-  // Get all cameras
-  getCameras() {
-    return apiClient.get('/cameras/')
+  // Get one page of cameras; params take cursor and page_size
+  getCameras(params = {}) {
+    return apiClient.get('/cameras/', { params })
   },
   
   // Get a specific camera
@@ -72,5 +72,55 @@ export default {
   // Restart streaming for a camera
   restartStream(id) {
     return apiClient.post(`/cameras/${id}/restart/`)
+  },
+  
+  // Create many cameras in one request
+  bulkCreateCameras(items) {
+    return apiClient.post('/cameras/bulk/create/', items)
+  },
+  
+  // Partially update many cameras; each item must include its id
+  bulkUpdateCameras(items) {
+    return apiClient.patch('/cameras/bulk/update/', items)
+  },
+  
+  // Delete many cameras
+  bulkDeleteCameras(ids) {
+    return apiClient.post('/cameras/bulk/delete/', { ids })
+  },
+  
+  // Start, stop or restart streaming for many cameras
+  // action is one of 'start', 'stop' or 'restart'
+  bulkStreamAction(action, ids) {
+    return apiClient.post(`/cameras/bulk/${action}/`, { ids })
+  },
+  
+  // Latest keyframe stills of many cameras
+  // etags: ETags of the stills the client already has; those come back as
+  // {status: 'unchanged', sequence, etag} without the image
+  // Resolves to {id: {status, sequence, etag, jpeg (base64)}}
+  getSnapshots(ids, width = 480, etags = []) {
+    const params = { ids: ids.join(','), width }
+    if (etags.length) {
+      params.etags = etags.join(',')
+    }
+    return apiClient.get('/cameras/bulk/snapshots/', { params })
+  },
+  
+  // Subscribe to camera state changes pushed by the server (Server-Sent Events)
+  // cursor: X-Events-Cursor header of the camera list the client already has
+  // onDeltas: called with an array of {id, active, hls_url, updated_at} or {id, deleted}
+  // onReset: called when the server cannot resume and the list must be reloaded
+  // Returns the EventSource; call close() on it to unsubscribe
+  subscribeCameraEvents(cursor, { onDeltas, onReset }) {
+    const url = new URL(`${getBaseUrl()}/events/cameras/`, window.location.origin)
+    if (cursor) {
+      url.searchParams.set('cursor', cursor)
+    }
+    // EventSource reconnects on its own and resumes with Last-Event-ID
+    const source = new EventSource(url.toString())
+    source.addEventListener('cameras', event => onDeltas(JSON.parse(event.data)))
+    source.addEventListener('reset', () => onReset())
+    return source
   }
 } 
\ No newline at end of file
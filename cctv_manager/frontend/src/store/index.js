@@ -1,9 +1,17 @@
 import { createStore } from 'vuex'
 import cameraService from '../services/cameraService'
 
+// Open camera event stream, kept outside the reactive state
+let cameraEvents = null
+// Ids of cameras learnt from events that are being fetched
+const fetchingCameras = new Set()
+// Cameras per request while loading the list; the API's largest page
+const CAMERAS_PAGE_SIZE = 500
+
 export default createStore({
   state: {
     cameras: [],
+    eventsCursor: null,
     currentCamera: null,
     loading: false,
     error: null
@@ -17,6 +25,30 @@ export default createStore({
     SET_CAMERAS(state, cameras) {
       state.cameras = cameras || []
     },
+    SET_EVENTS_CURSOR(state, cursor) {
+      state.eventsCursor = cursor || null
+    },
+    APPLY_CAMERA_DELTAS(state, deltas) {
+      if (!Array.isArray(state.cameras)) {
+        state.cameras = []
+      }
+      deltas.forEach(delta => {
+        const index = state.cameras.findIndex(c => c && c.id === delta.id)
+        if (delta.deleted) {
+          if (index !== -1) {
+            state.cameras.splice(index, 1)
+          }
+        } else if (index !== -1) {
+          state.cameras.splice(index, 1, { ...state.cameras[index], ...delta })
+        }
+      })
+      if (state.currentCamera) {
+        const delta = deltas.find(d => d.id === state.currentCamera.id && !d.deleted)
+        if (delta) {
+          state.currentCamera = { ...state.currentCamera, ...delta }
+        }
+      }
+    },
     SET_CURRENT_CAMERA(state, camera) {
       state.currentCamera = camera
     },
@@ -25,7 +57,13 @@ export default createStore({
         state.cameras = []
       }
       if (camera) {
-        state.cameras.push(camera)
+        // Its event may have added it already, see applyCameraDeltas
+        const index = state.cameras.findIndex(c => c && c.id === camera.id)
+        if (index !== -1) {
+          state.cameras.splice(index, 1, camera)
+        } else {
+          state.cameras.push(camera)
+        }
       }
     },
     UPDATE_CAMERA(state, updatedCamera) {
@@ -63,12 +101,25 @@ export default createStore({
       commit('SET_LOADING', true)
       commit('CLEAR_ERROR')
       try {
-        const response = await cameraService.getCameras()
-        if (response && response.data && Array.isArray(response.data)) {
-          commit('SET_CAMERAS', response.data)
-        } else {
-          commit('SET_CAMERAS', [])
+        // The first page's cursor: changes made while later pages load are replayed
+        let eventsCursor = null
+        const cameras = new Map()
+        let params = { page_size: CAMERAS_PAGE_SIZE }
+        while (params) {
+          const response = await cameraService.getCameras(params)
+          if (!params.cursor) {
+            eventsCursor = response && response.headers['x-events-cursor']
+          }
+          const data = response && response.data
+          const page = Array.isArray(data) ? data : (data && Array.isArray(data.results) ? data.results : [])
+          // A camera changed meanwhile moves to a later page and is listed again
+          page.forEach(camera => cameras.set(camera.id, camera))
+          const next = data && !Array.isArray(data) && data.next
+          const cursor = next && new URL(next, window.location.origin).searchParams.get('cursor')
+          params = cursor ? { page_size: CAMERAS_PAGE_SIZE, cursor } : null
         }
+        commit('SET_CAMERAS', [...cameras.values()])
+        commit('SET_EVENTS_CURSOR', eventsCursor)
       } catch (error) {
         console.error('Error fetching cameras:', error)
         commit('SET_ERROR', error.message || 'Error fetching cameras')
@@ -77,6 +128,49 @@ export default createStore({
         commit('SET_LOADING', false)
       }
     },
+    subscribeCameraEvents({ commit, state, dispatch }) {
+      if (cameraEvents) {
+        return
+      }
+      cameraEvents = cameraService.subscribeCameraEvents(state.eventsCursor, {
+        onDeltas: deltas => dispatch('applyCameraDeltas', deltas),
+        onReset: () => dispatch('fetchCameras')
+      })
+    },
+    // Deltas only carry the state that changed: cameras created after the
+    // list was loaded are fetched in full and inserted
+    async applyCameraDeltas({ commit, state }, deltas) {
+      const unknown = []
+      deltas.forEach(delta => {
+        if (delta.deleted) {
+          // Not to be inserted when a fetch still under way returns
+          fetchingCameras.delete(delta.id)
+        } else if (!fetchingCameras.has(delta.id) && !state.cameras.some(c => c && c.id === delta.id)) {
+          fetchingCameras.add(delta.id)
+          unknown.push(delta.id)
+        }
+      })
+      commit('APPLY_CAMERA_DELTAS', deltas)
+      await Promise.all(unknown.map(async id => {
+        try {
+          const response = await cameraService.getCamera(id)
+          if (response && response.data && fetchingCameras.has(id)) {
+            commit('ADD_CAMERA', response.data)
+          }
+        } catch (error) {
+          // Most likely deleted meanwhile
+          console.error(`Error fetching camera ${id}:`, error)
+        } finally {
+          fetchingCameras.delete(id)
+        }
+      }))
+    },
+    unsubscribeCameraEvents() {
+      if (cameraEvents) {
+        cameraEvents.close()
+        cameraEvents = null
+      }
+    },
     async fetchCamera({ commit }, cameraId) {
       commit('SET_LOADING', true)
       commit('CLEAR_ERROR')